@@ -0,0 +1,41 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import timeit
+
+
+def measure(fn, number=None, repeat=3):
+    """
+    Returns the best time, in microseconds, of a single call to the
+    supplied zero-argument callable. If number is not supplied, it is
+    picked so that each timing run takes at least 0.2 seconds.
+    """
+    timer = timeit.Timer(fn)
+    if number is None:
+        number = 1
+        while timer.timeit(number) < 0.2:
+            number *= 10
+    best = min(timer.repeat(repeat=repeat, number=number))
+    return best * 1e6 / number
+
+
+def report(results):
+    """
+    Prints a table of (name, microseconds) tuples.
+    """
+    width = max(len(name) for name, _usec in results)
+    for name, usec in results:
+        print('{0:<{1}}  {2:10.3f} usec/call'.format(name, width, usec))
@@ -0,0 +1,97 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+"""
+Measures `talons.auth.middleware.Middleware.process()` without an audit
+log, with the asynchronous audit log, and with a synchronous write of
+each decision, for an accepted request.
+
+    python -m benchmarks.bench_audit
+"""
+
+import json
+import os
+import tempfile
+
+from talons.auth import interfaces
+from talons.auth import middleware
+from talons.auth import wsgi
+
+import benchmarks
+
+
+class Identifier(interfaces.Identifies):
+
+    def identify(self, request):
+        request.env[self.IDENTITY_ENV_KEY] = interfaces.Identity('Aladdin')
+        return True
+
+
+class Authenticator(interfaces.Authenticates):
+
+    def authenticate(self, identity):
+        return True
+
+
+class SyncAuditLog(object):
+
+    """
+    Writes and flushes each decision from the request thread.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, 'a')
+
+    def record(self, stage, ok, env):
+        self.file.write(json.dumps({'stage': stage, 'ok': ok}) + '\n')
+        self.file.flush()
+
+
+def _runner(**conf):
+    m = middleware.Middleware([Identifier()], [Authenticator()],
+                              default_authorize=True, **conf)
+    env = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/users/1'}
+
+    def run():
+        m.process(wsgi.Request(env.copy()), {})
+    return m, run
+
+
+def bench_audit_disabled():
+    return _runner()[1]
+
+
+def bench_audit_async(path):
+    return _runner(audit_path=path, audit_queue_size=1000000)[1]
+
+
+def bench_audit_sync(path):
+    m, run = _runner()
+    m.audit = SyncAuditLog(path)
+    return run
+
+
+if __name__ == '__main__':
+    tmp = tempfile.mkdtemp()
+    benchmarks.report([
+        ('process(): no audit log',
+         benchmarks.measure(bench_audit_disabled())),
+        ('process(): asynchronous audit log',
+         benchmarks.measure(bench_audit_async(os.path.join(tmp, 'a.log')))),
+        ('process(): synchronous writes',
+         benchmarks.measure(bench_audit_sync(os.path.join(tmp, 's.log')))),
+    ])
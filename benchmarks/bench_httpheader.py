@@ -0,0 +1,82 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+Compares header extraction in `talons.auth.httpheader.Identifier`, which
+reads a precompiled plan of WSGI environ keys, with the previous
+per-header `request.get_header()` and `setattr()` loop, for an identifier
+with 20 configured attributes.
+
+    python -m benchmarks.bench_httpheader
+"""
+
+import falcon
+from falcon import testing
+
+from talons.auth import httpheader
+from talons.auth import interfaces
+
+import benchmarks
+
+NUM_ATTRS = 20
+
+
+def _setup():
+    conf = dict(httpheader_user='X-Auth-User',
+                httpheader_key='X-Auth-Key')
+    headers = {'X-Auth-User': 'Aladdin', 'X-Auth-Key': 'open sesame'}
+    for x in range(NUM_ATTRS):
+        conf['httpheader_attr{0}'.format(x)] = 'X-Attr-{0}'.format(x)
+        headers['X-Attr-{0}'.format(x)] = 'value{0}'.format(x)
+    env = testing.create_environ(headers=headers)
+    return httpheader.Identifier(**conf), env
+
+
+def bench_compiled_plan():
+    identifier, env = _setup()
+    req = falcon.Request(env)
+
+    def run():
+        env.pop('wsgi.identity', None)
+        identifier.identify(req)
+    return run
+
+
+def bench_get_header_loop():
+    identifier, env = _setup()
+    req = falcon.Request(env)
+    IDENTITY_ENV_KEY = identifier.IDENTITY_ENV_KEY
+
+    def run():
+        env.pop(IDENTITY_ENV_KEY, None)
+        user_id = req.get_header(identifier.user_header)
+        key = req.get_header(identifier.key_header)
+        identity = interfaces.Identity(user_id, key=key)
+        for attr, header in identifier.attr_headers.items():
+            setattr(identity, attr, req.get_header(header))
+        env[IDENTITY_ENV_KEY] = identity
+    return run
+
+
+SUITE = [
+    ('compiled environ plan', bench_compiled_plan),
+    ('get_header() loop', bench_get_header_loop),
+]
+
+
+if __name__ == '__main__':
+    benchmarks.report([(name, benchmarks.measure(factory()))
+                       for name, factory in SUITE])
@@ -0,0 +1,57 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+"""
+Measures the cold-start cost of importing talons and building a chain,
+each in a fresh interpreter, as a short-lived worker would.
+
+    python -m benchmarks.bench_import
+"""
+
+import subprocess
+import sys
+import timeit
+
+import benchmarks
+
+CASES = (
+    ('python startup', 'pass'),
+    ('import pkg_resources', 'import pkg_resources'),
+    ('import talons.auth.middleware', 'import talons.auth.middleware'),
+    ('create_middleware(basicauth, htpasswd)',
+     "from talons.auth import middleware; "
+     "middleware.create_middleware('basicauth', 'htpasswd', "
+     "htpasswd_path='/dev/null')"),
+    ('import all plugins',
+     'from talons.auth import assertion, basicauth, clientcert, digest, '
+     'external, htpasswd, httpheader'),
+)
+
+
+def bench_import(code):
+    cmd = [sys.executable, '-c', code]
+
+    def run():
+        subprocess.check_call(cmd)
+    return run
+
+
+if __name__ == '__main__':
+    benchmarks.report([
+        (name, min(timeit.repeat(bench_import(code), repeat=5, number=3)) *
+         1e6 / 3)
+        for name, code in CASES])
@@ -0,0 +1,268 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+"""
+Measures each plugin, `talons.auth.interfaces.ResourceAction`, and full
+chains through `talons.auth.middleware.Middleware.__call__`, with
+synthetic Falcon requests. `talons.auth.htpasswd.Authenticator` is
+measured with its cache disabled for every hash scheme that htpasswd
+files can use.
+
+    python -m benchmarks.bench_plugins
+"""
+
+import atexit
+import base64
+import hashlib
+import os
+import shutil
+import tempfile
+
+import falcon
+from falcon import testing
+from passlib import apache
+
+from talons.auth import assertion
+from talons.auth import basicauth
+from talons.auth import clientcert
+from talons.auth import digest
+from talons.auth import external
+from talons.auth import htpasswd
+from talons.auth import httpheader
+from talons.auth import interfaces
+from talons.auth import middleware
+
+import benchmarks
+
+LOGIN = 'Aladdin'
+PASSWORD = 'open sesame'
+SECRET = 'benchmark secret'
+
+# Hash schemes htpasswd files can use. Schemes passlib lists after
+# plaintext are never identified, since plaintext matches any hash.
+SCHEMES = apache.htpasswd_context.schemes()
+SCHEMES = SCHEMES[:SCHEMES.index('plaintext') + 1]
+
+_tmp = tempfile.mkdtemp()
+atexit.register(shutil.rmtree, _tmp, True)
+
+
+def _htpasswd(scheme):
+    """
+    Returns the path of an htpasswd file with LOGIN's PASSWORD hashed with
+    the scheme.
+    """
+    path = os.path.join(_tmp, 'htpasswd.' + scheme)
+    if not os.path.exists(path):
+        htfile = apache.HtpasswdFile(path, new=True, default_scheme=scheme)
+        htfile.set_password(LOGIN, PASSWORD)
+        htfile.save()
+    return path
+
+
+def _basic_env(password=PASSWORD):
+    creds = base64.b64encode('{0}:{1}'.format(LOGIN, password).encode(
+        'ascii'))
+    return testing.create_environ(path='/users/1', headers={
+        'Authorization': 'Basic ' + creds.decode('ascii')})
+
+
+def _identify(identifier, env):
+    req = falcon.Request(env)
+
+    def run():
+        env.pop('wsgi.identity', None)
+        identifier.identify(req)
+    return run
+
+
+def _authenticate(authenticator, identity):
+    def run():
+        authenticator.authenticate(identity)
+    return run
+
+
+def bench_basicauth_identify():
+    return _identify(basicauth.Identifier(), _basic_env())
+
+
+def bench_httpheader_identify():
+    env = testing.create_environ(headers={'X-Auth-User': LOGIN,
+                                          'X-Auth-Key': PASSWORD})
+    return _identify(httpheader.Identifier(httpheader_user='X-Auth-User',
+                                           httpheader_key='X-Auth-Key'),
+                     env)
+
+
+def bench_clientcert_identify():
+    env = testing.create_environ()
+    env['SSL_CLIENT_S_DN'] = '/C=US/O=Acme/OU=Ops/CN={0}'.format(LOGIN)
+    env['SSL_CLIENT_VERIFY'] = 'SUCCESS'
+    return _identify(clientcert.Identifier(), env)
+
+
+def _assertion_env():
+    token = assertion.sign(interfaces.Identity(LOGIN, roles=['admin']),
+                           SECRET, ttl=3600)
+    return testing.create_environ(headers={
+        assertion.DEFAULT_HEADER: token})
+
+
+def bench_assertion_identify():
+    return _identify(assertion.Identifier(assertion_secret=SECRET),
+                     _assertion_env())
+
+
+def bench_assertion_authenticate():
+    env = _assertion_env()
+    assertion.Identifier(assertion_secret=SECRET).identify(
+        falcon.Request(env))
+    return _authenticate(assertion.Authenticator(assertion_secret=SECRET),
+                         env['wsgi.identity'])
+
+
+def _digest_header(nonce, nc):
+    def h(*parts):
+        return hashlib.md5(':'.join(parts).encode('utf-8')).hexdigest()
+    response = h(h(LOGIN, 'lamp', PASSWORD), nonce, nc, 'xyz', 'auth',
+                 h('GET', '/users/1'))
+    return ('Digest username="{0}", realm="lamp", nonce="{1}", '
+            'uri="/users/1", response="{2}", qop=auth, nc={3}, '
+            'cnonce="xyz", algorithm=MD5').format(LOGIN, nonce, response,
+                                                  nc)
+
+
+def bench_digest_identify():
+    env = testing.create_environ(path='/users/1', headers={
+        'Authorization': _digest_header('nonce', '00000001')})
+    return _identify(digest.Identifier(), env)
+
+
+def bench_digest_authenticate():
+    path = os.path.join(_tmp, 'htdigest')
+    with open(path, 'w') as f:
+        f.write('{0}:lamp:{1}\n'.format(LOGIN, hashlib.md5(
+            '{0}:lamp:{1}'.format(LOGIN, PASSWORD).encode('utf-8'))
+            .hexdigest()))
+    authenticator = digest.Authenticator(digest_realm='lamp',
+                                         digest_htdigest_path=path)
+    identifier = digest.Identifier()
+    nonce = authenticator.nonces.issue()
+    count = [0]
+
+    # Every request needs a new nonce count, so the client's hashing is
+    # part of the measurement.
+    def run():
+        count[0] += 1
+        env = testing.create_environ(path='/users/1', headers={
+            'Authorization': _digest_header(nonce,
+                                            '{0:08x}'.format(count[0]))})
+        env.pop('wsgi.identity', None)
+        identifier.identify(falcon.Request(env))
+        authenticator.authenticate(env['wsgi.identity'])
+    return run
+
+
+def bench_external_authenticate():
+    authenticator = external.Authenticator(
+        external_authn_callable=lambda identity: True)
+    return _authenticate(authenticator, interfaces.Identity(LOGIN, PASSWORD))
+
+
+def bench_external_authorize():
+    authorizer = external.Authorizer(
+        external_authz_callable=lambda identity, request_action: True)
+    identity = interfaces.Identity(LOGIN)
+    resource = interfaces.ResourceAction(falcon.Request(_basic_env()), {})
+
+    def run():
+        authorizer.authorize(identity, resource)
+    return run
+
+
+def bench_htpasswd(scheme):
+    authenticator = htpasswd.Authenticator(htpasswd_path=_htpasswd(scheme),
+                                           htpasswd_cache_size=0)
+    return _authenticate(authenticator, interfaces.Identity(LOGIN, PASSWORD))
+
+
+def bench_htpasswd_cached():
+    authenticator = htpasswd.Authenticator(
+        htpasswd_path=_htpasswd('bcrypt'), htpasswd_cache_size=1024)
+    identity = interfaces.Identity(LOGIN, PASSWORD)
+    authenticator.authenticate(identity)
+    return _authenticate(authenticator, identity)
+
+
+def bench_resource_action():
+    req = falcon.Request(testing.create_environ(path='/users/123/groups/ABC'))
+
+    def run():
+        interfaces.ResourceAction(req, {}).to_string()
+    return run
+
+
+def _chain(authorize, password=PASSWORD):
+    conf = dict(htpasswd_path=_htpasswd('apr_md5_crypt'))
+    if authorize:
+        authorizer = external.Authorizer(
+            external_authz_callable=lambda identity, request_action: True)
+    else:
+        authorizer = None
+        conf['default_authorize'] = True
+    m = middleware.create_middleware(basicauth.Identifier,
+                                     htpasswd.Authenticator, authorizer,
+                                     **conf)
+    env = _basic_env(password)
+
+    def run():
+        try:
+            m(falcon.Request(env.copy()), None, {})
+        except falcon.HTTPError:
+            pass
+    return run
+
+
+SUITE = [
+    ('basicauth.Identifier', bench_basicauth_identify),
+    ('httpheader.Identifier', bench_httpheader_identify),
+    ('clientcert.Identifier', bench_clientcert_identify),
+    ('assertion.Identifier', bench_assertion_identify),
+    ('assertion.Authenticator', bench_assertion_authenticate),
+    ('digest.Identifier', bench_digest_identify),
+    ('digest.Authenticator', bench_digest_authenticate),
+    ('external.Authenticator', bench_external_authenticate),
+    ('external.Authorizer', bench_external_authorize),
+    ('htpasswd.Authenticator: cached', bench_htpasswd_cached),
+] + [
+    ('htpasswd.Authenticator: ' + scheme,
+     (lambda scheme=scheme: bench_htpasswd(scheme)))
+    for scheme in SCHEMES
+] + [
+    ('ResourceAction.to_string()', bench_resource_action),
+    ('Middleware.__call__: no authorizer',
+     lambda: _chain(authorize=False)),
+    ('Middleware.__call__: external authorizer',
+     lambda: _chain(authorize=True)),
+    ('Middleware.__call__: rejected 401',
+     lambda: _chain(authorize=True, password='wrong')),
+]
+
+
+if __name__ == '__main__':
+    benchmarks.report([(name, benchmarks.measure(factory()))
+                       for name, factory in SUITE])
@@ -0,0 +1,84 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+"""
+Measures `talons.auth.middleware.Middleware.process()` without profiling,
+with a 1% sample of requests profiled, and with every request timed
+against a slow threshold that none of them reach.
+
+    python -m benchmarks.bench_profiling
+"""
+
+import atexit
+import shutil
+import tempfile
+
+from talons.auth import interfaces
+from talons.auth import middleware
+from talons.auth import wsgi
+
+import benchmarks
+
+_tmp = tempfile.mkdtemp()
+atexit.register(shutil.rmtree, _tmp, True)
+
+
+class Identifier(interfaces.Identifies):
+
+    def identify(self, request):
+        request.env[self.IDENTITY_ENV_KEY] = interfaces.Identity('Aladdin')
+        return True
+
+
+class Authenticator(interfaces.Authenticates):
+
+    def authenticate(self, identity):
+        return True
+
+
+def _runner(**conf):
+    m = middleware.Middleware([Identifier()], [Authenticator()],
+                              default_authorize=True, **conf)
+    env = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/users/1'}
+
+    def run():
+        m.process(wsgi.Request(env.copy()), {})
+    return run
+
+
+def bench_profiling_disabled():
+    return _runner()
+
+
+def bench_profiling_sampled():
+    return _runner(profile_path=_tmp, profile_sample_rate=0.01)
+
+
+def bench_profiling_slow_threshold():
+    return _runner(profile_path=_tmp, profile_slow_threshold=60)
+
+
+SUITE = [
+    ('process(): profiling disabled', bench_profiling_disabled),
+    ('process(): 1% sampled', bench_profiling_sampled),
+    ('process(): slow threshold', bench_profiling_slow_threshold),
+]
+
+
+if __name__ == '__main__':
+    benchmarks.report([(name, benchmarks.measure(factory()))
+                       for name, factory in SUITE])
@@ -0,0 +1,89 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+"""
+Measures the per-request cost of the rate limiter: a single
+`GCRALimiter.acquire()` call, and `Middleware.process()` with and without
+rate limiting, for an accepted request.
+
+    python -m benchmarks.bench_ratelimit
+"""
+
+from talons.auth import interfaces
+from talons.auth import middleware
+from talons.auth import ratelimit
+from talons.auth import wsgi
+
+import benchmarks
+
+
+class Identifier(interfaces.Identifies):
+
+    def identify(self, request):
+        request.env[self.IDENTITY_ENV_KEY] = interfaces.Identity(
+            'Aladdin', roles=['reader'])
+        return True
+
+
+class Authenticator(interfaces.Authenticates):
+
+    def authenticate(self, identity):
+        return True
+
+
+def bench_acquire():
+    limiter = ratelimit.GCRALimiter()
+    limit = ratelimit.Limit(1e9)
+
+    def run():
+        limiter.acquire('Aladdin', limit)
+    return run
+
+
+def _runner(**conf):
+    m = middleware.Middleware([Identifier()], [Authenticator()],
+                              default_authorize=True, **conf)
+    env = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/users/1'}
+
+    def run():
+        m.process(wsgi.Request(env.copy()), {})
+    return run
+
+
+def bench_process_unlimited():
+    return _runner()
+
+
+def bench_process_limited():
+    return _runner(ratelimit_rate=1e9)
+
+
+def bench_process_role_limited():
+    return _runner(ratelimit_rate=1, ratelimit_roles='reader=1e9,admin=0')
+
+
+SUITE = [
+    ('GCRALimiter.acquire()', bench_acquire),
+    ('process(): no rate limit', bench_process_unlimited),
+    ('process(): default rate limit', bench_process_limited),
+    ('process(): per-role rate limit', bench_process_role_limited),
+]
+
+
+if __name__ == '__main__':
+    benchmarks.report([(name, benchmarks.measure(factory()))
+                       for name, factory in SUITE])
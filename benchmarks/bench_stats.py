@@ -0,0 +1,71 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+Measures `talons.auth.middleware.Middleware.process()` with stats disabled
+and with an in-memory stats sink, for an accepted request.
+
+    python -m benchmarks.bench_stats
+"""
+
+from talons import stats
+from talons.auth import interfaces
+from talons.auth import middleware
+from talons.auth import wsgi
+
+import benchmarks
+
+
+class Identifier(interfaces.Identifies):
+
+    def identify(self, request):
+        request.env[self.IDENTITY_ENV_KEY] = interfaces.Identity('Aladdin')
+        return True
+
+
+class Authenticator(interfaces.Authenticates):
+
+    def authenticate(self, identity):
+        return True
+
+
+def _runner(**conf):
+    m = middleware.Middleware([Identifier()], [Authenticator()],
+                              default_authorize=True, **conf)
+    env = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/users/1'}
+
+    def run():
+        m.process(wsgi.Request(env.copy()), {})
+    return run
+
+
+def bench_stats_disabled():
+    return _runner()
+
+
+def bench_stats_in_memory():
+    return _runner(stats_sink=stats.InMemorySink())
+
+
+SUITE = [
+    ('process(): stats disabled', bench_stats_disabled),
+    ('process(): in-memory sink', bench_stats_in_memory),
+]
+
+
+if __name__ == '__main__':
+    benchmarks.report([(name, benchmarks.measure(factory()))
+                       for name, factory in SUITE])
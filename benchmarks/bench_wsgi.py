@@ -0,0 +1,125 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+Compares the cost of a request through a Falcon app that uses the
+`talons.auth.middleware.Middleware` before hook with the same chain run
+by `talons.auth.wsgi.AuthMiddleware` in front of the app, for accepted and
+rejected requests.
+
+    python -m benchmarks.bench_wsgi
+"""
+
+import base64
+
+import falcon
+from falcon import testing
+
+from talons.auth import basicauth
+from talons.auth import interfaces
+from talons.auth import middleware
+from talons.auth import wsgi
+
+import benchmarks
+
+
+class PasswordAuthenticator(interfaces.Authenticates):
+
+    def authenticate(self, identity):
+        return identity.key == 'open sesame'
+
+
+class Resource(object):
+
+    def on_get(self, req, resp, user_id):
+        resp.status = falcon.HTTP_200
+
+
+def _app(before=None):
+    app = getattr(falcon, 'App', None) or falcon.API
+    app = app()
+    resource = Resource()
+    if before is not None:
+        resource = falcon.before(before)(Resource)()
+    app.add_route('/users/{user_id}', resource)
+    return app
+
+
+def _environ(password):
+    creds = base64.b64encode(('Aladdin:' + password).encode('ascii'))
+    headers = {'Authorization': 'Basic ' + creds.decode('ascii')}
+    return testing.create_environ(path='/users/1', headers=headers)
+
+
+def _start_response(status, headers, exc_info=None):
+    pass
+
+
+def _runner(app, password):
+    env = _environ(password)
+
+    def run():
+        environ = env.copy()
+        for chunk in app(environ, _start_response):
+            pass
+    return run
+
+
+def _auth_middleware():
+    return middleware.create_middleware(basicauth.Identifier,
+                                        PasswordAuthenticator,
+                                        default_authorize=True)
+
+
+def _hook_app():
+    mw = _auth_middleware()
+
+    def hook(req, resp, *args):
+        mw(req, resp, args[-1])
+    return _app(before=hook)
+
+
+def _wsgi_app():
+    return wsgi.AuthMiddleware(_app(), _auth_middleware())
+
+
+def bench_hook_accepted():
+    return _runner(_hook_app(), 'open sesame')
+
+
+def bench_hook_rejected():
+    return _runner(_hook_app(), 'wrong')
+
+
+def bench_wsgi_accepted():
+    return _runner(_wsgi_app(), 'open sesame')
+
+
+def bench_wsgi_rejected():
+    return _runner(_wsgi_app(), 'wrong')
+
+
+SUITE = [
+    ('falcon hook: accepted', bench_hook_accepted),
+    ('wsgi middleware: accepted', bench_wsgi_accepted),
+    ('falcon hook: rejected 401', bench_hook_rejected),
+    ('wsgi middleware: rejected 401', bench_wsgi_rejected),
+]
+
+
+if __name__ == '__main__':
+    benchmarks.report([(name, benchmarks.measure(factory()))
+                       for name, factory in SUITE])
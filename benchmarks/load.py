@@ -0,0 +1,414 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+"""
+Drives a Falcon app protected by a `talons.auth.component.Component`
+chain of `talons.auth.basicauth.Identifier` and
+`talons.auth.htpasswd.Authenticator` from many threads and processes at
+once, with a mix of request classes, and reports the throughput and
+latency percentiles of each class. Unlike the microbenchmarks, this shows
+contention: the GIL held while hashing passwords, and the cache locks.
+
+    python -m benchmarks.load                        # in-process WSGI calls
+    python -m benchmarks.load --server               # over HTTP, wsgiref
+    python -m benchmarks.load -t 8 -p 4 -d 30        # 4 processes x 8 threads
+    python -m benchmarks.load --mix valid=50,invalid=50
+    python -m benchmarks.load -o cache_shm_path=/tmp/c -o cache_secret=s
+
+The request classes are:
+
+    valid: Correct password of one of --users logins. Expects 200.
+    invalid: Wrong password of a known login. Expects 401.
+    unknown: Login not in the htpasswd file. Expects 401.
+    malformed: Authorization header that is not valid Basic credentials.
+               Expects 401.
+    anonymous: No Authorization header. Expects 401.
+
+In-process, every process builds its own app, like the workers of a
+pre-forking server, and its threads call it directly. With --server, the
+parent process serves the app with a threaded wsgiref server, and the
+worker processes and threads are HTTP clients.
+"""
+
+import argparse
+import base64
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from wsgiref import simple_server
+
+import falcon
+from falcon import testing
+from passlib import apache
+from six.moves import http_client
+from six.moves import socketserver
+
+from talons import stats
+from talons.auth import basicauth
+from talons.auth import component
+from talons.auth import htpasswd
+
+PASSWORD = 'open sesame'
+CLASSES = ('valid', 'invalid', 'unknown', 'malformed', 'anonymous')
+EXPECTED_STATUS = {'valid': 200, 'invalid': 401, 'unknown': 401,
+                   'malformed': 401, 'anonymous': 401}
+DEFAULT_MIX = 'valid=70,invalid=10,unknown=10,malformed=5,anonymous=5'
+PERCENTILES = (0.5, 0.99, 0.999)
+
+
+class Resource(object):
+
+    def on_get(self, req, resp, user_id):
+        resp.status = falcon.HTTP_200
+
+
+def parse_mix(value):
+    """
+    Returns a list of (class, weight) tuples from a string like
+    'valid=70,invalid=30'.
+
+    :raises ValueError if a class is unknown or a weight is not a
+            non-negative number.
+    """
+    mix = []
+    for item in value.split(','):
+        name, _sep, weight = item.partition('=')
+        name = name.strip()
+        if name not in CLASSES:
+            raise ValueError("Unknown request class {0!r}; expected one of "
+                             "{1}.".format(name, ', '.join(CLASSES)))
+        weight = float(weight)
+        if weight < 0:
+            raise ValueError("Weight of {0} is negative.".format(name))
+        mix.append((name, weight))
+    if not sum(w for _name, w in mix):
+        raise ValueError("The request mix has no weight.")
+    return mix
+
+
+def percentile(ordered, fraction):
+    """
+    Returns the nearest-rank percentile of a sorted, non-empty list.
+    """
+    rank = int(fraction * len(ordered) + 0.5)
+    return ordered[min(max(rank, 1), len(ordered)) - 1]
+
+
+def write_htpasswd(path, users, scheme):
+    htfile = apache.HtpasswdFile(path, new=True, default_scheme=scheme)
+    for x in range(users):
+        htfile.set_password('user{0}'.format(x), PASSWORD)
+    htfile.save()
+
+
+def create_app(htpasswd_path, **conf):
+    """
+    Returns a Falcon app whose /users/{user_id} route needs Basic
+    credentials of a login in the htpasswd file.
+    """
+    conf.setdefault('htpasswd_cache_size', 1024)
+    auth = component.create_component(basicauth.Identifier,
+                                      htpasswd.Authenticator,
+                                      htpasswd_path=htpasswd_path,
+                                      default_authorize=True, **conf)
+    app = getattr(falcon, 'App', None) or falcon.API
+    app = app(middleware=[auth])
+    app.add_route('/users/{user_id}', Resource())
+    return app
+
+
+def _basic(login, password):
+    creds = '{0}:{1}'.format(login, password).encode('utf-8')
+    return 'Basic ' + base64.b64encode(creds).decode('ascii')
+
+
+def request_headers(name, rand, users):
+    """
+    Returns the headers dict of a request of the named class.
+    """
+    login = 'user{0}'.format(rand.randrange(users))
+    if name == 'valid':
+        return {'Authorization': _basic(login, PASSWORD)}
+    if name == 'invalid':
+        return {'Authorization': _basic(login, 'wrong')}
+    if name == 'unknown':
+        return {'Authorization': _basic('nobody{0}'.format(
+            rand.randrange(1000000)), PASSWORD)}
+    if name == 'malformed':
+        return {'Authorization': rand.choice(
+            ['Basic', 'Basic !!!', 'Basic ' + base64.b64encode(
+                b'no-colon').decode('ascii'), 'Bearer abc'])}
+    return {}
+
+
+class InProcessClient(object):
+
+    """
+    Calls the WSGI app directly and returns the response status code.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def _start_response(self, status, headers, exc_info=None):
+        self.status = int(status.split(' ', 1)[0])
+
+    def request(self, headers):
+        env = testing.create_environ(path='/users/1', headers=headers)
+        for _chunk in self.app(env, self._start_response):
+            pass
+        return self.status
+
+
+class HTTPClient(object):
+
+    """
+    Sends each request over a new HTTP connection and returns the response
+    status code.
+    """
+
+    def __init__(self, address):
+        self.address = address
+
+    def request(self, headers):
+        conn = http_client.HTTPConnection(*self.address)
+        try:
+            conn.request('GET', '/users/1', headers=headers)
+            resp = conn.getresponse()
+            resp.read()
+            return resp.status
+        finally:
+            conn.close()
+
+
+class _QuietHandler(simple_server.WSGIRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+class _ThreadingServer(socketserver.ThreadingMixIn,
+                       simple_server.WSGIServer):
+
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def serve(app):
+    """
+    Serves the app on a free local port from a daemon thread and returns
+    the server object.
+    """
+    server = simple_server.make_server('127.0.0.1', 0, app,
+                                       server_class=_ThreadingServer,
+                                       handler_class=_QuietHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def _thread_run(client, mix, users, seed, start, duration, results):
+    rand = random.Random(seed)
+    names = [name for name, _w in mix]
+    weights = [w for _name, w in mix]
+    total = sum(weights)
+    latencies = dict((name, []) for name in names)
+    unexpected = dict((name, 0) for name in names)
+    start.wait()
+    deadline = stats.clock() + duration
+    while True:
+        pick = rand.random() * total
+        for name, weight in zip(names, weights):
+            pick -= weight
+            if pick < 0:
+                break
+        headers = request_headers(name, rand, users)
+        began = stats.clock()
+        if began >= deadline:
+            break
+        try:
+            status = client.request(headers)
+        except Exception:
+            status = None
+        latencies[name].append(stats.clock() - began)
+        if status != EXPECTED_STATUS[name]:
+            unexpected[name] += 1
+    results.append((latencies, unexpected))
+
+
+def run_worker(options, index, queue=None):
+    """
+    Runs options.threads client threads for options.duration seconds and
+    returns, or puts in the queue, a (latencies, unexpected) tuple of
+    dicts keyed by request class, merged across the threads.
+    """
+    if options.address is not None:
+        def client():
+            return HTTPClient(options.address)
+    else:
+        app = create_app(options.htpasswd_path, **options.conf)
+
+        def client():
+            return InProcessClient(app)
+    start = threading.Event()
+    results = []
+    threads = []
+    for x in range(options.threads):
+        t = threading.Thread(target=_thread_run, args=(
+            client(), options.mix, options.users,
+            options.seed + index * 1000 + x, start, options.duration,
+            results))
+        t.daemon = True
+        t.start()
+        threads.append(t)
+    start.set()
+    for t in threads:
+        t.join()
+    merged = merge(results)
+    if queue is not None:
+        queue.put(merged)
+    return merged
+
+
+def merge(results):
+    """
+    Merges a list of (latencies, unexpected) tuples into one.
+    """
+    latencies = {}
+    unexpected = {}
+    for lat, unexp in results:
+        for name, values in lat.items():
+            latencies.setdefault(name, []).extend(values)
+        for name, count in unexp.items():
+            unexpected[name] = unexpected.get(name, 0) + count
+    return latencies, unexpected
+
+
+def run(options):
+    """
+    Runs the load test described by options in options.processes
+    processes and returns the merged (latencies, unexpected) tuple.
+    """
+    if options.processes == 1:
+        return run_worker(options, 0)
+    queue = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=run_worker,
+                                     args=(options, x, queue))
+             for x in range(options.processes)]
+    for p in procs:
+        p.start()
+    # Read the results before joining, so no child blocks on a full pipe
+    results = [queue.get() for _p in procs]
+    for p in procs:
+        p.join()
+    return merge(results)
+
+
+def report(latencies, unexpected, elapsed):
+    """
+    Prints the count, throughput, unexpected responses and latency
+    percentiles, in milliseconds, of each request class and of all
+    requests.
+    """
+    print('{0:<10} {1:>9} {2:>10} {3:>10} {4:>9} {5:>9} {6:>9}'.format(
+        'class', 'requests', 'req/s', 'unexpected', 'p50 ms', 'p99 ms',
+        'p99.9 ms'))
+    rows = [(name, latencies[name], unexpected[name])
+            for name in CLASSES if name in latencies]
+    everything = [v for _name, values, _u in rows for v in values]
+    rows.append(('all', everything, sum(u for _n, _v, u in rows)))
+    for name, values, unexp in rows:
+        values = sorted(values)
+        if values:
+            pcts = ['{0:9.3f}'.format(percentile(values, p) * 1000.0)
+                    for p in PERCENTILES]
+        else:
+            pcts = ['{0:>9}'.format('-')] * len(PERCENTILES)
+        print('{0:<10} {1:9d} {2:10.1f} {3:10d} {4}'.format(
+            name, len(values), len(values) / elapsed, unexp, ' '.join(pcts)))
+
+
+def _mix_option(value):
+    try:
+        return parse_mix(value)
+    except ValueError as err:
+        raise argparse.ArgumentTypeError(str(err))
+
+
+def _conf_option(value):
+    key, sep, val = value.partition('=')
+    if not sep:
+        raise argparse.ArgumentTypeError(
+            "Expected key=value, got {0!r}.".format(value))
+    return key.strip(), val.strip()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('-t', '--threads', type=int, default=4,
+                        help='client threads per process')
+    parser.add_argument('-p', '--processes', type=int, default=1,
+                        help='worker processes')
+    parser.add_argument('-d', '--duration', type=float, default=10.0,
+                        help='seconds to run for')
+    parser.add_argument('--mix', type=_mix_option, default=DEFAULT_MIX,
+                        help='weights of the request classes')
+    parser.add_argument('--users', type=int, default=100,
+                        help='logins in the htpasswd file')
+    parser.add_argument('--scheme', default='apr_md5_crypt',
+                        help='hash scheme of the htpasswd file')
+    parser.add_argument('--server', action='store_true',
+                        help='send requests over HTTP to a wsgiref server')
+    parser.add_argument('-o', '--option', dest='conf', action='append',
+                        type=_conf_option, default=[],
+                        help='talons configuration option, key=value')
+    parser.add_argument('--seed', type=int, default=0)
+    options = parser.parse_args(argv)
+    options.conf = dict(options.conf)
+
+    tmp = tempfile.mkdtemp()
+    server = None
+    try:
+        options.htpasswd_path = os.path.join(tmp, 'htpasswd')
+        write_htpasswd(options.htpasswd_path, options.users, options.scheme)
+        options.address = None
+        if options.server:
+            server = serve(create_app(options.htpasswd_path, **options.conf))
+            options.address = server.server_address[:2]
+        began = time.time()
+        latencies, unexpected = run(options)
+        elapsed = time.time() - began
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        shutil.rmtree(tmp, True)
+    print('{0} process(es) x {1} thread(s), {2}, {3:.1f}s'.format(
+        options.processes, options.threads,
+        'wsgiref server' if options.server else 'in-process', elapsed))
+    report(latencies, unexpected, elapsed)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,178 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+"""
+Runs every benchmark listed in the SUITE of the benchmarks.bench_*
+modules, compares the results with a stored baseline, and exits with a
+non-zero status if any benchmark got slower than the threshold allows.
+
+    python -m benchmarks.suite                   # compare with baseline
+    python -m benchmarks.suite --save            # store a new baseline
+    python -m benchmarks.suite -k htpasswd       # only matching names
+    python -m benchmarks.suite --threshold 0.1   # fail past 10% slower
+
+Results are stored relative to a fixed pure-Python calibration workload
+measured in the same run, so that a baseline recorded on one machine is
+still meaningful on a faster or slower one.
+"""
+
+import argparse
+import importlib
+import json
+import os
+import pkgutil
+import platform
+import sys
+
+import benchmarks
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'baselines',
+                                'default.json')
+DEFAULT_THRESHOLD = 0.25
+
+
+def calibration():
+    """
+    Returns a callable doing a fixed amount of the dict, string and call
+    work that talons' request path is made of.
+    """
+    env = dict(('HTTP_X_{0}'.format(x), str(x)) for x in range(20))
+
+    def run():
+        for key in ('HTTP_X_1', 'HTTP_X_10', 'PATH_INFO'):
+            env.get(key)
+        '.'.join(['users', '123', 'get']).split('.')
+    return run
+
+
+def collect(pattern=None):
+    """
+    Returns a list of (name, factory) tuples of all benchmarks whose name
+    contains pattern, in module order.
+    """
+    suite = []
+    for _finder, name, _ispkg in pkgutil.iter_modules(benchmarks.__path__):
+        if not name.startswith('bench_'):
+            continue
+        module = importlib.import_module('benchmarks.' + name)
+        for bench_name, factory in getattr(module, 'SUITE', ()):
+            full_name = '{0}: {1}'.format(name[len('bench_'):], bench_name)
+            if pattern is None or pattern in full_name:
+                suite.append((full_name, factory))
+    return suite
+
+
+def run(suite, repeat=3):
+    """
+    Returns a dict with the calibration time and the time of each
+    benchmark, in microseconds.
+    """
+    results = {}
+    for name, factory in suite:
+        results[name] = benchmarks.measure(factory(), repeat=repeat)
+    return {
+        'calibration': benchmarks.measure(calibration(), repeat=repeat),
+        'python': platform.python_version(),
+        'results': results,
+    }
+
+
+def compare(current, baseline, threshold):
+    """
+    Returns a list of (name, usec, expected usec, change) tuples, where
+    expected usec is the baseline scaled to this machine's calibration,
+    and the list of names that regressed past the threshold. Benchmarks
+    missing from the baseline have an expected time and change of None.
+    """
+    scale = current['calibration'] / baseline['calibration']
+    rows = []
+    regressed = []
+    for name, usec in sorted(current['results'].items()):
+        expected = baseline['results'].get(name)
+        if expected is None:
+            rows.append((name, usec, None, None))
+            continue
+        expected *= scale
+        change = usec / expected - 1
+        rows.append((name, usec, expected, change))
+        if change > threshold:
+            regressed.append(name)
+    return rows, regressed
+
+
+def _report(rows):
+    width = max(len(row[0]) for row in rows)
+    for name, usec, expected, change in rows:
+        if expected is None:
+            print('{0:<{1}}  {2:12.3f} usec    (no baseline)'.format(
+                name, width, usec))
+        else:
+            print('{0:<{1}}  {2:12.3f} usec  {3:12.3f} expected  '
+                  '{4:+7.1%}'.format(name, width, usec, expected, change))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-k', dest='pattern',
+                        help='only run benchmarks whose name contains this')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE,
+                        help='path of the baseline file')
+    parser.add_argument('--save', action='store_true',
+                        help='store the results as the baseline')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='fraction a benchmark may slow down by')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='timing runs per benchmark; the best counts')
+    args = parser.parse_args(argv)
+
+    current = run(collect(args.pattern), args.repeat)
+    if args.save:
+        if args.pattern and os.path.exists(args.baseline):
+            # Only replace the benchmarks that were run
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+            scale = baseline['calibration'] / current['calibration']
+            for name, usec in current['results'].items():
+                baseline['results'][name] = usec * scale
+            current = baseline
+        directory = os.path.dirname(args.baseline)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(args.baseline, 'w') as f:
+            json.dump(current, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print('Saved {0} results to {1}'.format(len(current['results']),
+                                                args.baseline))
+        return 0
+
+    if not os.path.exists(args.baseline):
+        _report([(name, usec, None, None)
+                 for name, usec in sorted(current['results'].items())])
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    rows, regressed = compare(current, baseline, args.threshold)
+    _report(rows)
+    if regressed:
+        print('\n{0} benchmark(s) regressed by more than {1:.0%}: {2}'.format(
+            len(regressed), args.threshold, ', '.join(regressed)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
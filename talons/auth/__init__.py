@@ -1,2 +1,2 @@
-from pkg_resources import declare_namespace
-declare_namespace(__name__)
+# Namespace package, without importing pkg_resources
+__path__ = __import__('pkgutil').extend_path(__path__, __name__)
@@ -0,0 +1,208 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import logging
+import threading
+
+import six
+
+from talons import exc
+from talons import stats
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 1000
+
+
+def _pinned_list(value):
+    if not value:
+        return ()
+    if isinstance(value, six.string_types):
+        return tuple(v.strip() for v in value.split(',') if v.strip())
+    return tuple(value)
+
+
+class AdaptiveChain(object):
+
+    """
+    Runs a chain of plugins until the first one succeeds, periodically
+    reordering the chain so that the expected cost of reaching a success is
+    as low as possible.
+
+    For every plugin the chain keeps the average cost of a call and the
+    share of all requests that the plugin succeeded on. Plugins are sorted
+    by cost divided by success rate, which minimizes expected latency when
+    at most one plugin in the chain can succeed for a given request, e.g. an
+    API key identifier and an HTTP Basic identifier. Reordering does not
+    change the outcome of such chains, only how quickly it is reached.
+
+    Plugins whose position matters must be pinned. A pinned plugin stays at
+    its configured position and no plugin is moved across it, so plugins
+    are only reordered between pins.
+
+    The statistics are updated without a lock, so that the request path
+    never waits, and are approximate: concurrent requests may lose an
+    update, and reordering may read a plugin's counts mid-update. Losing
+    a few of a thousand samples does not change the order, and
+    `reorder` copies the counts and copes with inconsistent ones.
+    """
+
+    def __init__(self, plugins, pinned=(), interval=DEFAULT_INTERVAL):
+        """
+        :param plugins: List of plugin objects, in configured order.
+        :param pinned: Collection of plugin objects, or of plugin names as
+                       returned by `talons.stats.plugin_name`, that must
+                       stay in place.
+        :param interval: Number of requests between reorderings.
+        """
+        self.plugins = list(plugins)
+        self.interval = interval
+        self.pinned = [p in pinned or stats.plugin_name(p) in pinned
+                       for p in self.plugins]
+        n = len(self.plugins)
+        self.calls = [0] * n
+        self.successes = [0] * n
+        self.cost = [0.0] * n
+        self.requests = 0
+        self.order = tuple(range(n))
+        self._lock = threading.Lock()
+
+    @property
+    def ordered(self):
+        """
+        Returns the list of plugins in the order they are currently tried.
+        """
+        return [self.plugins[x] for x in self.order]
+
+    def steps(self):
+        """
+        Returns a list of (position, plugin) tuples of the plugins in the
+        order they are currently tried. Callers pass the position to
+        `record` after each call, and call `finish` once per request.
+        """
+        plugins = self.plugins
+        return [(x, plugins[x]) for x in self.order]
+
+    def record(self, x, seconds, ok):
+        """
+        Records that the plugin at position x took seconds and whether it
+        succeeded.
+        """
+        self.cost[x] += seconds
+        self.calls[x] += 1
+        if ok:
+            self.successes[x] += 1
+
+    def finish(self):
+        """
+        Counts a request that went through the chain, and reorders the
+        chain every interval requests.
+        """
+        self.requests += 1
+        if self.requests >= self.interval:
+            self.reorder()
+
+    @staticmethod
+    def _keys(calls, successes, cost, requests):
+        """
+        Returns the expected cost of each plugin from copies of the
+        statistics. Plugins that never succeeded come last.
+        """
+        keys = []
+        for x, c in enumerate(calls):
+            if not successes[x] or not c:
+                keys.append((float('inf'), x))
+                continue
+            rate = float(successes[x]) / max(requests, successes[x])
+            keys.append(((cost[x] / c) / rate, x))
+        return keys
+
+    def reorder(self):
+        """
+        Sorts the unpinned plugins between pins by expected cost, then
+        halves the collected statistics so that older requests weigh less.
+        """
+        if not self._lock.acquire(False):
+            return
+        try:
+            requests = self.requests
+            if not requests:
+                return
+            keys = self._keys(list(self.calls), list(self.successes),
+                              list(self.cost), requests)
+            order = []
+            segment = []
+            for x in range(len(self.plugins)):
+                if self.pinned[x]:
+                    order.extend(sorted(segment, key=keys.__getitem__))
+                    order.append(x)
+                    segment = []
+                else:
+                    segment.append(x)
+            order.extend(sorted(segment, key=keys.__getitem__))
+            order = tuple(order)
+            if order != self.order:
+                LOG.debug("Reordered chain to {0}".format(
+                    [stats.plugin_name(self.plugins[x]) for x in order]))
+                self.order = order
+
+            for x in range(len(self.plugins)):
+                self.calls[x] //= 2
+                self.successes[x] //= 2
+                self.cost[x] /= 2
+            self.requests //= 2
+        finally:
+            self._lock.release()
+
+
+def create_chains(identifiers, authenticators, **conf):
+    """
+    Returns an (identifier_chain, authenticator_chain) tuple of
+    `AdaptiveChain` objects, or None for the chains that keep their
+    configured order. Authenticators are reordered if the adaptive_order
+    configuration option is set, and identifiers only if the
+    adaptive_identifiers option is set too, since an identifier often has
+    to run before another, e.g. one that reads an API key header before
+    one that reads any Authorization header. See
+    `talons.auth.middleware.Middleware` for the configuration options.
+
+    Authenticators that set roles or groups on the identity are always
+    pinned, since skipping them would change the resulting identity.
+
+    :raises `talons.exc.BadConfiguration` if configuration options
+            are not valid.
+    """
+    if not conf.get('adaptive_order', False):
+        return None, None
+    try:
+        interval = int(conf.get('adaptive_interval', DEFAULT_INTERVAL))
+    except (TypeError, ValueError):
+        interval = 0
+    if interval < 1:
+        msg = "adaptive_interval must be a positive integer."
+        LOG.error(msg)
+        raise exc.BadConfiguration(msg)
+    pinned = _pinned_list(conf.get('adaptive_pinned'))
+    auth_pinned = list(pinned)
+    for a in authenticators:
+        if a.sets_roles() or a.sets_groups():
+            auth_pinned.append(a)
+    identifier_chain = None
+    if conf.get('adaptive_identifiers', False):
+        identifier_chain = AdaptiveChain(identifiers, pinned, interval)
+    return (identifier_chain,
+            AdaptiveChain(authenticators, auth_pinned, interval))
@@ -0,0 +1,128 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import logging
+import threading
+import time
+
+from talons import exc
+
+LOG = logging.getLogger(__name__)
+
+
+class Shed(Exception):
+
+    """
+    Raised when expensive verification work was not admitted.
+    """
+
+
+class AdmissionController(object):
+
+    """
+    Bounds the number of expensive credential verifications, such as bcrypt
+    checks or remote callouts, that run at the same time.
+
+    When max_concurrent verifications are in flight, further requests wait
+    up to max_queue_time seconds for one to finish, and are shed if none
+    does. Requests whose credentials are cheap to verify are not counted,
+    so already-authenticated traffic keeps flowing during a burst of new
+    clients.
+    """
+
+    def __init__(self, max_concurrent, max_queue_time=0):
+        self.max_concurrent = max_concurrent
+        self.max_queue_time = max_queue_time
+        self.in_flight = 0
+        self._cond = threading.Condition(threading.Lock())
+
+    def try_acquire(self):
+        """
+        Takes a slot without waiting. Returns True if a slot was taken,
+        False otherwise.
+        """
+        with self._cond:
+            if self.in_flight < self.max_concurrent:
+                self.in_flight += 1
+                return True
+            return False
+
+    def acquire(self):
+        """
+        Takes a slot, waiting up to max_queue_time seconds for one to be
+        released. Returns True if a slot was taken, False otherwise.
+        """
+        with self._cond:
+            if self.in_flight >= self.max_concurrent and self.max_queue_time:
+                deadline = time.time() + self.max_queue_time
+                while self.in_flight >= self.max_concurrent:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            if self.in_flight < self.max_concurrent:
+                self.in_flight += 1
+                return True
+            return False
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def call(self, authenticator, identity):
+        """
+        Calls authenticator.authenticate(identity), holding a slot if the
+        authenticator's `is_expensive` method says verifying the identity
+        is expensive.
+
+        :raises `Shed` if no slot could be taken.
+        """
+        is_expensive = getattr(authenticator, 'is_expensive', None)
+        if is_expensive is None or not is_expensive(identity):
+            return authenticator.authenticate(identity)
+        if not self.acquire():
+            raise Shed()
+        try:
+            return authenticator.authenticate(identity)
+        finally:
+            self.release()
+
+
+def create_admission_controller(**conf):
+    """
+    Returns an `AdmissionController` if the admission_max_concurrent
+    configuration option is set, or None otherwise. See
+    `talons.auth.middleware.Middleware` for the configuration options.
+
+    :raises `talons.exc.BadConfiguration` if configuration options
+            are not valid.
+    """
+    max_concurrent = conf.get('admission_max_concurrent')
+    if not max_concurrent:
+        return None
+    try:
+        max_concurrent = int(max_concurrent)
+        max_queue_time = float(conf.get('admission_max_queue_time', 0))
+        if max_concurrent < 1 or max_queue_time < 0:
+            raise ValueError()
+    except (TypeError, ValueError):
+        msg = ("admission_max_concurrent must be a positive integer and "
+               "admission_max_queue_time a positive number of seconds.")
+        LOG.error(msg)
+        raise exc.BadConfiguration(msg)
+    return AdmissionController(max_concurrent, max_queue_time)
@@ -0,0 +1,339 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+Falcon ASGI support. This module requires Python 3.5 or later.
+"""
+
+import asyncio
+
+from talons import helpers
+from talons import stats
+from talons.auth import admission
+from talons.auth import component as component_mod
+from talons.auth import interfaces
+from talons.auth import middleware
+from talons.auth import parallel
+from talons.auth import routes as routes_mod
+from talons.auth import wsgi
+
+# Key in the ASGI scope that holds the WSGI-style environ that identifiers
+# and authenticators see. The 'wsgi.identity', 'wsgi.identified',
+# 'wsgi.authenticated' and 'wsgi.authorized' results are stored in it.
+ENVIRON_SCOPE_KEY = 'talons.environ'
+
+
+def environ_from_request(req):
+    """
+    Returns a WSGI-style environ dict built from a `falcon.asgi.Request`,
+    with the request line and HTTP_* header keys that plugins look at.
+    """
+    env = {
+        'REQUEST_METHOD': req.method,
+        'SCRIPT_NAME': req.root_path or '',
+        'PATH_INFO': req.path,
+        'QUERY_STRING': req.query_string,
+    }
+    for name, value in req.headers.items():
+        env[helpers.environ_key(name)] = value
+    return env
+
+
+def _async_method(plugin, name):
+    """
+    Returns the plugin's `<name>_async` coroutine function, if it has one.
+    """
+    fn = getattr(plugin, name + '_async', None)
+    if fn is not None and asyncio.iscoroutinefunction(fn):
+        return fn
+    return None
+
+
+class AsyncComponent(object):
+
+    """
+    Falcon ASGI middleware component that runs a
+    `talons.auth.middleware.Middleware` chain once per request.
+
+    Plugins that define coroutine `identify_async`, `authenticate_async` or
+    `authorize_async` methods are awaited directly on the event loop.
+    Plugins that only have the regular methods are called inline, so no
+    request hops to a thread pool, unless the parallel_authenticate option
+    is set: then all authenticators run concurrently, and regular methods
+    run on the fan-out thread pool.
+    """
+
+    def __init__(self, auth_middleware):
+        """
+        :param auth_middleware: A `talons.auth.middleware.Middleware` object.
+        """
+        self.auth_middleware = auth_middleware
+        # Maps the id of each plugin to its coroutine method, or None. The
+        # order plugins are tried in is the middleware's, which may change
+        # if the adaptive_order option is set.
+        self.async_methods = {}
+        for plugins, name in ((auth_middleware.identifiers, 'identify'),
+                              (auth_middleware.authenticators,
+                               'authenticate'),
+                              ([auth_middleware.authorizer], 'authorize')):
+            for p in plugins:
+                if p is not None:
+                    self.async_methods[id(p)] = _async_method(p, name)
+
+    async def _fan_out(self, identity):
+        """
+        Runs all authenticators concurrently: coroutine methods as tasks on
+        the event loop, and regular methods on the fan-out thread pool.
+        Behaves like `talons.auth.parallel.FanOut.authenticate`.
+        """
+        fan_out = self.auth_middleware.fan_out
+        loop = asyncio.get_running_loop()
+        deadline = None
+        if fan_out.timeout is not None:
+            deadline = loop.time() + fan_out.timeout
+        pending = {}
+        for a in self.auth_middleware.authenticators:
+            c = parallel.copy_identity(identity)
+            authenticate_async = self.async_methods[id(a)]
+            if authenticate_async is not None:
+                f = asyncio.ensure_future(authenticate_async(c))
+            elif self.auth_middleware.admission is not None:
+                f = loop.run_in_executor(fan_out.executor,
+                                         self.auth_middleware.admission.call,
+                                         a, c)
+            else:
+                f = loop.run_in_executor(fan_out.executor, a.authenticate, c)
+            pending[f] = c
+
+        error = None
+        try:
+            while pending:
+                timeout = None
+                if deadline is not None:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        return False
+                done, _not_done = await asyncio.wait(
+                    list(pending), timeout=timeout,
+                    return_when=asyncio.FIRST_COMPLETED)
+                for f in done:
+                    c = pending.pop(f)
+                    err = f.exception()
+                    if err is not None:
+                        error = error or err
+                    elif f.result():
+                        identity.__dict__.update(c.__dict__)
+                        return True
+        finally:
+            for f in pending:
+                f.cancel()
+        if error is not None:
+            raise error
+        return False
+
+    async def process_request(self, req, resp):
+        mw = self.auth_middleware
+        env = environ_from_request(req)
+        req.scope[ENVIRON_SCOPE_KEY] = env
+        if mw.public_paths is not None and mw.is_public(env):
+            return
+        trace = None
+        if mw.profiler is not None:
+            # Other requests run on the same thread, so no deep profile
+            trace = mw.profiler.begin(deep=False)
+        try:
+            outcome = await self._authenticate(wsgi.Request(env), trace)
+        except Exception:
+            if trace is not None:
+                mw.profiler.pause(trace)
+            raise
+        if trace is not None:
+            mw.hold_trace(trace, env, outcome)
+        if outcome is not None and outcome is not middleware.ANONYMOUS:
+            mw.raise_for(outcome, env)
+
+    async def _authenticate(self, request, trace):
+        """
+        Runs the identify and authenticate part of the chain and returns
+        the same outcomes as
+        `talons.auth.middleware.Middleware.process_authentication`. Mirrors
+        `talons.auth.middleware.Middleware._authenticate`, awaiting the
+        plugins that have coroutine methods.
+        """
+        mw = self.auth_middleware
+        env = request.env
+        start = stats.clock() if mw.stats_sink is not None else None
+        identified = False
+        chain = mw.identifier_chain
+        for x, i in mw.plugin_steps(chain, mw.identifiers):
+            identify_async = self.async_methods[id(i)]
+            began = mw.start_call(i, chain, trace)
+            if identify_async is not None:
+                found = await identify_async(request)
+            else:
+                found = i.identify(request)
+            mw.end_call('identify', i, x, chain, trace, began, found)
+            if found:
+                identified = True
+                break
+        start = mw.end_stage('identify', identified, env, start, chain)
+        if not identified:
+            if mw.delay_401:
+                return middleware.ANONYMOUS
+            return middleware.NO_IDENTITY
+
+        identity = env['wsgi.identity']
+        authenticated = False
+        shed = []
+        chain = None
+        if mw.login_filter is not None and mw.is_unknown(identity):
+            # No authenticator knows the login, so none is called
+            pass
+        elif mw.fan_out is not None:
+            for a in mw.authenticators:
+                mw.start_call(a)
+            began = stats.clock() if trace is not None else None
+            try:
+                authenticated = await self._fan_out(identity)
+            except admission.Shed:
+                shed.append(None)
+            mw.end_call('authenticate', 'parallel', None, None, trace,
+                        began, authenticated)
+        else:
+            chain = mw.authenticator_chain
+            for x, a in mw.plugin_steps(chain, mw.authenticators):
+                authenticate_async = self.async_methods[id(a)]
+                began = mw.start_call(a, chain, trace)
+                # Waiting for a slot would block the event loop, so
+                # expensive verifications are only admitted if a slot is
+                # free right away.
+                admitted = (mw.admission is not None and
+                            a.is_expensive(identity))
+                if admitted and not mw.admission.try_acquire():
+                    shed.append(a)
+                    mw.end_call('authenticate', a, x, chain, trace, began,
+                                False)
+                    continue
+                try:
+                    if authenticate_async is not None:
+                        ok = await authenticate_async(identity)
+                    else:
+                        ok = a.authenticate(identity)
+                finally:
+                    if admitted:
+                        mw.admission.release()
+                mw.end_call('authenticate', a, x, chain, trace, began, ok)
+                if ok:
+                    authenticated = True
+                    break
+        mw.end_stage('authenticate', authenticated, env, start, chain)
+        return mw.finish_authentication(identity, env, authenticated, shed)
+
+    async def process_resource(self, req, resp, resource, params=None):
+        env = req.scope.get(ENVIRON_SCOPE_KEY)
+        if resource is None or env is None or not env['wsgi.identified']:
+            return
+        mw = self.auth_middleware
+        trace = mw.resume_trace(env)
+        start = stats.clock() if mw.stats_sink is not None else None
+        authorized = mw.default_authorize
+        authorizer = mw.authorizer
+        if authorizer is not None:
+            res = interfaces.ResourceAction(wsgi.Request(env), params or {},
+                                            resource=resource,
+                                            route=req.uri_template)
+            authorize_async = self.async_methods[id(authorizer)]
+            began = mw.start_call(authorizer, trace=trace)
+            try:
+                if authorize_async is not None:
+                    authorized = await authorize_async(env['wsgi.identity'],
+                                                       res)
+                else:
+                    authorized = authorizer.authorize(env['wsgi.identity'],
+                                                      res)
+            except Exception:
+                if trace is not None:
+                    mw.profiler.pause(trace)
+                raise
+            mw.end_call('authorize', authorizer, None, None, trace, began,
+                        authorized)
+        outcome = mw.finish_authorization(env, authorized, start, trace)
+        if outcome is not None:
+            mw.raise_for(outcome)
+
+    async def process_response(self, req, resp, resource, req_succeeded):
+        env = req.scope.get(ENVIRON_SCOPE_KEY)
+        if env is not None:
+            self.auth_middleware.finish_held_trace(env)
+
+
+def create_async_component(identify_with, authenticate_with,
+                           authorize_with=None, **conf):
+    """
+    Helper method to create a Falcon ASGI middleware component that can be
+    supplied to `falcon.asgi.App(middleware=[...])`. Takes the same
+    arguments as `talons.auth.middleware.create_middleware`.
+
+    :raises `talons.exc.BadConfiguration` if the identifiers or authenticators
+            lists are empty or don't make sense.
+    """
+    return AsyncComponent(middleware.create_middleware(identify_with,
+                                                       authenticate_with,
+                                                       authorize_with,
+                                                       **conf))
+
+
+class AsyncRouteComponent(object):
+
+    """
+    Falcon ASGI middleware component with a chain per route. See
+    `talons.auth.component.RouteComponent`.
+    """
+
+    def __init__(self, routes, default, templates=()):
+        def _component(chain):
+            if chain is None:
+                return None
+            return AsyncComponent(chain)
+
+        routes = [(p, _component(chain)) for p, chain in
+                  (routes.items() if isinstance(routes, dict) else routes)]
+        self.routes = routes_mod.RouteTable(routes, _component(default),
+                                            templates)
+
+    async def process_resource(self, req, resp, resource, params=None):
+        if resource is None:
+            return
+        component = self.routes.resolve(req.uri_template)
+        if component is None:
+            req.scope[ENVIRON_SCOPE_KEY] = dict(component_mod.PUBLIC_ENV)
+            return
+        await component.process_request(req, resp)
+        await component.process_resource(req, resp, resource, params)
+
+
+def create_async_route_component(routes, default, **conf):
+    """
+    Helper method to create a Falcon ASGI middleware component with a chain
+    per route. Takes the same arguments as
+    `talons.auth.component.create_route_component`.
+
+    :raises `talons.exc.BadConfiguration` if the identifiers or authenticators
+            lists are empty or don't make sense.
+    """
+    routes, default = routes_mod.build_policies(
+        routes, default, middleware.create_middleware, **conf)
+    return AsyncRouteComponent(routes, default)
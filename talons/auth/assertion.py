@@ -0,0 +1,233 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+Signed identity assertions that let a trusted upstream hop vouch for an
+identity it has already authenticated.
+
+An assertion is a compact token of the form::
+
+    base64url(payload) "." base64url(hmac-sha256(secret, base64url(payload)))
+
+where the payload is a small JSON document holding the login, roles,
+groups and an expiry timestamp. Downstream services that share the
+secret only need a single HMAC computation to accept the identity, instead
+of repeating password hashing or external callouts.
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import time
+
+import six
+
+from talons import exc
+from talons.auth import interfaces
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_HEADER = 'X-Talons-Assertion'
+DEFAULT_TTL = 60
+ASSERTION_ENV_KEY = 'wsgi.identity_assertion'
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(six.b('='))
+
+
+def _b64decode(data):
+    if isinstance(data, six.text_type):
+        data = data.encode('ascii')
+    return base64.urlsafe_b64decode(data + six.b('=') * (-len(data) % 4))
+
+
+def _to_bytes(value):
+    if isinstance(value, six.text_type):
+        return value.encode('utf-8')
+    return value
+
+
+def _signature(secret, body):
+    return _b64encode(hmac.new(_to_bytes(secret), body,
+                               hashlib.sha256).digest())
+
+
+def sign(identity, secret, ttl=DEFAULT_TTL, now=None):
+    """
+    Returns a signed assertion string for the supplied identity.
+
+    :param identity: The `talons.auth.interfaces.Identity` object that has
+                     been authenticated.
+    :param secret: Shared secret used to sign the assertion.
+    :param ttl: Number of seconds the assertion stays valid.
+    :param now: Optional current timestamp, for testing.
+    """
+    now = time.time() if now is None else now
+    payload = {
+        'l': identity.login,
+        'r': sorted(identity.roles),
+        'g': sorted(identity.groups),
+        'e': int(now + ttl),
+    }
+    payload = json.dumps(payload, separators=(',', ':'), sort_keys=True)
+    body = _b64encode(payload.encode('utf-8'))
+    return (body + six.b('.') + _signature(secret, body)).decode('ascii')
+
+
+def decode(token):
+    """
+    Returns the payload dict of the supplied assertion string *without*
+    checking its signature, or None if the token is not well-formed.
+    """
+    try:
+        body, _sep, _sig = token.partition('.')
+        payload = json.loads(_b64decode(body).decode('utf-8'))
+    except (TypeError, ValueError, UnicodeError) as err:
+        LOG.debug("Malformed identity assertion. Got error: {0}".format(err))
+        return None
+    if not isinstance(payload, dict) or 'l' not in payload:
+        return None
+    return payload
+
+
+def verify(token, secret, now=None):
+    """
+    Returns the payload dict of the supplied assertion string if the
+    signature matches and the assertion has not expired, None otherwise.
+    """
+    if not token or '.' not in token:
+        return None
+    body, _sep, sig = token.partition('.')
+    try:
+        expected = _signature(secret, body.encode('ascii'))
+    except UnicodeError:
+        return None
+    if not hmac.compare_digest(expected, _to_bytes(sig)):
+        LOG.debug("Identity assertion signature mismatch.")
+        return None
+    payload = decode(token)
+    if payload is None:
+        return None
+    now = time.time() if now is None else now
+    if payload.get('e', 0) < now:
+        LOG.debug("Identity assertion for {0} expired.".format(payload['l']))
+        return None
+    return payload
+
+
+class Identifier(interfaces.Identifies):
+
+    """
+    Looks for a signed identity assertion in an HTTP header and stores
+    identity in the request environ's 'wsgi.identity' key. The assertion
+    itself is stored as the identity's key, so that the matching
+    `talons.auth.assertion.Authenticator` can verify it.
+    """
+
+    options = ('assertion_header',)
+
+    def __init__(self, **conf):
+        """
+        Construct a concrete object with a set of keyword configuration
+        options.
+
+        :param **conf:
+
+            assertion_header: HTTP header to look for the assertion in.
+                              (defaults to X-Talons-Assertion)
+
+        :raises `talons.exc.BadConfiguration` if configuration options
+                are not valid or conflict with each other.
+        """
+        self.header = conf.get('assertion_header', DEFAULT_HEADER)
+
+    def identify(self, request):
+        if request.env.get(self.IDENTITY_ENV_KEY) is not None:
+            return True
+
+        token = request.get_header(self.header)
+        if not token:
+            return False
+
+        payload = decode(token)
+        if payload is None:
+            return False
+
+        identity = interfaces.Identity(payload['l'], key=token)
+        request.env[self.IDENTITY_ENV_KEY] = identity
+        return True
+
+
+class Authenticator(interfaces.Authenticates):
+
+    """
+    Authenticates the supplied Identity by checking the HMAC signature and
+    expiry of the identity assertion stored as the identity's key. Roles
+    and groups carried by the assertion are set on the identity.
+    """
+
+    options = ('assertion_secret',)
+
+    def __init__(self, **conf):
+        """
+        Construct a concrete object with a set of keyword configuration
+        options.
+
+        :param **conf:
+
+            assertion_secret: Secret shared with the trusted upstream peers
+                              that sign assertions. (required)
+
+        :raises `talons.exc.BadConfiguration` if configuration options
+                are not valid or conflict with each other.
+        """
+        self.secret = conf.get('assertion_secret')
+        if not self.secret:
+            msg = ("Missing required assertion_secret "
+                   "configuration option.")
+            LOG.error(msg)
+            raise exc.BadConfiguration(msg)
+
+    def authenticate(self, identity):
+        """
+        Looks at the supplied identity object and returns True if the
+        credentials can be verified, False otherwise.
+        """
+        if not isinstance(identity.key, six.string_types):
+            return False
+        payload = verify(identity.key, self.secret)
+        if payload is None or payload['l'] != identity.login:
+            return False
+        identity.roles = set(payload.get('r', []))
+        identity.groups = set(payload.get('g', []))
+        return True
+
+    def sets_roles(self):
+        """
+        Returns True if the authenticator plugin decorates the Identity
+        object with a set of roles, False otherwise.
+        """
+        return True
+
+    def sets_groups(self):
+        """
+        Returns True if the authenticator plugin decorates the Identity
+        object with a set of groups, False otherwise.
+        """
+        return True
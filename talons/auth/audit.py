@@ -0,0 +1,319 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+"""
+Audit log of the identify, authenticate and authorize decisions of a
+chain, written as JSON lines by a background thread.
+"""
+
+import atexit
+import collections
+import json
+import logging
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # pragma: NO COVER
+    fcntl = None
+
+from talons import exc
+
+LOG = logging.getLogger(__name__)
+
+DROP = 'drop'
+BLOCK = 'block'
+
+# Field names of the JSON object written for each record tuple
+FIELDS = ('ts', 'stage', 'ok', 'login', 'method', 'path')
+
+
+class AuditLog(object):
+
+    """
+    Writes decision records to a file as JSON lines, without adding disk
+    latency to requests.
+
+    `record()` appends a small tuple to a deque, which is thread-safe
+    without a lock, and only wakes the writer thread once a batch is
+    ready. The writer thread serializes and writes whole batches, at least
+    every flush_interval seconds, and rotates the file by size and age.
+
+    The writer thread is started by the first record of each process, so
+    that the workers of a pre-forking server that created the log before
+    forking each start their own. Worker processes may share the path:
+    batches are appended with one write each, and the file is rotated by
+    one process at a time, holding a lock on path.lock, while the others
+    reopen the new file once they see that it was rotated.
+
+    When the queue is full, records are dropped and counted in `dropped`
+    and in the 'audit.dropped' counter of the stats sink, or, with the
+    block policy, the request waits for the writer to catch up, for at
+    most block_timeout seconds. Records are always dropped once the writer
+    thread is no longer running, and batches that could not be written
+    are counted as dropped.
+    """
+
+    def __init__(self, path, max_queue=10000, batch_size=256,
+                 flush_interval=1.0, max_bytes=0, rotate_interval=0,
+                 backup_count=5, when_full=DROP, block_timeout=1.0,
+                 stats_sink=None):
+        """
+        :param path: Path of the audit log file.
+        :param max_queue: Maximum number of records waiting to be written.
+        :param batch_size: Number of queued records that wakes the writer.
+        :param flush_interval: Maximum seconds a record waits to be
+                               written.
+        :param max_bytes: Size at which the file is rotated. 0 never
+                          rotates by size.
+        :param rotate_interval: Seconds after which the file is rotated. 0
+                                never rotates by age.
+        :param backup_count: Number of rotated files kept, as path.1 (the
+                             newest) to path.<backup_count>.
+        :param when_full: DROP or BLOCK.
+        :param block_timeout: Maximum seconds a request waits for space in
+                              the queue with the BLOCK policy, after which
+                              its record is dropped.
+        :param stats_sink: Optional `talons.stats.Sink` object.
+        """
+        self.path = path
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backup_count = backup_count
+        self.when_full = when_full
+        self.block_timeout = block_timeout
+        self.stats_sink = stats_sink
+        self.dropped = 0
+        self._queue = collections.deque()
+        self._wake = threading.Event()
+        self._space = threading.Event()
+        self._closed = False
+        self._file = None
+        self._start_lock = threading.Lock()
+        self._thread = None
+        # Process that owns the open file and the writer thread
+        self._pid = os.getpid()
+        self._open()
+        atexit.register(self.close)
+
+    def _start(self):
+        """
+        Starts the writer thread of the calling process. A process forked
+        after the log was created discards the records it inherited, which
+        its parent writes, and opens the file again.
+        """
+        with self._start_lock:
+            pid = os.getpid()
+            if self._pid != pid:
+                self._queue = collections.deque()
+                self._wake = threading.Event()
+                self._space = threading.Event()
+                self._file.close()
+                self._open()
+                self._pid = pid
+                self._thread = None
+            if self._thread is None and not self._closed:
+                self._thread = threading.Thread(target=self._run,
+                                                name='talons-audit')
+                self._thread.daemon = True
+                self._thread.start()
+
+    def record(self, stage, ok, env):
+        """
+        Queues a decision record with the login of the environ's identity,
+        if any, and the request method and path. Returns False if the
+        record was dropped.
+
+        :param stage: 'identify', 'authenticate' or 'authorize'.
+        :param ok: Whether the stage succeeded.
+        :param env: WSGI environ of the request.
+        """
+        if self._thread is None or self._pid != os.getpid():
+            self._start()
+        queue = self._queue
+        if len(queue) >= self.max_queue:
+            if (self.when_full == DROP or self._closed or
+                    not self._thread.is_alive()):
+                return self._drop()
+            deadline = time.time() + self.block_timeout
+            while len(queue) >= self.max_queue and not self._closed:
+                if time.time() >= deadline or not self._thread.is_alive():
+                    return self._drop()
+                self._space.clear()
+                self._wake.set()
+                self._space.wait(0.1)
+        identity = env.get('wsgi.identity')
+        queue.append((time.time(), stage, bool(ok),
+                      getattr(identity, 'login', None),
+                      env.get('REQUEST_METHOD'), env.get('PATH_INFO')))
+        if len(queue) >= self.batch_size:
+            self._wake.set()
+        return True
+
+    def _drop(self, count=1):
+        self.dropped += count
+        if self.stats_sink is not None:
+            self.stats_sink.incr('audit.dropped', count)
+        return False
+
+    def _open(self):
+        # Unbuffered, so that each batch is appended with one write
+        self._file = open(self.path, 'ab', 0)
+        self._opened = time.time()
+
+    def _rotated(self):
+        """
+        Returns True if the file at the path is no longer the open file,
+        because another process rotated it or it was removed.
+        """
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return True
+        current = os.fstat(self._file.fileno())
+        return (st.st_dev, st.st_ino) != (current.st_dev, current.st_ino)
+
+    def _should_rotate(self, now):
+        # The size of the file, which other processes may append to
+        if (self.max_bytes and
+                os.fstat(self._file.fileno()).st_size >= self.max_bytes):
+            return True
+        return bool(self.rotate_interval and
+                    now - self._opened >= self.rotate_interval)
+
+    def rotate(self):
+        """
+        Renames the file to path.1, shifting older files up to
+        path.<backup_count>, and starts a new file. Without backups, the
+        file is truncated. If another process already rotated or removed
+        the file, the new file is only opened.
+        """
+        with open(self.path + '.lock', 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            try:
+                if not self._rotated():
+                    self._shift()
+            finally:
+                self._file.close()
+                self._open()
+
+    def _shift(self):
+        if self.backup_count:
+            for x in range(self.backup_count - 1, 0, -1):
+                src = '{0}.{1}'.format(self.path, x)
+                if os.path.exists(src):
+                    os.rename(src, '{0}.{1}'.format(self.path, x + 1))
+            os.rename(self.path, self.path + '.1')
+        else:
+            os.unlink(self.path)
+
+    def flush(self):
+        """
+        Writes all queued records. Only called by the writer thread, and by
+        `close()` once the writer thread has stopped. A batch that cannot
+        be written is counted as dropped.
+        """
+        queue = self._queue
+        while queue:
+            lines = []
+            while queue and len(lines) < self.batch_size:
+                lines.append(json.dumps(dict(zip(FIELDS, queue.popleft())),
+                                        separators=(',', ':')))
+            self._space.set()
+            data = ('\n'.join(lines) + '\n').encode('utf-8')
+            try:
+                if self._rotated():
+                    self._file.close()
+                    self._open()
+                self._file.write(data)
+            except (IOError, OSError):
+                self._drop(len(lines))
+                raise
+            if self._should_rotate(time.time()):
+                self.rotate()
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+                if self._should_rotate(time.time()):
+                    self.rotate()
+            except Exception as err:
+                # The writer must keep running, or blocked requests would
+                # wait until they time out
+                LOG.warning("Unable to write audit log {0}: {1}".format(
+                    self.path, err))
+
+    def close(self):
+        """
+        Stops the writer thread and writes the remaining records. Does
+        nothing in a forked process that never recorded anything.
+        """
+        if self._closed or self._pid != os.getpid():
+            return
+        self._closed = True
+        self._wake.set()
+        self._space.set()
+        if self._thread is not None:
+            self._thread.join()
+        try:
+            self.flush()
+        finally:
+            self._file.close()
+
+
+def create_audit_log(**conf):
+    """
+    Returns an `AuditLog` built from the audit_* configuration options, or
+    None if audit_path is not set. See `talons.auth.middleware.Middleware`
+    for the configuration options.
+
+    :raises `talons.exc.BadConfiguration` if configuration options
+            are not valid.
+    """
+    path = conf.get('audit_path')
+    if not path:
+        return None
+    when_full = conf.get('audit_when_full', DROP)
+    if when_full not in (DROP, BLOCK):
+        msg = "audit_when_full must be 'drop' or 'block'."
+        LOG.error(msg)
+        raise exc.BadConfiguration(msg)
+    try:
+        return AuditLog(
+            path,
+            max_queue=int(conf.get('audit_queue_size', 10000)),
+            batch_size=int(conf.get('audit_batch_size', 256)),
+            flush_interval=float(conf.get('audit_flush_interval', 1.0)),
+            max_bytes=int(conf.get('audit_max_bytes', 0)),
+            rotate_interval=float(conf.get('audit_rotate_interval', 0)),
+            backup_count=int(conf.get('audit_backup_count', 5)),
+            when_full=when_full,
+            block_timeout=float(conf.get('audit_block_timeout', 1.0)),
+            stats_sink=conf.get('stats_sink'))
+    except (TypeError, ValueError, IOError, OSError) as err:
+        msg = "Invalid audit log configuration: {0}".format(err)
+        LOG.error(msg)
+        raise exc.BadConfiguration(msg)
@@ -0,0 +1,246 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+"""
+Prefilter that rejects requests for logins that do not exist before any
+authenticator runs, using a Bloom filter of the known logins.
+"""
+
+import hashlib
+import logging
+import math
+import struct
+import threading
+
+import six
+
+from talons import exc
+from talons import helpers
+from talons import stats
+
+LOG = logging.getLogger(__name__)
+
+_LN2 = math.log(2)
+
+
+def _hashes(login):
+    if not isinstance(login, six.binary_type):
+        login = six.text_type(login).encode('utf-8')
+    return struct.unpack('<QQ', hashlib.sha256(login).digest()[:16])
+
+
+class BloomFilter(object):
+
+    """
+    Bloom filter of strings. Membership tests never give false negatives,
+    and give false positives at about the error rate the filter was sized
+    for, as long as no more than `capacity` strings were added.
+
+    The k bit positions of a string are derived from a single SHA-256
+    digest by double hashing.
+    """
+
+    def __init__(self, capacity, error_rate=0.001, max_bytes=None):
+        """
+        :param capacity: Number of strings the filter is sized for.
+        :param error_rate: Target rate of false positives.
+        :param max_bytes: Optional cap on the size of the bit array. If the
+                          error rate needs more memory, the filter is
+                          capped and has a higher error rate.
+        """
+        capacity = max(int(capacity), 1)
+        bits = int(math.ceil(-capacity * math.log(error_rate) / _LN2 ** 2))
+        if max_bytes:
+            bits = min(bits, int(max_bytes) * 8)
+        self.bits = max(bits, 8)
+        per_item = self.bits / float(capacity)
+        self.hash_count = max(1, int(round(per_item * _LN2)))
+        self.capacity = capacity
+        self.array = bytearray((self.bits + 7) // 8)
+
+    def _positions(self, value):
+        h1, h2 = _hashes(value)
+        bits = self.bits
+        return [(h1 + x * h2) % bits for x in range(self.hash_count)]
+
+    def add(self, value):
+        array = self.array
+        for pos in self._positions(value):
+            array[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, value):
+        array = self.array
+        for pos in self._positions(value):
+            if not array[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    @property
+    def error_rate(self):
+        """
+        Expected rate of false positives once `capacity` strings are added.
+        """
+        return (1 - math.exp(-self.hash_count * self.capacity /
+                             float(self.bits))) ** self.hash_count
+
+
+def file_logins(path):
+    """
+    Returns the logins in a file, one per line. Lines of the form
+    'login:...', as in an htpasswd file, give the part before the colon.
+    Blank lines and lines starting with '#' are skipped.
+    """
+    logins = []
+    with open(path, 'rb') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith(b'#'):
+                logins.append(line.partition(b':')[0].decode('utf-8'))
+    return logins
+
+
+class LoginFilter(object):
+
+    """
+    Keeps a `BloomFilter` of the logins returned by a source, such as an
+    htpasswd file, an exported list or a database query, and rebuilds it
+    from the source in a background thread. The filter in use is replaced
+    in a single assignment, so lookups never wait for a rebuild.
+    """
+
+    def __init__(self, source, capacity=None, error_rate=0.001,
+                 max_bytes=None, rebuild_interval=0, stats_sink=None):
+        """
+        :param source: Callable that returns an iterable of known logins.
+        :param capacity: Number of logins the filter is sized for.
+                         (defaults to the number of logins at each build)
+        :param error_rate: Target rate of unknown logins that get through.
+        :param max_bytes: Optional cap on the memory used by the filter.
+        :param rebuild_interval: Seconds between rebuilds. 0 never
+                                 rebuilds.
+        :param stats_sink: Optional `talons.stats.Sink`. The time taken to
+                           build the filter is recorded in its
+                           'login_filter_rebuild' histogram.
+        """
+        self.source = source
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.max_bytes = max_bytes
+        self.rebuild_interval = rebuild_interval
+        self.stats_sink = stats_sink
+        self.bloom = self.build()
+        self._stop = threading.Event()
+        self._thread = None
+        if rebuild_interval:
+            self._thread = threading.Thread(target=self._run,
+                                            name='talons-login-filter')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def build(self):
+        """
+        Returns a new `BloomFilter` of the logins of the source.
+        """
+        start = stats.clock()
+        logins = list(self.source())
+        bloom = BloomFilter(self.capacity or len(logins), self.error_rate,
+                            self.max_bytes)
+        for login in logins:
+            bloom.add(login)
+        if self.stats_sink is not None:
+            self.stats_sink.observe('login_filter_rebuild',
+                                    stats.clock() - start)
+        return bloom
+
+    def rebuild(self):
+        """
+        Replaces the filter with one built from the source. If the source
+        fails, the current filter is kept.
+        """
+        try:
+            self.bloom = self.build()
+        except Exception as err:
+            LOG.warning("Unable to rebuild the login filter, keeping the "
+                        "current one: {0}".format(err))
+
+    def _run(self):
+        while not self._stop.wait(self.rebuild_interval):
+            self.rebuild()
+
+    def stop(self):
+        self._stop.set()
+
+    def might_exist(self, login):
+        """
+        Returns False if the login is definitely unknown, True if it is
+        probably known.
+        """
+        return login in self.bloom
+
+
+def create_login_filter(**conf):
+    """
+    Returns a `LoginFilter` built from the login_filter_* configuration
+    options, or None if neither login_filter_path nor
+    login_filter_callable is set. See `talons.auth.middleware.Middleware`
+    for the configuration options.
+
+    :raises `talons.exc.BadConfiguration` if configuration options
+            are not valid.
+    """
+    path = conf.get('login_filter_path')
+    source = conf.get('login_filter_callable')
+    if not path and not source:
+        return None
+    if path and source:
+        msg = ("login_filter_path and login_filter_callable cannot both "
+               "be set.")
+        LOG.error(msg)
+        raise exc.BadConfiguration(msg)
+    if path:
+        def source():
+            return file_logins(path)
+    elif not callable(source):
+        try:
+            source = helpers.import_function(source)
+        except (TypeError, ImportError):
+            msg = ("login_filter_callable either could not be found or "
+                   "was not callable.")
+            LOG.error(msg)
+            raise exc.BadConfiguration(msg)
+    try:
+        capacity = conf.get('login_filter_capacity')
+        capacity = int(capacity) if capacity else None
+        error_rate = float(conf.get('login_filter_error_rate', 0.001))
+        max_bytes = conf.get('login_filter_max_bytes')
+        max_bytes = int(max_bytes) if max_bytes else None
+        interval = float(conf.get('login_filter_rebuild_interval', 300))
+    except (TypeError, ValueError):
+        error_rate = -1
+    if not 0 < error_rate < 1:
+        msg = ("login_filter_error_rate must be between 0 and 1, and the "
+               "other login_filter_* options numbers.")
+        LOG.error(msg)
+        raise exc.BadConfiguration(msg)
+    try:
+        return LoginFilter(source, capacity, error_rate, max_bytes,
+                           interval, conf.get('stats_sink'))
+    except (IOError, OSError, ValueError) as err:
+        # UnicodeDecodeError, for files that are not UTF-8, is a ValueError
+        msg = "Unable to build the login filter: {0}".format(err)
+        LOG.error(msg)
+        raise exc.BadConfiguration(msg)
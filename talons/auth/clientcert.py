@@ -0,0 +1,233 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import logging
+
+from talons import cache
+from talons import exc
+from talons.auth import interfaces
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_ENV_KEY = 'SSL_CLIENT_S_DN'
+VERIFY_ENV_KEY = 'SSL_CLIENT_VERIFY'
+
+
+class CertificateKey(object):
+
+    """
+    Key stored on identities built from a client certificate subject. The
+    TLS layer has already verified the certificate, so there is no secret
+    to check; `talons.auth.clientcert.Authenticator` only needs to see that
+    the identity came from a certificate.
+    """
+
+    def __init__(self, subject):
+        self.subject = subject
+
+    def __repr__(self):
+        return '<CertificateKey {0}>'.format(self.subject)
+
+
+def parse_dn(subject):
+    """
+    Returns a list of (attribute, value) tuples from a distinguished name
+    string. Both the OpenSSL "oneline" format (/C=US/O=Acme/CN=alice) and
+    the RFC 2253 format (CN=alice,O=Acme,C=US) are understood.
+
+    :raises ValueError if the subject is not a well-formed DN.
+    """
+    subject = subject.strip()
+    if subject.startswith('/'):
+        parts = subject[1:].split('/')
+    else:
+        parts = []
+        buf = []
+        escaped = False
+        for c in subject:
+            if escaped:
+                buf.append(c)
+                escaped = False
+            elif c == '\\':
+                escaped = True
+            elif c in ',+':
+                parts.append(''.join(buf))
+                buf = []
+            else:
+                buf.append(c)
+        parts.append(''.join(buf))
+
+    rdns = []
+    for part in parts:
+        attr, sep, value = part.partition('=')
+        if not sep or not attr.strip():
+            raise ValueError("Invalid RDN {0!r} in {1!r}".format(part,
+                                                                 subject))
+        rdns.append((attr.strip().upper(), value.strip()))
+    return rdns
+
+
+def _attr_list(value):
+    if not value:
+        return ()
+    if isinstance(value, (list, tuple, set)):
+        return tuple(v.upper() for v in value)
+    return tuple(v.strip().upper() for v in value.split(',') if v.strip())
+
+
+class Identifier(interfaces.Identifies):
+
+    """
+    Builds an identity from the subject of a client certificate that was
+    verified by the TLS terminator in front of the WSGI server, and stores
+    it in the request environ's 'wsgi.identity' key.
+
+    Parsed subjects are memoized in a bounded LRU cache, since a small
+    number of client certificates usually make up all of the traffic.
+    """
+
+    options = ('clientcert_env_key', 'clientcert_header',
+               'clientcert_login_attr', 'clientcert_role_attrs',
+               'clientcert_group_attrs', 'clientcert_cache_size')
+
+    def __init__(self, **conf):
+        """
+        Construct a concrete object with a set of keyword configuration
+        options.
+
+        :param **conf:
+
+            clientcert_env_key: WSGI environ key holding the certificate
+                                subject DN. (defaults to SSL_CLIENT_S_DN)
+            clientcert_header: HTTP header holding the certificate subject
+                               DN, for TLS terminators that forward it in a
+                               header. Only looked at if the environ key is
+                               missing. The terminator *must* strip this
+                               header from client requests. (optional)
+            clientcert_login_attr: DN attribute used as the identity's
+                                   login. (defaults to CN)
+            clientcert_role_attrs: Comma-separated DN attributes whose values
+                                   are added to the identity's roles.
+                                   (optional)
+            clientcert_group_attrs: Comma-separated DN attributes whose values
+                                    are added to the identity's groups.
+                                    (defaults to OU)
+            clientcert_cache_size: Number of parsed subjects to keep.
+                                   (defaults to 1024)
+            cache_backend: See `talons.cache.create_cache`.
+
+        :raises `talons.exc.BadConfiguration` if configuration options
+                are not valid or conflict with each other.
+        """
+        self.env_key = conf.pop('clientcert_env_key', DEFAULT_ENV_KEY)
+        self.header = conf.pop('clientcert_header', None)
+        self.login_attr = conf.pop('clientcert_login_attr', 'CN').upper()
+        self.role_attrs = _attr_list(conf.pop('clientcert_role_attrs', None))
+        self.group_attrs = _attr_list(conf.pop('clientcert_group_attrs',
+                                               'OU'))
+        try:
+            cache_size = int(conf.pop('clientcert_cache_size', 1024))
+        except (TypeError, ValueError):
+            cache_size = 0
+        if cache_size < 1:
+            msg = "clientcert_cache_size must be a positive integer."
+            LOG.error(msg)
+            raise exc.BadConfiguration(msg)
+        self.subjects = cache.create_cache('clientcert', cache_size, **conf)
+
+    def _map_subject(self, subject):
+        """
+        Returns a (login, roles, groups) tuple for the supplied subject, or
+        None if the subject cannot be parsed or has no login attribute.
+        """
+        try:
+            rdns = parse_dn(subject)
+        except ValueError as err:
+            LOG.debug("Unable to parse client certificate subject. "
+                      "Got error: {0}".format(err))
+            return None
+
+        login = None
+        roles = set()
+        groups = set()
+        for attr, value in rdns:
+            if attr == self.login_attr and login is None:
+                login = value
+            if attr in self.role_attrs:
+                roles.add(value)
+            if attr in self.group_attrs:
+                groups.add(value)
+        if not login:
+            return None
+        return login, frozenset(roles), frozenset(groups)
+
+    def identify(self, request):
+        if request.env.get(self.IDENTITY_ENV_KEY) is not None:
+            return True
+
+        verify = request.env.get(VERIFY_ENV_KEY)
+        if verify is not None and verify != 'SUCCESS':
+            return False
+
+        subject = request.env.get(self.env_key)
+        if not subject and self.header is not None:
+            subject = request.get_header(self.header)
+        if not subject:
+            return False
+
+        mapped = self.subjects.get(subject)
+        if mapped is None:
+            mapped = self._map_subject(subject)
+            if mapped is None:
+                return False
+            self.subjects.set(subject, mapped)
+
+        login, roles, groups = mapped
+        identity = interfaces.Identity(login, key=CertificateKey(subject),
+                                       roles=roles, groups=groups)
+        request.env[self.IDENTITY_ENV_KEY] = identity
+        return True
+
+
+class Authenticator(interfaces.Authenticates):
+
+    """
+    Trusts identities built by `talons.auth.clientcert.Identifier`, since
+    the client certificate was already verified when TLS was terminated.
+    """
+
+    options = ()
+
+    def authenticate(self, identity):
+        """
+        Looks at the supplied identity object and returns True if the
+        identity came from a verified client certificate, False otherwise.
+        """
+        return isinstance(identity.key, CertificateKey)
+
+    def sets_roles(self):
+        """
+        Returns True if the authenticator plugin decorates the Identity
+        object with a set of roles, False otherwise.
+        """
+        return False
+
+    def sets_groups(self):
+        """
+        Returns True if the authenticator plugin decorates the Identity
+        object with a set of groups, False otherwise.
+        """
+        return False
@@ -0,0 +1,146 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from talons.auth import middleware
+from talons.auth import routes as routes_mod
+
+# Results recorded in the environ of requests to routes without a chain
+PUBLIC_ENV = {'wsgi.identified': False, 'wsgi.authenticated': False,
+              'wsgi.authorized': True}
+
+
+class Component(object):
+
+    """
+    Falcon middleware component that runs a
+    `talons.auth.middleware.Middleware` chain once per request.
+
+    Identification and authentication happen in `process_request`, before
+    routing, so a rejected request short-circuits the rest of Falcon's
+    processing. Authorization happens in `process_resource`, where the
+    responder object and the matched route template are known and are
+    passed on to the authorizer in the
+    `talons.auth.interfaces.ResourceAction` object.
+    """
+
+    def __init__(self, auth_middleware):
+        """
+        :param auth_middleware: A `talons.auth.middleware.Middleware` object.
+        """
+        self.auth_middleware = auth_middleware
+
+    def process_request(self, req, resp):
+        outcome = self.auth_middleware.process_authentication(req)
+        if outcome is not None and outcome is not middleware.ANONYMOUS:
+            self.auth_middleware.raise_for(outcome, req.env)
+
+    def process_resource(self, req, resp, resource, params=None):
+        if resource is None or not req.env.get('wsgi.identified'):
+            return
+        outcome = self.auth_middleware.process_authorization(
+            req, params or {}, resource=resource,
+            route=getattr(req, 'uri_template', None))
+        if outcome is not None:
+            self.auth_middleware.raise_for(outcome)
+
+    def process_response(self, req, resp, resource, req_succeeded):
+        self.auth_middleware.finish_held_trace(req.env)
+
+
+def create_component(identify_with, authenticate_with, authorize_with=None,
+                     **conf):
+    """
+    Helper method to create a Falcon middleware component that can be
+    supplied to `falcon.App(middleware=[...])`. Takes the same arguments
+    as `talons.auth.middleware.create_middleware`.
+
+    :raises `talons.exc.BadConfiguration` if the identifiers or authenticators
+            lists are empty or don't make sense.
+    """
+    return Component(middleware.create_middleware(identify_with,
+                                                  authenticate_with,
+                                                  authorize_with, **conf))
+
+
+class RouteComponent(object):
+
+    """
+    Falcon middleware component that applies a different
+    `talons.auth.middleware.Middleware` chain to each route, so that, for
+    instance, public read-only routes skip authorization while admin routes
+    use a stricter chain.
+
+    The chain of a route is looked up in a `talons.auth.routes.RouteTable`
+    by the matched route template, so the whole chain runs in
+    `process_resource`, after routing. Requests that match no route are
+    left to Falcon, which returns a 404. Requests to routes without a chain
+    are recorded in the environ as anonymous and authorized.
+    """
+
+    def __init__(self, routes, default, templates=()):
+        """
+        :param routes: Dict, or list of (pattern, chain) tuples, of route
+                       templates or prefixes ending in '*' to
+                       `talons.auth.middleware.Middleware` objects. A chain
+                       of None means the route needs no authentication.
+        :param default: Chain of routes that match no pattern, or None.
+        :param templates: Optional list of route templates to resolve when
+                          the component is created.
+        """
+        def _component(chain):
+            if chain is None:
+                return None
+            return Component(chain)
+
+        routes = [(p, _component(chain)) for p, chain in
+                  (routes.items() if isinstance(routes, dict) else routes)]
+        self.routes = routes_mod.RouteTable(routes, _component(default),
+                                            templates)
+
+    def process_resource(self, req, resp, resource, params=None):
+        if resource is None:
+            return
+        component = self.routes.resolve(req.uri_template)
+        if component is None:
+            req.env.update(PUBLIC_ENV)
+            return
+        component.process_request(req, resp)
+        component.process_resource(req, resp, resource, params)
+
+
+def create_route_component(routes, default, **conf):
+    """
+    Helper method to create a Falcon middleware component with a chain per
+    route. Every chain, and the default chain, is either a
+    `talons.auth.middleware.Middleware` object, None for no authentication,
+    or a dict of `talons.auth.middleware.create_middleware` keyword
+    arguments, e.g.:
+
+        create_route_component({
+            '/articles/{article_id}': dict(identify_with=..., ...),
+            '/admin/*': dict(identify_with=..., authorize_with=...),
+            '/healthz': None,
+        }, default=dict(identify_with=..., ...), **config)
+
+    :param **conf: Configuration options used by every chain that is given
+                   as a dict, unless the dict sets them.
+
+    :raises `talons.exc.BadConfiguration` if the identifiers or authenticators
+            lists are empty or don't make sense.
+    """
+    routes, default = routes_mod.build_policies(
+        routes, default, middleware.create_middleware, **conf)
+    return RouteComponent(routes, default)
@@ -0,0 +1,373 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+"""
+Builds middleware from a declarative configuration, read from an INI,
+YAML or JSON file or given as a dict, e.g.:
+
+    [talons]
+    identify_with = basicauth, httpheader
+    authenticate_with = htpasswd
+    authorize_with = external
+    delay_401 = false
+
+    [cache]
+    backend = memcached
+    ttl = 60
+
+    [plugin:htpasswd]
+    path = /etc/myapp/htpasswd
+
+    [plugin:external]
+    authz_callable = myapp.auth.authorize
+
+The same configuration as a dict, or in YAML or JSON:
+
+    {'talons': {'identify_with': ['basicauth', 'httpheader'], ...},
+     'cache': {'backend': 'memcached', 'ttl': 60},
+     'plugins': {'htpasswd': {'path': '/etc/myapp/htpasswd'}, ...}}
+
+Options of the [talons] section are `talons.auth.middleware.Middleware`
+options. Options of the [cache] section are the cache_* options of
+`talons.cache.create_cache`, without the prefix. Options of a plugin
+section are the options of that plugin, with or without the plugin name
+as prefix. Each plugin is given its own section, the [talons] options and
+the cache options, and never the sections of other plugins.
+
+Unknown options are rejected, so that a misspelled option does not go
+unnoticed: the [talons] section may only hold options of the middleware
+and of the plugins in the chain, and a plugin section only the plugin's
+own options. Plugins whose options are not known, i.e. whose `options`
+attribute is None, accept any option in their section and let any option
+through in the [talons] section.
+"""
+
+import fnmatch
+import json
+import logging
+import os
+import re
+import threading
+
+import six
+from six.moves import configparser
+
+from talons import cache as cache_mod
+from talons import exc
+from talons.auth import middleware
+from talons.auth import plugins
+
+LOG = logging.getLogger(__name__)
+
+CHAIN_KEYS = ('identify_with', 'authenticate_with', 'authorize_with')
+PLUGIN_SECTION_PREFIX = 'plugin:'
+
+_BOOLEANS = {'true': True, 'yes': True, 'on': True,
+             'false': False, 'no': False, 'off': False}
+_INT_RE = re.compile(r'^[-+]?[0-9]+$')
+_FLOAT_RE = re.compile(r'^[-+]?([0-9]+\.[0-9]*|\.[0-9]+)$')
+
+# Plugin objects and middleware built by `build`, keyed by their frozen
+# configuration, so that applications of the same process that use the
+# same configuration share them
+_instances = {}
+_lock = threading.RLock()
+
+
+def _error(msg):
+    LOG.error(msg)
+    raise exc.BadConfiguration(msg)
+
+
+def _ini_value(key, value):
+    stripped = value.strip()
+    if key.endswith('secret'):
+        return value
+    if _INT_RE.match(stripped):
+        return int(stripped)
+    if _FLOAT_RE.match(stripped):
+        return float(stripped)
+    return _BOOLEANS.get(stripped.lower(), value)
+
+
+def parse_ini(text):
+    """
+    Returns the configuration dict of the supplied INI text. The words
+    true, yes, on, false, no and off are read as booleans, and integers
+    and decimal numbers such as 5 or 10.5 as numbers, except in secrets.
+    """
+    parser = configparser.RawConfigParser()
+    parser.optionxform = str
+    try:
+        if hasattr(parser, 'read_string'):
+            parser.read_string(text)
+        else:  # pragma: NO COVER
+            parser.readfp(six.StringIO(text))
+    except configparser.Error as err:
+        _error("Invalid INI configuration: {0}".format(err))
+    config = {'plugins': {}}
+    for section in parser.sections():
+        values = dict((k, _ini_value(k, v))
+                      for k, v in parser.items(section))
+        if section.startswith(PLUGIN_SECTION_PREFIX):
+            name = section[len(PLUGIN_SECTION_PREFIX):].strip()
+            config['plugins'][name] = values
+        else:
+            config[section] = values
+    return config
+
+
+def read(path):
+    """
+    Returns the configuration dict of an INI (.ini, .cfg or .conf), YAML
+    (.yaml or .yml) or JSON (.json) file. Reading YAML requires PyYAML.
+
+    :raises `talons.exc.BadConfiguration` if the file cannot be read.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    try:
+        with open(path) as f:
+            text = f.read()
+    except (IOError, OSError) as err:
+        _error("Unable to read configuration {0}: {1}".format(path, err))
+    if ext in ('.yaml', '.yml'):
+        try:
+            import yaml
+        except ImportError:
+            _error("Reading {0} requires PyYAML.".format(path))
+        try:
+            return yaml.safe_load(text) or {}
+        except yaml.YAMLError as err:
+            _error("Invalid YAML configuration {0}: {1}".format(path, err))
+    if ext == '.json':
+        try:
+            return json.loads(text)
+        except ValueError as err:
+            _error("Invalid JSON configuration {0}: {1}".format(path, err))
+    return parse_ini(text)
+
+
+def _names(value):
+    if value is None:
+        return []
+    if isinstance(value, six.string_types):
+        return [v.strip() for v in value.split(',') if v.strip()]
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value]
+
+
+def _option_name(name, key):
+    """
+    Returns the name of a plugin section option with the plugin name as
+    prefix, unless it already has it. Plugins given by dotted path take
+    options as is.
+    """
+    if not isinstance(name, six.string_types) or '.' in name:
+        return key
+    prefix = name + '_'
+    return key if key.startswith(prefix) else prefix + key
+
+
+def _plugin_options(name, options):
+    """
+    Returns the plugin options with the plugin name as prefix, unless they
+    already have it.
+    """
+    return dict((_option_name(name, k), v) for k, v in options.items())
+
+
+def _accepts(accepted, option):
+    return any(fnmatch.fnmatchcase(option, a) for a in accepted)
+
+
+def _check_options(section, options, accepted):
+    """
+    Raises BadConfiguration naming the options of a section that are not
+    accepted.
+
+    :param options: Dict of the options as written to their full names.
+    """
+    unknown = sorted(k for k, full in options.items()
+                     if not _accepts(accepted, full))
+    if unknown:
+        _error("Unknown options in {0}: {1}".format(section,
+                                                    ', '.join(unknown)))
+
+
+def _freeze(value):
+    """
+    Returns a hashable equivalent of a configuration value.
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, set):
+        return frozenset(_freeze(v) for v in value)
+    return value
+
+
+def _shared(key, factory):
+    """
+    Returns the object built by factory for the key, building it only the
+    first time. Objects with unhashable configuration are never shared.
+    """
+    try:
+        hash(key)
+    except TypeError:
+        return factory()
+    with _lock:
+        try:
+            return _instances[key]
+        except KeyError:
+            obj = _instances[key] = factory()
+            return obj
+
+
+def validate(config):
+    """
+    Checks the structure of a configuration dict and returns a normalized
+    (identifiers, authenticators, authorizer, options, cache, plugins)
+    tuple, with every named plugin resolved to its class.
+
+    :raises `talons.exc.BadConfiguration` if the configuration is not
+            valid.
+    """
+    if not isinstance(config, dict):
+        _error("Configuration must be a mapping.")
+    unknown = set(config) - set(['talons', 'cache', 'plugins'])
+    if unknown:
+        _error("Unknown configuration sections: {0}".format(
+            ', '.join(sorted(unknown))))
+    options = dict(config.get('talons') or {})
+    cache = dict(config.get('cache') or {})
+    plugin_options = dict(config.get('plugins') or {})
+
+    chain = [_names(options.pop(key, None)) for key in CHAIN_KEYS]
+    identifiers, authenticators, authorizer = chain
+    if not identifiers:
+        _error("identify_with must name at least one identifier.")
+    if not authenticators:
+        _error("authenticate_with must name at least one authenticator.")
+    if len(authorizer) > 1:
+        _error("authorize_with must name a single authorizer.")
+
+    def _resolve(names, role):
+        return [(n, plugins.load(n, role) if isinstance(n, six.string_types)
+                 else n) for n in names]
+
+    identifiers = _resolve(identifiers, plugins.IDENTIFIER)
+    authenticators = _resolve(authenticators, plugins.AUTHENTICATOR)
+    authorizer = _resolve(authorizer, plugins.AUTHORIZER)
+    used = set(n for n, _cls in identifiers + authenticators + authorizer)
+    unused = set(plugin_options) - used
+    if unused:
+        _error("Configuration of plugins that are not in the chain: "
+               "{0}".format(', '.join(sorted(unused))))
+    for name, section in plugin_options.items():
+        if not isinstance(section, dict):
+            _error("Options of plugin {0} must be a mapping.".format(name))
+
+    resolved = identifiers + authenticators + authorizer
+    talons_accepted = list(middleware.OPTIONS) + list(cache_mod.OPTIONS)
+    check_talons = True
+    for _n, cls in resolved:
+        declared = getattr(cls, 'options', None)
+        if declared is None:
+            check_talons = False
+        else:
+            talons_accepted.extend(declared)
+    if check_talons:
+        _check_options('the talons section',
+                       dict((k, k) for k in options), talons_accepted)
+    for name, section in plugin_options.items():
+        declared = [getattr(cls, 'options', None)
+                    for n, cls in resolved if n == name]
+        if None in declared:
+            continue
+        _check_options('the section of plugin {0}'.format(name),
+                       dict((k, _option_name(name, k)) for k in section),
+                       [o for d in declared for o in d])
+    cache_names = dict((k, k if k.startswith('cache_') else 'cache_' + k)
+                       for k in cache)
+    _check_options('the cache section', cache_names, cache_mod.OPTIONS)
+    cache = dict((cache_names[k], v) for k, v in cache.items())
+    return (identifiers, authenticators, authorizer[0] if authorizer
+            else None, options, cache, plugin_options)
+
+
+def build(config, **overrides):
+    """
+    Returns a frozen `talons.auth.middleware.Middleware` for the supplied
+    configuration dict. Every plugin is constructed, and so validated, up
+    front. Plugins, and whole chains, built from the same configuration
+    are shared with earlier calls.
+
+    :param **overrides: Options added to the [talons] section, such as a
+                        stats_sink object, which cannot be given in a
+                        file.
+
+    :raises `talons.exc.BadConfiguration` if the configuration is not
+            valid.
+    """
+    (identifiers, authenticators, authorizer, options, cache,
+     plugin_options) = validate(config)
+    options.update(overrides)
+    options.update(cache)
+    frozen_options = _freeze(options)
+
+    def _plugin(name_cls, role):
+        name, cls = name_cls
+        conf = dict(options)
+        conf.update(_plugin_options(name, plugin_options.get(name) or {}))
+        if not isinstance(cls, six.class_types):
+            return cls
+        return _shared(('plugin', cls, _freeze(conf)), lambda: cls(**conf))
+
+    def _build():
+        return middleware.create_middleware(
+            [_plugin(i, plugins.IDENTIFIER) for i in identifiers],
+            [_plugin(a, plugins.AUTHENTICATOR) for a in authenticators],
+            _plugin(authorizer, plugins.AUTHORIZER) if authorizer else None,
+            **options)
+
+    key = ('middleware', _freeze([n for n, _c in identifiers]),
+           _freeze([n for n, _c in authenticators]),
+           authorizer[0] if authorizer else None, frozen_options,
+           _freeze(plugin_options))
+    m = _shared(key, _build)
+    m.freeze()
+    return m
+
+
+def load(source, **overrides):
+    """
+    Returns a frozen `talons.auth.middleware.Middleware` built from a
+    configuration file path or dict. See `build`.
+    """
+    if isinstance(source, six.string_types):
+        source = read(source)
+    return build(source, **overrides)
+
+
+def clear():
+    """
+    Forgets all shared plugins and middleware, e.g. between tests.
+    """
+    with _lock:
+        _instances.clear()
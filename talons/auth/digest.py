@@ -0,0 +1,348 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import binascii
+import collections
+import hashlib
+import hmac
+import logging
+import os
+import re
+import threading
+import time
+
+from passlib import apache
+
+from talons import cache
+from talons import compat
+from talons import exc
+from talons import helpers
+from talons.auth import interfaces
+
+LOG = logging.getLogger(__name__)
+
+ALGORITHMS = {
+    'MD5': hashlib.md5,
+    'MD5-SESS': hashlib.md5,
+    'SHA-256': hashlib.sha256,
+    'SHA-256-SESS': hashlib.sha256,
+}
+
+_PARAM_RE = re.compile(r'([\w-]+)\s*=\s*(?:"((?:[^"\\]|\\.)*)"|([^,\s]*))')
+_REQUIRED_PARAMS = ('username', 'realm', 'nonce', 'uri', 'response',
+                    'qop', 'nc', 'cnonce')
+
+
+def parse_header(value):
+    """
+    Returns a dict of the parameters in a Digest Authorization header
+    value, or None if the value is not a Digest header.
+    """
+    scheme, _sep, rest = value.strip().partition(' ')
+    if scheme.lower() != 'digest':
+        return None
+    params = {}
+    for m in _PARAM_RE.finditer(rest):
+        if m.group(2) is not None:
+            params[m.group(1).lower()] = re.sub(r'\\(.)', r'\1', m.group(2))
+        else:
+            params[m.group(1).lower()] = m.group(3)
+    return params
+
+
+def _hash(algorithm, *parts):
+    data = ':'.join(parts).encode('utf-8')
+    return ALGORITHMS[algorithm](data).hexdigest()
+
+
+class NonceStore(object):
+
+    """
+    Bounded, in-memory store of issued nonces and the highest nonce count
+    seen for each one.
+
+    Nonces are kept in a time wheel of `slots` buckets that together span
+    `ttl` seconds. Expiry drops a whole bucket at a time instead of scanning
+    every nonce. No more than `max_nonces` nonces are ever stored; once the
+    store is full, the oldest nonces are evicted to make room, so memory
+    stays fixed no matter how many challenges are issued.
+    """
+
+    def __init__(self, ttl=300, max_nonces=10000, slots=10, clock=time.time):
+        self.ttl = ttl
+        self.max_nonces = max_nonces
+        self.slots = slots
+        self.slot_width = float(ttl) / slots
+        self._clock = clock
+        self._wheel = collections.deque()
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._counts)
+
+    def _advance(self):
+        current = int(self._clock() // self.slot_width)
+        while self._wheel and self._wheel[0][0] <= current - self.slots:
+            _slot, nonces = self._wheel.popleft()
+            for nonce in nonces:
+                del self._counts[nonce]
+        if not self._wheel or self._wheel[-1][0] != current:
+            self._wheel.append((current, set()))
+
+    def issue(self):
+        """
+        Creates, stores and returns a new nonce string.
+        """
+        nonce = binascii.hexlify(os.urandom(16)).decode('ascii')
+        with self._lock:
+            self._advance()
+            while len(self._counts) >= self.max_nonces:
+                oldest = self._wheel[0][1]
+                if not oldest:
+                    self._wheel.popleft()
+                    continue
+                del self._counts[oldest.pop()]
+            self._wheel[-1][1].add(nonce)
+            self._counts[nonce] = 0
+        return nonce
+
+    def use(self, nonce, count):
+        """
+        Returns True if the nonce was issued, has not expired, and the
+        supplied nonce count is higher than any count seen before for it.
+        Records the count, so that a replayed request is rejected.
+        """
+        with self._lock:
+            self._advance()
+            last = self._counts.get(nonce)
+            if last is None or count <= last:
+                return False
+            self._counts[nonce] = count
+            return True
+
+
+class DigestCredentials(object):
+
+    """
+    Key stored on identities found by `talons.auth.digest.Identifier`. Holds
+    the parsed Digest parameters and the request method, which together
+    are what `talons.auth.digest.Authenticator` needs to verify the
+    response.
+    """
+
+    def __init__(self, params, method):
+        self.params = params
+        self.method = method
+
+
+class Identifier(interfaces.Identifies):
+
+    """
+    Looks in the HTTP Authorization header for Digest access authentication
+    credentials and stores identity in the request environ's
+    'wsgi.identity' key.
+
+    :see http://tools.ietf.org/html/rfc7616
+    """
+
+    options = ()
+
+    def identify(self, request):
+        if request.env.get(self.IDENTITY_ENV_KEY) is not None:
+            return True
+
+        http_auth = request.auth
+        if http_auth is None:
+            return False
+        http_auth = compat.b2u(http_auth)
+
+        params = parse_header(http_auth)
+        if params is None:
+            return False
+
+        missing = [p for p in _REQUIRED_PARAMS if not params.get(p)]
+        if missing:
+            LOG.debug("Digest authorize header missing parameters: "
+                      "{0}".format(', '.join(missing)))
+            return False
+
+        path = (request.env.get('SCRIPT_NAME', '') +
+                request.env.get('PATH_INFO', ''))
+        query = request.env.get('QUERY_STRING')
+        if params['uri'] not in (path, path + '?' + (query or '')):
+            LOG.debug("Digest uri {0} does not match requested "
+                      "path {1}".format(params['uri'], path))
+            return False
+
+        creds = DigestCredentials(params, request.method)
+        identity = interfaces.Identity(params['username'], key=creds)
+        request.env[self.IDENTITY_ENV_KEY] = identity
+        return True
+
+
+class Authenticator(interfaces.Authenticates):
+
+    """
+    Authenticates identities found by `talons.auth.digest.Identifier` by
+    checking the Digest response against a precomputed HA1 value for the
+    login, and by checking the nonce and nonce count against a bounded
+    nonce store.
+
+    HA1 values are cached, so a request costs only the hashes over the
+    request line and the final response.
+    """
+
+    options = ('digest_realm', 'digest_htdigest_path', 'digest_ha1_callable',
+               'digest_algorithm', 'digest_nonce_ttl', 'digest_max_nonces',
+               'digest_ha1_cache_size')
+
+    def __init__(self, **conf):
+        """
+        Construct a concrete object with a set of keyword configuration
+        options.
+
+        :param **conf:
+
+            digest_realm: The authentication realm. (required)
+            digest_htdigest_path: Path to an Apache htdigest file to read
+                                  MD5 HA1 values from.
+            digest_ha1_callable: Either a callable, or a string in
+                                 dotted-notation module.function, that
+                                 accepts a login, realm and algorithm name
+                                 and returns the hex HA1 value for the
+                                 login, or None if the login is unknown.
+            digest_algorithm: Algorithm offered in challenges, either MD5
+                              or SHA-256. (defaults to MD5)
+            digest_nonce_ttl: Number of seconds an issued nonce stays valid.
+                              (defaults to 300)
+            digest_max_nonces: Maximum number of nonces stored.
+                               (defaults to 10000)
+            digest_ha1_cache_size: Number of HA1 values to cache.
+                                   (defaults to 1024)
+
+            One of digest_htdigest_path or digest_ha1_callable is required.
+
+        :raises `talons.exc.BadConfiguration` if configuration options
+                are not valid or conflict with each other.
+        """
+        self.realm = conf.pop('digest_realm', None)
+        if not self.realm:
+            msg = "Missing required digest_realm configuration option."
+            LOG.error(msg)
+            raise exc.BadConfiguration(msg)
+
+        self.htfile = None
+        self.ha1fn = None
+        htpath = conf.pop('digest_htdigest_path', None)
+        ha1fn = conf.pop('digest_ha1_callable', None)
+        if htpath:
+            if not os.path.exists(htpath):
+                msg = "htdigest file {0} does not exist.".format(htpath)
+                LOG.error(msg)
+                raise exc.BadConfiguration(msg)
+            self.htfile = apache.HtdigestFile(htpath)
+        elif ha1fn:
+            if not callable(ha1fn):
+                try:
+                    ha1fn = helpers.import_function(ha1fn)
+                except (TypeError, ImportError):
+                    msg = ("digest_ha1_callable either could not be found "
+                           "or was not callable.")
+                    LOG.error(msg)
+                    raise exc.BadConfiguration(msg)
+            self.ha1fn = ha1fn
+        else:
+            msg = ("One of digest_htdigest_path or digest_ha1_callable "
+                   "configuration options is required.")
+            LOG.error(msg)
+            raise exc.BadConfiguration(msg)
+
+        self.algorithm = conf.pop('digest_algorithm', 'MD5').upper()
+        if self.algorithm not in ('MD5', 'SHA-256'):
+            msg = "digest_algorithm must be either MD5 or SHA-256."
+            LOG.error(msg)
+            raise exc.BadConfiguration(msg)
+        if self.htfile is not None and self.algorithm != 'MD5':
+            msg = "htdigest files only support the MD5 digest_algorithm."
+            LOG.error(msg)
+            raise exc.BadConfiguration(msg)
+
+        self.nonces = NonceStore(
+            ttl=int(conf.pop('digest_nonce_ttl', 300)),
+            max_nonces=int(conf.pop('digest_max_nonces', 10000)))
+        self.ha1s = cache.LRUCache(int(conf.pop('digest_ha1_cache_size',
+                                                1024)), name='digest_ha1')
+
+    def _get_ha1(self, login, algorithm):
+        key = (login, algorithm)
+        ha1 = self.ha1s.get(key)
+        if ha1 is None:
+            if self.htfile is not None:
+                if algorithm != 'MD5':
+                    return None
+                ha1 = self.htfile.get_hash(login, self.realm)
+                if ha1 is not None:
+                    ha1 = compat.b2u(ha1)
+            else:
+                ha1 = self.ha1fn(login, self.realm, algorithm)
+            if ha1 is None:
+                return None
+            self.ha1s.set(key, ha1)
+        return ha1
+
+    def authenticate(self, identity):
+        """
+        Looks at the supplied identity object and returns True if the
+        credentials can be verified, False otherwise.
+        """
+        creds = identity.key
+        if not isinstance(creds, DigestCredentials):
+            return False
+        p = creds.params
+        algorithm = p.get('algorithm', 'MD5').upper()
+        if algorithm not in ALGORITHMS or p['realm'] != self.realm:
+            return False
+        if p['qop'] != 'auth':
+            return False
+        try:
+            count = int(p['nc'], 16)
+        except ValueError:
+            return False
+
+        ha1 = self._get_ha1(identity.login, algorithm.replace('-SESS', ''))
+        if ha1 is None:
+            return False
+        if algorithm.endswith('-SESS'):
+            ha1 = _hash(algorithm, ha1, p['nonce'], p['cnonce'])
+        ha2 = _hash(algorithm, creds.method, p['uri'])
+        expected = _hash(algorithm, ha1, p['nonce'], p['nc'], p['cnonce'],
+                         p['qop'], ha2)
+        if not hmac.compare_digest(expected.encode('ascii'),
+                                   p['response'].lower().encode('utf-8')):
+            return False
+        # Only consume the nonce count once the response is known to be
+        # genuine, so forged requests cannot burn a client's nonce.
+        return self.nonces.use(p['nonce'], count)
+
+    def challenge(self):
+        """
+        Returns the value of a WWW-Authenticate header that challenges the
+        client for Digest credentials, using a freshly issued nonce.
+        """
+        return ('Digest realm="{0}", qop="auth", algorithm={1}, '
+                'nonce="{2}"').format(self.realm, self.algorithm,
+                                      self.nonces.issue())
@@ -14,15 +14,43 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import hashlib
 import inspect
 import logging
 
+import six
+
+from talons import cache
 from talons import exc
 from talons import helpers
+from talons import stats
 from talons.auth import interfaces
 
 LOG = logging.getLogger(__name__)
 
+# inspect.getargspec() was removed in Python 3.11
+_getargspec = getattr(inspect, 'getfullargspec', None) or inspect.getargspec
+
+
+def _create_cache(prefix, conf):
+    """
+    Returns a (cache, ttl) tuple for the <prefix>_cache_ttl and
+    <prefix>_cache_size options, with a cache of None if caching is off.
+    """
+    try:
+        ttl = float(conf.pop(prefix + '_cache_ttl', 0) or 0)
+        size = int(conf.pop(prefix + '_cache_size', 1024))
+    except (TypeError, ValueError):
+        ttl = size = -1
+    if ttl < 0 or size < 1:
+        msg = ("{0}_cache_ttl must be a positive number or 0 and "
+               "{0}_cache_size a positive integer.".format(prefix))
+        LOG.error(msg)
+        raise exc.BadConfiguration(msg)
+    if not ttl:
+        return None, None
+    return cache.create_cache(prefix, size, **conf), ttl
+
 
 class Authenticator(interfaces.Authenticates):
 
@@ -31,6 +59,11 @@ class Authenticator(interfaces.Authenticates):
     authentication function.
     """
 
+    options = ('external_authn_callable', 'external_authfn',
+               'external_sets_roles', 'external_sets_groups',
+               'external_expensive', 'external_authn_cache_ttl',
+               'external_authn_cache_size')
+
     def __init__(self, **conf):
         """
         Construct a concrete object with a set of keyword configuration
@@ -50,6 +83,23 @@ class Authenticator(interfaces.Authenticates):
             external_sets_groups: Boolean (defaults to False) of whether the
                                   external authentication function will set
                                   the groups attribute of the Identity object.
+            external_expensive: Boolean (defaults to True) of whether calls
+                                to the external authentication function are
+                                slow enough to be subject to admission
+                                control.
+            external_authn_cache_ttl: Number of seconds successful
+                                      authentications are remembered, with
+                                      the roles and groups the function
+                                      set, so that repeat requests skip the
+                                      call. Only a SHA-256 digest of the
+                                      key is kept. (defaults to 0, off)
+            external_authn_cache_size: Number of authentications to
+                                       remember in process. (defaults to
+                                       1024)
+            cache_backend: See `talons.cache.create_cache`.
+            stats_sink: Optional `talons.stats.Sink` object. The latency of
+                        each call to the external function is recorded in
+                        its 'external_callout.authenticate' histogram.
 
         :raises `talons.exc.BadConfiguration` if configuration options
                 are not valid or conflict with each other.
@@ -78,7 +128,7 @@ class Authenticator(interfaces.Authenticates):
             self.authfn = authfn
 
         # Ensure that the auth function signature is what we expect
-        spec = inspect.getargspec(self.authfn)
+        spec = _getargspec(self.authfn)
         if len(spec[0]) != 1:
             msg = ("external_authn_callable has an invalid function "
                    "signature. The function must take only a single "
@@ -88,13 +138,53 @@ class Authenticator(interfaces.Authenticates):
 
         self._sets_roles = conf.get('external_sets_roles', False)
         self._sets_groups = conf.get('external_sets_groups', False)
+        self._expensive = conf.get('external_expensive', True)
+        self.stats_sink = conf.get('stats_sink')
+        self.results, self.cache_ttl = _create_cache('external_authn', conf)
+
+    def _cache_key(self, identity):
+        key = identity.key
+        if not isinstance(key, six.binary_type):
+            key = six.text_type(key).encode('utf-8')
+        return (identity.login, hashlib.sha256(key).hexdigest())
+
+    def is_expensive(self, identity):
+        if not self._expensive or self.results is None:
+            return self._expensive
+        return self.results.get(self._cache_key(identity)) is None
+
+    def _call(self, identity):
+        if self.stats_sink is None:
+            return self.authfn(identity)
+        start = stats.clock()
+        try:
+            return self.authfn(identity)
+        finally:
+            self.stats_sink.observe('external_callout.authenticate',
+                                    stats.clock() - start)
 
     def authenticate(self, identity):
         """
         Looks at the supplied identity object and returns True if the
         credentials can be verified, False otherwise.
         """
-        return self.authfn(identity)
+        if self.results is None:
+            return self._call(identity)
+        cache_key = self._cache_key(identity)
+        cached = self.results.get(cache_key)
+        if cached is not None:
+            roles, groups = cached
+            if self._sets_roles:
+                identity.roles = set(roles)
+            if self._sets_groups:
+                identity.groups = set(groups)
+            return True
+        if not self._call(identity):
+            return False
+        self.results.set(cache_key,
+                         [sorted(identity.roles), sorted(identity.groups)],
+                         ttl=self.cache_ttl)
+        return True
 
     def sets_roles(self):
         """
@@ -118,6 +208,9 @@ class Authorizer(interfaces.Authorizes):
     an external function.
     """
 
+    options = ('external_authz_callable', 'external_authz_cache_ttl',
+               'external_authz_cache_size')
+
     def __init__(self, **conf):
         """
         Construct a concrete object with a set of keyword configuration
@@ -133,6 +226,18 @@ class Authorizer(interfaces.Authorizes):
                                      and a
                                      `talons.interfaces.auth.RequestAction`
                                      object.
+            external_authz_cache_ttl: Number of seconds decisions are
+                                      remembered for an identity's login,
+                                      roles and groups and the request's
+                                      `to_string()`, so that repeat
+                                      requests skip the call. (defaults to
+                                      0, off)
+            external_authz_cache_size: Number of decisions to remember in
+                                       process. (defaults to 1024)
+            cache_backend: See `talons.cache.create_cache`.
+            stats_sink: Optional `talons.stats.Sink` object. The latency of
+                        each call to the external function is recorded in
+                        its 'external_callout.authorize' histogram.
 
         :raises `talons.exc.BadConfiguration` if configuration options
                 are not valid or conflict with each other.
@@ -157,7 +262,7 @@ class Authorizer(interfaces.Authorizes):
             self.authfn = authfn
 
         # Ensure that the auth function signature is what we expect
-        spec = inspect.getargspec(self.authfn)
+        spec = _getargspec(self.authfn)
         if len(spec[0]) != 2:
             msg = ("external_authz_callable has an invalid function "
                    "signature. The function must take two arguments: "
@@ -165,10 +270,32 @@ class Authorizer(interfaces.Authorizes):
             LOG.error(msg)
             raise exc.BadConfiguration(msg)
 
+        self.stats_sink = conf.get('stats_sink')
+        self.decisions, self.cache_ttl = _create_cache('external_authz', conf)
+
+    def _call(self, identity, request_action):
+        if self.stats_sink is None:
+            return self.authfn(identity, request_action)
+        start = stats.clock()
+        try:
+            return self.authfn(identity, request_action)
+        finally:
+            self.stats_sink.observe('external_callout.authorize',
+                                    stats.clock() - start)
+
     def authorize(self, identity, request_action):
         """
         Looks at the supplied identity object and returns True if the
         credentials are authorized to perform the requested action,
         False otherwise
         """
-        return self.authfn(identity, request_action)
+        if self.decisions is None:
+            return self._call(identity, request_action)
+        cache_key = (identity.login, tuple(sorted(identity.roles)),
+                     tuple(sorted(identity.groups)),
+                     request_action.to_string())
+        decision = self.decisions.get(cache_key)
+        if decision is None:
+            decision = bool(self._call(identity, request_action))
+            self.decisions.set(cache_key, decision, ttl=self.cache_ttl)
+        return decision
@@ -14,16 +14,48 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import atexit
+import hashlib
 import logging
 import os
+import threading
+import time
+import weakref
 
 from passlib import apache
+import six
 
+from talons import cache
 from talons import exc
+from talons import snapshot
+from talons import stats
 from talons.auth import interfaces
 
 LOG = logging.getLogger(__name__)
 
+# Authenticators whose snapshot is saved when the process exits. They are
+# held weakly, so that authenticators that are dropped, e.g. those of
+# tenants evicted from a `talons.auth.tenant.Authenticator`, can be freed
+_SNAPSHOTTED = weakref.WeakSet()
+_SNAPSHOT_LOCK = threading.Lock()
+_snapshot_hook = False
+
+
+def _save_snapshots():
+    with _SNAPSHOT_LOCK:
+        authenticators = list(_SNAPSHOTTED)
+    for a in authenticators:
+        a.save_snapshot()
+
+
+def _register_snapshot(authenticator):
+    global _snapshot_hook
+    with _SNAPSHOT_LOCK:
+        if not _snapshot_hook:
+            atexit.register(_save_snapshots)
+            _snapshot_hook = True
+        _SNAPSHOTTED.add(authenticator)
+
 
 class Authenticator(interfaces.Authenticates):
 
@@ -31,6 +63,10 @@ class Authenticator(interfaces.Authenticates):
     Authenticates the supplied Identity by querying an Apache htpasswd file.
     """
 
+    options = ('htpasswd_path', 'htpasswd_reload_interval',
+               'htpasswd_cache_size', 'htpasswd_snapshot_path',
+               'htpasswd_snapshot_max_age')
+
     def __init__(self, **conf):
         """
         Construct a concrete object with a set of keyword configuration
@@ -39,6 +75,37 @@ class Authenticator(interfaces.Authenticates):
         :param **conf:
 
             htpasswd_path: Path to the Apache htpasswd file.
+            htpasswd_reload_interval: If set, the number of seconds between
+                                      checks of whether the htpasswd file
+                                      changed. A changed file is reloaded.
+                                      (defaults to 0, never reload)
+            htpasswd_cache_size: Number of successfully verified
+                                 credentials to remember, so that repeat
+                                 requests skip the password hash check.
+                                 Only a SHA-256 digest of the password is
+                                 kept, together with the path of the file.
+                                 The cache is cleared when the file is
+                                 reloaded, and a password changed in the
+                                 file is only noticed then.
+                                 (defaults to 0, no cache)
+            htpasswd_snapshot_path: If set, path of a file the verified
+                                    credentials cache is saved to when the
+                                    process exits, and loaded from when it
+                                    starts, so that a restart does not
+                                    redo every password hash check. Only
+                                    digests keyed with cache_secret, which
+                                    is required, and expiry times are
+                                    saved. The snapshot is ignored if the
+                                    htpasswd file or the secret changed.
+                                    (optional)
+            htpasswd_snapshot_max_age: Number of seconds entries of a
+                                       snapshot stay valid, unless they
+                                       expire sooner. (defaults to 3600)
+            cache_backend: See `talons.cache.create_cache`.
+            cache_secret: See `talons.cache.create_cache`.
+            stats_sink: Optional `talons.stats.Sink` object. The time taken
+                        to (re)load the htpasswd file is recorded in its
+                        'htpasswd_reload' histogram.
 
         :raises `talons.exc.BadConfiguration` if configuration options
                 are not valid or conflict with each other.
@@ -55,12 +122,166 @@ class Authenticator(interfaces.Authenticates):
             LOG.error(msg)
             raise exc.BadConfiguration(msg)
 
+        self.stats_sink = conf.get('stats_sink')
+        self.reload_interval = float(conf.pop('htpasswd_reload_interval', 0))
+        self._reload_lock = threading.Lock()
+        try:
+            cache_size = int(conf.pop('htpasswd_cache_size', 0))
+        except (TypeError, ValueError):
+            cache_size = -1
+        if cache_size < 0:
+            msg = "htpasswd_cache_size must be a positive integer or 0."
+            LOG.error(msg)
+            raise exc.BadConfiguration(msg)
+        self.verified = None
+        if cache_size:
+            self.verified = cache.create_cache('htpasswd', cache_size, **conf)
+
+        self.snapshot_path = conf.pop('htpasswd_snapshot_path', None)
+        self.snapshot_max_age = float(conf.pop('htpasswd_snapshot_max_age',
+                                               3600))
+        self.secret = conf.get('cache_secret')
+        if self.snapshot_path and (not self.secret or not cache_size):
+            msg = ("htpasswd_snapshot_path requires cache_secret and a "
+                   "verified credentials cache.")
+            LOG.error(msg)
+            raise exc.BadConfiguration(msg)
+        # Digests of credentials verified by an earlier process, loaded
+        # from the snapshot
+        self.warm = {}
+
+        start = stats.clock()
+        self._abspath = os.path.abspath(htpath)
         self.htfile = apache.HtpasswdFile(htpath)
+        self._record_reload(start)
+        self._next_check = time.time() + self.reload_interval
+        if self.snapshot_path:
+            self._source = snapshot.file_fingerprint(htpath)
+            self.warm = snapshot.load(self.snapshot_path, self.secret,
+                                      self._source)
+            _register_snapshot(self)
+
+    def _record_reload(self, start):
+        if self.stats_sink is not None:
+            self.stats_sink.observe('htpasswd_reload', stats.clock() - start)
+
+    def reload_if_changed(self):
+        """
+        Reloads the htpasswd file if it changed since it was last loaded.
+        Only one thread checks at a time; others carry on with the
+        currently loaded file.
+        """
+        if not self._reload_lock.acquire(False):
+            return
+        try:
+            self._next_check = time.time() + self.reload_interval
+            start = stats.clock()
+            if self.htfile.load_if_changed():
+                LOG.info("Reloaded htpasswd file {0}".format(
+                    self.htfile.path))
+                if self.verified is not None:
+                    self.verified.clear()
+                self.warm = {}
+                if self.snapshot_path:
+                    self._source = snapshot.file_fingerprint(
+                        self.htfile.path)
+                self._record_reload(start)
+        finally:
+            self._reload_lock.release()
+
+    def _cache_key(self, identity):
+        key = identity.key
+        if not isinstance(key, six.binary_type):
+            key = six.text_type(key).encode('utf-8')
+        # The file's absolute path and modification time are part of the
+        # key, so that entries verified against another file, or an older
+        # copy of this one, possibly by another process sharing the cache,
+        # are never used.
+        return (identity.login, hashlib.sha256(key).hexdigest(),
+                self._abspath, self.htfile.mtime)
+
+    def _warm_digest(self, cache_key):
+        # Snapshots are matched to the file by its contents, so the
+        # modification time is left out.
+        return cache.key_digest(cache_key[:2], self.secret)
+
+    def _is_warm(self, cache_key):
+        expires = self.warm.get(self._warm_digest(cache_key))
+        return expires is not None and expires > time.time()
+
+    def save_snapshot(self):
+        """
+        Saves the digests and expiry times of the verified credentials to
+        the snapshot file. Called when the process exits; servers that
+        exit without running atexit handlers should call it themselves.
+        Only in-process caches are saved, since shared caches outlive the
+        process anyway.
+        """
+        items = getattr(self.verified, 'items', None)
+        if not self.snapshot_path or items is None:
+            return
+        now = time.time()
+        max_expires = now + self.snapshot_max_age
+        entries = dict((d, min(e, max_expires))
+                       for d, e in self.warm.items())
+        current = (self._abspath, self.htfile.mtime)
+        for key, _value, expires in items():
+            if key[2:] == current:
+                entries[self._warm_digest(key)] = min(expires or max_expires,
+                                                      max_expires)
+        try:
+            count = snapshot.save(self.snapshot_path, self.secret,
+                                  self._source, entries.items(), now)
+        except (IOError, OSError) as err:
+            LOG.warning("Unable to save htpasswd cache snapshot {0}: "
+                        "{1}".format(self.snapshot_path, err))
+            return
+        LOG.debug("Saved {0} verified credentials to {1}".format(
+            count, self.snapshot_path))
+
+    def _is_verified(self, identity, cache_key):
+        """
+        Returns whether the cache key is in the verified cache, reusing the
+        answer `is_expensive` got for the same identity and key, so that a
+        request under admission control looks the key up once.
+        """
+        memo = identity.__dict__.pop('_htpasswd_verified', None)
+        if memo is not None and memo[0] is self and memo[1] == cache_key:
+            return memo[2]
+        return self.verified.get(cache_key) is not None
+
+    def is_expensive(self, identity):
+        """
+        Returns False if the identity's credentials were recently verified,
+        True otherwise, since checking a password hash is slow by design.
+        """
+        if self.verified is None:
+            return True
+        cache_key = self._cache_key(identity)
+        verified = self._is_verified(identity, cache_key)
+        identity._htpasswd_verified = (self, cache_key, verified)
+        if verified:
+            return False
+        return not (self.warm and self._is_warm(cache_key))
 
     def authenticate(self, identity):
         """
         Looks at the supplied identity object and returns True if the
         credentials can be verified, False otherwise.
         """
-        # check_password returns None if user was not found...
-        return self.htfile.check_password(identity.login, identity.key) is True
+        if self.reload_interval and time.time() >= self._next_check:
+            self.reload_if_changed()
+        if self.verified is None:
+            # check_password returns None if user was not found...
+            return self.htfile.check_password(identity.login,
+                                              identity.key) is True
+        cache_key = self._cache_key(identity)
+        if self._is_verified(identity, cache_key):
+            return True
+        if self.warm and self._is_warm(cache_key):
+            self.verified.set(cache_key, True)
+            return True
+        if self.htfile.check_password(identity.login, identity.key) is True:
+            self.verified.set(cache_key, True)
+            return True
+        return False
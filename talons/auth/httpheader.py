@@ -17,6 +17,7 @@
 import logging
 
 from talons import exc
+from talons import helpers
 from talons.auth import interfaces
 
 LOG = logging.getLogger(__name__)
@@ -30,6 +31,8 @@ class Identifier(interfaces.Identifies):
     None.
     """
 
+    options = ('httpheader_*',)
+
     def __init__(self, **conf):
         """
         Construct a concrete object with a set of keyword configuration
@@ -80,17 +83,27 @@ class Identifier(interfaces.Identifies):
                     continue
                 self.attr_headers[attr] = v
 
+        # The set of headers to extract is fixed here, once, as a plan of
+        # WSGI environ keys, so identify() does not have to normalize header
+        # names for every request.
+        self.user_env_key = helpers.environ_key(self.user_header)
+        self.key_env_key = helpers.environ_key(self.key_header)
+        self.attr_plan = tuple((attr, helpers.environ_key(header))
+                               for attr, header in self.attr_headers.items())
+
     def identify(self, request):
-        if request.env.get(self.IDENTITY_ENV_KEY) is not None:
+        env = request.env
+        if env.get(self.IDENTITY_ENV_KEY) is not None:
             return True
 
-        user_id = request.get_header(self.user_header)
-        key = request.get_header(self.key_header)
+        user_id = env.get(self.user_env_key)
+        key = env.get(self.key_env_key)
         if not user_id or not key:
             return False
 
         identity = interfaces.Identity(user_id, key=key)
-        for attr, header in self.attr_headers.items():
-            setattr(identity, attr, request.get_header(header))
-        request.env[self.IDENTITY_ENV_KEY] = identity
+        if self.attr_plan:
+            identity.__dict__.update((attr, env.get(env_key))
+                                     for attr, env_key in self.attr_plan)
+        env[self.IDENTITY_ENV_KEY] = identity
         return True
@@ -38,7 +38,7 @@ class ResourceAction(object):
     membership).
     """
 
-    def __init__(self, request, params):
+    def __init__(self, request, params, resource=None, route=None):
         """
         Constructs a ResourceAction object from a `falcon.request.Request`
         object and a dict of params.
@@ -52,9 +52,15 @@ class ResourceAction(object):
                        app from the requested URI. The parameters represent
                        matched field expressions that the responder object's
                        path_template matched at routing time.
+        :param resource: The responder object the request was routed to, if
+                         known.
+        :param route: The URI template of the route that was matched, e.g.
+                      '/users/{user_id}', if known.
         """
         self.request = request
         self.params = params
+        self.resource = resource
+        self.route = route
         path = request.env['PATH_INFO']
         # Cut off the query string
         path = path.split('?')[0]
@@ -98,6 +104,11 @@ class Identifies(object):
 
     IDENTITY_ENV_KEY = 'wsgi.identity'
 
+    # Names of the configuration options the plugin reads, which
+    # `talons.auth.config` checks plugin sections against. A name may
+    # end with '*' to accept any suffix. None if they are not known.
+    options = None
+
     def __init__(self, **conf):
         """
         Construct a concrete object with a set of keyword configuration
@@ -126,6 +137,9 @@ class Authenticates(object):
     Base class for plugins that act to authenticate the identified credentials
     """
 
+    # See `Identifies.options`
+    options = None
+
     def __init__(self, **conf):
         """
         Construct a concrete object with a set of keyword configuration
@@ -148,6 +162,15 @@ class Authenticates(object):
         """
         raise NotImplementedError  # pragma: NO COVER
 
+    def is_expensive(self, identity):
+        """
+        Returns True if verifying the credentials of the supplied identity
+        takes significant time or resources, e.g. a bcrypt check or a
+        remote call, False if it is cheap, e.g. because the result was
+        cached. Expensive verifications are subject to admission control.
+        """
+        return False
+
     def sets_roles(self):
         """
         Returns True if the authenticator plugin decorates the Identity
@@ -162,6 +185,14 @@ class Authenticates(object):
         """
         return False  # pragma: NO COVER
 
+    def challenge(self):
+        """
+        Returns the value of a WWW-Authenticate header that tells the client
+        how to supply credentials this plugin can authenticate, or None if
+        the plugin has no challenge to send.
+        """
+        return None  # pragma: NO COVER
+
 
 class Authorizes(object):
 
@@ -170,6 +201,9 @@ class Authorizes(object):
     an action against a particular resource.
     """
 
+    # See `Identifies.options`
+    options = None
+
     def __init__(self, **conf):
         """
         Construct a concrete object with a set of keyword configuration
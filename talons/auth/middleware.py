@@ -14,12 +14,73 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import importlib
 import inspect
+import math
 
 from talons import exc
+from talons import stats
 from talons.auth import interfaces
+from talons.auth import plugins
 
 import falcon
+import six
+
+# Outcomes of Middleware.process() for requests that should be rejected
+NO_IDENTITY = 'no_identity'
+AUTHENTICATE_FAILED = 'authenticate_failed'
+FORBIDDEN = 'forbidden'
+RATE_LIMITED = 'rate_limited'
+OVERLOADED = 'overloaded'
+# Outcome of Middleware.process_authentication() for a request that carries
+# no identity but may continue, because 401s are delayed
+ANONYMOUS = 'anonymous'
+
+# Names of the configuration options read by the middleware and the
+# features it creates, which `talons.auth.config` checks the [talons]
+# section against
+OPTIONS = (
+    'delay_401', 'delay_403', 'default_authorize', 'stats_sink',
+    'assertion_emit', 'assertion_secret', 'assertion_ttl',
+    'adaptive_order', 'adaptive_identifiers', 'adaptive_pinned',
+    'adaptive_interval',
+    'parallel_authenticate', 'parallel_workers', 'parallel_timeout',
+    'public_paths', 'public_methods',
+    'ratelimit_rate', 'ratelimit_burst', 'ratelimit_roles',
+    'ratelimit_shards', 'ratelimit_max_entries',
+    'admission_max_concurrent', 'admission_max_queue_time',
+    'admission_retry_after',
+    'login_filter_path', 'login_filter_callable', 'login_filter_capacity',
+    'login_filter_error_rate', 'login_filter_max_bytes',
+    'login_filter_rebuild_interval',
+    'audit_path', 'audit_max_bytes', 'audit_backup_count',
+    'audit_rotate_interval', 'audit_queue_size', 'audit_batch_size',
+    'audit_flush_interval', 'audit_when_full', 'audit_block_timeout',
+    'profile_path', 'profile_sample_rate', 'profile_slow_threshold',
+    'profile_mode', 'profile_slots', 'profile_stack_interval',
+    'profile_top',
+)
+
+# Environ keys that hold the result of each stage of the chain
+_RESULT_KEYS = {
+    'identify': 'wsgi.identified',
+    'authenticate': 'wsgi.authenticated',
+    'authorize': 'wsgi.authorized',
+}
+
+
+def _create_feature(module, factory, options, conf, *args):
+    """
+    Returns the result of the named factory function of a talons.auth
+    module, called with args and the configuration options, or None if
+    none of the options that enable the feature is set. The module is
+    only imported when the feature is enabled, so that chains don't pay
+    for importing the features they don't use.
+    """
+    if not any(conf.get(option) for option in options):
+        return None
+    mod = importlib.import_module('talons.auth.' + module)
+    return getattr(mod, factory)(*args, **conf)
 
 
 class Middleware(object):
@@ -64,9 +125,209 @@ class Middleware(object):
                        not authenticated (essentially meaning that
                        authorization would be for an anonymous identity).
 
-            default_authorized: Sets the value of the 'wsgi.authorized'
-                                WSGI environment value when there is no
-                                authorizer parameter. (defaults to False)
+            default_authorize: Sets the value of the 'wsgi.authorized'
+                               WSGI environment value when there is no
+                               authorizer parameter. (defaults to False)
+
+            assertion_emit: If set, a signed identity assertion is stored
+                            in the request environ's
+                            'wsgi.identity_assertion' key once the identity
+                            has been authenticated. Applications that proxy
+                            to downstream services forward this value in
+                            the X-Talons-Assertion header, so downstream
+                            hops using `talons.auth.assertion` can skip
+                            re-authentication. (defaults to False)
+
+            assertion_secret: Secret used to sign emitted assertions.
+                              Required if assertion_emit is set.
+
+            assertion_ttl: Number of seconds an emitted assertion stays
+                           valid. (defaults to 60)
+
+            stats_sink: A `talons.stats.Sink` object. If set, the middleware
+                        records counters for identify, authenticate and
+                        authorize outcomes, a call counter per plugin, and a
+                        latency histogram per stage. (defaults to None, which
+                        records nothing)
+
+            adaptive_order: If set, the authenticators are periodically
+                            reordered by their measured cost and success
+                            rate, so that the plugin most likely to
+                            succeed cheaply is tried first. This only
+                            preserves results if at most one plugin of
+                            each chain can succeed for a given request;
+                            pin plugins whose position matters.
+                            Authenticators that set roles or groups are
+                            always pinned. (defaults to False)
+
+            adaptive_identifiers: If set with adaptive_order, the
+                                  identifiers are reordered too. Only set
+                                  it if no identifier has to run before
+                                  another. (defaults to False)
+
+            adaptive_pinned: List, or comma-separated string, of plugins
+                             that keep their configured position. Plugins
+                             are named as in `talons.stats.plugin_name`,
+                             e.g. 'basicauth.Identifier'.
+
+            adaptive_interval: Number of requests between reorderings.
+                               (defaults to 1000)
+
+            parallel_authenticate: If set, all authenticators are called at
+                                   the same time on a thread pool and the
+                                   first one to succeed wins. Useful when
+                                   several authenticators make remote
+                                   calls. Takes precedence over
+                                   adaptive_order for authenticators.
+                                   (defaults to False)
+
+            parallel_workers: Maximum number of threads in the pool.
+                              (defaults to the number of authenticators)
+
+            parallel_timeout: Seconds to wait for an authenticator to
+                              succeed before authentication fails.
+                              (defaults to None, no deadline)
+
+            public_paths: List, or comma-separated string, of path patterns
+                          of requests that skip identification,
+                          authentication and authorization entirely, e.g.
+                          '/healthz' or '/static/*'. A pattern may start
+                          with '|'-separated methods and a space, e.g.
+                          'GET|HEAD /status'. See
+                          `talons.auth.public.PublicPaths`.
+
+            public_methods: List, or comma-separated string, of methods
+                            whose requests are public for any path, e.g.
+                            OPTIONS.
+
+            ratelimit_rate: Maximum number of requests per second of each
+                            authenticated login. Requests over the limit
+                            are rejected with a 429 Too Many Requests and
+                            a Retry-After header. (defaults to None, no
+                            limit)
+
+            ratelimit_burst: Number of requests a login may make at once
+                             before ratelimit_rate applies. (defaults to
+                             ratelimit_rate)
+
+            ratelimit_roles: Dict, or string of the form
+                             'role=rate/burst,...', of per-role limits. A
+                             login gets the most generous limit of its
+                             roles; a rate of 0 means no limit.
+
+            ratelimit_shards: Number of independently locked shards of
+                              limiter state. (defaults to 16)
+
+            ratelimit_max_entries: Maximum number of logins whose state is
+                                   kept. (defaults to 100000)
+
+            admission_max_concurrent: Maximum number of expensive credential
+                                      verifications, as reported by the
+                                      authenticators' `is_expensive`
+                                      method, that may run at the same
+                                      time. Requests past the limit are
+                                      rejected with a 503 Service
+                                      Unavailable, while requests with
+                                      cheap or cached credentials keep
+                                      going through. (defaults to None, no
+                                      limit)
+
+            admission_max_queue_time: Seconds a request may wait for an
+                                      expensive verification to finish
+                                      before it is rejected. (defaults to
+                                      0, reject right away)
+
+            admission_retry_after: Value of the Retry-After header of 503
+                                   responses. (defaults to 1)
+
+            login_filter_path: Path of an htpasswd file, or of a file with
+                               one login per line, of the known logins.
+                               Requests whose login is definitely not one
+                               of them fail authentication without calling
+                               any authenticator. Only set it if every
+                               authenticator checks logins from this
+                               source. See `talons.auth.bloom.LoginFilter`.
+
+            login_filter_callable: Callable, or string in dotted-notation
+                                   module.function, that returns an
+                                   iterable of the known logins, e.g. from
+                                   a database table. Used instead of
+                                   login_filter_path.
+
+            login_filter_error_rate: Rate of unknown logins the filter lets
+                                     through. (defaults to 0.001)
+
+            login_filter_capacity: Number of logins the filter is sized
+                                   for. (defaults to the number of known
+                                   logins)
+
+            login_filter_max_bytes: Maximum memory used by the filter. If
+                                    the error rate needs more, the filter
+                                    is capped and lets more unknown logins
+                                    through. (optional)
+
+            login_filter_rebuild_interval: Seconds between rebuilds of the
+                                           filter in a background thread.
+                                           0 never rebuilds. (defaults to
+                                           300)
+
+            audit_path: Path of a file that every identify, authenticate
+                        and authorize decision is written to, as a line
+                        of JSON, by a background thread. See
+                        `talons.auth.audit.AuditLog`. (optional)
+
+            audit_queue_size: Maximum number of decisions waiting to be
+                              written. (defaults to 10000)
+
+            audit_when_full: 'drop' to drop decisions when the queue is
+                             full, or 'block' to make requests wait for
+                             the writer. (defaults to 'drop')
+
+            audit_block_timeout: Maximum seconds a request waits for the
+                                 writer with the 'block' policy, after
+                                 which its decision is dropped. (defaults
+                                 to 1)
+
+            audit_batch_size: Number of waiting decisions that wakes the
+                              writer. (defaults to 256)
+
+            audit_flush_interval: Maximum seconds a decision waits to be
+                                  written. (defaults to 1)
+
+            audit_max_bytes: Size at which the file is rotated. (defaults
+                             to 0, no size limit)
+
+            audit_rotate_interval: Seconds after which the file is
+                                   rotated. (defaults to 0, no age limit)
+
+            audit_backup_count: Number of rotated files kept. (defaults to
+                                5)
+
+            profile_path: Directory that traces of profiled requests are
+                          written to, as a ring of JSON files, by a
+                          background thread. A trace has the time taken
+                          by each plugin and, depending on profile_mode,
+                          a profile of the whole chain. Read them with
+                          `talons.auth.profiling.read`. (optional)
+
+            profile_sample_rate: Fraction of requests that are profiled.
+                                 (defaults to 0)
+
+            profile_slow_threshold: Seconds the chain may take before the
+                                    request is profiled. (optional)
+
+            profile_mode: 'cprofile' to add a cProfile profile of the
+                          sampled requests, or 'stack' to sample the
+                          stack of every profiled request's thread.
+                          (defaults to None, plugin timings only)
+
+            profile_slots: Number of trace files kept. (defaults to 100)
+
+            profile_stack_interval: Seconds between stack samples.
+                                    (defaults to 0.005)
+
+            profile_top: Number of functions kept from cProfile profiles.
+                         (defaults to 30)
 
         :raises `talons.exc.BadConfiguration` if configuration options
                 are not valid or conflict with each other.
@@ -77,52 +338,490 @@ class Middleware(object):
         self.delay_401 = conf.get('delay_401', False)
         self.delay_403 = conf.get('delay_403', False)
         self.default_authorize = conf.get('default_authorize', False)
+        self.assertion_secret = None
+        if conf.get('assertion_emit', False):
+            self.assertion_secret = conf.get('assertion_secret')
+            if not self.assertion_secret:
+                msg = ("assertion_emit requires the assertion_secret "
+                       "configuration option.")
+                raise exc.BadConfiguration(msg)
+            from talons.auth import assertion
+            self.assertion_ttl = int(conf.get('assertion_ttl',
+                                              assertion.DEFAULT_TTL))
+        self.stats_sink = conf.get('stats_sink')
+        self.plugin_counters = {}
+        if self.stats_sink is not None:
+            plugins = list(identifiers) + list(authenticators)
+            if authorizer is not None:
+                plugins.append(authorizer)
+            for p in plugins:
+                name = 'plugin.{0}.calls'.format(stats.plugin_name(p))
+                self.plugin_counters[id(p)] = name
+        self.identifier_chain, self.authenticator_chain = _create_feature(
+            'adaptive', 'create_chains', ('adaptive_order',), conf,
+            identifiers, authenticators) or (None, None)
+        self.fan_out = _create_feature(
+            'parallel', 'create_fan_out', ('parallel_authenticate',), conf,
+            authenticators)
+        self.public_paths = _create_feature(
+            'public', 'create_public_paths',
+            ('public_paths', 'public_methods'), conf)
+        self.rate_limiter = _create_feature(
+            'ratelimit', 'create_rate_limiter',
+            ('ratelimit_rate', 'ratelimit_roles'), conf)
+        self.admission = _create_feature(
+            'admission', 'create_admission_controller',
+            ('admission_max_concurrent',), conf)
+        self.admission_retry_after = int(conf.get('admission_retry_after', 1))
+        self.login_filter = _create_feature(
+            'bloom', 'create_login_filter',
+            ('login_filter_path', 'login_filter_callable'), conf)
+        self.audit = _create_feature('audit', 'create_audit_log',
+                                     ('audit_path',), conf)
+        self.profiler = _create_feature('profiling', 'create_profiler',
+                                        ('profile_path',), conf)
+
+    def freeze(self):
+        """
+        Makes the chain immutable: the identifier and authenticator lists
+        become tuples and setting an attribute raises AttributeError.
+        Middleware that is shared, e.g. by `talons.auth.config.build`, is
+        frozen so that one application cannot change another's chain.
+        """
+        if self.__dict__.get('frozen'):
+            return
+        self.identifiers = tuple(self.identifiers)
+        self.authenticators = tuple(self.authenticators)
+        self.frozen = True
+
+    def __setattr__(self, name, value):
+        if self.__dict__.get('frozen'):
+            raise AttributeError("Cannot set {0} of frozen middleware".format(
+                name))
+        object.__setattr__(self, name, value)
+
+    def is_public(self, env):
+        """
+        Returns True if the request with the supplied environ bypasses the
+        chain because it matches the public_paths or public_methods
+        configuration options. The request is then recorded in the environ
+        as anonymous and authorized.
+        """
+        if self.public_paths is None:
+            return False
+        if not self.public_paths.match(env.get('REQUEST_METHOD'),
+                                       env.get('PATH_INFO') or '/'):
+            return False
+        env['wsgi.identified'] = False
+        env['wsgi.authenticated'] = False
+        env['wsgi.authorized'] = True
+        if self.stats_sink is not None:
+            self.stats_sink.incr('public.bypass')
+        return True
+
+    def is_unknown(self, identity):
+        """
+        Returns True if the login filter says the identity's login
+        definitely does not exist, so no authenticator needs to run.
+        """
+        if self.login_filter.might_exist(identity.login):
+            return False
+        if self.stats_sink is not None:
+            self.stats_sink.incr('login_filter.rejected')
+        return True
+
+    def check_rate_limit(self, identity, env):
+        """
+        Counts the request against the identity's rate limit. Returns None
+        if the request is allowed, or RATE_LIMITED after storing the number
+        of seconds to wait in the environ's 'talons.retry_after' key.
+        """
+        wait = self.rate_limiter.check(identity)
+        if not wait:
+            return None
+        from talons.auth import ratelimit
+        env[ratelimit.RETRY_AFTER_ENV_KEY] = int(math.ceil(wait))
+        if self.stats_sink is not None:
+            self.stats_sink.incr('ratelimit.rejected')
+        return RATE_LIMITED
+
+    def admit(self, authenticator, identity, shed):
+        """
+        Calls the authenticator under admission control. Returns False and
+        appends the authenticator to the shed list if the verification was
+        not admitted.
+        """
+        from talons.auth import admission
+        try:
+            return self.admission.call(authenticator, identity)
+        except admission.Shed:
+            shed.append(authenticator)
+            return False
+
+    def shed_outcome(self):
+        if self.stats_sink is not None:
+            self.stats_sink.incr('admission.shed')
+        return OVERLOADED
+
+    def record(self, stage, ok, start):
+        """
+        Records the latency and outcome of a stage of the chain in the stats
+        sink, and returns the current clock value.
+
+        :param stage: One of 'identify', 'authenticate' or 'authorize'.
+        :param ok: Whether the stage succeeded.
+        :param start: Value of `talons.stats.clock()` when the stage began.
+        """
+        now = stats.clock()
+        self.stats_sink.observe('stage.' + stage, now - start)
+        self.stats_sink.incr(stage + ('.success' if ok else '.failure'))
+        return now
+
+    # The helpers below hold every step of the chain except the plugin
+    # calls themselves, so that `_authenticate` and
+    # `process_authorization` here and `talons.auth.asgi.AsyncComponent`,
+    # which awaits the plugins that have coroutine methods, behave the
+    # same.
+
+    @staticmethod
+    def plugin_steps(chain, plugins):
+        """
+        Returns (position, plugin) tuples of the plugins in the order they
+        are tried: the order of the adaptive chain, if there is one, or the
+        configured order.
+        """
+        if chain is None:
+            return enumerate(plugins)
+        return chain.steps()
+
+    def start_call(self, plugin, chain=None, trace=None):
+        """
+        Counts a call of the plugin and returns the clock value it began
+        at, or None if neither the adaptive chain nor the trace need it.
+        """
+        if self.stats_sink is not None:
+            self.stats_sink.incr(self.plugin_counters[id(plugin)])
+        if chain is None and trace is None:
+            return None
+        return stats.clock()
+
+    @staticmethod
+    def end_call(stage, plugin, x, chain, trace, began, ok):
+        """
+        Records the time a plugin call took and its result in the adaptive
+        chain and the trace, if any.
+
+        :param x: Position of the plugin in the chain.
+        :param began: The value `start_call` returned.
+        """
+        if began is None:
+            return
+        seconds = stats.clock() - began
+        if chain is not None:
+            chain.record(x, seconds, ok)
+        if trace is not None:
+            trace.add(stage, plugin, seconds, ok)
+
+    def end_stage(self, stage, ok, env, start, chain=None):
+        """
+        Records the result of a stage of the chain in the environ, the
+        audit log and the stats sink, and counts the request in the
+        adaptive chain that ran, if any. Returns the clock value the next
+        stage starts at, or None if there is no stats sink.
+
+        :param start: Clock value the stage started at, or None if there
+                      is no stats sink.
+        """
+        if chain is not None:
+            chain.finish()
+        env[_RESULT_KEYS[stage]] = ok
+        if self.audit is not None:
+            self.audit.record(stage, ok, env)
+        if self.stats_sink is not None:
+            return self.record(stage, ok, start)
+        return None
+
+    def finish_authentication(self, identity, env, authenticated, shed):
+        """
+        Returns the outcome of an authenticate stage that ended with the
+        supplied result: None if the request may continue, or one of
+        AUTHENTICATE_FAILED, OVERLOADED or RATE_LIMITED. Signs the
+        assertion of authenticated identities.
+
+        :param shed: List of authenticators that were not admitted.
+        """
+        if not authenticated:
+            if shed:
+                return self.shed_outcome()
+            return None if self.delay_401 else AUTHENTICATE_FAILED
+        if self.rate_limiter is not None:
+            outcome = self.check_rate_limit(identity, env)
+            if outcome is not None:
+                return outcome
+        if self.assertion_secret is not None:
+            from talons.auth import assertion
+            env[assertion.ASSERTION_ENV_KEY] = assertion.sign(
+                identity, self.assertion_secret, self.assertion_ttl)
+        return None
+
+    def hold_trace(self, trace, env, outcome):
+        """
+        Finishes the trace of a request that authentication rejected, or
+        pauses it and keeps it in the environ until authorization.
+        """
+        from talons.auth import profiling
+        if outcome is None:
+            self.profiler.pause(trace)
+            env[profiling.TRACE_ENV_KEY] = trace
+        else:
+            self.profiler.finish(trace, env, outcome)
+
+    def resume_trace(self, env):
+        """
+        Returns the trace that `hold_trace` kept in the environ, resumed,
+        or None.
+        """
+        if self.profiler is None:
+            return None
+        from talons.auth import profiling
+        trace = env.pop(profiling.TRACE_ENV_KEY, None)
+        if trace is not None:
+            self.profiler.resume(trace)
+        return trace
+
+    def finish_held_trace(self, env):
+        """
+        Finishes the trace that `hold_trace` kept in the environ of a
+        request that never reached authorization, e.g. because it matched
+        no route. Components call this when the response is sent.
+        """
+        if self.profiler is None:
+            return
+        from talons.auth import profiling
+        trace = env.pop(profiling.TRACE_ENV_KEY, None)
+        if trace is not None:
+            self.profiler.finish(trace, env, profiling.UNROUTED)
+
+    def finish_authorization(self, env, authorized, start, trace):
+        """
+        Ends the authorize stage and the trace, if any, and returns None
+        if the request may continue, or FORBIDDEN.
+        """
+        self.end_stage('authorize', authorized, env, start)
+        outcome = None
+        if not authorized and not self.delay_403:
+            outcome = FORBIDDEN
+        if trace is not None:
+            self.profiler.finish(trace, env, outcome)
+        return outcome
+
+    def challenge_headers(self):
+        """
+        Returns a dict with a WWW-Authenticate header gathered from the
+        authenticators' challenges, or None if none of them has one.
+        """
+        challenges = []
+        for a in self.authenticators:
+            if isinstance(a, interfaces.Authenticates):
+                challenge = a.challenge()
+                if challenge:
+                    challenges.append(challenge)
+        if not challenges:
+            return None
+        return {'WWW-Authenticate': ', '.join(challenges)}
 
     def raise_401_no_identity(self):
-        raise falcon.HTTPUnauthorized('Authentication required',
-                                      'No identity information found.')
+        raise falcon.HTTPUnauthorized(
+            title='Authentication required',
+            description='No identity information found.',
+            headers=self.challenge_headers())
 
     def raise_401_fail_authenticate(self):
-        raise falcon.HTTPUnauthorized('Authentication required',
-                                      'Authentication failed.')
+        raise falcon.HTTPUnauthorized(
+            title='Authentication required',
+            description='Authentication failed.',
+            headers=self.challenge_headers())
 
     def raise_403(self):
-        raise falcon.HTTPForbidden('Action not allowed',
-                                   'The action on that resource is '
-                                   'not allowed.')
+        raise falcon.HTTPForbidden(title='Action not allowed',
+                                   description='The action on that '
+                                               'resource is not allowed.')
 
-    def __call__(self, request, response, params):
+    def process(self, request, params):
+        """
+        Runs the identify, authenticate and authorize chain against the
+        supplied request, and records the results in the request environ.
+
+        Returns None if the request may continue down the WSGI pipeline,
+        or one of NO_IDENTITY, AUTHENTICATE_FAILED, OVERLOADED,
+        RATE_LIMITED or FORBIDDEN if it should be rejected. The caller
+        decides how the rejection is sent back.
+
+        :param request: The `falcon.request.Request` object, or any object
+                        with the same `env`, `method`, `auth` and
+                        `get_header` members, such as
+                        `talons.auth.wsgi.Request`.
+        :param params: Dict of parameters matched by the router, if any.
+        """
+        outcome = self.process_authentication(request)
+        if outcome is ANONYMOUS:
+            return None
+        if outcome is not None:
+            return outcome
+        return self.process_authorization(request, params)
+
+    def process_authentication(self, request):
+        """
+        Runs the identify and authenticate part of the chain. Returns None
+        if the identity was authenticated (or authentication failures are
+        delayed), ANONYMOUS if no identity was found and 401s are delayed,
+        or one of NO_IDENTITY, AUTHENTICATE_FAILED, OVERLOADED or
+        RATE_LIMITED.
+
+        Requests to public paths are not identified and return ANONYMOUS.
+        """
+        env = request.env
+        if self.public_paths is not None and self.is_public(env):
+            return ANONYMOUS
+        if self.profiler is None:
+            return self._authenticate(request, None)
+        trace = self.profiler.begin()
+        if trace is None:
+            return self._authenticate(request, None)
+        try:
+            outcome = self._authenticate(request, trace)
+        except Exception:
+            self.profiler.pause(trace)
+            raise
+        self.hold_trace(trace, env, outcome)
+        return outcome
+
+    def _authenticate(self, request, trace):
+        """
+        Runs the identify and authenticate part of the chain, recording the
+        time taken by each plugin in the trace, if any.
+        """
+        env = request.env
+        start = stats.clock() if self.stats_sink is not None else None
         identified = False
-        for i in self.identifiers:
-            if i.identify(request):
+        chain = self.identifier_chain
+        for x, i in self.plugin_steps(chain, self.identifiers):
+            began = self.start_call(i, chain, trace)
+            found = i.identify(request)
+            self.end_call('identify', i, x, chain, trace, began, found)
+            if found:
                 identified = True
                 break
-
-        request.env['wsgi.identified'] = identified
+        start = self.end_stage('identify', identified, env, start, chain)
         if not identified:
-            if self.delay_401:
-                return
-            self.raise_401_no_identity()
+            return ANONYMOUS if self.delay_401 else NO_IDENTITY
 
-        identity = request.env['wsgi.identity']
+        identity = env['wsgi.identity']
         authenticated = False
-        for a in self.authenticators:
-            if a.authenticate(identity):
-                authenticated = True
-                break
+        shed = []
+        chain = None
+        if self.login_filter is not None and self.is_unknown(identity):
+            # No authenticator knows the login, so none is called
+            pass
+        elif self.fan_out is not None:
+            from talons.auth import admission
+            for a in self.authenticators:
+                self.start_call(a)
+            began = stats.clock() if trace is not None else None
+            if self.admission is None:
+                authenticated = self.fan_out.authenticate(identity)
+            else:
+                try:
+                    authenticated = self.fan_out.authenticate(
+                        identity, self.admission.call)
+                except admission.Shed:
+                    shed.append(None)
+            # The authenticators ran concurrently, so only the time of the
+            # whole fan-out is meaningful
+            self.end_call('authenticate', 'parallel', None, None, trace,
+                          began, authenticated)
+        else:
+            chain = self.authenticator_chain
+            for x, a in self.plugin_steps(chain, self.authenticators):
+                began = self.start_call(a, chain, trace)
+                if self.admission is None:
+                    ok = a.authenticate(identity)
+                else:
+                    ok = self.admit(a, identity, shed)
+                self.end_call('authenticate', a, x, chain, trace, began, ok)
+                if ok:
+                    authenticated = True
+                    break
+        self.end_stage('authenticate', authenticated, env, start, chain)
+        return self.finish_authentication(identity, env, authenticated, shed)
 
-        request.env['wsgi.authenticated'] = authenticated
-        if not authenticated and not self.delay_401:
-            self.raise_401_fail_authenticate()
+    def process_authorization(self, request, params, resource=None,
+                              route=None):
+        """
+        Runs the authorize part of the chain for a request that has been
+        through `process_authentication`. Returns None if the request may
+        continue, or FORBIDDEN.
 
+        :param resource: The responder object that the request was routed
+                         to, if known.
+        :param route: The URI template of the matched route, if known.
+        """
+        env = request.env
+        trace = self.resume_trace(env)
+        start = stats.clock() if self.stats_sink is not None else None
         authorized = self.default_authorize
         if self.authorizer is not None:
-            res = interfaces.ResourceAction(request, params)
-            authorized = self.authorizer.authorize(identity, res)
+            res = interfaces.ResourceAction(request, params,
+                                            resource=resource, route=route)
+            began = self.start_call(self.authorizer, trace=trace)
+            try:
+                authorized = self.authorizer.authorize(env['wsgi.identity'],
+                                                       res)
+            except Exception:
+                if trace is not None:
+                    self.profiler.pause(trace)
+                raise
+            self.end_call('authorize', self.authorizer, None, None, trace,
+                          began, authorized)
+        return self.finish_authorization(env, authorized, start, trace)
 
-        request.env['wsgi.authorized'] = authorized
-        if not authorized and not self.delay_403:
-            self.raise_403()
+    def raise_429(self, retry_after):
+        raise falcon.HTTPError(falcon.HTTP_429,
+                               title='Too many requests',
+                               description='The request rate limit was '
+                                           'exceeded.',
+                               headers={'Retry-After': str(retry_after)})
+
+    def raise_503(self):
+        raise falcon.HTTPError(falcon.HTTP_503,
+                               title='Service unavailable',
+                               description='Too many credentials are '
+                                           'waiting to be verified.',
+                               headers={'Retry-After':
+                                        str(self.admission_retry_after)})
+
+    def raise_for(self, outcome, env=None):
+        """
+        Raises the Falcon HTTP error matching a rejecting outcome.
+
+        :param env: The request environ, which holds the Retry-After value
+                    of RATE_LIMITED outcomes.
+        """
+        if outcome is OVERLOADED:
+            self.raise_503()
+        if outcome is RATE_LIMITED:
+            from talons.auth import ratelimit
+            self.raise_429((env or {}).get(ratelimit.RETRY_AFTER_ENV_KEY, 1))
+        if outcome is NO_IDENTITY:
+            self.raise_401_no_identity()
+        if outcome is AUTHENTICATE_FAILED:
+            self.raise_401_fail_authenticate()
+        self.raise_403()
+
+    def __call__(self, request, response, params):
+        outcome = self.process(request, params)
+        if outcome is not None:
+            self.raise_for(outcome, request.env)
 
 
 def create_middleware(identify_with, authenticate_with,
@@ -154,12 +853,18 @@ def create_middleware(identify_with, authenticate_with,
     :param **conf: Configuration option dictionary that will be supplied
                    to the identifiers and authenticators.
 
+    Plugins may also be given by name, such as 'basicauth' or 'htpasswd',
+    or as the dotted path of a class. Named plugins are looked up in
+    `talons.auth.plugins` and only their modules are imported.
+
     :raises `talons.exc.BadConfiguration` if the identifiers or authenticators
             lists are empty or don't make sense.
     """
     if not isinstance(identify_with, list):
         identify_with = [identify_with]
     for x, i in enumerate(identify_with):
+        if isinstance(i, six.string_types):
+            i = plugins.load(i, plugins.IDENTIFIER)
         if inspect.isclass(i):
             if issubclass(i, interfaces.Identifies):
                 identify_with[x] = i = i(**conf)
@@ -172,6 +877,8 @@ def create_middleware(identify_with, authenticate_with,
     if not isinstance(authenticate_with, list):
         authenticate_with = [authenticate_with]
     for x, a in enumerate(authenticate_with):
+        if isinstance(a, six.string_types):
+            a = plugins.load(a, plugins.AUTHENTICATOR)
         if inspect.isclass(a):
             if issubclass(a, interfaces.Authenticates):
                 authenticate_with[x] = a = a(**conf)
@@ -182,6 +889,8 @@ def create_middleware(identify_with, authenticate_with,
             raise exc.BadConfiguration(msg)
 
     if authorize_with is not None:
+        if isinstance(authorize_with, six.string_types):
+            authorize_with = plugins.load(authorize_with, plugins.AUTHORIZER)
         if inspect.isclass(authorize_with):
             if issubclass(authorize_with, interfaces.Authorizes):
                 authorize_with = authorize_with(**conf)
@@ -0,0 +1,165 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+"""
+Runs a set of authenticators concurrently. Requires the `concurrent.futures`
+module, which is part of the standard library on Python 3 and available as
+the `futures` package on Python 2.
+"""
+
+import copy
+import logging
+import time
+
+try:
+    from concurrent import futures
+except ImportError:  # pragma: NO COVER
+    futures = None
+
+from talons import exc
+
+LOG = logging.getLogger(__name__)
+
+
+def copy_identity(identity):
+    """
+    Returns a copy of the identity whose roles and groups can be modified
+    without affecting the original.
+    """
+    c = copy.copy(identity)
+    c.roles = set(identity.roles)
+    c.groups = set(identity.groups)
+    return c
+
+
+class FanOut(object):
+
+    """
+    Calls every authenticator at the same time on a bounded thread pool,
+    instead of one after the other, so that a miss on a slow remote
+    authenticator does not delay the next one.
+
+    The first authenticator to succeed wins: the roles, groups and other
+    attributes it set are copied onto the identity and the calls still
+    pending are cancelled if they have not started, or ignored otherwise.
+    Each authenticator works on its own copy of the identity, so the
+    losers cannot modify it.
+    """
+
+    def __init__(self, authenticators, workers=None, timeout=None):
+        """
+        :param authenticators: List of authenticator objects.
+        :param workers: Maximum number of threads. (defaults to the number
+                        of authenticators)
+        :param timeout: Overall deadline, in seconds, for an authenticator
+                        to succeed. Authentication fails if none succeeds
+                        in time. (defaults to None, no deadline)
+        """
+        self.authenticators = list(authenticators)
+        self.timeout = timeout
+        self.executor = futures.ThreadPoolExecutor(
+            max_workers=workers or len(self.authenticators))
+
+    def authenticate(self, identity, call=None):
+        """
+        Returns True if any authenticator succeeded before the deadline,
+        False otherwise.
+
+        :param call: Optional callable used instead of
+                     `authenticator.authenticate(identity)`, which is passed
+                     the authenticator and the identity.
+
+        If no authenticator succeeded and one of them raised an exception,
+        the first such exception is raised, as it would have been had the
+        authenticators been called one after the other.
+        """
+        deadline = None
+        if self.timeout is not None:
+            deadline = time.time() + self.timeout
+        pending = {}
+        for a in self.authenticators:
+            c = copy_identity(identity)
+            if call is None:
+                f = self.executor.submit(a.authenticate, c)
+            else:
+                f = self.executor.submit(call, a, c)
+            pending[f] = c
+
+        error = None
+        try:
+            while pending:
+                timeout = None
+                if deadline is not None:
+                    timeout = deadline - time.time()
+                    if timeout <= 0:
+                        LOG.debug("Authentication deadline of {0}s "
+                                  "exceeded.".format(self.timeout))
+                        return False
+                done, _not_done = futures.wait(
+                    pending, timeout=timeout,
+                    return_when=futures.FIRST_COMPLETED)
+                for f in done:
+                    c = pending.pop(f)
+                    err = f.exception()
+                    if err is not None:
+                        error = error or err
+                    elif f.result():
+                        identity.__dict__.update(c.__dict__)
+                        return True
+        finally:
+            for f in pending:
+                f.cancel()
+        if error is not None:
+            raise error
+        return False
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+def create_fan_out(authenticators, **conf):
+    """
+    Returns a `FanOut` object if the parallel_authenticate configuration
+    option is set and there is more than one authenticator, or None
+    otherwise. See `talons.auth.middleware.Middleware` for the
+    configuration options.
+
+    :raises `talons.exc.BadConfiguration` if configuration options
+            are not valid.
+    """
+    if not conf.get('parallel_authenticate', False):
+        return None
+    if len(authenticators) < 2:
+        return None
+    if futures is None:  # pragma: NO COVER
+        msg = ("parallel_authenticate requires the concurrent.futures "
+               "module. Install the futures package.")
+        LOG.error(msg)
+        raise exc.BadConfiguration(msg)
+    timeout = conf.get('parallel_timeout')
+    try:
+        workers = int(conf.get('parallel_workers') or len(authenticators))
+        if timeout is not None:
+            timeout = float(timeout)
+    except (TypeError, ValueError):
+        workers = 0
+    if workers < 1 or (timeout is not None and timeout <= 0):
+        msg = ("parallel_workers and parallel_timeout must be positive "
+               "numbers.")
+        LOG.error(msg)
+        raise exc.BadConfiguration(msg)
+    return FanOut(authenticators, workers, timeout)
@@ -0,0 +1,138 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+"""
+Registry of plugins by short name, such as 'basicauth' or 'htpasswd', so
+that `talons.auth.middleware.create_middleware` only imports the plugin
+modules, and their dependencies, that are actually used.
+"""
+
+import importlib
+import logging
+import threading
+
+import six
+
+from talons import exc
+
+LOG = logging.getLogger(__name__)
+
+# Entry point group through which other packages register plugin modules,
+# or plugin classes, by short name
+ENTRY_POINT_GROUP = 'talons.plugins'
+
+# Plugins that ship with talons. Also declared as entry points in
+# setup.cfg, but looked up here first, so that resolving them does not
+# require scanning the installed distributions.
+BUILTIN = {
+    'assertion': 'talons.auth.assertion',
+    'basicauth': 'talons.auth.basicauth',
+    'clientcert': 'talons.auth.clientcert',
+    'digest': 'talons.auth.digest',
+    'external': 'talons.auth.external',
+    'htpasswd': 'talons.auth.htpasswd',
+    'httpheader': 'talons.auth.httpheader',
+    'tenant': 'talons.auth.tenant',
+}
+
+# Name of the class a plugin module exposes for each role
+IDENTIFIER = 'Identifier'
+AUTHENTICATOR = 'Authenticator'
+AUTHORIZER = 'Authorizer'
+
+_entry_points = None
+_lock = threading.Lock()
+
+
+def _iter_entry_points():
+    """
+    Returns a list of (name, loader) tuples of the entry points of the
+    ENTRY_POINT_GROUP group.
+    """
+    try:
+        from importlib import metadata
+    except ImportError:  # pragma: NO COVER
+        import pkg_resources
+        return [(ep.name, ep.load)
+                for ep in pkg_resources.iter_entry_points(ENTRY_POINT_GROUP)]
+    eps = metadata.entry_points()
+    if hasattr(eps, 'select'):
+        eps = eps.select(group=ENTRY_POINT_GROUP)
+    else:  # pragma: NO COVER
+        eps = eps.get(ENTRY_POINT_GROUP, ())
+    return [(ep.name, ep.load) for ep in eps]
+
+
+def entry_points():
+    """
+    Returns a dict of plugin name to entry point loader. Installed
+    distributions are only scanned the first time.
+    """
+    global _entry_points
+    with _lock:
+        if _entry_points is None:
+            _entry_points = dict(_iter_entry_points())
+        return _entry_points
+
+
+def names():
+    """
+    Returns the sorted names of all available plugins.
+    """
+    return sorted(set(BUILTIN) | set(entry_points()))
+
+
+def load(name, role):
+    """
+    Returns the class of the named plugin for a role, importing its module
+    if needed.
+
+    :param name: Short name of a built-in or entry point plugin, such as
+                 'htpasswd', or a dotted path of a class, such as
+                 'myapp.auth.Authenticator'.
+    :param role: One of IDENTIFIER, AUTHENTICATOR or AUTHORIZER.
+
+    :raises `talons.exc.BadConfiguration` if the plugin cannot be found or
+            has no class for the role.
+    """
+    if name in BUILTIN:
+        target = importlib.import_module(BUILTIN[name])
+    elif '.' in name:
+        mod_name, _sep, cls_name = name.rpartition('.')
+        try:
+            target = getattr(importlib.import_module(mod_name), cls_name)
+        except (ImportError, AttributeError) as err:
+            msg = "Plugin {0} could not be imported: {1}".format(name, err)
+            LOG.error(msg)
+            raise exc.BadConfiguration(msg)
+        return target
+    else:
+        loader = entry_points().get(name)
+        if loader is None:
+            msg = "Unknown plugin {0!r}. Available plugins: {1}".format(
+                name, ', '.join(names()))
+            LOG.error(msg)
+            raise exc.BadConfiguration(msg)
+        target = loader()
+    if isinstance(target, six.class_types):
+        return target
+    cls = getattr(target, role, None)
+    if cls is None:
+        msg = "Plugin {0} has no {1}.".format(name, role)
+        LOG.error(msg)
+        raise exc.BadConfiguration(msg)
+    return cls
@@ -0,0 +1,469 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+"""
+Opt-in profiling of the requests that go through a chain. A fraction of
+requests, and every request slower than a threshold, is written with the
+time spent in each plugin, and optionally a cProfile or stack-sample
+profile of the whole chain, to a ring of files on disk.
+"""
+
+import atexit
+import collections
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+
+import six
+
+from talons import exc
+from talons import stats
+
+try:
+    import cProfile
+    import pstats
+except ImportError:  # pragma: NO COVER
+    cProfile = None
+
+LOG = logging.getLogger(__name__)
+
+CPROFILE = 'cprofile'
+STACK = 'stack'
+
+# Key in the request environ that holds the trace of a request between
+# authentication and authorization
+TRACE_ENV_KEY = 'talons.profile'
+
+# Outcome of the traces of requests that were authenticated but never
+# reached authorization, e.g. because they matched no route
+UNROUTED = 'unrouted'
+
+_SLOT_PREFIX = 'profile-'
+_SLOT_SUFFIX = '.json'
+
+
+class Trace(object):
+
+    """
+    Timings, and the optional deep profile, of one request.
+    """
+
+    __slots__ = ('start', 'paused', 'idle', 'sampled', 'plugins', 'profile',
+                 'stacks', 'thread_id')
+
+    def __init__(self, sampled, profile=None, stacks=None):
+        self.start = stats.clock()
+        self.paused = None
+        self.idle = 0.0
+        self.sampled = sampled
+        self.plugins = []
+        self.profile = profile
+        self.stacks = stacks
+        self.thread_id = None
+
+    def add(self, stage, plugin, seconds, ok):
+        """
+        Records the time a plugin took and its result.
+
+        :param stage: 'identify', 'authenticate' or 'authorize'.
+        :param plugin: The plugin object, or a name.
+        """
+        if not isinstance(plugin, six.string_types):
+            plugin = stats.plugin_name(plugin)
+        self.plugins.append((stage, plugin, seconds, bool(ok)))
+
+
+def _collapse(frame, limit=64):
+    """
+    Returns the stack of a frame as 'file:function;...', outermost first.
+    """
+    names = []
+    while frame is not None and len(names) < limit:
+        code = frame.f_code
+        names.append('{0}:{1}'.format(os.path.basename(code.co_filename),
+                                      code.co_name))
+        frame = frame.f_back
+    names.reverse()
+    return ';'.join(names)
+
+
+class Profiler(object):
+
+    """
+    Decides which requests to profile and writes their traces to a ring of
+    `slots` JSON files in a directory, overwriting the oldest ones. A
+    restarted process continues after the newest file. Worker processes
+    may share the directory; they then overwrite each other's oldest
+    files.
+
+    Every request whose trace may be kept is timed plugin by plugin, which
+    costs a few clock reads. Deep profiles are only taken of the sampled
+    requests in cprofile mode, since cProfile slows the request down, but
+    of every timed request in stack mode, where a background thread
+    records the stack of each request's thread every stack_interval
+    seconds.
+
+    Traces are written by a background thread, so profiling adds no disk
+    latency to requests. When more than `slots` traces wait to be
+    written, the oldest are dropped. The background threads are started
+    by the first request of each process, so that the workers of a
+    pre-forking server that created the profiler before forking each
+    start their own.
+    """
+
+    def __init__(self, path, sample_rate=0.0, slow_threshold=None,
+                 mode=None, slots=100, stack_interval=0.005, top=30):
+        """
+        :param path: Directory of the ring of trace files.
+        :param sample_rate: Fraction of requests traced regardless of
+                            their latency.
+        :param slow_threshold: Seconds after which a request is traced, or
+                               None.
+        :param mode: None for plugin timings only, CPROFILE or STACK.
+        :param slots: Number of trace files kept.
+        :param stack_interval: Seconds between stack samples.
+        :param top: Number of functions kept from cProfile profiles.
+        """
+        self.path = path
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.mode = mode
+        self.slots = slots
+        self.stack_interval = stack_interval
+        self.top = top
+        self.written = 0
+        self.dropped = 0
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._next_slot = self._newest_slot() + 1
+        self._random = random.random
+        self._queue = collections.deque()
+        self._wake = threading.Event()
+        self._closed = False
+        self._active = {}
+        self._start_lock = threading.Lock()
+        self._writer = None
+        # Process whose background threads are running, if any
+        self._pid = None
+        atexit.register(self.close)
+
+    def _start(self):
+        """
+        Starts the background threads of the calling process. A process
+        forked after the profiler was created discards the traces it
+        inherited, which its parent writes.
+        """
+        with self._start_lock:
+            pid = os.getpid()
+            if self._pid == pid or self._closed:
+                return
+            if self._pid is not None:
+                self._queue = collections.deque()
+                self._wake = threading.Event()
+                self._active = {}
+            self._pid = pid
+            self._writer = threading.Thread(target=self._run,
+                                            name='talons-profile-writer')
+            self._writer.daemon = True
+            self._writer.start()
+            if self.mode == STACK:
+                sampler = threading.Thread(target=self._sample,
+                                           name='talons-profile-sampler')
+                sampler.daemon = True
+                sampler.start()
+
+    def _slot_path(self, slot):
+        return os.path.join(self.path, '{0}{1:06d}{2}'.format(
+            _SLOT_PREFIX, slot, _SLOT_SUFFIX))
+
+    def _newest_slot(self):
+        newest = -1
+        newest_mtime = None
+        for name in os.listdir(self.path):
+            if not (name.startswith(_SLOT_PREFIX) and
+                    name.endswith(_SLOT_SUFFIX)):
+                continue
+            try:
+                slot = int(name[len(_SLOT_PREFIX):-len(_SLOT_SUFFIX)])
+                mtime = os.path.getmtime(os.path.join(self.path, name))
+            except (ValueError, OSError):
+                continue
+            if slot < self.slots and (newest_mtime is None or
+                                      mtime > newest_mtime):
+                newest, newest_mtime = slot, mtime
+        return newest
+
+    def begin(self, deep=True):
+        """
+        Returns a new `Trace` for a request, or None if the request cannot
+        be kept, i.e. if it is not sampled and there is no slow threshold.
+        The deep profile, if any, starts right away.
+
+        :param deep: False to never take a deep profile, e.g. for requests
+                     that share an event loop thread with others.
+        """
+        if self._pid != os.getpid():
+            self._start()
+        sampled = self.sample_rate > 0 and self._random() < self.sample_rate
+        if not sampled and self.slow_threshold is None:
+            return None
+        trace = Trace(sampled)
+        if not deep:
+            return trace
+        if self.mode == CPROFILE and sampled:
+            trace.profile = cProfile.Profile()
+        elif self.mode == STACK:
+            trace.stacks = {}
+        self.resume(trace)
+        return trace
+
+    def resume(self, trace):
+        """
+        Starts, or continues, the deep profile of the trace on the calling
+        thread. Time spent paused is not counted as time in the chain.
+        """
+        if trace.paused is not None:
+            trace.idle += stats.clock() - trace.paused
+            trace.paused = None
+        if trace.profile is not None:
+            try:
+                trace.profile.enable()
+            except ValueError:
+                # Another profiler is active on this thread
+                trace.profile = None
+        if trace.stacks is not None:
+            trace.thread_id = threading.current_thread().ident
+            self._active[trace.thread_id] = trace
+
+    def pause(self, trace):
+        """
+        Stops the deep profile of the trace, e.g. between authentication
+        and authorization, or when the chain raised an error. Does nothing
+        if the trace is already paused.
+        """
+        if trace.paused is not None:
+            return
+        trace.paused = stats.clock()
+        if trace.profile is not None:
+            trace.profile.disable()
+        if trace.stacks is not None:
+            self._active.pop(trace.thread_id, None)
+
+    def finish(self, trace, env, outcome):
+        """
+        Stops the trace and queues it to be written if the request was
+        sampled or slow.
+
+        :param env: WSGI environ of the request.
+        :param outcome: The outcome returned by the middleware, UNROUTED,
+                        or None if the request was accepted.
+        """
+        self.pause(trace)
+        total = trace.paused - trace.start - trace.idle
+        slow = (self.slow_threshold is not None and
+                total >= self.slow_threshold)
+        if not (trace.sampled or slow):
+            return
+        identity = env.get('wsgi.identity')
+        record = {
+            'ts': time.time(),
+            'pid': os.getpid(),
+            'reason': 'slow' if slow else 'sampled',
+            'seconds': total,
+            'outcome': outcome or 'accepted',
+            'login': getattr(identity, 'login', None),
+            'method': env.get('REQUEST_METHOD'),
+            'path': env.get('PATH_INFO'),
+            'plugins': [{'stage': stage, 'plugin': plugin,
+                         'seconds': seconds, 'ok': ok}
+                        for stage, plugin, seconds, ok in trace.plugins],
+        }
+        if trace.profile is not None:
+            record['cprofile'] = trace.profile
+        if trace.stacks:
+            record['stacks'] = trace.stacks
+        if len(self._queue) >= self.slots:
+            self._queue.popleft()
+            self.dropped += 1
+        self._queue.append(record)
+        self._wake.set()
+
+    def _cprofile_rows(self, profile):
+        """
+        Returns the top functions of a cProfile profile by cumulative time,
+        as lists of [function, calls, total seconds, cumulative seconds].
+        """
+        rows = []
+        for func, (_cc, calls, tt, ct, _callers) in pstats.Stats(
+                profile).stats.items():
+            filename, line, name = func
+            rows.append(['{0}:{1}({2})'.format(os.path.basename(filename),
+                                               line, name), calls, tt, ct])
+        rows.sort(key=lambda row: row[3], reverse=True)
+        return rows[:self.top]
+
+    def _write(self, record):
+        if 'cprofile' in record:
+            record['cprofile'] = self._cprofile_rows(record['cprofile'])
+        # Serialized before a slot is taken, so that a trace that cannot
+        # be serialized leaves no file behind
+        data = json.dumps(record, separators=(',', ':'))
+        slot = self._next_slot % self.slots
+        self._next_slot = slot + 1
+        path = self._slot_path(slot)
+        tmp = '{0}.{1}.tmp'.format(path, os.getpid())
+        with open(tmp, 'w') as f:
+            f.write(data)
+        os.rename(tmp, path)
+        self.written += 1
+
+    def flush(self):
+        """
+        Writes all queued traces. Only called by the writer thread, and by
+        `close()` once the writer thread has stopped. A trace that cannot
+        be serialized or written is dropped, and the others are still
+        written.
+        """
+        while self._queue:
+            record = self._queue.popleft()
+            try:
+                self._write(record)
+            except (IOError, OSError) as err:
+                LOG.warning("Unable to write profile to {0}: {1}".format(
+                    self.path, err))
+            except Exception as err:
+                self.dropped += 1
+                LOG.warning("Unable to serialize profile of {0}: {1}".format(
+                    record.get('path'), err))
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(1.0)
+            self._wake.clear()
+            self.flush()
+
+    def _sample(self):
+        while not self._closed:
+            time.sleep(self.stack_interval)
+            if not self._active:
+                continue
+            frames = sys._current_frames()
+            for thread_id, trace in list(self._active.items()):
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                stack = _collapse(frame)
+                trace.stacks[stack] = trace.stacks.get(stack, 0) + 1
+
+    def close(self):
+        """
+        Stops the background threads and writes the remaining traces. Does
+        nothing in a forked process that never profiled a request.
+        """
+        if self._closed or self._pid not in (None, os.getpid()):
+            return
+        self._closed = True
+        self._wake.set()
+        if self._writer is not None:
+            self._writer.join()
+        self.flush()
+
+
+def read(path):
+    """
+    Returns the traces in a profiler's directory, oldest first, as dicts
+    with the keys:
+
+        ts: Time the request finished, in seconds since the epoch.
+        pid: Process that served the request.
+        reason: 'sampled' or 'slow'.
+        seconds: Time spent in the chain.
+        outcome: 'accepted', 'unrouted' for requests that never reached
+                 authorization, or the rejecting outcome of
+                 `talons.auth.middleware.Middleware.process`.
+        login, method, path: Of the request.
+        plugins: List of dicts with the stage, plugin, seconds and ok
+                 (result) of each plugin call, in call order.
+        cprofile: List of [function, calls, total seconds, cumulative
+                  seconds] lists of the slowest functions. (cprofile mode)
+        stacks: Dict of 'file:function;...' stacks, outermost first, to
+                the number of times they were sampled. (stack mode)
+    """
+    records = []
+    for name in os.listdir(path):
+        if not (name.startswith(_SLOT_PREFIX) and
+                name.endswith(_SLOT_SUFFIX)):
+            continue
+        try:
+            with open(os.path.join(path, name)) as f:
+                records.append(json.load(f))
+        except (IOError, OSError, ValueError) as err:
+            LOG.warning("Unable to read profile {0}: {1}".format(name, err))
+    records.sort(key=lambda r: r.get('ts', 0))
+    return records
+
+
+def create_profiler(**conf):
+    """
+    Returns a `Profiler` built from the profile_* configuration options, or
+    None if profile_path is not set. See `talons.auth.middleware.Middleware`
+    for the configuration options.
+
+    :raises `talons.exc.BadConfiguration` if configuration options
+            are not valid.
+    """
+    path = conf.get('profile_path')
+    if not path:
+        return None
+    mode = conf.get('profile_mode') or None
+    if mode not in (None, CPROFILE, STACK):
+        msg = "profile_mode must be 'cprofile' or 'stack'."
+        LOG.error(msg)
+        raise exc.BadConfiguration(msg)
+    if mode == CPROFILE and cProfile is None:
+        msg = "profile_mode 'cprofile' requires the cProfile module."
+        LOG.error(msg)
+        raise exc.BadConfiguration(msg)
+    try:
+        sample_rate = float(conf.get('profile_sample_rate', 0))
+        threshold = conf.get('profile_slow_threshold')
+        threshold = float(threshold) if threshold is not None else None
+        slots = int(conf.get('profile_slots', 100))
+        stack_interval = float(conf.get('profile_stack_interval', 0.005))
+        top = int(conf.get('profile_top', 30))
+        valid = (0 <= sample_rate <= 1 and slots > 0 and stack_interval > 0
+                 and (sample_rate > 0 or threshold is not None))
+    except (TypeError, ValueError):
+        valid = False
+    if not valid:
+        msg = ("profile_path requires a profile_sample_rate between 0 and "
+               "1 or a profile_slow_threshold, and the other profile_* "
+               "options must be positive numbers.")
+        LOG.error(msg)
+        raise exc.BadConfiguration(msg)
+    try:
+        return Profiler(path, sample_rate=sample_rate,
+                        slow_threshold=threshold, mode=mode, slots=slots,
+                        stack_interval=stack_interval, top=top)
+    except (IOError, OSError) as err:
+        msg = "Unable to use profile_path {0}: {1}".format(path, err)
+        LOG.error(msg)
+        raise exc.BadConfiguration(msg)
@@ -0,0 +1,142 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import logging
+import re
+
+import six
+
+from talons import exc
+
+LOG = logging.getLogger(__name__)
+
+_ANY_METHOD = None
+
+
+def _as_list(value):
+    if not value:
+        return []
+    if isinstance(value, six.string_types):
+        return [v.strip() for v in value.split(',') if v.strip()]
+    return list(value)
+
+
+def _split_pattern(pattern):
+    """
+    Returns a (methods, path) tuple for a pattern such as '/healthz' or
+    'GET|HEAD /status'. methods is None if the pattern applies to any
+    method.
+    """
+    methods, sep, path = pattern.strip().rpartition(' ')
+    if not path.startswith('/'):
+        msg = "Public path pattern {0!r} must start with '/'.".format(
+            pattern)
+        LOG.error(msg)
+        raise exc.BadConfiguration(msg)
+    if not sep:
+        return _ANY_METHOD, path
+    return frozenset(m.upper() for m in methods.split('|') if m), path
+
+
+def _path_regex(path):
+    """
+    Returns a regular expression for a path pattern. A trailing '*' matches
+    the rest of the path, any other '*' matches a single path segment.
+    """
+    parts = path.split('*')
+    regex = '[^/]*'.join(re.escape(p) for p in parts[:-1])
+    if path.endswith('*'):
+        return regex + '.*'
+    return regex + '[^/]*' + re.escape(parts[-1])
+
+
+class PublicPaths(object):
+
+    """
+    Matches requests that bypass identification, authentication and
+    authorization, such as load balancer health checks and static files.
+
+    Patterns are compiled once: paths without wildcards go into a dict
+    that maps each path to the methods it is public for, and all wildcard
+    patterns are combined into a single regular expression, so that
+    matching a request costs one dict lookup and at most one regex match.
+    """
+
+    def __init__(self, patterns=(), methods=()):
+        """
+        :param patterns: List of path patterns, e.g. '/healthz',
+                         '/static/*' or 'GET|HEAD /users/*/avatar'. A
+                         trailing '*' matches the rest of the path and any
+                         other '*' matches one path segment. A pattern may
+                         be prefixed by '|'-separated methods and a space to
+                         apply only to those methods.
+        :param methods: List of methods that are public for any path, e.g.
+                        OPTIONS for CORS preflight requests.
+        """
+        self.methods = frozenset(m.upper() for m in methods)
+        self.exact = {}
+        regexes = []
+        for pattern in patterns:
+            methods, path = _split_pattern(pattern)
+            if '*' not in path:
+                if path in self.exact:
+                    known = self.exact[path]
+                    if known is _ANY_METHOD or methods is _ANY_METHOD:
+                        methods = _ANY_METHOD
+                    else:
+                        methods = known | methods
+                self.exact[path] = methods
+                continue
+            if methods is _ANY_METHOD:
+                method_regex = '[^ ]+'
+            else:
+                method_regex = '(?:{0})'.format(
+                    '|'.join(re.escape(m) for m in sorted(methods)))
+            regexes.append('{0} {1}'.format(method_regex, _path_regex(path)))
+        self.regex = None
+        if regexes:
+            self.regex = re.compile('(?:{0})\\Z'.format('|'.join(regexes)))
+
+    def match(self, method, path):
+        """
+        Returns True if a request with the supplied method and path is
+        public, False otherwise.
+        """
+        if method in self.methods:
+            return True
+        methods = self.exact.get(path, False)
+        if methods is not False:
+            if methods is _ANY_METHOD or method in methods:
+                return True
+        if self.regex is not None:
+            return self.regex.match(method + ' ' + path) is not None
+        return False
+
+
+def create_public_paths(**conf):
+    """
+    Returns a `PublicPaths` object built from the public_paths and
+    public_methods configuration options, or None if neither is set. See
+    `talons.auth.middleware.Middleware` for the configuration options.
+
+    :raises `talons.exc.BadConfiguration` if a pattern is not valid.
+    """
+    patterns = _as_list(conf.get('public_paths'))
+    methods = _as_list(conf.get('public_methods'))
+    if not patterns and not methods:
+        return None
+    return PublicPaths(patterns, methods)
@@ -0,0 +1,213 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import collections
+import itertools
+import logging
+import math
+import threading
+import time
+
+from talons import exc
+
+LOG = logging.getLogger(__name__)
+
+# Key in the request environ holding the number of seconds a rate limited
+# client should wait before retrying
+RETRY_AFTER_ENV_KEY = 'talons.retry_after'
+
+clock = getattr(time, 'monotonic', time.time)
+
+
+class Limit(object):
+
+    """
+    A request quota of `rate` requests per second, allowing bursts of up to
+    `burst` requests.
+    """
+
+    __slots__ = ('rate', 'burst', 'interval', 'tolerance')
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = max(1, int(burst or math.ceil(self.rate)))
+        self.interval = 1.0 / self.rate
+        self.tolerance = self.interval * self.burst
+
+    def __repr__(self):
+        return '<Limit {0}/s burst {1}>'.format(self.rate, self.burst)
+
+
+def parse_limit(value):
+    """
+    Returns a `Limit` for a 'rate' or 'rate/burst' string, or None for a
+    rate of 0, which means no limit.
+
+    :raises ValueError if the value is not a valid limit.
+    """
+    if isinstance(value, Limit):
+        return value
+    if isinstance(value, (tuple, list)):
+        rate, burst = value
+    else:
+        rate, _sep, burst = str(value).partition('/')
+        burst = burst or None
+    rate = float(rate)
+    if rate < 0 or (burst is not None and int(burst) < 1):
+        raise ValueError("Invalid limit {0!r}".format(value))
+    if not rate:
+        return None
+    return Limit(rate, burst)
+
+
+class GCRALimiter(object):
+
+    """
+    Generic cell rate algorithm (GCRA) limiter. For every key, only the
+    theoretical arrival time (TAT) of the next request is stored.
+
+    State is kept in a number of shards, each an ordered dict with its own
+    lock, so that concurrent requests for different keys rarely contend.
+    Keys whose TAT is in the past carry no information and are evicted as
+    other keys are updated. Each shard holds at most max_entries / shards
+    keys; past that, the least recently updated keys are dropped.
+    """
+
+    def __init__(self, shards=16, max_entries=100000, clock=clock):
+        self.shards = [(collections.OrderedDict(), threading.Lock())
+                       for _x in range(shards)]
+        self.max_per_shard = max(1, max_entries // shards)
+        self.clock = clock
+
+    def __len__(self):
+        return sum(len(tats) for tats, _lock in self.shards)
+
+    def acquire(self, key, limit):
+        """
+        Counts a request for key against the supplied `Limit`. Returns 0 if
+        the request is allowed, or the number of seconds after which it
+        would be.
+        """
+        tats, lock = self.shards[hash(key) % len(self.shards)]
+        now = self.clock()
+        with lock:
+            tat = max(tats.get(key, now), now)
+            new_tat = tat + limit.interval
+            wait = new_tat - now - limit.tolerance
+            if wait > 0:
+                return wait
+            tats.pop(key, None)
+            tats[key] = new_tat
+            # Evict idle keys from the least recently updated end
+            for oldest in list(itertools.islice(tats, 2)):
+                if oldest == key or tats[oldest] > now:
+                    break
+                del tats[oldest]
+            while len(tats) > self.max_per_shard:
+                tats.popitem(last=False)
+        return 0
+
+
+class RateLimiter(object):
+
+    """
+    Limits the number of requests per second of each authenticated login.
+    The limit of a login is the most generous limit among those configured
+    for its roles, or the default limit if none of its roles has one.
+    """
+
+    def __init__(self, default=None, roles=None, shards=16,
+                 max_entries=100000, clock=clock):
+        """
+        :param default: Default `Limit`, or None for no limit.
+        :param roles: Dict of role names to a `Limit`, or None for no limit.
+        """
+        self.default = default
+        self.roles = roles or {}
+        self.limiter = GCRALimiter(shards, max_entries, clock)
+
+    def limit_for(self, identity):
+        """
+        Returns the `Limit` of the supplied identity, or None if its
+        requests are not limited.
+        """
+        if not self.roles:
+            return self.default
+        best = False
+        for role in identity.roles:
+            limit = self.roles.get(role, False)
+            if limit is False:
+                continue
+            if limit is None:
+                return None
+            if best is False or limit.rate > best.rate:
+                best = limit
+        if best is False:
+            return self.default
+        return best
+
+    def check(self, identity):
+        """
+        Returns 0 if a request by the identity is allowed, or the number of
+        seconds the client should wait before retrying.
+        """
+        limit = self.limit_for(identity)
+        if limit is None:
+            return 0
+        return self.limiter.acquire(identity.login, limit)
+
+
+def _role_limits(value):
+    if isinstance(value, dict):
+        items = value.items()
+    else:
+        items = []
+        for entry in value.split(','):
+            if entry.strip():
+                role, _sep, limit = entry.partition('=')
+                items.append((role.strip(), limit.strip()))
+    return dict((role, parse_limit(limit)) for role, limit in items)
+
+
+def create_rate_limiter(**conf):
+    """
+    Returns a `RateLimiter` built from the ratelimit_* configuration
+    options, or None if neither ratelimit_rate nor ratelimit_roles is set.
+    See `talons.auth.middleware.Middleware` for the configuration options.
+
+    :raises `talons.exc.BadConfiguration` if configuration options
+            are not valid.
+    """
+    rate = conf.get('ratelimit_rate')
+    roles = conf.get('ratelimit_roles')
+    if not rate and not roles:
+        return None
+    try:
+        default = None
+        if rate:
+            default = parse_limit((rate, conf.get('ratelimit_burst')))
+        role_limits = _role_limits(roles or {})
+        shards = int(conf.get('ratelimit_shards', 16))
+        max_entries = int(conf.get('ratelimit_max_entries', 100000))
+        if shards < 1 or max_entries < 1:
+            raise ValueError()
+    except (TypeError, ValueError):
+        msg = ("ratelimit_* options must be positive numbers, and "
+               "ratelimit_roles of the form 'role=rate/burst,...'.")
+        LOG.error(msg)
+        raise exc.BadConfiguration(msg)
+    return RateLimiter(default, role_limits, shards, max_entries)
@@ -0,0 +1,109 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import logging
+
+from talons import exc
+
+LOG = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class RouteTable(object):
+
+    """
+    Maps Falcon route templates to per-route policies.
+
+    Routes are declared either by their exact template, e.g.
+    '/users/{user_id}', or by a prefix ending in '*', e.g. '/admin/*'. A
+    prefix ending in '/*' also matches its parent path, e.g. '/admin'. A
+    template is resolved to the policy of its exact declaration, otherwise
+    to that of the longest matching prefix, otherwise to the default. Each
+    template is only resolved once; the result is kept in a dispatch table
+    so that every later request costs a single dict lookup.
+    """
+
+    def __init__(self, routes, default, templates=()):
+        """
+        :param routes: Dict, or list of (pattern, policy) tuples, of route
+                       templates or prefixes to policies.
+        :param default: Policy of routes that match no declaration.
+        :param templates: Optional list of route templates to resolve
+                          right away.
+
+        :raises `talons.exc.BadConfiguration` if a pattern is not valid.
+        """
+        if isinstance(routes, dict):
+            routes = list(routes.items())
+        self.exact = {}
+        self.prefixes = []
+        for pattern, policy in routes:
+            if not pattern.startswith('/'):
+                msg = "Route pattern {0!r} must start with '/'.".format(
+                    pattern)
+                LOG.error(msg)
+                raise exc.BadConfiguration(msg)
+            if pattern.endswith('*'):
+                self.prefixes.append((pattern[:-1], policy))
+            else:
+                self.exact[pattern] = policy
+        self.prefixes.sort(key=lambda p: len(p[0]), reverse=True)
+        self.default = default
+        self.table = {}
+        for template in templates:
+            self.resolve(template)
+
+    def _lookup(self, template):
+        policy = self.exact.get(template, _MISSING)
+        if policy is not _MISSING:
+            return policy
+        for prefix, policy in self.prefixes:
+            if (template.startswith(prefix) or
+                    (prefix.endswith('/') and template == prefix[:-1])):
+                return policy
+        return self.default
+
+    def resolve(self, template):
+        """
+        Returns the policy of the supplied route template.
+        """
+        try:
+            return self.table[template]
+        except KeyError:
+            policy = self.table[template] = self._lookup(template)
+            return policy
+
+
+def build_policies(routes, default, build, **conf):
+    """
+    Returns a (routes, default) tuple in which every policy given as a dict
+    of `talons.auth.middleware.create_middleware` keyword arguments was
+    replaced by build(policy), with conf supplying options the dict does
+    not set. None policies, meaning no authentication at all, and objects
+    that were already built are kept as they are.
+    """
+    def _build(policy):
+        if isinstance(policy, dict):
+            options = dict(conf)
+            options.update(policy)
+            return build(**options)
+        return policy
+
+    if isinstance(routes, dict):
+        routes = list(routes.items())
+    return [(p, _build(policy)) for p, policy in routes], _build(default)
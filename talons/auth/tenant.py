@@ -0,0 +1,416 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+"""
+Routes authentication to one authenticator per tenant, chosen by a
+tenant key taken from a header, the host name or a prefix of the login.
+"""
+
+import inspect
+import logging
+import re
+import threading
+
+import six
+
+from talons import cache
+from talons import exc
+from talons import helpers
+from talons.auth import interfaces
+from talons.auth import parallel
+from talons.auth import plugins
+
+LOG = logging.getLogger(__name__)
+
+HEADER = 'header'
+HOST = 'host'
+LOGIN = 'login'
+
+DEFAULT_HEADER = 'X-Tenant-Id'
+DEFAULT_SEPARATOR = '/'
+
+# Tenant keys are substituted into per-tenant options such as file paths,
+# so only a conservative set of characters is allowed
+_TENANT_RE = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_-]{0,127}$')
+
+# Seconds a tenant whose authenticator failed to be created is unknown,
+# so that a transient error is retried soon
+ERROR_TTL = 5
+
+
+def _tenant_from(conf):
+    source = conf.get('tenant_from', HEADER)
+    if source not in (HEADER, HOST, LOGIN):
+        msg = "tenant_from must be 'header', 'host' or 'login'."
+        LOG.error(msg)
+        raise exc.BadConfiguration(msg)
+    return source
+
+
+def _plugin_list(value, role):
+    if isinstance(value, six.string_types):
+        value = [v.strip() for v in value.split(',') if v.strip()]
+    elif not isinstance(value, (list, tuple)):
+        value = [value]
+    return [plugins.load(v, role) if isinstance(v, six.string_types) else v
+            for v in value]
+
+
+class Identifier(interfaces.Identifies):
+
+    """
+    Runs other identifiers, and adds the tenant key of the request, from a
+    header or the host name, to the identity they find as its `tenant`
+    attribute, for `talons.auth.tenant.Authenticator`.
+    """
+
+    def __init__(self, **conf):
+        """
+        Construct a concrete object with a set of keyword configuration
+        options.
+
+        :param **conf:
+
+            tenant_identify_with: Identifier, or list or comma-separated
+                                  string of identifiers, given as in
+                                  `talons.auth.middleware.create_middleware`,
+                                  that find the identity. (required)
+            tenant_from: 'header' to take the tenant key from the
+                         tenant_header header, 'host' to take it from the
+                         host name, or 'login' to leave it to the
+                         authenticator. (defaults to 'header')
+            tenant_header: Header holding the tenant key. (defaults to
+                           X-Tenant-Id)
+            tenant_host_suffix: Domain that tenant host names end with,
+                                e.g. '.example.com', so that
+                                acme.example.com is tenant acme. Hosts
+                                outside the domain have no tenant.
+                                (defaults to None: the first label of the
+                                host name is the tenant key)
+
+        :raises `talons.exc.BadConfiguration` if configuration options
+                are not valid or conflict with each other.
+        """
+        self.source = _tenant_from(conf)
+        self.env_key = helpers.environ_key(conf.get('tenant_header',
+                                                    DEFAULT_HEADER))
+        self.host_suffix = conf.get('tenant_host_suffix')
+        if self.host_suffix:
+            self.host_suffix = self.host_suffix.lower()
+        identify_with = conf.pop('tenant_identify_with', None)
+        if not identify_with:
+            msg = "Missing required tenant_identify_with configuration option."
+            LOG.error(msg)
+            raise exc.BadConfiguration(msg)
+        self.identifiers = []
+        for i in _plugin_list(identify_with, plugins.IDENTIFIER):
+            if inspect.isclass(i) and issubclass(i, interfaces.Identifies):
+                i = i(**conf)
+            if not isinstance(i, interfaces.Identifies):
+                msg = ("{0} is not a subclass of "
+                       "`talons.auth.interfaces.Identifies`")
+                msg = msg.format(i.__class__.__name__)
+                LOG.error(msg)
+                raise exc.BadConfiguration(msg)
+            self.identifiers.append(i)
+
+    def tenant_of(self, env):
+        """
+        Returns the tenant key of the request with the supplied environ, or
+        None if it has none.
+        """
+        if self.source == HEADER:
+            return env.get(self.env_key) or None
+        if self.source == HOST:
+            host = (env.get('HTTP_HOST') or '').partition(':')[0].lower()
+            if not host:
+                return None
+            if self.host_suffix:
+                if not host.endswith(self.host_suffix):
+                    return None
+                return host[:-len(self.host_suffix)] or None
+            return host.partition('.')[0]
+        return None
+
+    def identify(self, request):
+        for i in self.identifiers:
+            if i.identify(request):
+                break
+        else:
+            return False
+        identity = request.env[self.IDENTITY_ENV_KEY]
+        tenant = self.tenant_of(request.env)
+        if tenant is not None:
+            identity.tenant = tenant
+        return True
+
+
+class Authenticator(interfaces.Authenticates):
+
+    """
+    Authenticates each identity with the authenticator of its tenant, found
+    with one dict lookup however many tenants there are.
+
+    Whatever tenant_from is, the login of an identity with a tenant key is
+    qualified with it once authenticated, e.g. acme/alice, so that the
+    same login in two tenants never shares rate limits, cached
+    authorization decisions, assertions or audit records.
+
+    Tenant authenticators are created the first time their tenant is seen
+    and kept in a `talons.cache.LRUCache`, so that only the
+    tenant_cache_size most recently used tenants stay in memory. Tenants
+    without an authenticator are remembered for a while in a separate,
+    smaller cache, so that requests for them do not try to create one
+    every time, and requests for random tenant keys cannot evict the
+    authenticators of real tenants.
+    """
+
+    def __init__(self, **conf):
+        """
+        Construct a concrete object with a set of keyword configuration
+        options.
+
+        :param **conf:
+
+            tenant_from: 'header' or 'host' to use the tenant key that
+                         `talons.auth.tenant.Identifier`, or e.g. the
+                         httpheader_tenant option of
+                         `talons.auth.httpheader.Identifier`, stored in
+                         the identity's tenant attribute, or 'login' to
+                         take it from the login, e.g. acme/alice.
+                         (defaults to 'header')
+            tenant_login_separator: Separator of the tenant key and the
+                                    login the tenant's authenticator sees.
+                                    (defaults to '/')
+            tenant_authenticator: Authenticator class, plugin name or
+                                  dotted class path, created for each
+                                  tenant with these configuration options,
+                                  in whose string values '{tenant}' is
+                                  replaced by the tenant key, e.g.
+                                  htpasswd_path='/etc/talons/{tenant}.htpasswd'.
+                                  Tenants whose authenticator cannot be
+                                  created, e.g. because the file does not
+                                  exist, are unknown.
+            tenant_factory: Callable, or string in dotted-notation
+                            module.function, that is passed a tenant key
+                            and returns its authenticator, or None if the
+                            tenant is unknown. Used instead of
+                            tenant_authenticator.
+            tenant_cache_size: Number of tenants whose authenticator is
+                               kept. (defaults to 1000)
+            tenant_ttl: Seconds after which a tenant's authenticator is
+                        created again, e.g. to see new tenants. (defaults
+                        to None, until evicted)
+            tenant_unknown_cache_size: Number of unknown tenants
+                                       remembered. (defaults to 100)
+            tenant_unknown_ttl: Seconds an unknown tenant is remembered,
+                                after which creating its authenticator is
+                                tried again. Tenants whose authenticator
+                                failed with an unexpected error are only
+                                remembered for ERROR_TTL seconds.
+                                (defaults to 60)
+            tenant_sets_roles: Boolean of whether the tenant
+                               authenticators set roles. (defaults to
+                               False)
+            tenant_sets_groups: Boolean of whether the tenant
+                                authenticators set groups. (defaults to
+                                False)
+
+        :raises `talons.exc.BadConfiguration` if configuration options
+                are not valid or conflict with each other.
+        """
+        self.source = _tenant_from(conf)
+        self.separator = conf.pop('tenant_login_separator', DEFAULT_SEPARATOR)
+        self._sets_roles = conf.pop('tenant_sets_roles', False)
+        self._sets_groups = conf.pop('tenant_sets_groups', False)
+        factory = conf.pop('tenant_factory', None)
+        authenticator = conf.pop('tenant_authenticator', None)
+        if (factory is None) == (authenticator is None):
+            msg = ("Exactly one of the tenant_authenticator and "
+                   "tenant_factory configuration options is required.")
+            LOG.error(msg)
+            raise exc.BadConfiguration(msg)
+        if factory is not None and not callable(factory):
+            try:
+                factory = helpers.import_function(factory)
+            except (TypeError, ImportError):
+                msg = ("tenant_factory either could not be found or was "
+                       "not callable.")
+                LOG.error(msg)
+                raise exc.BadConfiguration(msg)
+        if authenticator is not None:
+            if isinstance(authenticator, six.string_types):
+                authenticator = plugins.load(authenticator,
+                                             plugins.AUTHENTICATOR)
+            if not (inspect.isclass(authenticator) and
+                    issubclass(authenticator, interfaces.Authenticates)):
+                msg = ("tenant_authenticator must be a subclass of "
+                       "`talons.auth.interfaces.Authenticates`.")
+                LOG.error(msg)
+                raise exc.BadConfiguration(msg)
+            factory = self._plugin_factory(authenticator, conf)
+        self.factory = factory
+        try:
+            cache_size = int(conf.pop('tenant_cache_size', 1000))
+            unknown_size = int(conf.pop('tenant_unknown_cache_size', 100))
+            ttl = conf.pop('tenant_ttl', None)
+            ttl = float(ttl) if ttl else None
+            unknown_ttl = float(conf.pop('tenant_unknown_ttl', 60))
+        except (TypeError, ValueError):
+            cache_size = 0
+        if cache_size < 1 or unknown_size < 1 or unknown_ttl <= 0:
+            msg = ("tenant_cache_size and tenant_unknown_cache_size must be "
+                   "positive integers, tenant_ttl a number and "
+                   "tenant_unknown_ttl a positive number.")
+            LOG.error(msg)
+            raise exc.BadConfiguration(msg)
+        self.tenants = cache.LRUCache(cache_size, name='tenant', ttl=ttl)
+        self.unknown = cache.LRUCache(unknown_size, name='tenant_unknown',
+                                      ttl=unknown_ttl)
+        # Guards _locks, which maps the tenants whose authenticator is
+        # being created to a lock that the threads wanting it wait on
+        self._lock = threading.Lock()
+        self._locks = {}
+
+    @staticmethod
+    def _plugin_factory(cls, conf):
+        def create(tenant):
+            tenant_conf = dict(
+                (k, v.replace('{tenant}', tenant)
+                 if isinstance(v, six.string_types) else v)
+                for k, v in conf.items())
+            return cls(**tenant_conf)
+        return create
+
+    def split(self, identity):
+        """
+        Returns a (tenant, login) tuple of the tenant key of the identity and
+        the login its tenant's authenticator sees, or (None, None) if the
+        identity has no valid tenant key.
+        """
+        if self.source == LOGIN:
+            tenant, sep, login = identity.login.partition(self.separator)
+            if not sep or not login:
+                return None, None
+        else:
+            tenant = getattr(identity, 'tenant', None)
+            login = identity.login
+        if not tenant or not _TENANT_RE.match(tenant):
+            return None, None
+        return tenant, login
+
+    def authenticator_for(self, tenant):
+        """
+        Returns the authenticator of the tenant, creating it if it is not
+        cached, or None if the tenant is unknown.
+        """
+        a = self.tenants.get(tenant)
+        if a is not None or self.unknown.get(tenant):
+            return a
+        # Only threads wanting the same tenant wait for each other, so
+        # that a slow tenant does not hold up the others
+        with self._lock:
+            lock = self._locks.setdefault(tenant, threading.Lock())
+        with lock:
+            try:
+                # Another thread may have created it while we waited
+                a = self.tenants.get(tenant)
+                if a is None and not self.unknown.get(tenant):
+                    a = self._create(tenant)
+            finally:
+                with self._lock:
+                    if self._locks.get(tenant) is lock:
+                        del self._locks[tenant]
+        return a
+
+    def _create(self, tenant):
+        """
+        Creates and caches the authenticator of the tenant and returns it,
+        or remembers the tenant as unknown and returns None.
+        """
+        try:
+            a = self.factory(tenant)
+        except exc.BadConfiguration as err:
+            LOG.info("No authenticator for tenant {0}: {1}".format(tenant,
+                                                                   err))
+            a = None
+        except Exception:
+            LOG.exception("Failed to create the authenticator of tenant "
+                          "{0}".format(tenant))
+            self.unknown.set(tenant, True, ttl=ERROR_TTL)
+            return None
+        if a is None:
+            self.unknown.set(tenant, True)
+            return None
+        self.tenants.set(tenant, a)
+        return a
+
+    def authenticate(self, identity):
+        """
+        Looks at the supplied identity object and returns True if the
+        authenticator of its tenant verified it, False otherwise. The
+        identity's tenant attribute is set to its tenant key, and its login
+        is qualified with the tenant key.
+        """
+        tenant, login = self.split(identity)
+        if tenant is None:
+            return False
+        a = self.authenticator_for(tenant)
+        if a is None:
+            return False
+        if login == identity.login:
+            ok = a.authenticate(identity)
+        else:
+            # The tenant's authenticator sees the login without the tenant
+            # key
+            c = parallel.copy_identity(identity)
+            c.login = login
+            ok = a.authenticate(c)
+            if ok:
+                identity.__dict__.update(c.__dict__)
+        identity.login = tenant + self.separator + login
+        if ok:
+            identity.tenant = tenant
+        return ok
+
+    def is_expensive(self, identity):
+        tenant, login = self.split(identity)
+        if tenant is None:
+            return False
+        a = self.tenants.get(tenant)
+        if a is None:
+            # Creating the authenticator may read files or connect
+            return not self.unknown.get(tenant)
+        if login == identity.login:
+            return a.is_expensive(identity)
+        c = parallel.copy_identity(identity)
+        c.login = login
+        return a.is_expensive(c)
+
+    def sets_roles(self):
+        """
+        Returns True if the authenticator plugin decorates the Identity
+        object with a set of roles, False otherwise.
+        """
+        return self._sets_roles
+
+    def sets_groups(self):
+        """
+        Returns True if the authenticator plugin decorates the Identity
+        object with a set of groups, False otherwise.
+        """
+        return self._sets_groups
@@ -0,0 +1,128 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+
+from talons import helpers
+from talons.auth import middleware
+
+
+class Request(object):
+
+    """
+    Minimal stand-in for `falcon.request.Request` that exposes only what
+    identifiers, authenticators and `talons.auth.interfaces.ResourceAction`
+    use, read directly from the WSGI environ.
+    """
+
+    __slots__ = ('env',)
+
+    def __init__(self, env):
+        self.env = env
+
+    @property
+    def method(self):
+        return self.env['REQUEST_METHOD']
+
+    @property
+    def auth(self):
+        return self.env.get('HTTP_AUTHORIZATION')
+
+    def get_header(self, name):
+        return self.env.get(helpers.environ_key(name))
+
+
+def _error_response(status, title, description):
+    body = json.dumps({'title': title, 'description': description})
+    body = body.encode('utf-8')
+    headers = [('Content-Type', 'application/json'),
+               ('Content-Length', str(len(body)))]
+    return status, headers, body
+
+
+class AuthMiddleware(object):
+
+    """
+    Plain WSGI middleware that runs the identify, authenticate and authorize
+    chain of a `talons.auth.middleware.Middleware` directly against the WSGI
+    environ, in front of any WSGI application.
+
+    No framework request or response objects are built. Rejected requests
+    get a 401 or 403 response whose status, headers and body were built
+    when the middleware was constructed.
+    """
+
+    def __init__(self, app, auth_middleware):
+        """
+        :param app: The WSGI application to call for accepted requests.
+        :param auth_middleware: A `talons.auth.middleware.Middleware` object.
+        """
+        self.app = app
+        self.auth_middleware = auth_middleware
+        self.responses = {
+            middleware.NO_IDENTITY: _error_response(
+                '401 Unauthorized', 'Authentication required',
+                'No identity information found.'),
+            middleware.AUTHENTICATE_FAILED: _error_response(
+                '401 Unauthorized', 'Authentication required',
+                'Authentication failed.'),
+            middleware.FORBIDDEN: _error_response(
+                '403 Forbidden', 'Action not allowed',
+                'The action on that resource is not allowed.'),
+            middleware.RATE_LIMITED: _error_response(
+                '429 Too Many Requests', 'Too many requests',
+                'The request rate limit was exceeded.'),
+        }
+        status, headers, body = _error_response(
+            '503 Service Unavailable', 'Service unavailable',
+            'Too many credentials are waiting to be verified.')
+        headers.append(('Retry-After',
+                        str(auth_middleware.admission_retry_after)))
+        self.responses[middleware.OVERLOADED] = status, headers, body
+
+    def __call__(self, environ, start_response):
+        outcome = self.auth_middleware.process(Request(environ), {})
+        if outcome is None:
+            return self.app(environ, start_response)
+
+        status, headers, body = self.responses[outcome]
+        if outcome is middleware.RATE_LIMITED:
+            from talons.auth import ratelimit
+            retry_after = environ.get(ratelimit.RETRY_AFTER_ENV_KEY, 1)
+            headers = headers + [('Retry-After', str(retry_after))]
+        elif outcome in (middleware.NO_IDENTITY,
+                         middleware.AUTHENTICATE_FAILED):
+            challenge = self.auth_middleware.challenge_headers()
+            if challenge is not None:
+                headers = headers + list(challenge.items())
+        start_response(status, list(headers))
+        return [body]
+
+
+def create_wsgi_middleware(app, identify_with, authenticate_with,
+                           authorize_with=None, **conf):
+    """
+    Helper method to wrap a WSGI application in authentication middleware.
+    Takes the same arguments as `talons.auth.middleware.create_middleware`,
+    plus the WSGI application to wrap.
+
+    :raises `talons.exc.BadConfiguration` if the identifiers or authenticators
+            lists are empty or don't make sense.
+    """
+    auth_middleware = middleware.create_middleware(identify_with,
+                                                   authenticate_with,
+                                                   authorize_with, **conf)
+    return AuthMiddleware(app, auth_middleware)
@@ -0,0 +1,315 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import collections
+import hashlib
+import hmac
+import json
+import logging
+import threading
+import time
+import weakref
+
+from talons import exc
+
+LOG = logging.getLogger(__name__)
+
+# Caches created with a name, so that their hit and miss counts can be
+# reported, e.g. by `talons.metrics`.
+_NAMED_CACHES = weakref.WeakSet()
+
+# Names of the configuration options read by `create_cache`
+OPTIONS = ('cache_backend', 'cache_ttl', 'cache_secret', 'cache_shm_path',
+           'cache_shm_slots', 'cache_shm_slot_size',
+           'cache_memcached_server', 'cache_memcached_pool_size',
+           'cache_memcached_timeout')
+
+
+def named_caches():
+    """
+    Returns a list of (name, cache) tuples for all live named caches.
+    """
+    return [(c.name, c) for c in list(_NAMED_CACHES)]
+
+
+def register(c):
+    """
+    Lists the supplied cache object, which must have name, hits and misses
+    attributes, in `named_caches()`.
+    """
+    _NAMED_CACHES.add(c)
+
+
+def _json_default(value):
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    raise TypeError("{0!r} cannot be stored in a shared cache".format(value))
+
+
+def dumps(value):
+    """
+    Returns the JSON encoding, as bytes, of a value stored in a cache that
+    is shared between processes. Sets are stored as sorted lists.
+    """
+    return json.dumps(value, default=_json_default,
+                      separators=(',', ':')).encode('utf-8')
+
+
+def key_digest(key, secret):
+    """
+    Returns the HMAC-SHA256 digest of the repr of a cache key, keyed with
+    the supplied secret. Shared caches store digests so that keys, which
+    may contain passwords, never leave the process, and key them so that
+    whoever can write to the cache but does not know the secret cannot
+    compute the key of an entry.
+
+    :raises ValueError if there is no secret.
+    """
+    if not secret:
+        raise ValueError("Cache key digests require a secret.")
+    if not isinstance(secret, bytes):
+        secret = secret.encode('utf-8')
+    return hmac.new(secret, repr(key).encode('utf-8'),
+                    hashlib.sha256).digest()
+
+
+def create_cache(name, maxsize=1024, **conf):
+    """
+    Returns the cache backend a plugin should use, given the configuration
+    options shared by all plugins:
+
+        cache_backend: One of 'memory', for a `LRUCache` in each process,
+                       'shm', for a `talons.shmcache.SharedMemoryCache`
+                       shared by all processes on the host, or 'memcached',
+                       for a `talons.memcache.MemcacheBackend`. May also be
+                       a callable that is passed the cache name and maxsize
+                       and returns a `Backend`. (defaults to 'shm' if
+                       cache_shm_path is set, 'memory' otherwise)
+        cache_ttl: Number of seconds entries stay valid. (defaults to None,
+                   until evicted)
+        cache_secret: Secret used to key the digests of the keys of shared
+                      caches, the same for all processes sharing them.
+                      Required by the 'shm' and 'memcached' backends.
+        cache_shm_path: Path of the memory-mapped file of the 'shm'
+                        backend, the same for all worker processes.
+        cache_shm_slots: Number of entries in the shared file, for all
+                         caches together. (defaults to 65536)
+        cache_shm_slot_size: Size, in bytes, of each entry. (defaults to
+                             128)
+        cache_memcached_server: 'host:port' of the memcached server of the
+                                'memcached' backend. (defaults to
+                                127.0.0.1:11211)
+        cache_memcached_pool_size: Maximum number of connections to the
+                                   memcached server. (defaults to 4)
+        cache_memcached_timeout: Socket timeout, in seconds. (defaults to
+                                 0.5)
+
+    :param name: Name of the cache, e.g. 'htpasswd'.
+    :param maxsize: Size of the cache if it is kept in process.
+
+    :raises `talons.exc.BadConfiguration` if configuration options
+            are not valid.
+    """
+    backend = conf.get('cache_backend')
+    if backend is None:
+        backend = 'shm' if conf.get('cache_shm_path') else 'memory'
+    if callable(backend):
+        return backend(name, maxsize)
+    ttl = conf.get('cache_ttl')
+    ttl = float(ttl) if ttl else None
+    if backend == 'memory':
+        return LRUCache(maxsize, name=name, ttl=ttl)
+    if backend == 'shm':
+        from talons import shmcache
+        path = conf.get('cache_shm_path')
+        if not path:
+            msg = "The shm cache backend requires cache_shm_path."
+            LOG.error(msg)
+            raise exc.BadConfiguration(msg)
+        return shmcache.SharedMemoryCache(
+            path, name, ttl=ttl, secret=conf.get('cache_secret'),
+            slots=int(conf.get('cache_shm_slots', shmcache.DEFAULT_SLOTS)),
+            slot_size=int(conf.get('cache_shm_slot_size',
+                                   shmcache.DEFAULT_SLOT_SIZE)))
+    if backend == 'memcached':
+        from talons import memcache
+        return memcache.MemcacheBackend(
+            conf.get('cache_memcached_server', memcache.DEFAULT_SERVER),
+            name, ttl=ttl, secret=conf.get('cache_secret'),
+            pool_size=int(conf.get('cache_memcached_pool_size', 4)),
+            timeout=float(conf.get('cache_memcached_timeout', 0.5)))
+    msg = "Unknown cache_backend {0!r}.".format(backend)
+    LOG.error(msg)
+    raise exc.BadConfiguration(msg)
+
+
+class Backend(object):
+
+    """
+    Base class for cache backends. Values are cached by key until they
+    expire or are evicted. Backends that are shared between processes
+    store JSON-serializable values only.
+
+    Every backend has name, hits and misses attributes, so that its
+    effectiveness can be reported.
+    """
+
+    name = None
+    hits = 0
+    misses = 0
+
+    def get(self, key, default=None):
+        """
+        Returns the value stored for the supplied key, or the default if
+        there is none.
+        """
+        raise NotImplementedError  # pragma: NO COVER
+
+    def get_many(self, keys):
+        """
+        Returns a dict of the supplied keys that have a value to their
+        value.
+        """
+        result = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                result[key] = value
+        return result
+
+    def set(self, key, value, ttl=None):
+        """
+        Stores the value for the key, for ttl seconds if supplied, or for
+        the backend's default time otherwise.
+        """
+        raise NotImplementedError  # pragma: NO COVER
+
+    def add(self, key, value, ttl=None):
+        """
+        Stores the value for the key only if the key has no value yet.
+        Returns True if the value was stored, False otherwise. The check
+        and the store happen atomically.
+        """
+        raise NotImplementedError  # pragma: NO COVER
+
+    def delete(self, key):
+        """
+        Removes the value of the supplied key, if any.
+        """
+        raise NotImplementedError  # pragma: NO COVER
+
+    def clear(self):
+        """
+        Removes all values from the cache.
+        """
+        raise NotImplementedError  # pragma: NO COVER
+
+
+class LRUCache(Backend):
+
+    """
+    Simple thread-safe, size-bounded mapping that evicts the least recently
+    used entry once `maxsize` entries are stored. Keeps a count of hits and
+    misses so that callers can report cache effectiveness.
+
+    If a name is supplied, the cache is listed by `named_caches()`.
+    """
+
+    def __init__(self, maxsize=1024, name=None, ttl=None):
+        self.maxsize = maxsize
+        self.name = name
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+        if name is not None:
+            register(self)
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        """
+        Returns the value stored for the supplied key, or the default if
+        the key is not in the cache.
+        """
+        with self._lock:
+            try:
+                value, expires = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and expires <= time.time():
+                self.misses += 1
+                return default
+            self._data[key] = value, expires
+            self.hits += 1
+            return value
+
+    def _expires(self, ttl):
+        ttl = self.ttl if ttl is None else ttl
+        if not ttl:
+            return None
+        return time.time() + ttl
+
+    def _store(self, key, value, expires):
+        self._data[key] = value, expires
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def set(self, key, value, ttl=None):
+        """
+        Stores the supplied value for the key, evicting the least recently
+        used entry if the cache is full.
+        """
+        expires = self._expires(ttl)
+        with self._lock:
+            self._data.pop(key, None)
+            self._store(key, value, expires)
+
+    def add(self, key, value, ttl=None):
+        expires = self._expires(ttl)
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and (entry[1] is None or
+                                      entry[1] > time.time()):
+                return False
+            self._data.pop(key, None)
+            self._store(key, value, expires)
+            return True
+
+    def delete(self, key):
+        """
+        Removes the supplied key from the cache, if present.
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def items(self):
+        """
+        Returns a list of (key, value, expires) tuples of the unexpired
+        entries, least recently used first. expires is None for entries
+        that never expire.
+        """
+        now = time.time()
+        with self._lock:
+            return [(k, v, e) for k, (v, e) in self._data.items()
+                    if e is None or e > now]
@@ -20,6 +20,9 @@ import traceback
 
 LOG = logging.getLogger(__name__)
 
+# Headers that PEP 3333 does not prefix with HTTP_ in the WSGI environ
+_UNPREFIXED_HEADERS = ('CONTENT_TYPE', 'CONTENT_LENGTH')
+
 
 def import_function(import_str):
     """
@@ -49,3 +52,14 @@ def import_function(import_str):
         LOG.error(msg + ' Details: (%s)'.format(err_details))
         raise
     return fn
+
+
+def environ_key(header):
+    """
+    Returns the WSGI environ key that holds the value of the supplied HTTP
+    header, e.g. 'X-Auth-User' -> 'HTTP_X_AUTH_USER'.
+    """
+    key = header.upper().replace('-', '_')
+    if key in _UNPREFIXED_HEADERS:
+        return key
+    return 'HTTP_' + key
@@ -0,0 +1,395 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+"""
+Cache backend that stores entries in a memcached server, or any server that
+speaks the memcached text protocol, so that all hosts running talons share
+verified credentials and authorization decisions.
+"""
+
+import binascii
+import hashlib
+import hmac
+import json
+import logging
+import math
+import socket
+import threading
+import time
+
+from talons import cache
+from talons import exc
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_SERVER = '127.0.0.1:11211'
+
+# Maximum number of keys in a single get command of a batch
+BATCH_SIZE = 100
+
+# Number of seconds a cache's namespace generation is trusted before it is
+# read from the server again. A `MemcacheBackend.clear()` in another
+# process is seen by this process within this time.
+GENERATION_INTERVAL = 1.0
+
+# Number of seconds the server is left alone after it could not be reached,
+# so that an outage doesn't add the connect timeout to every request
+RETRY_INTERVAL = 1.0
+
+# Length of the HMAC-SHA256 that precedes every stored value
+MAC_SIZE = 32
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def parse_server(server):
+    """
+    Returns a (host, port) tuple for a 'host:port' string.
+
+    :raises ValueError if the string is not a valid address.
+    """
+    host, sep, port = server.rpartition(':')
+    if not sep or not host:
+        raise ValueError("Expected host:port, got {0!r}".format(server))
+    return host.strip('[]'), int(port)
+
+
+class Connection(object):
+
+    """
+    Socket connected to the server, with a buffered reader for replies.
+    """
+
+    def __init__(self, address, timeout):
+        self.sock = socket.create_connection(address, timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile('rb')
+
+    def send(self, data):
+        self.sock.sendall(data)
+
+    def readline(self):
+        line = self.reader.readline()
+        if not line.endswith(b'\r\n'):
+            raise ProtocolError("Connection closed by server")
+        return line[:-2]
+
+    def read_value(self, length):
+        data = self.reader.read(length + 2)
+        if len(data) != length + 2 or not data.endswith(b'\r\n'):
+            raise ProtocolError("Truncated value")
+        return data[:-2]
+
+    def close(self):
+        try:
+            self.reader.close()
+            self.sock.close()
+        except (IOError, OSError):  # pragma: NO COVER
+            pass
+
+
+class ConnectionPool(object):
+
+    """
+    Keeps up to `size` idle connections to the server, so that requests
+    don't pay for a TCP handshake. A connection is only returned to the
+    pool after a complete exchange, so a connection is never shared by two
+    requests and never holds an unread reply.
+    """
+
+    def __init__(self, address, size=4, timeout=0.5):
+        self.address = address
+        self.size = size
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return Connection(self.address, self.timeout)
+
+    def release(self, conn):
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+class MemcacheBackend(cache.Backend):
+
+    """
+    `talons.cache.Backend` whose entries live in a memcached server.
+
+    Keys are stored as HMAC-SHA256 digests keyed with the cache secret,
+    under a namespace made of the cache name and a generation number, so
+    that `clear()` only has to increment the generation. Every value is
+    stored after an HMAC-SHA256 of itself and its server key, so that
+    other clients of the server can neither plant entries nor overwrite
+    existing ones; a value whose MAC does not match is a miss. Values
+    must be JSON-serializable. Tuples and sets come back as lists.
+
+    The server is a cache and never a dependency: if it cannot be reached
+    or replies with an error, reads are misses and writes are dropped.
+    Once it could not be reached, it is not contacted again for
+    RETRY_INTERVAL seconds.
+    """
+
+    def __init__(self, server, name, ttl=None, secret=None, pool_size=4,
+                 timeout=0.5, prefix='talons:'):
+        """
+        :param server: 'host:port' of the server.
+        :param name: Name of the cache.
+        :param ttl: Optional number of seconds entries stay valid.
+        :param secret: Secret the key digests are keyed with. (required)
+        :param pool_size: Maximum number of idle connections kept open.
+        :param timeout: Socket timeout, in seconds.
+        :param prefix: Prefix of all keys stored by talons.
+
+        :raises `talons.exc.BadConfiguration` if there is no secret.
+        """
+        if not secret:
+            msg = "The memcached cache backend requires cache_secret."
+            LOG.error(msg)
+            raise exc.BadConfiguration(msg)
+        self.pool = ConnectionPool(parse_server(server), pool_size, timeout)
+        self.name = name
+        self.ttl = ttl
+        self.secret = secret
+        self._mac_key = (secret if isinstance(secret, bytes)
+                         else secret.encode('utf-8'))
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self._retry_at = 0
+        self._generation = None
+        self._generation_read = 0
+        self._generation_key = '{0}{1}:gen'.format(prefix, name)
+        cache.register(self)
+
+    def _call(self, fn, fallback):
+        """
+        Runs fn with a pooled connection and returns its result, or returns
+        fallback if the server cannot be reached or misbehaves, or could
+        not be reached less than RETRY_INTERVAL seconds ago.
+        """
+        if self._retry_at and time.time() < self._retry_at:
+            return fallback
+        try:
+            conn = self.pool.acquire()
+        except (IOError, OSError) as err:
+            LOG.debug("Unable to connect to memcached server {0}: "
+                      "{1}".format(self.pool.address, err))
+            self._retry_at = time.time() + RETRY_INTERVAL
+            return fallback
+        try:
+            result = fn(conn)
+        except (IOError, OSError, ProtocolError, ValueError) as err:
+            LOG.debug("memcached cache {0} failed: {1}".format(self.name,
+                                                               err))
+            conn.close()
+            if isinstance(err, (IOError, OSError)):
+                # Timed out or disconnected
+                self._retry_at = time.time() + RETRY_INTERVAL
+            return fallback
+        self._retry_at = 0
+        self.pool.release(conn)
+        return result
+
+    @staticmethod
+    def _exptime(ttl):
+        if not ttl:
+            return 0
+        return max(1, int(math.ceil(ttl)))
+
+    def _store(self, conn, command, key, data, ttl):
+        conn.send(b''.join([
+            '{0} {1} 0 {2} {3}\r\n'.format(
+                command, key, self._exptime(ttl), len(data)).encode('ascii'),
+            data, b'\r\n']))
+        reply = conn.readline()
+        if reply not in (b'STORED', b'NOT_STORED'):
+            raise ProtocolError(reply)
+        return reply == b'STORED'
+
+    def _read_values(self, conn):
+        values = {}
+        while True:
+            line = conn.readline()
+            if line == b'END':
+                return values
+            parts = line.split()
+            if len(parts) < 4 or parts[0] != b'VALUE':
+                raise ProtocolError(line)
+            values[parts[1].decode('ascii')] = conn.read_value(int(parts[3]))
+
+    def generation(self):
+        """
+        Returns the namespace generation of the cache, reading it from the
+        server at most once every GENERATION_INTERVAL seconds.
+        """
+        now = time.time()
+        if (self._generation is not None and
+                now - self._generation_read < GENERATION_INTERVAL):
+            return self._generation
+
+        def _read(conn):
+            key = self._generation_key
+            conn.send('get {0}\r\n'.format(key).encode('ascii'))
+            value = self._read_values(conn).get(key)
+            if value is None:
+                # Start from the clock, so that a generation evicted by the
+                # server doesn't bring back entries of an older one.
+                value = str(int(now)).encode('ascii')
+                if not self._store(conn, 'add', key, value, None):
+                    conn.send('get {0}\r\n'.format(key).encode('ascii'))
+                    value = self._read_values(conn).get(key, value)
+            return int(value)
+
+        generation = self._call(_read, None)
+        if generation is not None:
+            self._generation = generation
+            self._generation_read = now
+        return self._generation
+
+    def server_key(self, key, generation):
+        digest = binascii.hexlify(cache.key_digest(key, self.secret))
+        return '{0}{1}:{2}:{3}'.format(self.prefix, self.name, generation,
+                                       digest.decode('ascii'))
+
+    def _mac(self, name, data):
+        return hmac.new(self._mac_key, name.encode('ascii') + b'\n' + data,
+                        hashlib.sha256).digest()
+
+    def seal(self, name, data):
+        """
+        Returns the bytes stored for the encoded value of a server key.
+        """
+        return self._mac(name, data) + data
+
+    def unseal(self, name, stored):
+        """
+        Returns the encoded value in the bytes stored for a server key, or
+        None if they were not written with the cache secret for that key.
+        """
+        mac, data = stored[:MAC_SIZE], stored[MAC_SIZE:]
+        if not hmac.compare_digest(mac, self._mac(name, data)):
+            LOG.warning("Ignoring an entry of memcached cache {0} with an "
+                        "invalid MAC.".format(self.name))
+            return None
+        return data
+
+    def get(self, key, default=None):
+        return self.get_many([key]).get(key, default)
+
+    def get_many(self, keys):
+        """
+        Returns a dict of the supplied keys that have a value to their
+        value. Keys are sent in get commands of up to BATCH_SIZE keys each,
+        and all commands are sent before any reply is read, so the whole
+        batch costs a single round trip.
+        """
+        keys = list(keys)
+        generation = self.generation()
+        if generation is None:
+            self.misses += len(keys)
+            return {}
+        server_keys = dict((self.server_key(k, generation), k) for k in keys)
+        names = list(server_keys)
+        batches = [names[x:x + BATCH_SIZE]
+                   for x in range(0, len(names), BATCH_SIZE)]
+
+        def _get(conn):
+            conn.send(b''.join('get {0}\r\n'.format(' '.join(b)).encode(
+                'ascii') for b in batches))
+            values = {}
+            for _b in batches:
+                values.update(self._read_values(conn))
+            return values
+
+        result = {}
+        for name, stored in self._call(_get, {}).items():
+            if name not in server_keys:
+                continue
+            data = self.unseal(name, stored)
+            if data is not None:
+                result[server_keys[name]] = json.loads(data.decode('utf-8'))
+        self.hits += len(result)
+        self.misses += len(keys) - len(result)
+        return result
+
+    def _write(self, command, key, value, ttl):
+        generation = self.generation()
+        if generation is None:
+            return False
+        ttl = self.ttl if ttl is None else ttl
+        name = self.server_key(key, generation)
+        data = self.seal(name, cache.dumps(value))
+        return self._call(
+            lambda conn: self._store(conn, command, name, data, ttl), False)
+
+    def set(self, key, value, ttl=None):
+        self._write('set', key, value, ttl)
+
+    def add(self, key, value, ttl=None):
+        return self._write('add', key, value, ttl)
+
+    def delete(self, key):
+        generation = self.generation()
+        if generation is None:
+            return
+
+        def _delete(conn):
+            conn.send('delete {0}\r\n'.format(
+                self.server_key(key, generation)).encode('ascii'))
+            reply = conn.readline()
+            if reply not in (b'DELETED', b'NOT_FOUND'):
+                raise ProtocolError(reply)
+
+        self._call(_delete, None)
+
+    def clear(self):
+        """
+        Moves the cache to a new namespace generation. Entries of older
+        generations are never read again and are left to expire or be
+        evicted by the server.
+        """
+        def _incr(conn):
+            key = self._generation_key
+            conn.send('incr {0} 1\r\n'.format(key).encode('ascii'))
+            reply = conn.readline()
+            if reply == b'NOT_FOUND':
+                value = max(int(time.time()), (self._generation or 0) + 1)
+                value = str(value).encode('ascii')
+                self._store(conn, 'set', key, value, None)
+                return int(value)
+            return int(reply)
+
+        generation = self._call(_incr, None)
+        if generation is not None:
+            self._generation = generation
+            self._generation_read = time.time()
@@ -0,0 +1,414 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+Exposes the statistics recorded in a `talons.stats.InMemorySink` in the
+Prometheus text exposition format.
+"""
+
+import errno
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+
+try:
+    import fcntl
+except ImportError:  # pragma: NO COVER
+    fcntl = None
+
+from talons import cache
+from talons import exc
+from talons import stats
+
+LOG = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+PREFIX = 'talons'
+
+_INVALID_NAME_CHARS = re.compile(r'[^a-zA-Z0-9_]')
+
+
+def _metric_name(*parts):
+    return _INVALID_NAME_CHARS.sub('_', '_'.join((PREFIX,) + parts))
+
+
+def _label_value(value):
+    value = value.replace('\\', '\\\\').replace('"', '\\"')
+    return value.replace('\n', '\\n')
+
+
+def _family(name):
+    """
+    Splits a dotted statistic name into a (family, label) tuple. Names with
+    more than two parts keep their first and last part in the family and
+    the parts in between become the 'name' label, so that
+    'plugin.htpasswd.Authenticator.calls' becomes
+    ('plugin_calls', 'htpasswd.Authenticator').
+    """
+    parts = name.split('.')
+    if len(parts) <= 2:
+        return '_'.join(parts), None
+    return parts[0] + '_' + parts[-1], '.'.join(parts[1:-1])
+
+
+def _histogram_family(name):
+    """
+    Splits a dotted histogram name into a (family, label) tuple, so that
+    'stage.identify' becomes ('stage', 'identify').
+    """
+    family, _sep, label = name.partition('.')
+    return family, label or None
+
+
+def _labels(label, extra=None):
+    pairs = []
+    if label is not None:
+        pairs.append('name="{0}"'.format(_label_value(label)))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def cache_counters():
+    """
+    Returns a dict of 'cache.<name>.hits' and 'cache.<name>.misses'
+    counters for all named `talons.cache.LRUCache` objects in this process.
+    Caches sharing a name are added together.
+    """
+    counters = {}
+    for name, c in cache.named_caches():
+        for kind, value in (('hits', c.hits), ('misses', c.misses)):
+            key = 'cache.{0}.{1}'.format(name, kind)
+            counters[key] = counters.get(key, 0) + value
+    return counters
+
+
+def collect(sink):
+    """
+    Returns a (counters, histograms) tuple with the statistics recorded in
+    the supplied `talons.stats.InMemorySink` and the counters of the named
+    caches of this process.
+    """
+    counters, histograms = sink.snapshot()
+    for name, value in cache_counters().items():
+        counters[name] = counters.get(name, 0) + value
+    return counters, histograms
+
+
+def render(counters, histograms):
+    """
+    Returns the supplied counters and histograms as a string in the
+    Prometheus text exposition format. A hit ratio gauge is added for every
+    cache that has hit and miss counters.
+    """
+    families = {}
+    for name, value in counters.items():
+        family, label = _family(name)
+        families.setdefault(_metric_name(family, 'total'), []).append(
+            (label, value))
+
+    ratios = []
+    for name in counters:
+        parts = name.split('.')
+        if len(parts) < 3 or parts[0] != 'cache' or parts[-1] != 'hits':
+            continue
+        label = '.'.join(parts[1:-1])
+        hits = counters[name]
+        total = hits + counters.get('cache.{0}.misses'.format(label), 0)
+        if total:
+            ratios.append((label, float(hits) / total))
+
+    lines = []
+    for metric in sorted(families):
+        lines.append('# TYPE {0} counter'.format(metric))
+        for label, value in sorted(families[metric],
+                                   key=lambda x: x[0] or ''):
+            lines.append('{0}{1} {2}'.format(metric, _labels(label),
+                                             _format_value(value)))
+
+    if ratios:
+        metric = _metric_name('cache', 'hit_ratio')
+        lines.append('# TYPE {0} gauge'.format(metric))
+        for label, ratio in sorted(ratios):
+            lines.append('{0}{1} {2}'.format(metric, _labels(label),
+                                             _format_value(ratio)))
+
+    hist_families = {}
+    for name, h in histograms.items():
+        family, label = _histogram_family(name)
+        hist_families.setdefault(_metric_name(family, 'seconds'), []).append(
+            (label, h))
+
+    for metric in sorted(hist_families):
+        lines.append('# TYPE {0} histogram'.format(metric))
+        for label, h in sorted(hist_families[metric],
+                               key=lambda x: x[0] or ''):
+            cumulative = 0
+            for bound, count in zip(h.bounds, h.counts):
+                cumulative += count
+                le = 'le="{0}"'.format(_format_value(bound))
+                lines.append('{0}_bucket{1} {2}'.format(
+                    metric, _labels(label, le), cumulative))
+            if h.bounds[-1] != float('inf'):
+                lines.append('{0}_bucket{1} {2}'.format(
+                    metric, _labels(label, 'le="+Inf"'), h.count))
+            lines.append('{0}_sum{1} {2}'.format(metric, _labels(label),
+                                                 _format_value(h.sum)))
+            lines.append('{0}_count{1} {2}'.format(metric, _labels(label),
+                                                   h.count))
+
+    lines.append('')
+    return '\n'.join(lines)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as err:
+        return err.errno != errno.ESRCH
+    return True
+
+
+class SharedStatsFile(object):
+
+    """
+    Aggregates statistics across the worker processes of a pre-forking
+    server, such as Gunicorn, through a memory-mapped file.
+
+    The file is divided into fixed-size slots. Each worker process claims a
+    slot the first time it publishes and is the only writer of that slot,
+    so publishing takes no lock. Every slot is guarded by a sequence
+    counter that is odd while a write is in progress, which lets readers
+    detect and retry torn reads without blocking the writer. Slots of
+    workers that have exited are reclaimed by new workers.
+
+    Slot layout: pid (int64), sequence (uint64), payload length (uint32),
+    followed by the JSON-encoded snapshot.
+    """
+
+    HEADER = struct.Struct('<qQI')
+
+    def __init__(self, path, slots=64, slot_size=65536):
+        """
+        :param path: Path of the shared file. It is created if it does not
+                     exist. All workers must use the same path.
+        :param slots: Maximum number of worker processes.
+        :param slot_size: Size, in bytes, of each worker's slot.
+
+        :raises `talons.exc.BadConfiguration` if the shared file cannot be
+                used on this platform.
+        """
+        if fcntl is None:
+            msg = "SharedStatsFile requires a POSIX platform."
+            LOG.error(msg)
+            raise exc.BadConfiguration(msg)
+        if slot_size <= self.HEADER.size:
+            msg = "slot_size must be larger than {0} bytes.".format(
+                self.HEADER.size)
+            LOG.error(msg)
+            raise exc.BadConfiguration(msg)
+        self.path = path
+        self.slots = slots
+        self.slot_size = slot_size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        size = slots * slot_size
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+        self._slot = None
+        self._owner = None
+        self._thread = None
+        # Serializes the publishing thread and scrapes of this process
+        self._lock = threading.Lock()
+
+    def _read_header(self, slot):
+        return self.HEADER.unpack_from(self._map, slot * self.slot_size)
+
+    def _claim(self):
+        """
+        Claims a free slot, or the slot of a dead process, for the current
+        process. Claiming is serialized between processes with flock().
+        """
+        pid = os.getpid()
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            for slot in range(self.slots):
+                owner, seq, _length = self._read_header(slot)
+                if owner == pid or owner == 0 or not _pid_alive(owner):
+                    if seq % 2:
+                        seq += 1
+                    self.HEADER.pack_into(self._map, slot * self.slot_size,
+                                          pid, seq, 0)
+                    self._slot = slot
+                    self._owner = pid
+                    return slot
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        msg = "All {0} slots of {1} are in use.".format(self.slots,
+                                                        self.path)
+        LOG.warning(msg)
+        return None
+
+    def publish(self, sink):
+        """
+        Writes the current statistics of this process to its slot. Returns
+        True if the statistics were written, False otherwise.
+        """
+        with self._lock:
+            return self._publish(sink)
+
+    def _publish(self, sink):
+        if self._owner != os.getpid():
+            # First publish, or first publish since a fork()
+            if self._claim() is None:
+                return False
+        counters, histograms = collect(sink)
+        payload = json.dumps({
+            'c': counters,
+            'h': dict((name, [list(h.bounds), h.counts, h.sum, h.count])
+                      for name, h in histograms.items()),
+        }).encode('utf-8')
+        if len(payload) > self.slot_size - self.HEADER.size:
+            LOG.warning("Statistics of {0} bytes do not fit in a slot of "
+                        "{1}.".format(len(payload), self.path))
+            return False
+
+        offset = self._slot * self.slot_size
+        pid, seq, _length = self._read_header(self._slot)
+        self.HEADER.pack_into(self._map, offset, pid, seq + 1, len(payload))
+        start = offset + self.HEADER.size
+        self._map[start:start + len(payload)] = payload
+        # The sequence number is only made even once the slot is complete
+        struct.pack_into('<Q', self._map, offset + 8, seq + 2)
+        return True
+
+    def _read_slot(self, slot, retries=10):
+        offset = slot * self.slot_size
+        start = offset + self.HEADER.size
+        for _x in range(retries):
+            pid, seq, length = self._read_header(slot)
+            if seq % 2:
+                continue
+            data = self._map[start:start + length]
+            if self._read_header(slot)[1] == seq:
+                return pid, data
+        return None, None
+
+    def collect(self):
+        """
+        Returns a (counters, histograms) tuple with the statistics of all
+        worker processes added together.
+        """
+        counters = {}
+        histograms = {}
+        for slot in range(self.slots):
+            pid, data = self._read_slot(slot)
+            if not pid or not data:
+                continue
+            try:
+                snap = json.loads(data.decode('utf-8'))
+            except ValueError:
+                continue
+            for name, value in snap['c'].items():
+                counters[name] = counters.get(name, 0) + value
+            for name, (bounds, counts, total, count) in snap['h'].items():
+                h = stats.Histogram(tuple(bounds))
+                h.counts = counts
+                h.sum = total
+                h.count = count
+                if name not in histograms:
+                    histograms[name] = h
+                elif histograms[name].bounds == h.bounds:
+                    histograms[name].merge(h)
+        return counters, histograms
+
+    def start(self, sink, interval=5.0):
+        """
+        Starts a daemon thread that publishes the statistics of this process
+        every interval seconds. Threads do not survive fork(), so with
+        Gunicorn call this from the post_fork server hook.
+        """
+        if self._thread is not None and self._owner == os.getpid():
+            return
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                try:
+                    self.publish(sink)
+                except Exception as err:
+                    LOG.warning("Unable to publish statistics: {0}".format(
+                        err))
+
+        self._stop = stop
+        self._thread = threading.Thread(target=run,
+                                        name='talons-metrics-publisher')
+        self._thread.daemon = True
+        self.publish(sink)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread = None
+
+
+class MetricsResource(object):
+
+    """
+    Falcon resource that returns talons' statistics in the Prometheus text
+    exposition format, e.g.:
+
+        sink = stats.InMemorySink()
+        app.add_route('/metrics', metrics.MetricsResource(sink))
+
+    Reading the statistics never blocks the request path: every thread
+    records into its own shard of the sink, and shards are only merged when
+    the resource is scraped.
+    """
+
+    def __init__(self, sink, shared=None):
+        """
+        :param sink: The `talons.stats.InMemorySink` passed as the
+                     `stats_sink` configuration option.
+        :param shared: Optional `talons.metrics.SharedStatsFile`. If set,
+                       the statistics of all worker processes are returned.
+        """
+        self.sink = sink
+        self.shared = shared
+
+    def on_get(self, req, resp):
+        if self.shared is not None:
+            self.shared.publish(self.sink)
+            counters, histograms = self.shared.collect()
+        else:
+            counters, histograms = collect(self.sink)
+        resp.content_type = CONTENT_TYPE
+        resp.data = render(counters, histograms).encode('utf-8')
@@ -0,0 +1,335 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+"""
+Cache shared by all worker processes of a pre-forking server, such as
+Gunicorn, through a memory-mapped file.
+"""
+
+import contextlib
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # pragma: NO COVER
+    fcntl = None
+
+from talons import cache
+from talons import exc
+
+LOG = logging.getLogger(__name__)
+
+MAGIC = b'TLNSHM01'
+FILE_HEADER = struct.Struct('<8sII')
+# Slot header: sequence, namespace tag, key digest, expiry time, value length
+SLOT_HEADER = struct.Struct('<QI16sdH')
+
+DEFAULT_SLOTS = 65536
+DEFAULT_SLOT_SIZE = 128
+PROBE_LIMIT = 8
+
+# Tables already mapped by this process, by path
+_TABLES = {}
+_TABLES_LOCK = threading.Lock()
+
+
+class Table(object):
+
+    """
+    Fixed-size open-addressing hash table in a memory-mapped file.
+
+    Every slot holds the digest of its key, never the key itself, and a
+    small JSON-encoded value. A key can be stored in any of PROBE_LIMIT
+    consecutive slots starting at its home slot; when all of them are in
+    use, the entry closest to expiring is replaced.
+
+    Readers never lock. Each slot starts with a sequence number that
+    writers make odd while they modify the slot, and only make even again
+    once the rest of the slot is written, so a reader that sees an odd or
+    changed sequence number retries. Writers are serialized across
+    processes with flock() and across threads with a lock; writes only
+    happen on cache misses. Each process locks through its own file
+    descriptor, which is reopened after a fork(), since processes that
+    share a descriptor share its flock() lock.
+    """
+
+    def __init__(self, path, slots=DEFAULT_SLOTS,
+                 slot_size=DEFAULT_SLOT_SIZE):
+        if fcntl is None:  # pragma: NO COVER
+            msg = "Shared memory caches require a POSIX platform."
+            LOG.error(msg)
+            raise exc.BadConfiguration(msg)
+        if slots < PROBE_LIMIT or slot_size <= SLOT_HEADER.size:
+            msg = ("Shared memory caches need at least {0} slots of more "
+                   "than {1} bytes.").format(PROBE_LIMIT, SLOT_HEADER.size)
+            LOG.error(msg)
+            raise exc.BadConfiguration(msg)
+        self.path = path
+        self.slots = slots
+        self.slot_size = slot_size
+        self.max_value = slot_size - SLOT_HEADER.size
+        self.size = FILE_HEADER.size + slots * slot_size
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            st_size = os.fstat(self._fd).st_size
+            if st_size == 0:
+                os.ftruncate(self._fd, self.size)
+                os.write(self._fd, FILE_HEADER.pack(MAGIC, slots, slot_size))
+            else:
+                header = os.read(self._fd, FILE_HEADER.size)
+                if (st_size != self.size or
+                        FILE_HEADER.unpack(header) !=
+                        (MAGIC, slots, slot_size)):
+                    msg = ("Shared cache file {0} exists with a different "
+                           "layout.").format(path)
+                    LOG.error(msg)
+                    raise exc.BadConfiguration(msg)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._map = mmap.mmap(self._fd, self.size)
+
+    def _offset(self, slot):
+        return FILE_HEADER.size + slot * self.slot_size
+
+    def _probe(self, digest):
+        home = struct.unpack('<Q', digest[:8])[0] % self.slots
+        return [(home + x) % self.slots for x in range(PROBE_LIMIT)]
+
+    def read(self, slot, retries=10):
+        """
+        Returns a (tag, digest, expires, value bytes) tuple for a slot, or
+        None if no consistent copy could be read.
+        """
+        offset = self._offset(slot)
+        start = offset + SLOT_HEADER.size
+        for _x in range(retries):
+            seq, tag, digest, expires, length = SLOT_HEADER.unpack_from(
+                self._map, offset)
+            if seq % 2:
+                continue
+            value = self._map[start:start + length]
+            if struct.unpack_from('<Q', self._map, offset)[0] == seq:
+                return tag, digest, expires, value
+        return None
+
+    def _read_raw(self, slot):
+        # Only called by writers, which exclude each other
+        offset = self._offset(slot)
+        _seq, tag, digest, expires, length = SLOT_HEADER.unpack_from(
+            self._map, offset)
+        start = offset + SLOT_HEADER.size
+        return tag, digest, expires, self._map[start:start + length]
+
+    def _write(self, slot, tag, digest, expires, value):
+        offset = self._offset(slot)
+        seq = struct.unpack_from('<Q', self._map, offset)[0]
+        if seq % 2:
+            # Left odd by a writer that died mid-write
+            seq += 1
+        struct.pack_into('<Q', self._map, offset, seq + 1)
+        SLOT_HEADER.pack_into(self._map, offset, seq + 1, tag, digest,
+                              expires, len(value))
+        start = offset + SLOT_HEADER.size
+        self._map[start:start + len(value)] = value
+        # The sequence number is only made even once the slot is complete
+        struct.pack_into('<Q', self._map, offset, seq + 2)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # First write since a fork(): the inherited descriptor
+                # shares its flock() lock with the parent and siblings
+                os.close(self._fd)
+                self._fd = os.open(self.path, os.O_RDWR)
+                self._pid = os.getpid()
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def get(self, tag, digest, now):
+        for slot in self._probe(digest):
+            entry = self.read(slot)
+            if entry is None:
+                continue
+            t, d, expires, value = entry
+            if t == tag and d == digest and value:
+                if expires and expires <= now:
+                    return None
+                return value
+        return None
+
+    def put(self, tag, digest, expires, value, now, only_new=False):
+        """
+        Stores a value. Returns False if only_new is set and a live entry
+        already exists for the key, True otherwise.
+        """
+        with self._locked():
+            probe = [(slot,) + self._read_raw(slot)
+                     for slot in self._probe(digest)]
+            victim = None
+            for slot, t, d, e, v in probe:
+                if v and t == tag and d == digest:
+                    if only_new and not (e and e <= now):
+                        return False
+                    victim = slot
+                    break
+            if victim is None:
+                # Replace a free or expired slot, otherwise the entry
+                # closest to expiring
+                best = None
+                for slot, t, d, e, v in probe:
+                    if not v or (e and e <= now):
+                        rank = -1
+                    else:
+                        rank = e or float('inf')
+                    if best is None or rank < best:
+                        victim, best = slot, rank
+            self._write(victim, tag, digest, expires, value)
+            return True
+
+    def remove(self, tag, digest=None):
+        """
+        Empties the slots of a key, or of all keys with the tag if no
+        digest is supplied.
+        """
+        with self._locked():
+            if digest is not None:
+                slots = self._probe(digest)
+            else:
+                slots = range(self.slots)
+            for slot in slots:
+                t, d, _e, v = self._read_raw(slot)
+                if v and t == tag and (digest is None or d == digest):
+                    self._write(slot, 0, b'\0' * 16, 0, b'')
+
+
+def get_table(path, slots=DEFAULT_SLOTS, slot_size=DEFAULT_SLOT_SIZE):
+    """
+    Returns the `Table` for the supplied path, mapping the file if this
+    process has not done so yet.
+    """
+    with _TABLES_LOCK:
+        table = _TABLES.get(path)
+        if table is None:
+            table = _TABLES[path] = Table(path, slots, slot_size)
+        return table
+
+
+class SharedMemoryCache(cache.Backend):
+
+    """
+    `talons.cache.Backend` whose entries live in a `Table` shared by all
+    processes that use the same file.
+
+    Several caches can share a table; entries are kept apart by a tag
+    derived from the cache name. Keys are stored as HMAC-SHA256 digests
+    keyed with the cache secret, so that a process that can write to the
+    file but does not know the secret cannot plant entries, and values
+    must be JSON-serializable. Tuples and sets come back as lists.
+    """
+
+    def __init__(self, path, name, ttl=None, secret=None,
+                 slots=DEFAULT_SLOTS, slot_size=DEFAULT_SLOT_SIZE):
+        """
+        :param path: Path of the shared file. All workers must use the same
+                     path, number of slots and slot size.
+        :param name: Name of the cache.
+        :param ttl: Optional number of seconds entries stay valid.
+        :param secret: Secret the key digests are keyed with. (required)
+
+        :raises `talons.exc.BadConfiguration` if there is no secret.
+        """
+        if not secret:
+            msg = "The shm cache backend requires cache_secret."
+            LOG.error(msg)
+            raise exc.BadConfiguration(msg)
+        self.table = get_table(path, slots, slot_size)
+        self.name = name
+        self.ttl = ttl
+        self.secret = secret
+        self.tag = struct.unpack(
+            '<I', hashlib.sha256(name.encode('utf-8')).digest()[:4])[0]
+        self.hits = 0
+        self.misses = 0
+        cache.register(self)
+
+    def __len__(self):
+        count = 0
+        for slot in range(self.table.slots):
+            entry = self.table.read(slot)
+            if entry is not None and entry[0] == self.tag and entry[3]:
+                count += 1
+        return count
+
+    def digest(self, key):
+        return cache.key_digest(key, self.secret)[:16]
+
+    def get(self, key, default=None):
+        value = self.table.get(self.tag, self.digest(key), time.time())
+        if value is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return json.loads(value.decode('utf-8'))
+
+    def _encode(self, value):
+        data = cache.dumps(value)
+        if len(data) > self.table.max_value:
+            LOG.debug("Value of {0} bytes is too large for the shared "
+                      "cache {1}.".format(len(data), self.name))
+            return None
+        return data
+
+    def _expires(self, ttl, now):
+        ttl = self.ttl if ttl is None else ttl
+        return now + ttl if ttl else 0
+
+    def set(self, key, value, ttl=None):
+        data = self._encode(value)
+        if data is None:
+            return
+        now = time.time()
+        self.table.put(self.tag, self.digest(key), self._expires(ttl, now),
+                       data, now)
+
+    def add(self, key, value, ttl=None):
+        data = self._encode(value)
+        if data is None:
+            return False
+        now = time.time()
+        return self.table.put(self.tag, self.digest(key),
+                              self._expires(ttl, now), data, now,
+                              only_new=True)
+
+    def delete(self, key):
+        self.table.remove(self.tag, self.digest(key))
+
+    def clear(self):
+        self.table.remove(self.tag)
@@ -0,0 +1,128 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+"""
+Snapshots of warm caches, saved when a worker exits and loaded when the
+next one starts, so that a restart does not mean redoing every expensive
+verification.
+
+A snapshot only holds keyed digests of cache keys and their expiry times,
+never the keys. Its header records a fingerprint of the cache secret and
+of the source the entries were verified against, e.g. an htpasswd file,
+so that a snapshot is ignored once either changes.
+"""
+
+import binascii
+import hashlib
+import hmac
+import json
+import logging
+import os
+import time
+
+LOG = logging.getLogger(__name__)
+
+VERSION = 1
+
+
+def _bytes(value):
+    if isinstance(value, bytes):
+        return value
+    return value.encode('utf-8')
+
+
+def secret_fingerprint(secret):
+    """
+    Returns a hex string identifying the secret without revealing it.
+    """
+    return hmac.new(_bytes(secret), b'talons.snapshot',
+                    hashlib.sha256).hexdigest()
+
+
+def file_fingerprint(path):
+    """
+    Returns the hex SHA-256 digest of the contents of a file.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def save(path, secret, source, entries, now=None):
+    """
+    Writes a snapshot of the supplied (digest, expires) entries, skipping
+    expired ones. The file is written next to its final path and renamed
+    into place, so a reader never sees a partial snapshot, and is only
+    readable by its owner.
+
+    :param path: Path of the snapshot file.
+    :param secret: Secret the digests were keyed with.
+    :param source: Fingerprint of what the entries were verified against.
+    :param entries: Iterable of (digest bytes, expiry time) tuples.
+    """
+    now = time.time() if now is None else now
+    data = {
+        'version': VERSION,
+        'secret': secret_fingerprint(secret),
+        'source': source,
+        'entries': [[binascii.hexlify(d).decode('ascii'), e]
+                    for d, e in entries if e > now],
+    }
+    tmp = '{0}.{1}.tmp'.format(path, os.getpid())
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.rename(tmp, path)
+    except Exception:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    return len(data['entries'])
+
+
+def load(path, secret, source, now=None):
+    """
+    Returns a dict of digest bytes to expiry time of the unexpired entries
+    of a snapshot, or an empty dict if there is no usable snapshot: if it
+    is missing, unreadable, or was saved with another secret or source.
+    """
+    now = time.time() if now is None else now
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (IOError, OSError, ValueError) as err:
+        LOG.debug("No cache snapshot loaded from {0}: {1}".format(path,
+                                                                  err))
+        return {}
+    if (not isinstance(data, dict) or data.get('version') != VERSION or
+            data.get('secret') != secret_fingerprint(secret) or
+            data.get('source') != source):
+        LOG.info("Ignoring stale cache snapshot {0}".format(path))
+        return {}
+    entries = {}
+    try:
+        for digest, expires in data.get('entries', ()):
+            if expires > now:
+                entries[binascii.unhexlify(digest)] = expires
+    except (TypeError, ValueError) as err:
+        LOG.info("Ignoring corrupt cache snapshot {0}: {1}".format(path,
+                                                                   err))
+        return {}
+    return entries
@@ -0,0 +1,217 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import bisect
+import collections
+import logging
+import socket
+import threading
+import time
+import weakref
+
+LOG = logging.getLogger(__name__)
+
+# Monotonic, high-resolution clock used for all latency measurements
+clock = getattr(time, 'perf_counter', time.time)
+
+# Fixed upper bounds, in seconds, of latency histogram buckets. The last
+# bucket catches everything slower than the largest bound.
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   float('inf'))
+
+
+class Sink(object):
+
+    """
+    Base class for objects that receive the statistics recorded by talons.
+    """
+
+    def incr(self, name, value=1):
+        """
+        Adds value to the counter called name.
+        """
+        raise NotImplementedError  # pragma: NO COVER
+
+    def observe(self, name, seconds):
+        """
+        Records a latency, in seconds, in the histogram called name.
+        """
+        raise NotImplementedError  # pragma: NO COVER
+
+
+class Histogram(object):
+
+    """
+    Latency histogram with fixed bucket bounds. Counts are per bucket, not
+    cumulative.
+    """
+
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds=DEFAULT_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def merge(self, other):
+        for x, c in enumerate(other.counts):
+            self.counts[x] += c
+        self.sum += other.sum
+        self.count += other.count
+
+
+def _merge(counters, histograms, shard_counters, shard_histograms):
+    """
+    Adds the counters and histograms of a shard to the supplied dicts.
+    """
+    for name, value in list(shard_counters.items()):
+        counters[name] = counters.get(name, 0) + value
+    for name, h in list(shard_histograms.items()):
+        if name not in histograms:
+            histograms[name] = Histogram(h.bounds)
+        histograms[name].merge(h)
+
+
+class _Shard(object):
+
+    """
+    The counters and histograms of one thread. Only the thread's local
+    storage refers to it, so it is freed when the thread exits.
+    """
+
+    __slots__ = ('counters', 'histograms', '__weakref__')
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+
+
+class InMemorySink(Sink):
+
+    """
+    Keeps counters and latency histograms in memory.
+
+    Every thread records into its own shard, so the request path never
+    takes a lock or contends with other threads. `snapshot()` merges the
+    shards when the statistics are read. When a thread exits, its shard
+    is folded into the totals of exited threads, so that servers that
+    start a thread per request do not keep a shard per request.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._local = threading.local()
+        # Maps a weak reference to the shard of each live thread to the
+        # shard's (counters, histograms) dicts
+        self._shards = {}
+        self._exited = ({}, {})
+        self._freed = collections.deque()
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = _Shard()
+            ref = weakref.ref(shard, self._freed.append)
+            with self._lock:
+                self._fold_freed()
+                self._shards[ref] = (shard.counters, shard.histograms)
+            self._local.shard = shard
+            return shard
+
+    def _fold_freed(self):
+        """
+        Folds the shards of exited threads into the totals. Their weak
+        references are only queued when the shards are freed, since that
+        may happen on any thread, e.g. in the garbage collector, so this
+        is called with the lock held when a shard is added or the
+        statistics are read.
+        """
+        while self._freed:
+            counters, histograms = self._shards.pop(self._freed.popleft())
+            _merge(self._exited[0], self._exited[1], counters, histograms)
+
+    def incr(self, name, value=1):
+        counters = self._shard().counters
+        counters[name] = counters.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        histograms = self._shard().histograms
+        try:
+            h = histograms[name]
+        except KeyError:
+            h = histograms[name] = Histogram(self.buckets)
+        h.observe(seconds)
+
+    def snapshot(self):
+        """
+        Returns a (counters, histograms) tuple of dicts merged across all
+        threads. The returned objects are copies and are safe to modify.
+        """
+        counters = {}
+        histograms = {}
+        with self._lock:
+            self._fold_freed()
+            _merge(counters, histograms, *self._exited)
+            shards = list(self._shards.values())
+        for shard_counters, shard_histograms in shards:
+            _merge(counters, histograms, shard_counters, shard_histograms)
+        return counters, histograms
+
+
+class StatsdSink(Sink):
+
+    """
+    Sends counters and timings to a StatsD daemon over UDP. Sending never
+    blocks and errors are ignored, so an unavailable daemon does not affect
+    requests.
+    """
+
+    def __init__(self, host='127.0.0.1', port=8125, prefix='talons'):
+        self.address = (host, port)
+        self.prefix = prefix + '.' if prefix else ''
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.setblocking(False)
+
+    def _send(self, data):
+        try:
+            self._sock.sendto(data.encode('utf-8'), self.address)
+        except (IOError, OSError) as err:
+            LOG.debug("Unable to send stats to {0}: {1}".format(self.address,
+                                                                err))
+
+    def incr(self, name, value=1):
+        self._send('{0}{1}:{2}|c'.format(self.prefix, name, value))
+
+    def observe(self, name, seconds):
+        self._send('{0}{1}:{2:.3f}|ms'.format(self.prefix, name,
+                                              seconds * 1000.0))
+
+
+def plugin_name(plugin):
+    """
+    Returns a short name for a plugin object, e.g. 'htpasswd.Authenticator'.
+    """
+    cls = plugin.__class__
+    return '{0}.{1}'.format(cls.__module__.rpartition('.')[2], cls.__name__)
@@ -0,0 +1,163 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import mock
+import testtools
+
+from talons import exc
+from talons.auth import adaptive
+from talons.auth import interfaces
+from talons.auth import middleware
+
+from tests import base
+
+
+class Identifier(interfaces.Identifies):
+
+    def identify(self, request):
+        request.env['wsgi.identity'] = interfaces.Identity(
+            request.env['login'], key=None)
+        return True
+
+
+class Plugin(interfaces.Authenticates):
+
+    def __init__(self, name, cost, accepts, clock):
+        self.name = name
+        self.cost = cost
+        self.accepts = accepts
+        self.clock = clock
+
+    def authenticate(self, identity):
+        self.clock[0] += self.cost
+        return identity.login in self.accepts
+
+
+class TestAdaptiveChain(base.TestCase):
+
+    def setUp(self):
+        super(TestAdaptiveChain, self).setUp()
+        self.clock = [0.0]
+        self.patch('talons.stats.clock', side_effect=lambda: self.clock[0])
+
+    def plugin(self, name, cost, accepts):
+        return Plugin(name, cost, accepts, self.clock)
+
+    def create(self, plugins, **conf):
+        m = middleware.Middleware([Identifier()], plugins,
+                                  adaptive_order=True, **conf)
+        return m, m.authenticator_chain
+
+    def run_chain(self, m, requests):
+        results = []
+        for r in requests:
+            req = mock.MagicMock()
+            req.env = {'login': r}
+            m._authenticate(req, None)
+            results.append(req.env['wsgi.authenticated'])
+        return results
+
+    def test_reorders_by_expected_cost(self):
+        slow = self.plugin('slow', 0.05, ('ldap',))
+        fast = self.plugin('fast', 0.001, ('key',))
+        never = self.plugin('never', 0.0001, ())
+        m, chain = self.create([never, slow, fast], adaptive_interval=10)
+        requests = ['key'] * 8 + ['ldap'] * 2
+        self.assertEqual([True] * 10, self.run_chain(m, requests))
+        self.assertEqual([fast, slow, never], chain.ordered)
+        # Statistics are halved after reordering
+        self.assertEqual(5, chain.requests)
+        self.assertEqual(4, chain.successes[2])
+
+        # Same results after reordering
+        requests = ['key', 'ldap', 'other']
+        self.assertEqual([True, True, False], self.run_chain(m, requests))
+        # The configured list is left alone
+        self.assertEqual([never, slow, fast], m.authenticators)
+
+    def test_pinned(self):
+        a = self.plugin('a', 0.05, ('a',))
+        b = self.plugin('b', 0.04, ('b',))
+        c = self.plugin('c', 0.001, ('c',))
+        d = self.plugin('d', 0.001, ('d',))
+        m, chain = self.create([a, b, c, d], adaptive_pinned=(b,),
+                               adaptive_interval=4)
+        self.run_chain(m, ['a', 'b', 'c', 'd'])
+        # c and d are not moved across the pinned plugin b
+        self.assertEqual([a, b, c, d], chain.ordered)
+
+    def test_pinned_by_name(self):
+        a = self.plugin('a', 0.05, ('a',))
+        b = self.plugin('b', 0.001, ('b',))
+        m, chain = self.create([a, b],
+                               adaptive_pinned='test_adaptive.Plugin',
+                               adaptive_interval=2)
+        self.run_chain(m, ['b', 'b'])
+        self.assertEqual([a, b], chain.ordered)
+
+    def test_inconsistent_statistics(self):
+        # Counts read mid-update by reorder() may disagree
+        a = self.plugin('a', 0.05, ('a',))
+        b = self.plugin('b', 0.001, ('b',))
+        c = self.plugin('c', 0.001, ('c',))
+        chain = adaptive.AdaptiveChain([a, b, c])
+        chain.calls = [4, 0, 1]
+        chain.successes = [2, 1, 3]
+        chain.cost = [0.2, 0.0, 0.001]
+        chain.requests = 2
+        chain.reorder()
+        self.assertEqual([c, a, b], chain.ordered)
+
+    def test_failed_request_counted(self):
+        a = self.plugin('a', 0.05, ('a',))
+        m, chain = self.create([a])
+        self.assertEqual([False], self.run_chain(m, ['b']))
+        self.assertEqual(1, chain.requests)
+        self.assertEqual([1], chain.calls)
+        self.assertEqual([0], chain.successes)
+        self.assertEqual([0.05], chain.cost)
+
+
+class TestCreateChains(base.TestCase):
+
+    def test_disabled(self):
+        self.assertEqual((None, None), adaptive.create_chains([], []))
+
+    def test_identifiers_keep_order(self):
+        ids, auths = adaptive.create_chains([mock.sentinel.i], [],
+                                            adaptive_order=True)
+        self.assertIsNone(ids)
+        self.assertIsInstance(auths, adaptive.AdaptiveChain)
+
+    def test_bad_interval(self):
+        with testtools.ExpectedException(exc.BadConfiguration):
+            adaptive.create_chains([], [], adaptive_order=True,
+                                   adaptive_interval='x')
+
+    def test_role_setters_pinned(self):
+        a = mock.MagicMock()
+        a.sets_roles.return_value = True
+        b = mock.MagicMock()
+        b.sets_roles.return_value = False
+        b.sets_groups.return_value = False
+        ids, auths = adaptive.create_chains([mock.sentinel.i], [a, b],
+                                            adaptive_order=True,
+                                            adaptive_identifiers=True,
+                                            adaptive_pinned='x.Y, z.W')
+        self.assertEqual([False], ids.pinned)
+        self.assertEqual([True, False], auths.pinned)
+        self.assertEqual(adaptive.DEFAULT_INTERVAL, ids.interval)
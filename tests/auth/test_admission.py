@@ -0,0 +1,159 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import threading
+
+import mock
+import testtools
+
+from talons import exc
+from talons import stats
+from talons.auth import admission
+from talons.auth import interfaces
+from talons.auth import middleware
+from talons.auth import wsgi
+
+from tests import base
+
+
+class SlowAuthenticator(interfaces.Authenticates):
+
+    def __init__(self, cached=()):
+        self.cached = cached
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def is_expensive(self, identity):
+        return identity.login not in self.cached
+
+    def authenticate(self, identity):
+        if self.is_expensive(identity):
+            self.started.set()
+            self.release.wait(5)
+        return True
+
+
+class Identifier(interfaces.Identifies):
+
+    def identify(self, request):
+        login = request.env['HTTP_X_LOGIN']
+        request.env[self.IDENTITY_ENV_KEY] = interfaces.Identity(login)
+        return True
+
+
+class TestAdmissionController(base.TestCase):
+
+    def test_acquire_release(self):
+        ac = admission.AdmissionController(2)
+        self.assertTrue(ac.acquire())
+        self.assertTrue(ac.try_acquire())
+        self.assertFalse(ac.acquire())
+        self.assertFalse(ac.try_acquire())
+        ac.release()
+        self.assertTrue(ac.acquire())
+        self.assertEqual(2, ac.in_flight)
+
+    def test_queue_time(self):
+        ac = admission.AdmissionController(1, max_queue_time=5)
+        ac.acquire()
+        timer = threading.Timer(0.01, ac.release)
+        timer.start()
+        self.assertTrue(ac.acquire())
+        timer.join()
+        ac = admission.AdmissionController(1, max_queue_time=0.01)
+        ac.acquire()
+        self.assertFalse(ac.acquire())
+
+    def test_call(self):
+        ac = admission.AdmissionController(1)
+        a = SlowAuthenticator(cached=('cheap',))
+        ac.acquire()
+        self.assertTrue(ac.call(a, interfaces.Identity('cheap')))
+        with testtools.ExpectedException(admission.Shed):
+            ac.call(a, interfaces.Identity('new'))
+        ac.release()
+        # Plugins without is_expensive are cheap
+        plain = mock.Mock(spec=['authenticate'])
+        ac.acquire()
+        ac.call(plain, interfaces.Identity('new'))
+        plain.authenticate.assert_called_once_with(mock.ANY)
+
+    def test_create(self):
+        self.assertIsNone(admission.create_admission_controller())
+        ac = admission.create_admission_controller(
+            admission_max_concurrent='4', admission_max_queue_time='0.5')
+        self.assertEqual((4, 0.5), (ac.max_concurrent, ac.max_queue_time))
+        for conf in (dict(admission_max_concurrent='x'),
+                     dict(admission_max_concurrent=-1),
+                     dict(admission_max_concurrent=1,
+                          admission_max_queue_time=-1)):
+            with testtools.ExpectedException(exc.BadConfiguration):
+                admission.create_admission_controller(**conf)
+
+
+class TestLoadShedding(base.TestCase):
+
+    def test_shed_expensive_only(self):
+        authenticator = SlowAuthenticator(cached=('known',))
+        sink = stats.InMemorySink()
+        app = mock.MagicMock(return_value=[b'ok'])
+        mw = wsgi.create_wsgi_middleware(app, Identifier(), authenticator,
+                                         default_authorize=True,
+                                         admission_max_concurrent=1,
+                                         admission_retry_after=3,
+                                         stats_sink=sink)
+
+        def request(login):
+            env = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/',
+                   'HTTP_X_LOGIN': login}
+            start_response = mock.MagicMock()
+            body = mw(env, start_response)
+            return start_response.call_args, body
+
+        busy = threading.Thread(target=request, args=('first',))
+        busy.start()
+        self.assertTrue(authenticator.started.wait(5))
+        try:
+            ((status, headers), _kwargs), _body = request('second')
+            self.assertEqual('503 Service Unavailable', status)
+            self.assertIn(('Retry-After', '3'), headers)
+            # Cached credentials go through
+            _args, body = request('known')
+            self.assertEqual([b'ok'], body)
+        finally:
+            authenticator.release.set()
+            busy.join()
+        self.assertEqual(1, sink.snapshot()[0]['admission.shed'])
+        self.assertEqual(0, mw.auth_middleware.admission.in_flight)
+
+    def test_other_authenticator_tried(self):
+        expensive = SlowAuthenticator()
+        cheap = mock.MagicMock(spec=interfaces.Authenticates)
+        cheap.is_expensive.return_value = False
+        cheap.authenticate.return_value = True
+        m = middleware.Middleware([Identifier()], [expensive, cheap],
+                                  default_authorize=True,
+                                  admission_max_concurrent=1)
+        m.admission.acquire()
+        req = mock.MagicMock()
+        req.env = {'HTTP_X_LOGIN': 'new'}
+        self.assertIsNone(m.process(req, {}))
+        self.assertTrue(req.env['wsgi.authenticated'])
+
+        cheap.authenticate.return_value = False
+        req.env = {'HTTP_X_LOGIN': 'new'}
+        self.assertEqual(middleware.OVERLOADED, m.process(req, {}))
@@ -0,0 +1,181 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import base64
+
+import falcon.asgi
+from falcon import testing
+
+from talons.auth import asgi
+from talons.auth import basicauth
+from talons.auth import interfaces
+
+from tests import base
+
+
+class AsyncPasswordAuthenticator(interfaces.Authenticates):
+
+    def __init__(self, **conf):
+        self.calls = 0
+
+    def authenticate(self, identity):
+        raise AssertionError("sync authenticate should not be called")
+
+    async def authenticate_async(self, identity):
+        self.calls += 1
+        return identity.key == 'open sesame'
+
+
+class SyncAuthenticator(interfaces.Authenticates):
+
+    def __init__(self, **conf):
+        pass
+
+    def authenticate(self, identity):
+        return identity.key == 'backdoor'
+
+
+class SyncAuthorizer(interfaces.Authorizes):
+
+    def authorize(self, identity, resource):
+        return resource.route == '/users/{user_id}'
+
+
+class Resource(object):
+
+    async def on_get(self, req, resp, **kwargs):
+        env = req.scope[asgi.ENVIRON_SCOPE_KEY]
+        resp.media = {'login': env['wsgi.identity'].login,
+                      'authorized': env['wsgi.authorized']}
+
+
+class HealthResource(object):
+
+    async def on_get(self, req, resp):
+        resp.media = {'ok': True}
+
+
+def _headers(password):
+    creds = base64.b64encode(('Aladdin:' + password).encode('ascii'))
+    return {'Authorization': 'Basic ' + creds.decode('ascii')}
+
+
+class TestAsgi(base.TestCase):
+
+    def setUp(self):
+        super(TestAsgi, self).setUp()
+        self.authenticator = AsyncPasswordAuthenticator()
+        c = asgi.create_async_component(basicauth.Identifier,
+                                        self.authenticator,
+                                        SyncAuthorizer)
+        app = falcon.asgi.App(middleware=[c])
+        app.add_route('/users/{user_id}', Resource())
+        app.add_route('/admin', Resource())
+        self.client = testing.TestClient(app)
+
+    def test_environ_from_request(self):
+        scope = testing.create_scope(path='/users/1', query_string='a=1',
+                                     headers={'X-Auth-User': 'Aladdin',
+                                              'Content-Type': 'text/plain'})
+        req = falcon.asgi.Request(scope, testing.ASGIRequestEventEmitter())
+        env = asgi.environ_from_request(req)
+        self.assertEqual('GET', env['REQUEST_METHOD'])
+        self.assertEqual('/users/1', env['PATH_INFO'])
+        self.assertEqual('a=1', env['QUERY_STRING'])
+        self.assertEqual('Aladdin', env['HTTP_X_AUTH_USER'])
+        self.assertEqual('text/plain', env['CONTENT_TYPE'])
+
+    def test_authorized(self):
+        result = self.client.simulate_get('/users/1',
+                                          headers=_headers('open sesame'))
+        self.assertEqual(200, result.status_code)
+        self.assertEqual({'login': 'Aladdin', 'authorized': True},
+                         result.json)
+        self.assertEqual(1, self.authenticator.calls)
+
+    def test_rejected(self):
+        self.assertEqual(401, self.client.simulate_get('/users/1').status_code)
+        result = self.client.simulate_get('/users/1',
+                                          headers=_headers('wrong'))
+        self.assertEqual(401, result.status_code)
+        result = self.client.simulate_get('/admin',
+                                          headers=_headers('open sesame'))
+        self.assertEqual(403, result.status_code)
+
+    def test_parallel(self):
+        authenticator = AsyncPasswordAuthenticator()
+        c = asgi.create_async_component(basicauth.Identifier,
+                                        [authenticator, SyncAuthenticator],
+                                        SyncAuthorizer,
+                                        parallel_authenticate=True,
+                                        parallel_timeout=5)
+        app = falcon.asgi.App(middleware=[c])
+        app.add_route('/users/{user_id}', Resource())
+        client = testing.TestClient(app)
+        for password in ('open sesame', 'backdoor'):
+            result = client.simulate_get('/users/1',
+                                         headers=_headers(password))
+            self.assertEqual(200, result.status_code)
+        result = client.simulate_get('/users/1', headers=_headers('wrong'))
+        self.assertEqual(401, result.status_code)
+        self.assertEqual(3, authenticator.calls)
+
+    def test_adaptive_order(self):
+        c = asgi.create_async_component(basicauth.Identifier,
+                                        [SyncAuthenticator,
+                                         self.authenticator],
+                                        SyncAuthorizer,
+                                        adaptive_order=True,
+                                        adaptive_interval=2)
+        app = falcon.asgi.App(middleware=[c])
+        app.add_route('/users/{user_id}', Resource())
+        client = testing.TestClient(app)
+        for _x in range(3):
+            result = client.simulate_get('/users/1',
+                                         headers=_headers('open sesame'))
+            self.assertEqual(200, result.status_code)
+        chain = c.auth_middleware.authenticator_chain
+        self.assertIs(self.authenticator, chain.ordered[0])
+        self.assertEqual(1, chain.requests)
+
+    def test_public(self):
+        c = asgi.create_async_component(basicauth.Identifier,
+                                        self.authenticator,
+                                        SyncAuthorizer,
+                                        public_paths=['/health'])
+        app = falcon.asgi.App(middleware=[c])
+        app.add_route('/health', HealthResource())
+        client = testing.TestClient(app)
+        self.assertEqual(200, client.simulate_get('/health').status_code)
+        self.assertEqual(0, self.authenticator.calls)
+
+    def test_route_component(self):
+        c = asgi.create_async_route_component(
+            {'/health': None,
+             '/users/{user_id}': dict(identify_with=basicauth.Identifier,
+                                      authenticate_with=self.authenticator,
+                                      authorize_with=SyncAuthorizer)},
+            default=None)
+        app = falcon.asgi.App(middleware=[c])
+        app.add_route('/health', HealthResource())
+        app.add_route('/users/{user_id}', Resource())
+        client = testing.TestClient(app)
+        self.assertEqual(200, client.simulate_get('/health').status_code)
+        self.assertEqual(401, client.simulate_get('/users/1').status_code)
+        result = client.simulate_get('/users/1',
+                                     headers=_headers('open sesame'))
+        self.assertEqual({'login': 'Aladdin', 'authorized': True},
+                         result.json)
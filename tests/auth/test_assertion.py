@@ -0,0 +1,125 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import mock
+import testtools
+
+from talons import exc
+from talons.auth import assertion
+from talons.auth import interfaces
+from talons.auth import middleware
+
+from tests import base
+
+
+class TestAssertion(base.TestCase):
+
+    def setUp(self):
+        super(TestAssertion, self).setUp()
+        self.identity = interfaces.Identity('Aladdin', key='open sesame',
+                                            roles=['admin'],
+                                            groups=['lamps'])
+
+    def test_sign_verify(self):
+        token = assertion.sign(self.identity, 'secret', ttl=60, now=1000)
+        self.assertNotIn('open sesame', token)
+        payload = assertion.verify(token, 'secret', now=1050)
+        self.assertEqual('Aladdin', payload['l'])
+        self.assertEqual(['admin'], payload['r'])
+        self.assertEqual(['lamps'], payload['g'])
+
+    def test_verify_bad_secret(self):
+        token = assertion.sign(self.identity, 'secret', now=1000)
+        self.assertIsNone(assertion.verify(token, 'other', now=1000))
+
+    def test_verify_expired(self):
+        token = assertion.sign(self.identity, 'secret', ttl=60, now=1000)
+        self.assertIsNone(assertion.verify(token, 'secret', now=1061))
+
+    def test_verify_tampered(self):
+        token = assertion.sign(self.identity, 'secret', now=1000)
+        other = interfaces.Identity('Jafar', roles=['admin'])
+        forged = assertion.sign(other, 'secret', now=1000)
+        token = forged.split('.')[0] + '.' + token.split('.')[1]
+        self.assertIsNone(assertion.verify(token, 'secret', now=1000))
+        self.assertIsNone(assertion.verify('garbage', 'secret'))
+        self.assertIsNone(assertion.verify(u'\xe9.\xe9', 'secret'))
+
+    def test_identify(self):
+        token = assertion.sign(self.identity, 'secret')
+        req = mock.MagicMock()
+        req.env = {}
+        req.get_header.return_value = token
+        i = assertion.Identifier()
+        self.assertTrue(i.identify(req))
+        req.get_header.assert_called_once_with('X-Talons-Assertion')
+        identity = req.env['wsgi.identity']
+        self.assertEqual('Aladdin', identity.login)
+        self.assertEqual(token, identity.key)
+        self.assertEqual(set(), identity.roles)
+
+        req.env = {}
+        req.get_header.return_value = 'not an assertion'
+        self.assertFalse(i.identify(req))
+        req.get_header.return_value = None
+        self.assertFalse(i.identify(req))
+
+    def test_authenticate(self):
+        with testtools.ExpectedException(exc.BadConfiguration):
+            assertion.Authenticator()
+
+        a = assertion.Authenticator(assertion_secret='secret')
+        self.assertTrue(a.sets_roles())
+        self.assertTrue(a.sets_groups())
+
+        token = assertion.sign(self.identity, 'secret')
+        identity = interfaces.Identity('Aladdin', key=token)
+        self.assertTrue(a.authenticate(identity))
+        self.assertEqual(set(['admin']), identity.roles)
+        self.assertEqual(set(['lamps']), identity.groups)
+
+        identity = interfaces.Identity('Jafar', key=token)
+        self.assertFalse(a.authenticate(identity))
+
+        identity = interfaces.Identity('Aladdin', key='open sesame')
+        self.assertFalse(a.authenticate(identity))
+
+    def test_middleware_emits_assertion(self):
+        with testtools.ExpectedException(exc.BadConfiguration):
+            middleware.Middleware([], [], assertion_emit=True)
+
+        req = mock.MagicMock()
+        req.env = {'wsgi.identity': self.identity}
+        i = mock.MagicMock()
+        i.identify.return_value = True
+        a = mock.MagicMock()
+        a.authenticate.return_value = True
+
+        m = middleware.Middleware([i], [a], None, default_authorize=True,
+                                  assertion_emit=True,
+                                  assertion_secret='secret')
+        m(req, None, None)
+        token = req.env['wsgi.identity_assertion']
+        self.assertEqual('Aladdin', assertion.verify(token, 'secret')['l'])
+
+        req.env = {'wsgi.identity': self.identity}
+        a.authenticate.return_value = False
+        m = middleware.Middleware([i], [a], None, delay_401=True,
+                                  default_authorize=True,
+                                  assertion_emit=True,
+                                  assertion_secret='secret')
+        m(req, None, None)
+        self.assertNotIn('wsgi.identity_assertion', req.env)
@@ -0,0 +1,239 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import json
+import os
+import threading
+import time
+
+import fixtures
+import mock
+import testtools
+
+from talons import exc
+from talons import stats
+from talons.auth import audit
+from talons.auth import interfaces
+from talons.auth import middleware
+
+from tests import base
+
+ENV = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/users/1'}
+
+
+class TestAuditLog(base.TestCase):
+
+    def setUp(self):
+        super(TestAuditLog, self).setUp()
+        tmp = self.useFixture(fixtures.TempDir()).path
+        self.path = os.path.join(tmp, 'audit.log')
+        self.useFixture(fixtures.MockPatch('atexit.register'))
+
+    def audit_log(self, **kwargs):
+        log = audit.AuditLog(self.path, **kwargs)
+        self.addCleanup(log.close)
+        return log
+
+    def read(self, path=None):
+        with open(path or self.path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_records_written_on_close(self):
+        log = self.audit_log(flush_interval=60)
+        env = dict(ENV)
+        env['wsgi.identity'] = interfaces.Identity('alice')
+        log.record('authenticate', True, env)
+        log.record('authorize', False, ENV)
+        log.close()
+        records = self.read()
+        self.assertEqual(2, len(records))
+        self.assertEqual({'stage': 'authenticate', 'ok': True,
+                          'login': 'alice', 'method': 'GET',
+                          'path': '/users/1'},
+                         dict((k, v) for k, v in records[0].items()
+                              if k != 'ts'))
+        self.assertIsNone(records[1]['login'])
+
+    def test_batch_wakes_writer(self):
+        log = self.audit_log(batch_size=2, flush_interval=60)
+        log.record('identify', True, ENV)
+        log.record('identify', True, ENV)
+        for _x in range(500):
+            if not log._queue and os.path.getsize(self.path):
+                break
+            threading.Event().wait(0.01)
+        self.assertEqual(2, len(self.read()))
+
+    def test_drop_when_full(self):
+        sink = stats.InMemorySink()
+        log = self.audit_log(max_queue=2, batch_size=10, flush_interval=60,
+                             stats_sink=sink)
+        self.assertTrue(log.record('identify', True, ENV))
+        self.assertTrue(log.record('identify', True, ENV))
+        self.assertFalse(log.record('identify', True, ENV))
+        self.assertEqual(1, log.dropped)
+        self.assertEqual(1, sink.snapshot()[0]['audit.dropped'])
+
+    def test_block_when_full(self):
+        log = self.audit_log(max_queue=2, batch_size=10, flush_interval=60,
+                             when_full=audit.BLOCK)
+        for _x in range(5):
+            self.assertTrue(log.record('identify', True, ENV))
+        log.close()
+        self.assertEqual(5, len(self.read()))
+        self.assertEqual(0, log.dropped)
+
+    def test_rotate_by_size(self):
+        log = self.audit_log(max_bytes=1, backup_count=2, flush_interval=60)
+        for _x in range(3):
+            log.record('identify', True, ENV)
+            log.flush()
+        log.close()
+        self.assertEqual(1, len(self.read(self.path + '.1')))
+        self.assertEqual(1, len(self.read(self.path + '.2')))
+        self.assertFalse(os.path.exists(self.path + '.3'))
+
+    def test_rotate_after_file_removed(self):
+        log = self.audit_log(backup_count=2, flush_interval=60)
+        log.record('identify', True, ENV)
+        log.flush()
+        os.unlink(self.path)
+        log.record('identify', True, ENV)
+        log.flush()
+        # A new file was opened, so writing goes on
+        self.assertEqual(1, len(self.read()))
+        self.assertFalse(os.path.exists(self.path + '.1'))
+
+    def test_rotated_by_another_process(self):
+        log = self.audit_log(max_bytes=1, backup_count=2, flush_interval=60)
+        other = self.audit_log(max_bytes=1, backup_count=2,
+                               flush_interval=60)
+        log.record('identify', True, ENV)
+        log.flush()
+        # The file log rotated is only reopened, not rotated again
+        other.rotate()
+        other.record('authorize', True, ENV)
+        other.flush()
+        self.assertEqual(['authorize'],
+                         [r['stage'] for r in self.read(self.path + '.1')])
+        self.assertEqual(['identify'],
+                         [r['stage'] for r in self.read(self.path + '.2')])
+        self.assertFalse(os.path.exists(self.path + '.3'))
+
+    def test_failed_write_counted(self):
+        log = self.audit_log(flush_interval=60)
+        log.record('identify', True, ENV)
+        log.record('authorize', True, ENV)
+        real = log._file
+        self.addCleanup(real.close)
+        log._file = mock.Mock(write=mock.Mock(side_effect=IOError),
+                              fileno=real.fileno)
+        self.assertRaises(IOError, log.flush)
+        self.assertEqual(2, log.dropped)
+
+    def test_writer_started_after_fork(self):
+        # Created before forking, as by a pre-forking server that loads
+        # the application first
+        log = self.audit_log(flush_interval=0.01)
+        self.assertIsNone(log._thread)
+        pid = os.fork()
+        if pid == 0:  # pragma: NO COVER
+            try:
+                log.record('identify', True, ENV)
+                deadline = time.time() + 5
+                while log._queue and time.time() < deadline:
+                    time.sleep(0.01)
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        self.assertIsNone(log._thread)
+        self.assertEqual(['identify'], [r['stage'] for r in self.read()])
+
+    def test_writer_survives_errors(self):
+        log = self.audit_log(batch_size=1, flush_interval=0.01)
+        with mock.patch.object(log, 'flush', side_effect=ValueError):
+            log.record('identify', True, ENV)
+            threading.Event().wait(0.05)
+        self.assertTrue(log._thread.is_alive())
+
+    def test_block_gives_up(self):
+        log = self.audit_log(max_queue=1, batch_size=10, flush_interval=60,
+                             when_full=audit.BLOCK, block_timeout=0.05)
+        with mock.patch.object(log, 'flush'):
+            self.assertTrue(log.record('identify', True, ENV))
+            self.assertFalse(log.record('identify', True, ENV))
+        self.assertEqual(1, log.dropped)
+
+    def test_block_drops_without_writer(self):
+        log = self.audit_log(max_queue=1, batch_size=10, flush_interval=60,
+                             when_full=audit.BLOCK, block_timeout=60)
+        log._thread = mock.Mock(is_alive=mock.Mock(return_value=False))
+        self.assertTrue(log.record('identify', True, ENV))
+        self.assertFalse(log.record('identify', True, ENV))
+
+    def test_rotate_by_age(self):
+        log = self.audit_log(rotate_interval=60, flush_interval=60)
+        log.record('identify', True, ENV)
+        log.flush()
+        self.assertFalse(log._should_rotate(log._opened + 30))
+        self.assertTrue(log._should_rotate(log._opened + 60))
+
+    def test_create(self):
+        self.assertIsNone(audit.create_audit_log())
+        log = audit.create_audit_log(audit_path=self.path,
+                                     audit_when_full='block',
+                                     audit_queue_size='5')
+        self.addCleanup(log.close)
+        self.assertEqual((5, audit.BLOCK), (log.max_queue, log.when_full))
+        for conf in (dict(audit_path=self.path, audit_when_full='wait'),
+                     dict(audit_path=self.path, audit_batch_size='x'),
+                     dict(audit_path=os.path.join(self.path, 'x'))):
+            with testtools.ExpectedException(exc.BadConfiguration):
+                audit.create_audit_log(**conf)
+
+
+class Identifier(interfaces.Identifies):
+
+    def identify(self, request):
+        request.env[self.IDENTITY_ENV_KEY] = interfaces.Identity('alice')
+        return True
+
+
+class Authenticator(interfaces.Authenticates):
+
+    def authenticate(self, identity):
+        return True
+
+
+class TestAuditMiddleware(base.TestCase):
+
+    def test_decisions_recorded(self):
+        tmp = self.useFixture(fixtures.TempDir()).path
+        path = os.path.join(tmp, 'audit.log')
+        self.useFixture(fixtures.MockPatch('atexit.register'))
+        m = middleware.Middleware([Identifier()], [Authenticator()],
+                                  default_authorize=True, audit_path=path)
+        req = mock.MagicMock()
+        req.env = dict(ENV)
+        m(req, None, {})
+        m.audit.close()
+        with open(path) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual([('identify', True), ('authenticate', True),
+                          ('authorize', True)],
+                         [(r['stage'], r['ok']) for r in records])
+        self.assertEqual('alice', records[1]['login'])
@@ -0,0 +1,146 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import os
+import threading
+
+import falcon
+import fixtures
+import mock
+import testtools
+
+from talons import exc
+from talons import stats
+from talons.auth import bloom
+from talons.auth import interfaces
+from talons.auth import middleware
+
+from tests import base
+
+
+class TestBloomFilter(base.TestCase):
+
+    def test_no_false_negatives(self):
+        b = bloom.BloomFilter(1000, error_rate=0.01)
+        logins = ['user{0}'.format(x) for x in range(1000)]
+        for login in logins:
+            b.add(login)
+        self.assertTrue(all(login in b for login in logins))
+        false_positives = sum('other{0}'.format(x) in b
+                              for x in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_max_bytes(self):
+        b = bloom.BloomFilter(100000, error_rate=0.0001, max_bytes=1024)
+        self.assertEqual(1024, len(b.array))
+        self.assertGreater(b.error_rate, 0.0001)
+
+
+class TestLoginFilter(base.TestCase):
+
+    def setUp(self):
+        super(TestLoginFilter, self).setUp()
+        tmp = self.useFixture(fixtures.TempDir()).path
+        self.path = os.path.join(tmp, 'logins')
+        with open(self.path, 'w') as f:
+            f.write('# exported\nalice:$apr1$x$y\n\nbob\n')
+
+    def test_file_logins(self):
+        self.assertEqual(['alice', 'bob'], bloom.file_logins(self.path))
+
+    def test_rebuild(self):
+        logins = ['alice']
+        f = bloom.LoginFilter(lambda: logins)
+        self.assertFalse(f.might_exist('bob'))
+        logins.append('bob')
+        f.rebuild()
+        self.assertTrue(f.might_exist('bob'))
+
+        # A failing source keeps the current filter
+        f.source = mock.MagicMock(side_effect=IOError('gone'))
+        f.rebuild()
+        self.assertTrue(f.might_exist('bob'))
+
+    def test_background_rebuild(self):
+        rebuilt = threading.Event()
+
+        def source():
+            if f is not None:
+                rebuilt.set()
+            return ['alice']
+
+        f = None
+        f = bloom.LoginFilter(source, rebuild_interval=0.01)
+        self.addCleanup(f.stop)
+        self.assertTrue(rebuilt.wait(5))
+
+    def test_create(self):
+        self.assertIsNone(bloom.create_login_filter())
+        f = bloom.create_login_filter(login_filter_path=self.path,
+                                      login_filter_error_rate='0.01',
+                                      login_filter_rebuild_interval=0)
+        self.assertTrue(f.might_exist('alice'))
+        self.assertAlmostEqual(0.01, f.error_rate)
+        latin1 = self.path + '.latin1'
+        with open(latin1, 'wb') as out:
+            out.write(b'j\xe9r\xf4me:x\n')
+        for conf in (dict(login_filter_path=self.path,
+                          login_filter_callable=list),
+                     dict(login_filter_path=self.path,
+                          login_filter_error_rate=2),
+                     dict(login_filter_path=self.path + '.missing'),
+                     dict(login_filter_path=latin1),
+                     dict(login_filter_callable='no.such.function')):
+            with testtools.ExpectedException(exc.BadConfiguration):
+                bloom.create_login_filter(**conf)
+
+
+class Identifier(interfaces.Identifies):
+
+    def identify(self, request):
+        login = request.env['HTTP_X_LOGIN']
+        request.env[self.IDENTITY_ENV_KEY] = interfaces.Identity(login)
+        return True
+
+
+class Authenticator(interfaces.Authenticates):
+
+    calls = 0
+
+    def authenticate(self, identity):
+        self.calls += 1
+        return True
+
+
+class TestLoginFilterMiddleware(base.TestCase):
+
+    def test_unknown_login_rejected(self):
+        sink = stats.InMemorySink()
+        authenticator = Authenticator()
+        m = middleware.Middleware([Identifier()], [authenticator],
+                                  default_authorize=True, stats_sink=sink,
+                                  login_filter_callable=lambda: ['alice'],
+                                  login_filter_rebuild_interval=0)
+        req = mock.MagicMock()
+        req.env = {'HTTP_X_LOGIN': 'alice'}
+        m(req, None, {})
+        self.assertTrue(req.env['wsgi.authenticated'])
+        req.env = {'HTTP_X_LOGIN': 'mallory'}
+        with testtools.ExpectedException(falcon.HTTPUnauthorized):
+            m(req, None, {})
+        self.assertEqual(1, authenticator.calls)
+        self.assertEqual(1, sink.snapshot()[0]['login_filter.rejected'])
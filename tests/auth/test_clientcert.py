@@ -0,0 +1,107 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import mock
+import testtools
+
+from talons import exc
+from talons.auth import clientcert
+from talons.auth import interfaces
+
+from tests import base
+
+
+class TestClientCert(base.TestCase):
+
+    def _request(self, env, header=None):
+        req = mock.MagicMock()
+        req.env = env
+        req.get_header.return_value = header
+        return req
+
+    def test_parse_dn(self):
+        expected = [('C', 'US'), ('O', 'Acme'), ('OU', 'eng'),
+                    ('CN', 'alice')]
+        self.assertEqual(expected,
+                         clientcert.parse_dn('/C=US/O=Acme/OU=eng/CN=alice'))
+        self.assertEqual(list(reversed(expected)),
+                         clientcert.parse_dn('CN=alice,OU=eng,O=Acme,C=US'))
+        self.assertEqual([('CN', 'Smith, Bob'), ('O', 'Acme')],
+                         clientcert.parse_dn(r'CN=Smith\, Bob,O=Acme'))
+        with testtools.ExpectedException(ValueError):
+            clientcert.parse_dn('not a dn')
+
+    def test_bad_cache_size(self):
+        with testtools.ExpectedException(exc.BadConfiguration):
+            clientcert.Identifier(clientcert_cache_size=0)
+        with testtools.ExpectedException(exc.BadConfiguration):
+            clientcert.Identifier(clientcert_cache_size='lots')
+
+    def test_identify(self):
+        i = clientcert.Identifier(clientcert_role_attrs='CN')
+        env = {'SSL_CLIENT_S_DN': 'CN=alice,OU=eng,OU=ops,O=Acme',
+               'SSL_CLIENT_VERIFY': 'SUCCESS'}
+        req = self._request(env)
+        self.assertTrue(i.identify(req))
+        identity = env['wsgi.identity']
+        self.assertEqual('alice', identity.login)
+        self.assertEqual(set(['alice']), identity.roles)
+        self.assertEqual(set(['eng', 'ops']), identity.groups)
+        self.assertTrue(isinstance(identity.key, clientcert.CertificateKey))
+        self.assertFalse(req.get_header.called)
+
+    def test_identify_cached(self):
+        i = clientcert.Identifier()
+        parse_mock = self.patch('talons.auth.clientcert.parse_dn',
+                                wraps=clientcert.parse_dn)
+        for x in range(3):
+            env = {'SSL_CLIENT_S_DN': '/O=Acme/CN=alice'}
+            self.assertTrue(i.identify(self._request(env)))
+            env['wsgi.identity'].roles.add('mutated')
+        self.assertEqual(1, parse_mock.call_count)
+        self.assertEqual(2, i.subjects.hits)
+        self.assertEqual(set(['mutated']), env['wsgi.identity'].roles)
+
+    def test_identify_not_verified(self):
+        i = clientcert.Identifier()
+        env = {'SSL_CLIENT_S_DN': 'CN=alice',
+               'SSL_CLIENT_VERIFY': 'FAILED:unable to get issuer'}
+        self.assertFalse(i.identify(self._request(env)))
+        self.assertNotIn('wsgi.identity', env)
+
+    def test_identify_header(self):
+        i = clientcert.Identifier(clientcert_header='X-Client-DN')
+        env = {}
+        req = self._request(env, header='CN=bob,O=Acme')
+        self.assertTrue(i.identify(req))
+        req.get_header.assert_called_once_with('X-Client-DN')
+        self.assertEqual('bob', env['wsgi.identity'].login)
+
+    def test_identify_missing(self):
+        i = clientcert.Identifier()
+        self.assertFalse(i.identify(self._request({})))
+        env = {'SSL_CLIENT_S_DN': 'O=Acme'}
+        self.assertFalse(i.identify(self._request(env)))
+        env = {'SSL_CLIENT_S_DN': 'garbage'}
+        self.assertFalse(i.identify(self._request(env)))
+
+    def test_authenticate(self):
+        a = clientcert.Authenticator()
+        identity = interfaces.Identity(
+            'alice', key=clientcert.CertificateKey('CN=alice'))
+        self.assertTrue(a.authenticate(identity))
+        identity = interfaces.Identity('alice', key='CN=alice')
+        self.assertFalse(a.authenticate(identity))
@@ -0,0 +1,163 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import base64
+
+import falcon
+from falcon import testing
+
+from talons.auth import basicauth
+from talons.auth import component
+from talons.auth import interfaces
+
+from tests import base
+
+
+class PasswordAuthenticator(interfaces.Authenticates):
+
+    def authenticate(self, identity):
+        return identity.key == 'open sesame'
+
+
+class RouteAuthorizer(interfaces.Authorizes):
+
+    def __init__(self, **conf):
+        self.seen = []
+
+    def authorize(self, identity, resource):
+        self.seen.append((resource.route, resource.resource,
+                          resource.to_string()))
+        return resource.route != '/admin'
+
+
+class Resource(object):
+
+    def on_get(self, req, resp, **kwargs):
+        resp.media = {'login': req.env['wsgi.identity'].login}
+
+
+def _headers(password):
+    creds = base64.b64encode(('Aladdin:' + password).encode('ascii'))
+    return {'Authorization': 'Basic ' + creds.decode('ascii')}
+
+
+class TestComponent(base.TestCase):
+
+    def setUp(self):
+        super(TestComponent, self).setUp()
+        self.authorizer = RouteAuthorizer()
+        self.component = component.create_component(basicauth.Identifier,
+                                                    PasswordAuthenticator,
+                                                    self.authorizer)
+        app = falcon.App(middleware=[self.component])
+        self.resource = Resource()
+        app.add_route('/users/{user_id}', self.resource)
+        app.add_route('/admin', self.resource)
+        self.client = testing.TestClient(app)
+
+    def test_authorized(self):
+        result = self.client.simulate_get('/users/1',
+                                          headers=_headers('open sesame'))
+        self.assertEqual(200, result.status_code)
+        self.assertEqual({'login': 'Aladdin'}, result.json)
+        self.assertEqual([('/users/{user_id}', self.resource,
+                           'users.1.get')], self.authorizer.seen)
+
+    def test_unauthenticated(self):
+        result = self.client.simulate_get('/users/1')
+        self.assertEqual(401, result.status_code)
+        result = self.client.simulate_get('/users/1',
+                                          headers=_headers('wrong'))
+        self.assertEqual(401, result.status_code)
+        self.assertEqual([], self.authorizer.seen)
+
+    def test_no_route_skips_authorization(self):
+        result = self.client.simulate_get('/missing',
+                                          headers=_headers('open sesame'))
+        self.assertEqual(404, result.status_code)
+        self.assertEqual([], self.authorizer.seen)
+
+    def test_forbidden(self):
+        result = self.client.simulate_get('/admin',
+                                          headers=_headers('open sesame'))
+        self.assertEqual(403, result.status_code)
+
+    def test_delay_401_anonymous(self):
+        c = component.create_component(basicauth.Identifier,
+                                       PasswordAuthenticator,
+                                       self.authorizer, delay_401=True)
+        app = falcon.App(middleware=[c])
+        app.add_route('/admin', AnonymousResource())
+        result = testing.TestClient(app).simulate_get('/admin')
+        self.assertEqual(200, result.status_code)
+        self.assertEqual({'identified': False}, result.json)
+        self.assertEqual([], self.authorizer.seen)
+
+
+class AnonymousResource(object):
+
+    def on_get(self, req, resp):
+        resp.media = {'identified': req.env['wsgi.identified']}
+
+
+class TestRouteComponent(base.TestCase):
+
+    def setUp(self):
+        super(TestRouteComponent, self).setUp()
+        self.authorizer = RouteAuthorizer()
+        c = component.create_route_component(
+            {'/articles/{article_id}': dict(
+                identify_with=basicauth.Identifier,
+                authenticate_with=PasswordAuthenticator,
+                default_authorize=True),
+             '/admin*': dict(identify_with=basicauth.Identifier,
+                             authenticate_with=PasswordAuthenticator,
+                             authorize_with=self.authorizer),
+             '/healthz': None},
+            default=dict(identify_with=basicauth.Identifier,
+                         authenticate_with=PasswordAuthenticator))
+        app = falcon.App(middleware=[c])
+        self.resource = Resource()
+        app.add_route('/articles/{article_id}', self.resource)
+        app.add_route('/admin', self.resource)
+        app.add_route('/healthz', AnonymousResource())
+        app.add_route('/users/{user_id}', self.resource)
+        self.client = testing.TestClient(app)
+
+    def test_no_authorization(self):
+        result = self.client.simulate_get('/articles/1',
+                                          headers=_headers('open sesame'))
+        self.assertEqual(200, result.status_code)
+        self.assertEqual([], self.authorizer.seen)
+        result = self.client.simulate_get('/articles/1')
+        self.assertEqual(401, result.status_code)
+
+    def test_prefix(self):
+        result = self.client.simulate_get('/admin',
+                                          headers=_headers('open sesame'))
+        self.assertEqual(403, result.status_code)
+        self.assertEqual([('/admin', self.resource, 'admin.get')],
+                         self.authorizer.seen)
+
+    def test_public(self):
+        result = self.client.simulate_get('/healthz')
+        self.assertEqual(200, result.status_code)
+
+    def test_default(self):
+        result = self.client.simulate_get('/users/1',
+                                          headers=_headers('open sesame'))
+        self.assertEqual(403, result.status_code)
+        self.assertEqual(401, self.client.simulate_get('/users/1').status_code)
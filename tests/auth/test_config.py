@@ -0,0 +1,169 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import json
+import os
+
+import fixtures
+import testtools
+
+from talons import exc
+from talons import stats
+from talons.auth import basicauth
+from talons.auth import config
+from talons.auth import external
+from talons.auth import htpasswd
+
+from tests import base
+
+INI = """
+[talons]
+identify_with = basicauth
+authenticate_with = htpasswd
+authorize_with = external
+delay_401 = yes
+
+[cache]
+ttl = 30
+
+[plugin:htpasswd]
+path = {htpath}
+cache_size = 16
+
+[plugin:external]
+authz_callable = tests.auth.test_config.authorize
+"""
+
+
+def authorize(identity, request_action):
+    return True
+
+
+class TestConfig(base.TestCase):
+
+    def setUp(self):
+        super(TestConfig, self).setUp()
+        self.addCleanup(config.clear)
+        self.tmp = self.useFixture(fixtures.TempDir()).path
+        self.htpath = os.path.join(self.tmp, 'htpasswd')
+        with open(self.htpath, 'w') as f:
+            f.write('alice:$apr1$abcdefgh$xxxxxxxxxxxxxxxxxxxxxx\n')
+
+    def write(self, name, text):
+        path = os.path.join(self.tmp, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def test_ini(self):
+        path = self.write('talons.ini', INI.format(htpath=self.htpath))
+        m = config.load(path)
+        self.assertIsInstance(m.identifiers[0], basicauth.Identifier)
+        authenticator = m.authenticators[0]
+        self.assertIsInstance(authenticator, htpasswd.Authenticator)
+        self.assertEqual((16, 30.0), (authenticator.verified.maxsize,
+                                      authenticator.verified.ttl))
+        self.assertIsInstance(m.authorizer, external.Authorizer)
+        self.assertTrue(m.delay_401)
+
+    def test_frozen(self):
+        path = self.write('talons.ini', INI.format(htpath=self.htpath))
+        m = config.load(path)
+        self.assertIsInstance(m.authenticators, tuple)
+        with testtools.ExpectedException(AttributeError):
+            m.delay_401 = False
+
+    def test_dict_yaml_and_json_agree(self):
+        conf = {
+            'talons': {'identify_with': ['basicauth'],
+                       'authenticate_with': 'htpasswd'},
+            'plugins': {'htpasswd': {'htpasswd_path': self.htpath}},
+        }
+        m = config.load(conf)
+        self.assertIs(m, config.load(self.write('talons.json',
+                                                json.dumps(conf))))
+        yaml_text = ("talons:\n  identify_with: [basicauth]\n"
+                     "  authenticate_with: htpasswd\n"
+                     "plugins:\n  htpasswd:\n    path: {0}\n").format(
+            self.htpath)
+        other = config.load(self.write('talons.yaml', yaml_text))
+        self.assertIsNot(m, other)
+        self.assertIs(m.identifiers[0], other.identifiers[0])
+
+    def test_shared_plugins(self):
+        conf = {
+            'talons': {'identify_with': 'basicauth',
+                       'authenticate_with': 'htpasswd'},
+            'plugins': {'htpasswd': {'path': self.htpath}},
+        }
+        first = config.load(conf)
+        sink = stats.InMemorySink()
+        second = config.load(conf, stats_sink=sink)
+        self.assertIsNot(first, second)
+        self.assertIs(sink, second.stats_sink)
+        config.clear()
+        self.assertIsNot(first, config.load(conf))
+
+    def test_invalid(self):
+        good = {'identify_with': 'basicauth', 'authenticate_with': 'htpasswd'}
+        for conf in ({'talons': {'identify_with': 'basicauth'}},
+                     {'talons': {'authenticate_with': 'htpasswd'}},
+                     {'talons': good, 'caches': {}},
+                     {'talons': dict(good, authorize_with='external,x')},
+                     {'talons': dict(good, identify_with='nope')},
+                     {'talons': good,
+                      'plugins': {'htpasswd': {'path': self.htpath},
+                                  'digest': {'realm': 'x'}}},
+                     {'talons': good, 'plugins': {'htpasswd': {}}},
+                     []):
+            with testtools.ExpectedException(exc.BadConfiguration):
+                config.load(conf)
+
+    def test_unknown_options(self):
+        good = {'identify_with': 'basicauth', 'authenticate_with': 'htpasswd'}
+        section = {'path': self.htpath}
+        for conf, bad in (
+                ({'talons': dict(good, delay_41=True),
+                  'plugins': {'htpasswd': section}}, 'delay_41'),
+                ({'talons': good,
+                  'plugins': {'htpasswd': dict(section, cahce_size=5)}},
+                 'cahce_size'),
+                ({'talons': good, 'cache': {'tll': 5},
+                  'plugins': {'htpasswd': section}}, 'tll')):
+            with testtools.ExpectedException(exc.BadConfiguration,
+                                             '.*' + bad):
+                config.load(conf)
+        # Options of the plugins in the chain, and cache options, may be
+        # given in the talons section
+        m = config.load({'talons': dict(good, htpasswd_path=self.htpath,
+                                        cache_ttl=5, delay_401=True)})
+        self.assertTrue(m.delay_401)
+
+    def test_ini_numbers(self):
+        values = config.parse_ini(
+            "[talons]\na = 5\nb = 10.5\nc = -2\nd = 1.2.3\ne = on\n"
+            "f = 0x10\nassertion_secret = 1234\n")['talons']
+        self.assertEqual({'a': 5, 'b': 10.5, 'c': -2, 'd': '1.2.3', 'e': True,
+                          'f': '0x10', 'assertion_secret': '1234'}, values)
+
+    def test_bad_files(self):
+        for name, text in (('a.ini', '[talons'), ('a.json', '{'),
+                           ('a.yaml', 'talons: [')):
+            with testtools.ExpectedException(exc.BadConfiguration):
+                config.load(self.write(name, text))
+        with testtools.ExpectedException(exc.BadConfiguration):
+            config.load(os.path.join(self.tmp, 'missing.ini'))
@@ -14,11 +14,14 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import sys
+
 import falcon
 import mock
 import testtools
 
 from talons import exc
+from talons import stats
 from talons.auth import middleware
 from talons.auth import interfaces
 
@@ -64,6 +67,25 @@ class TestCreateMiddleware(base.TestCase):
                         interfaces.Authenticates))
         self.assertTrue(isinstance(m.authorizer, interfaces.Authorizes))
 
+    def test_features_imported_lazily(self):
+        features = ['talons.auth.' + name for name in (
+            'adaptive', 'admission', 'assertion', 'audit', 'bloom',
+            'parallel', 'profiling', 'public', 'ratelimit')]
+        with mock.patch.dict(sys.modules):
+            for name in features:
+                sys.modules.pop(name, None)
+            m = middleware.create_middleware(interfaces.Identifies,
+                                             interfaces.Authenticates)
+            self.assertEqual([], [n for n in features if n in sys.modules])
+            m = middleware.create_middleware(interfaces.Identifies,
+                                             interfaces.Authenticates,
+                                             public_paths='/healthz',
+                                             ratelimit_rate=10)
+            self.assertIsNotNone(m.public_paths)
+            self.assertIsNotNone(m.rate_limiter)
+            self.assertEqual(['talons.auth.public', 'talons.auth.ratelimit'],
+                             [n for n in features if n in sys.modules])
+
 
 class TestMiddleware(base.TestCase):
 
@@ -166,3 +188,84 @@ class TestMiddleware(base.TestCase):
                                   delay_403=False)
         with testtools.ExpectedException(falcon.HTTPForbidden):
             m(req, None, None)
+
+    def test_stats(self):
+        class Identifier(interfaces.Identifies):
+            def identify(self, request):
+                return request.env.get('wsgi.identity') is not None
+
+        class Authenticator(interfaces.Authenticates):
+            def authenticate(self, identity):
+                return identity.key == 'open sesame'
+
+        class Authorizer(interfaces.Authorizes):
+            def authorize(self, identity, resource):
+                return False
+
+        req = mock.MagicMock()
+        req.env = {'PATH_INFO': '/users/1'}
+        req.method = 'GET'
+        sink = stats.InMemorySink()
+        m = middleware.Middleware([Identifier()], [Authenticator()],
+                                  Authorizer(), delay_401=True,
+                                  delay_403=True, stats_sink=sink)
+        m(req, None, {})
+        req.env['wsgi.identity'] = interfaces.Identity('Aladdin',
+                                                       key='open sesame')
+        m(req, None, {})
+
+        counters, histograms = sink.snapshot()
+        self.assertEqual({'identify.failure': 1,
+                          'identify.success': 1,
+                          'authenticate.success': 1,
+                          'authorize.failure': 1,
+                          'plugin.test_create_middleware.Identifier.calls': 2,
+                          'plugin.test_create_middleware.Authenticator.calls':
+                          1,
+                          'plugin.test_create_middleware.Authorizer.calls':
+                          1},
+                         counters)
+        self.assertEqual(2, histograms['stage.identify'].count)
+        self.assertEqual(1, histograms['stage.authenticate'].count)
+        self.assertEqual(1, histograms['stage.authorize'].count)
+
+    def test_adaptive_order(self):
+        class Identifier(interfaces.Identifies):
+            def __init__(self, header):
+                self.header = header
+
+            def identify(self, request):
+                if self.header not in request.env:
+                    return False
+                request.env['wsgi.identity'] = interfaces.Identity(
+                    self.header, key=request.env[self.header])
+                return True
+
+        class Authenticator(interfaces.Authenticates):
+            def authenticate(self, identity):
+                return identity.key == 'open sesame'
+
+        first = Identifier('HTTP_AUTHORIZATION')
+        second = Identifier('HTTP_X_API_KEY')
+        sink = stats.InMemorySink()
+        m = middleware.Middleware([first, second], [Authenticator()],
+                                  default_authorize=True, adaptive_order=True,
+                                  adaptive_identifiers=True,
+                                  adaptive_interval=4, stats_sink=sink)
+        for _x in range(4):
+            req = mock.MagicMock()
+            req.env = {'HTTP_X_API_KEY': 'open sesame'}
+            m(req, None, {})
+            self.assertTrue(req.env['wsgi.authenticated'])
+            self.assertEqual('HTTP_X_API_KEY', req.env['wsgi.identity'].login)
+        self.assertEqual([second, first], m.identifier_chain.ordered)
+        # The configured lists are left alone
+        self.assertEqual([first, second], m.identifiers)
+        counters, _histograms = sink.snapshot()
+        self.assertEqual(4, counters['identify.success'])
+
+        # Identifiers keep their order unless adaptive_identifiers is set
+        m = middleware.Middleware([first, second], [Authenticator()],
+                                  adaptive_order=True)
+        self.assertIsNone(m.identifier_chain)
+        self.assertIsNotNone(m.authenticator_chain)
@@ -0,0 +1,193 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import hashlib
+import os
+import tempfile
+
+import mock
+import testtools
+
+from talons import exc
+from talons.auth import digest
+from talons.auth import interfaces
+from talons.auth import middleware
+
+from tests import base
+
+_HTDIGEST = 'Aladdin:lamp:{0}\n'.format(
+    hashlib.md5(b'Aladdin:lamp:open sesame').hexdigest())
+
+
+def _h(algorithm, *parts):
+    fn = hashlib.sha256 if algorithm.startswith('SHA') else hashlib.md5
+    return fn(':'.join(parts).encode('utf-8')).hexdigest()
+
+
+def _header(nonce, method='GET', uri='/users/1', nc='00000001',
+            algorithm='MD5', password='open sesame', **overrides):
+    ha1 = _h(algorithm, 'Aladdin', 'lamp', password)
+    ha2 = _h(algorithm, method, uri)
+    response = _h(algorithm, ha1, nonce, nc, 'xyz', 'auth', ha2)
+    params = dict(username='Aladdin', realm='lamp', nonce=nonce, uri=uri,
+                  response=response, qop='auth', nc=nc, cnonce='xyz',
+                  algorithm=algorithm)
+    params.update(overrides)
+    return 'Digest ' + ', '.join('{0}="{1}"'.format(k, v)
+                                 for k, v in sorted(params.items()))
+
+
+class TestNonceStore(base.TestCase):
+
+    def test_use(self):
+        store = digest.NonceStore()
+        nonce = store.issue()
+        self.assertTrue(store.use(nonce, 1))
+        self.assertFalse(store.use(nonce, 1))
+        self.assertTrue(store.use(nonce, 3))
+        self.assertFalse(store.use(nonce, 2))
+        self.assertFalse(store.use('unknown', 1))
+
+    def test_expiry(self):
+        now = [1000.0]
+        store = digest.NonceStore(ttl=10, slots=5, clock=lambda: now[0])
+        nonce = store.issue()
+        now[0] += 5
+        self.assertTrue(store.use(nonce, 1))
+        now[0] += 10
+        self.assertFalse(store.use(nonce, 2))
+        self.assertEqual(0, len(store))
+
+    def test_bounded(self):
+        store = digest.NonceStore(max_nonces=3)
+        first = store.issue()
+        for x in range(10):
+            last = store.issue()
+        self.assertEqual(3, len(store))
+        self.assertFalse(store.use(first, 1))
+        self.assertTrue(store.use(last, 1))
+
+
+class TestDigest(base.TestCase):
+
+    def setUp(self):
+        super(TestDigest, self).setUp()
+        fd, self.htpath = tempfile.mkstemp()
+        os.write(fd, _HTDIGEST.encode('ascii'))
+        os.close(fd)
+        self.addCleanup(os.unlink, self.htpath)
+
+    def _request(self, auth, path='/users/1', query=''):
+        req = mock.MagicMock()
+        req.auth = auth
+        req.method = 'GET'
+        req.env = {'PATH_INFO': path, 'QUERY_STRING': query}
+        return req
+
+    def _identity(self, auth, **kwargs):
+        req = self._request(auth, **kwargs)
+        self.assertTrue(digest.Identifier().identify(req))
+        return req.env['wsgi.identity']
+
+    def test_parse_header(self):
+        params = digest.parse_header(
+            'Digest username="Ala\\"ddin", realm="lamp", nc=00000001')
+        self.assertEqual(dict(username='Ala"ddin', realm='lamp',
+                              nc='00000001'), params)
+        self.assertIsNone(digest.parse_header('Basic QWxhZGRpbg=='))
+
+    def test_identify(self):
+        i = digest.Identifier()
+        self.assertFalse(i.identify(self._request(None)))
+        self.assertFalse(i.identify(self._request('Basic QWxhZGRpbg==')))
+        self.assertFalse(i.identify(self._request('Digest username="x"')))
+        self.assertFalse(i.identify(self._request(_header('n'),
+                                                  path='/other')))
+        identity = self._identity(_header('n', uri='/users/1?q=1'),
+                                  query='q=1')
+        self.assertEqual('Aladdin', identity.login)
+        self.assertEqual('GET', identity.key.method)
+        self.assertEqual('n', identity.key.params['nonce'])
+
+    def test_bad_config(self):
+        with testtools.ExpectedException(exc.BadConfiguration):
+            digest.Authenticator()
+        with testtools.ExpectedException(exc.BadConfiguration):
+            digest.Authenticator(digest_realm='lamp')
+        with testtools.ExpectedException(exc.BadConfiguration):
+            digest.Authenticator(digest_realm='lamp',
+                                 digest_htdigest_path='/does/not/exist')
+        with testtools.ExpectedException(exc.BadConfiguration):
+            digest.Authenticator(digest_realm='lamp',
+                                 digest_htdigest_path=self.htpath,
+                                 digest_algorithm='SHA-256')
+        with testtools.ExpectedException(exc.BadConfiguration):
+            digest.Authenticator(digest_realm='lamp',
+                                 digest_ha1_callable='not.exist.function')
+
+    def test_authenticate_htdigest(self):
+        a = digest.Authenticator(digest_realm='lamp',
+                                 digest_htdigest_path=self.htpath)
+        challenge = a.challenge()
+        self.assertTrue(challenge.startswith('Digest realm="lamp"'))
+        nonce = challenge.split('nonce="')[1].rstrip('"')
+
+        self.assertTrue(a.authenticate(self._identity(_header(nonce))))
+        # Replay of the same nonce count is rejected
+        self.assertFalse(a.authenticate(self._identity(_header(nonce))))
+        self.assertTrue(a.authenticate(
+            self._identity(_header(nonce, nc='00000002'))))
+        self.assertFalse(a.authenticate(
+            self._identity(_header(nonce, nc='00000003',
+                                   password='wrong'))))
+        # A forged request does not consume the nonce count
+        self.assertTrue(a.authenticate(
+            self._identity(_header(nonce, nc='00000003'))))
+        self.assertFalse(a.authenticate(
+            self._identity(_header('never-issued'))))
+        self.assertFalse(a.authenticate(
+            interfaces.Identity('Aladdin', key='open sesame')))
+
+    def test_authenticate_callable(self):
+        ha1fn = mock.MagicMock()
+        ha1fn.side_effect = lambda login, realm, alg: (
+            _h(alg, login, realm, 'open sesame') if login == 'Aladdin'
+            else None)
+        a = digest.Authenticator(digest_realm='lamp',
+                                 digest_ha1_callable=ha1fn,
+                                 digest_algorithm='SHA-256')
+        self.assertIn('algorithm=SHA-256', a.challenge())
+        for nc in ('00000001', '00000002'):
+            nonce = a.nonces.issue()
+            identity = self._identity(_header(nonce, nc=nc,
+                                              algorithm='SHA-256'))
+            self.assertTrue(a.authenticate(identity))
+        # HA1 is only looked up once
+        ha1fn.assert_called_once_with('Aladdin', 'lamp', 'SHA-256')
+
+        nonce = a.nonces.issue()
+        identity = self._identity(_header(nonce, username='Jafar'))
+        identity.login = 'Jafar'
+        self.assertFalse(a.authenticate(identity))
+
+    def test_middleware_challenge(self):
+        a = digest.Authenticator(digest_realm='lamp',
+                                 digest_htdigest_path=self.htpath)
+        m = middleware.Middleware([digest.Identifier()], [a])
+        headers = m.challenge_headers()
+        self.assertTrue(
+            headers['WWW-Authenticate'].startswith('Digest realm="lamp"'))
+        self.assertEqual(1, len(a.nonces))
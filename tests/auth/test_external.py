@@ -19,6 +19,7 @@ import testtools
 
 from talons import exc
 from talons.auth import external
+from talons.auth import interfaces
 
 from tests import base
 
@@ -73,3 +74,64 @@ class TestExternal(base.TestCase):
             self.assertEquals('this', auth.authenticate('this'))
             self.assertFalse(auth.sets_roles())
             self.assertFalse(auth.sets_groups())
+
+    def test_callout_timed(self):
+        def authme(identity):
+            return True
+
+        sink = mock.MagicMock()
+        with mock.patch('talons.helpers.import_function') as mocked:
+            mocked.return_value = authme
+            conf = dict(external_authfn='authme', stats_sink=sink)
+            auth = external.Authenticator(**conf)
+            self.assertTrue(auth.authenticate('this'))
+            self.assertEqual('external_callout.authenticate',
+                             sink.observe.call_args[0][0])
+
+    def test_authentication_cached(self):
+        calls = []
+
+        def authme(identity):
+            calls.append(identity.login)
+            identity.roles.add('admin')
+            return identity.key == 'pw'
+
+        auth = external.Authenticator(external_authn_callable=authme,
+                                      external_sets_roles=True,
+                                      external_authn_cache_ttl=60)
+        self.assertTrue(auth.is_expensive(interfaces.Identity('a', 'pw')))
+        self.assertTrue(auth.authenticate(interfaces.Identity('a', 'pw')))
+        identity = interfaces.Identity('a', 'pw')
+        self.assertFalse(auth.is_expensive(identity))
+        self.assertTrue(auth.authenticate(identity))
+        self.assertEqual(set(['admin']), identity.roles)
+        self.assertFalse(auth.authenticate(interfaces.Identity('a', 'no')))
+        self.assertFalse(auth.authenticate(interfaces.Identity('a', 'no')))
+        self.assertEqual(['a', 'a', 'a'], calls)
+
+    def test_authorization_cached(self):
+        authz = mock.MagicMock(return_value=True)
+
+        def authorizeme(identity, request_action):
+            return authz(identity, request_action)
+
+        auth = external.Authorizer(external_authz_callable=authorizeme,
+                                   external_authz_cache_ttl=60)
+        action = mock.MagicMock()
+        action.to_string.return_value = 'users.123.get'
+        alice = interfaces.Identity('alice', roles=['admin'])
+        self.assertTrue(auth.authorize(alice, action))
+        self.assertTrue(auth.authorize(alice, action))
+        self.assertEqual(1, authz.call_count)
+        authz.return_value = False
+        bob = interfaces.Identity('bob', roles=['admin'])
+        self.assertFalse(auth.authorize(bob, action))
+        self.assertFalse(auth.authorize(bob, action))
+        action.to_string.return_value = 'users.123.delete'
+        self.assertFalse(auth.authorize(alice, action))
+        self.assertEqual(3, authz.call_count)
+
+    def test_bad_cache_options(self):
+        with testtools.ExpectedException(exc.BadConfiguration):
+            external.Authenticator(external_authn_callable=lambda i: True,
+                                   external_authn_cache_ttl='soon')
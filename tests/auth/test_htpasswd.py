@@ -14,11 +14,20 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import gc
+import os
+import weakref
+
+import fixtures
 import mock
+from passlib import apache
 import testtools
 
+from talons import cache
 from talons import exc
+from talons.auth import admission
 from talons.auth import htpasswd
+from talons.auth import interfaces
 
 from tests import base
 
@@ -51,3 +60,172 @@ class TestExternal(base.TestCase):
                 htf.check_password = chk_mock
                 auth.authenticate(id_mock)
                 chk_mock.assert_called_once_with('foo', 'bar')
+
+    def test_reload_timed(self):
+        sink = mock.MagicMock()
+        with mock.patch('os.path.exists') as ope_mock:
+            ope_mock.return_value = True
+            with mock.patch('passlib.apache.HtpasswdFile') as htf_mock:
+                conf = dict(htpasswd_path='foo', stats_sink=sink,
+                            htpasswd_reload_interval=30)
+                auth = htpasswd.Authenticator(**conf)
+                sink.observe.assert_called_once_with('htpasswd_reload',
+                                                     mock.ANY)
+                htf = htf_mock.return_value
+                id_mock = mock.MagicMock()
+
+                auth.authenticate(id_mock)
+                self.assertFalse(htf.load_if_changed.called)
+
+                auth._next_check = 0
+                htf.load_if_changed.return_value = True
+                auth.authenticate(id_mock)
+                htf.load_if_changed.assert_called_once_with()
+                self.assertEqual(2, sink.observe.call_count)
+
+    def test_verified_cache(self):
+        with mock.patch('os.path.exists') as ope_mock:
+            ope_mock.return_value = True
+            with mock.patch('passlib.apache.HtpasswdFile') as htf_mock:
+                auth = htpasswd.Authenticator(htpasswd_path='foo',
+                                              htpasswd_reload_interval=30,
+                                              htpasswd_cache_size=16)
+                htf = htf_mock.return_value
+                htf.check_password.return_value = True
+                identity = interfaces.Identity('foo', key='bar')
+                self.assertTrue(auth.is_expensive(identity))
+                self.assertTrue(auth.authenticate(identity))
+                self.assertFalse(auth.is_expensive(identity))
+                self.assertTrue(auth.authenticate(identity))
+                self.assertEqual(1, htf.check_password.call_count)
+
+                # A different password is checked again
+                htf.check_password.return_value = False
+                other = interfaces.Identity('foo', key='baz')
+                self.assertTrue(auth.is_expensive(other))
+                self.assertFalse(auth.authenticate(other))
+
+                # Reloading the file clears the cache
+                htf.load_if_changed.return_value = True
+                auth.reload_if_changed()
+                self.assertTrue(auth.is_expensive(identity))
+
+    def test_one_lookup_under_admission(self):
+        with mock.patch('os.path.exists', return_value=True):
+            with mock.patch('passlib.apache.HtpasswdFile') as htf_mock:
+                auth = htpasswd.Authenticator(htpasswd_path='foo',
+                                              htpasswd_cache_size=16)
+                htf_mock.return_value.check_password.return_value = True
+                controller = admission.AdmissionController(1)
+                for _x in range(2):
+                    identity = interfaces.Identity('foo', key='bar')
+                    with mock.patch.object(auth.verified, 'get',
+                                           wraps=auth.verified.get) as get:
+                        self.assertTrue(controller.call(auth, identity))
+                    self.assertEqual(1, get.call_count)
+                self.assertEqual((1, 1), (auth.verified.hits,
+                                          auth.verified.misses))
+
+    def test_verified_cache_disabled(self):
+        with mock.patch('os.path.exists') as ope_mock:
+            ope_mock.return_value = True
+            with mock.patch('passlib.apache.HtpasswdFile'):
+                auth = htpasswd.Authenticator(htpasswd_path='foo')
+                self.assertIsNone(auth.verified)
+                self.assertTrue(auth.is_expensive(mock.MagicMock()))
+                with testtools.ExpectedException(exc.BadConfiguration):
+                    htpasswd.Authenticator(htpasswd_path='foo',
+                                           htpasswd_cache_size='x')
+
+
+class TestSnapshot(base.TestCase):
+
+    def setUp(self):
+        super(TestSnapshot, self).setUp()
+        tmp = self.useFixture(fixtures.TempDir()).path
+        self.htpath = os.path.join(tmp, 'htpasswd')
+        self.snapshot_path = os.path.join(tmp, 'snapshot.json')
+        self.write_htpasswd('s3cr3t')
+        self.register = self.useFixture(
+            fixtures.MockPatch('atexit.register')).mock
+        self.useFixture(fixtures.MockPatch(
+            'talons.auth.htpasswd._snapshot_hook', False))
+
+    def write_htpasswd(self, password):
+        htfile = apache.HtpasswdFile(self.htpath, new=True)
+        htfile.set_password('alice', password)
+        htfile.save()
+
+    def authenticator(self, secret='key'):
+        return htpasswd.Authenticator(
+            htpasswd_path=self.htpath, cache_secret=secret,
+            htpasswd_cache_size=16,
+            htpasswd_snapshot_path=self.snapshot_path)
+
+    def test_warm_restart(self):
+        auth = self.authenticator()
+        self.assertTrue(auth.authenticate(interfaces.Identity('alice',
+                                                              's3cr3t')))
+        auth.save_snapshot()
+        with open(self.snapshot_path) as f:
+            data = f.read()
+        self.assertNotIn('alice', data)
+        self.assertNotIn('s3cr3t', data)
+
+        auth = self.authenticator()
+        self.assertEqual(1, len(auth.warm))
+        identity = interfaces.Identity('alice', 's3cr3t')
+        self.assertFalse(auth.is_expensive(identity))
+        with mock.patch.object(auth.htfile, 'check_password') as check:
+            self.assertTrue(auth.authenticate(identity))
+            self.assertFalse(check.called)
+        self.assertTrue(auth.is_expensive(interfaces.Identity('alice',
+                                                              'wrong')))
+
+        # Warm entries that were never used are saved again
+        auth.warm[b'\x01' * 32] = 1e12
+        auth.save_snapshot()
+        self.assertEqual(2, len(self.authenticator().warm))
+
+    def test_one_exit_hook(self):
+        auth = self.authenticator()
+        self.authenticator()
+        self.register.assert_called_once_with(htpasswd._save_snapshots)
+        with mock.patch.object(htpasswd.Authenticator,
+                               'save_snapshot') as save:
+            htpasswd._save_snapshots()
+        self.assertEqual(1, save.call_count)
+        # Dropped authenticators, e.g. of evicted tenants, can be freed
+        ref = weakref.ref(auth)
+        del auth
+        gc.collect()
+        self.assertIsNone(ref())
+
+    def test_invalidated(self):
+        auth = self.authenticator()
+        auth.authenticate(interfaces.Identity('alice', 's3cr3t'))
+        auth.save_snapshot()
+        self.assertEqual({}, self.authenticator(secret='other').warm)
+        self.write_htpasswd('n3w')
+        self.assertEqual({}, self.authenticator().warm)
+
+    def test_requires_secret(self):
+        with testtools.ExpectedException(exc.BadConfiguration):
+            self.authenticator(secret=None)
+
+    def test_shared_cache_keyed_by_file(self):
+        other = os.path.join(os.path.dirname(self.htpath), 'other')
+        htfile = apache.HtpasswdFile(other, new=True)
+        htfile.set_password('alice', 'different')
+        htfile.save()
+        mtime = os.stat(self.htpath).st_mtime
+        os.utime(other, (mtime, mtime))
+        shared = cache.LRUCache(16)
+        identity = interfaces.Identity('alice', 's3cr3t')
+        auths = [htpasswd.Authenticator(htpasswd_path=path,
+                                        htpasswd_cache_size=16,
+                                        cache_backend=lambda *args: shared)
+                 for path in (self.htpath, other)]
+        self.assertTrue(auths[0].authenticate(identity))
+        self.assertTrue(auths[1].is_expensive(identity))
+        self.assertFalse(auths[1].authenticate(identity))
@@ -58,84 +58,64 @@ class TestHttpHeader(base.TestCase):
 
     def test_identify_no_headers(self):
         req = mock.MagicMock()
-        req.env = mock.MagicMock()
-        req.env.get = mock.MagicMock()
-        req.env.get.side_effect = [None]
-        gh_mock = mock.MagicMock()
-        gh_mock.side_effect = [None, None]
-        req.get_header = gh_mock
+        req.env = {}
 
         conf = dict(httpheader_user='x-user',
                     httpheader_key='x-key',
                     httpheader_tenant='x-tenant')
         i = httpheader.Identifier(**conf)
-        i.identify(req)
-        req.env.get.assert_called_once_with('wsgi.identity')
-        expected = [mock.call('x-user'), mock.call('x-key')]
-        self.assertEquals(expected, gh_mock.call_args_list)
+        self.assertFalse(i.identify(req))
+        self.assertEqual({}, req.env)
+        self.assertFalse(req.get_header.called)
 
     def test_identify_identity_already_exist(self):
         req = mock.MagicMock()
-        req.env = mock.MagicMock()
-        req.env.get = mock.MagicMock()
-        req.env.get.side_effect = ['something']
+        req.env = {'wsgi.identity': 'something'}
 
         conf = dict(httpheader_user='x-user',
                     httpheader_key='x-key')
         i = httpheader.Identifier(**conf)
-        i.identify(req)
-        req.env.get.assert_called_once_with('wsgi.identity')
+        self.assertTrue(i.identify(req))
+        self.assertEqual('something', req.env['wsgi.identity'])
 
     def test_identify_missing_headers(self):
         req = mock.MagicMock()
-        req.env = mock.MagicMock()
-        req.env.get = mock.MagicMock()
-        req.env.get.side_effect = [None]
-        gh_mock = mock.MagicMock()
-        gh_mock.side_effect = ['Aladdin', None]
-        req.get_header = gh_mock
+        req.env = {'HTTP_X_USER': 'Aladdin'}
 
         conf = dict(httpheader_user='x-user',
                     httpheader_key='x-key',
                     httpheader_tenant='x-tenant')
         i = httpheader.Identifier(**conf)
-        i.identify(req)
-        req.env.get.assert_called_once_with('wsgi.identity')
-        expected = [mock.call('x-user'), mock.call('x-key')]
-        self.assertEquals(expected, gh_mock.call_args_list)
+        self.assertFalse(i.identify(req))
+        self.assertNotIn('wsgi.identity', req.env)
 
     def test_identify_valid_headers(self):
         req = mock.MagicMock()
-        req.env = mock.MagicMock()
-        req.env.get = mock.MagicMock()
-        req.env.get.side_effect = [None]
-        gh_mock = mock.MagicMock()
-        gh_mock.side_effect = ['Aladdin', 'open sesame']
-        req.get_header = gh_mock
+        req.env = {'HTTP_X_USER': 'Aladdin',
+                   'HTTP_X_KEY': 'open sesame'}
 
         conf = dict(httpheader_user='x-user',
                     httpheader_key='x-key')
         i = httpheader.Identifier(**conf)
-        i.identify(req)
-        req.env.get.assert_called_once_with('wsgi.identity')
-        expected = [mock.call('x-user'), mock.call('x-key')]
-        self.assertEquals(expected, gh_mock.call_args_list)
+        self.assertTrue(i.identify(req))
+        identity = req.env['wsgi.identity']
+        self.assertEqual('Aladdin', identity.login)
+        self.assertEqual('open sesame', identity.key)
+        self.assertFalse(hasattr(identity, 'tenant'))
 
         req = mock.MagicMock()
-        req.env = mock.MagicMock()
-        req.env.get = mock.MagicMock()
-        req.env.get.side_effect = [None]
-        gh_mock = mock.MagicMock()
-        gh_mock.side_effect = ['Aladdin', 'open sesame', 'genie']
-        req.get_header = gh_mock
-
-        conf = dict(httpheader_user='x-user',
-                    httpheader_key='x-key',
-                    httpheader_tenant='x-tenant')
+        req.env = {'HTTP_X_USER': 'Aladdin',
+                   'HTTP_X_KEY': 'open sesame',
+                   'HTTP_X_TENANT': 'genie'}
+
+        conf = dict(httpheader_user='X-User',
+                    httpheader_key='X-Key',
+                    httpheader_tenant='X-Tenant',
+                    httpheader_domain='X-Domain')
         i = httpheader.Identifier(**conf)
-        i.identify(req)
-        req.env.get.assert_called_once_with('wsgi.identity')
-        expected = [mock.call('x-user'),
-                    mock.call('x-key'),
-                    mock.call('x-tenant')]
-        self.assertEquals(expected, gh_mock.call_args_list)
+        self.assertTrue(i.identify(req))
+        identity = req.env['wsgi.identity']
+        self.assertEqual('Aladdin', identity.login)
+        self.assertEqual('open sesame', identity.key)
+        self.assertEqual('genie', identity.tenant)
+        self.assertIsNone(identity.domain)
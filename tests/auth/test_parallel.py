@@ -0,0 +1,138 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import threading
+
+import mock
+import testtools
+
+from talons import exc
+from talons.auth import interfaces
+from talons.auth import middleware
+from talons.auth import parallel
+
+from tests import base
+
+
+class Authenticator(interfaces.Authenticates):
+
+    def __init__(self, result, role=None, wait=None, error=None):
+        self.result = result
+        self.role = role
+        self.wait = wait
+        self.error = error
+        self.called = threading.Event()
+
+    def authenticate(self, identity):
+        self.called.set()
+        if self.wait is not None:
+            self.wait.wait(5)
+        if self.error is not None:
+            raise self.error
+        if self.role is not None:
+            identity.roles.add(self.role)
+        return self.result
+
+
+class TestFanOut(base.TestCase):
+
+    def setUp(self):
+        super(TestFanOut, self).setUp()
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def test_first_success_wins(self):
+        slow = Authenticator(True, role='slow', wait=self.release)
+        fast = Authenticator(True, role='fast')
+        fan_out = parallel.FanOut([slow, fast])
+        identity = interfaces.Identity('Aladdin', roles=['user'])
+        self.assertTrue(fan_out.authenticate(identity))
+        self.assertEqual(set(['user', 'fast']), identity.roles)
+        self.release.set()
+        fan_out.shutdown()
+
+    def test_all_fail(self):
+        fan_out = parallel.FanOut([Authenticator(False),
+                                   Authenticator(False)])
+        identity = interfaces.Identity('Aladdin')
+        self.assertFalse(fan_out.authenticate(identity))
+
+    def test_loser_does_not_modify_identity(self):
+        failing = Authenticator(False, role='loser')
+        ok = Authenticator(True)
+        fan_out = parallel.FanOut([failing, ok])
+        identity = interfaces.Identity('Aladdin')
+        self.assertTrue(fan_out.authenticate(identity))
+        self.assertEqual(set(), identity.roles)
+
+    def test_deadline(self):
+        slow = Authenticator(True, wait=self.release)
+        fan_out = parallel.FanOut([slow, Authenticator(False)], timeout=0.05)
+        identity = interfaces.Identity('Aladdin')
+        self.assertFalse(fan_out.authenticate(identity))
+        self.assertEqual(set(), identity.roles)
+
+    def test_error_raised_if_no_success(self):
+        fan_out = parallel.FanOut([Authenticator(False),
+                                   Authenticator(False,
+                                                 error=ValueError('boom'))])
+        with testtools.ExpectedException(ValueError):
+            fan_out.authenticate(interfaces.Identity('Aladdin'))
+        fan_out = parallel.FanOut([Authenticator(True),
+                                   Authenticator(False,
+                                                 error=ValueError('boom'))])
+        self.assertTrue(fan_out.authenticate(interfaces.Identity('Aladdin')))
+
+    def test_pending_cancelled(self):
+        blocking = Authenticator(False, wait=self.release)
+        queued = Authenticator(True)
+        ok = Authenticator(True)
+        fan_out = parallel.FanOut([blocking, ok, queued], workers=1,
+                                  timeout=0.05)
+        self.assertFalse(fan_out.authenticate(interfaces.Identity('Aladdin')))
+        self.release.set()
+        fan_out.executor.shutdown(wait=True)
+        self.assertFalse(queued.called.is_set())
+
+
+class TestCreateFanOut(base.TestCase):
+
+    def test_disabled(self):
+        a = [Authenticator(True), Authenticator(True)]
+        self.assertIsNone(parallel.create_fan_out(a))
+        self.assertIsNone(parallel.create_fan_out(a[:1],
+                                                  parallel_authenticate=True))
+
+    def test_bad_options(self):
+        a = [Authenticator(True), Authenticator(True)]
+        for conf in (dict(parallel_timeout='x'), dict(parallel_timeout=0),
+                     dict(parallel_workers=-1)):
+            with testtools.ExpectedException(exc.BadConfiguration):
+                parallel.create_fan_out(a, parallel_authenticate=True, **conf)
+
+    def test_middleware(self):
+        a = [Authenticator(False), Authenticator(True, role='admin')]
+        m = middleware.Middleware([mock.MagicMock()], a,
+                                  default_authorize=True,
+                                  parallel_authenticate=True,
+                                  parallel_timeout=5)
+        identity = interfaces.Identity('Aladdin')
+        req = mock.MagicMock()
+        req.env = {'wsgi.identity': identity}
+        m(req, None, {})
+        self.assertTrue(req.env['wsgi.authenticated'])
+        self.assertEqual(set(['admin']), identity.roles)
@@ -0,0 +1,84 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import subprocess
+import sys
+
+import mock
+import testtools
+
+from talons import exc
+from talons.auth import basicauth
+from talons.auth import interfaces
+from talons.auth import middleware
+from talons.auth import plugins
+
+from tests import base
+
+
+class Authenticator(interfaces.Authenticates):
+
+    def authenticate(self, identity):
+        return True
+
+
+class TestPlugins(base.TestCase):
+
+    def test_builtin(self):
+        self.assertIs(basicauth.Identifier,
+                      plugins.load('basicauth', plugins.IDENTIFIER))
+        self.assertIn('htpasswd', plugins.names())
+
+    def test_dotted_path(self):
+        self.assertIs(Authenticator, plugins.load(
+            'tests.auth.test_plugins.Authenticator', plugins.AUTHENTICATOR))
+        with testtools.ExpectedException(exc.BadConfiguration):
+            plugins.load('tests.auth.test_plugins.Nope',
+                         plugins.AUTHENTICATOR)
+
+    def test_entry_point(self):
+        module = mock.MagicMock(Authenticator=Authenticator,
+                                spec=['Authenticator'])
+        with mock.patch.object(plugins, '_entry_points',
+                               {'mine': lambda: module,
+                                'cls': lambda: Authenticator}):
+            self.assertIs(Authenticator,
+                          plugins.load('mine', plugins.AUTHENTICATOR))
+            self.assertIs(Authenticator,
+                          plugins.load('cls', plugins.IDENTIFIER))
+            with testtools.ExpectedException(exc.BadConfiguration):
+                plugins.load('mine', plugins.IDENTIFIER)
+            with testtools.ExpectedException(exc.BadConfiguration):
+                plugins.load('missing', plugins.IDENTIFIER)
+
+    def test_no_role(self):
+        with testtools.ExpectedException(exc.BadConfiguration):
+            plugins.load('basicauth', plugins.AUTHORIZER)
+
+    def test_create_middleware_by_name(self):
+        m = middleware.create_middleware(
+            'basicauth', ['tests.auth.test_plugins.Authenticator'],
+            'external', external_authz_callable=lambda i, r: True)
+        self.assertIsInstance(m.identifiers[0], basicauth.Identifier)
+        self.assertIsInstance(m.authenticators[0], Authenticator)
+
+    def test_lazy_import(self):
+        code = ("import sys; import talons.auth.middleware; "
+                "print(sorted(m for m in ('passlib', 'pkg_resources', "
+                "'talons.auth.htpasswd') if m in sys.modules))")
+        out = subprocess.check_output([sys.executable, '-c', code])
+        self.assertEqual(b'[]', out.strip())
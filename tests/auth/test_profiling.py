@@ -0,0 +1,347 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import base64
+import os
+import threading
+import time
+
+import falcon
+import falcon.asgi
+from falcon import testing
+import fixtures
+import mock
+import testtools
+
+from talons import exc
+from talons.auth import asgi
+from talons.auth import basicauth
+from talons.auth import component
+from talons.auth import interfaces
+from talons.auth import middleware
+from talons.auth import profiling
+
+from tests import base
+
+ENV = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/users/1'}
+
+
+class Identifier(interfaces.Identifies):
+
+    def identify(self, request):
+        request.env[self.IDENTITY_ENV_KEY] = interfaces.Identity('alice')
+        return True
+
+
+class Authenticator(interfaces.Authenticates):
+
+    def __init__(self, ok=True, delay=0):
+        self.ok = ok
+        self.delay = delay
+
+    def authenticate(self, identity):
+        if self.delay:
+            threading.Event().wait(self.delay)
+        return self.ok
+
+
+class Authorizer(interfaces.Authorizes):
+
+    def authorize(self, identity, resource):
+        return True
+
+
+def _request():
+    req = mock.MagicMock()
+    req.env = dict(ENV)
+    return req
+
+
+class TestProfiler(base.TestCase):
+
+    def setUp(self):
+        super(TestProfiler, self).setUp()
+        self.path = self.useFixture(fixtures.TempDir()).path
+        self.useFixture(fixtures.MockPatch('atexit.register'))
+
+    def profiler(self, **kwargs):
+        p = profiling.Profiler(self.path, **kwargs)
+        self.addCleanup(p.close)
+        return p
+
+    def trace(self, p, outcome=None):
+        trace = p.begin()
+        if trace is not None:
+            trace.add('authenticate', 'htpasswd.Authenticator', 0.001,
+                      True)
+            p.finish(trace, ENV, outcome)
+        return trace
+
+    def test_sampled(self):
+        p = self.profiler(sample_rate=1.0)
+        self.trace(p, middleware.AUTHENTICATE_FAILED)
+        p.close()
+        records = profiling.read(self.path)
+        self.assertEqual(1, len(records))
+        r = records[0]
+        self.assertEqual(('sampled', 'authenticate_failed', 'GET',
+                          '/users/1', os.getpid()),
+                         (r['reason'], r['outcome'], r['method'],
+                          r['path'], r['pid']))
+        self.assertEqual([('authenticate', 'htpasswd.Authenticator', True)],
+                         [(x['stage'], x['plugin'], x['ok'])
+                          for x in r['plugins']])
+        self.assertNotIn('cprofile', r)
+
+    def test_not_sampled(self):
+        p = self.profiler(sample_rate=0.5)
+        p._random = lambda: 0.7
+        self.assertIsNone(p.begin())
+
+    def test_slow_threshold(self):
+        p = self.profiler(slow_threshold=60.0)
+        self.assertIsNotNone(self.trace(p))
+        p.close()
+        self.assertEqual([], profiling.read(self.path))
+
+        p = self.profiler(slow_threshold=0.0)
+        self.trace(p)
+        p.close()
+        self.assertEqual(['slow'],
+                         [r['reason'] for r in profiling.read(self.path)])
+
+    def test_paused_time_not_counted(self):
+        p = self.profiler(sample_rate=1.0)
+        trace = p.begin()
+        p.pause(trace)
+        threading.Event().wait(0.05)
+        p.resume(trace)
+        p.finish(trace, ENV, None)
+        p.close()
+        self.assertLess(profiling.read(self.path)[0]['seconds'], 0.05)
+
+    def test_ring(self):
+        for x in range(3):
+            # Each profiler continues after the newest trace
+            p = self.profiler(sample_rate=1.0, slots=2)
+            self.trace(p, str(x))
+            p.close()
+            os.utime(p._slot_path(x % 2), (x, x))
+        self.assertEqual(2, len(os.listdir(self.path)))
+        self.assertEqual(['1', '2'],
+                         [r['outcome'] for r in profiling.read(self.path)])
+        self.assertEqual(1, self.profiler(sample_rate=1.0,
+                                          slots=2)._next_slot)
+
+    def test_queue_bounded(self):
+        p = self.profiler(sample_rate=1.0, slots=2)
+        p._wake = mock.MagicMock()
+        for x in range(3):
+            self.trace(p)
+        self.assertEqual(2, len(p._queue))
+        self.assertEqual(1, p.dropped)
+
+    def test_unserializable_trace(self):
+        p = self.profiler(sample_rate=1.0)
+        p._wake = mock.MagicMock()
+        trace = p.begin()
+        env = dict(ENV)
+        env['wsgi.identity'] = mock.Mock(login=object())
+        p.finish(trace, env, None)
+        self.trace(p)
+        p.close()
+        self.assertEqual(1, len(profiling.read(self.path)))
+        self.assertEqual((1, 1), (p.written, p.dropped))
+
+    def test_threads_started_after_fork(self):
+        # Created before forking, as by a pre-forking server that loads
+        # the application first
+        p = self.profiler(sample_rate=1.0)
+        self.assertIsNone(p._writer)
+        pid = os.fork()
+        if pid == 0:  # pragma: NO COVER
+            try:
+                self.trace(p, 'from child')
+                deadline = time.time() + 5
+                while not p.written and time.time() < deadline:
+                    time.sleep(0.01)
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        self.assertIsNone(p._writer)
+        self.assertEqual(['from child'],
+                         [r['outcome'] for r in profiling.read(self.path)])
+
+    def test_cprofile(self):
+        p = self.profiler(sample_rate=1.0, mode=profiling.CPROFILE, top=5)
+        self.trace(p)
+        p.close()
+        rows = profiling.read(self.path)[0]['cprofile']
+        self.assertTrue(0 < len(rows) <= 5)
+        self.assertEqual(4, len(rows[0]))
+
+    def test_stack(self):
+        p = self.profiler(slow_threshold=0.0, mode=profiling.STACK,
+                          stack_interval=0.001)
+        trace = p.begin()
+        threading.Event().wait(0.1)
+        p.finish(trace, ENV, None)
+        p.close()
+        stacks = profiling.read(self.path)[0]['stacks']
+        self.assertTrue(any('test_profiling.py:test_stack' in s
+                            for s in stacks))
+        self.assertEqual({}, p._active)
+
+    def test_create(self):
+        self.assertIsNone(profiling.create_profiler())
+        p = profiling.create_profiler(profile_path=self.path,
+                                      profile_sample_rate='0.1',
+                                      profile_slots='5')
+        self.addCleanup(p.close)
+        self.assertEqual((0.1, 5, None), (p.sample_rate, p.slots, p.mode))
+        for conf in (dict(profile_path=self.path),
+                     dict(profile_path=self.path, profile_sample_rate=2),
+                     dict(profile_path=self.path, profile_sample_rate='x'),
+                     dict(profile_path=self.path, profile_slow_threshold=1,
+                          profile_slots=0),
+                     dict(profile_path=self.path, profile_slow_threshold=1,
+                          profile_mode='perf')):
+            with testtools.ExpectedException(exc.BadConfiguration):
+                profiling.create_profiler(**conf)
+
+
+class TestProfiledMiddleware(base.TestCase):
+
+    def setUp(self):
+        super(TestProfiledMiddleware, self).setUp()
+        self.path = self.useFixture(fixtures.TempDir()).path
+        self.useFixture(fixtures.MockPatch('atexit.register'))
+
+    def middleware(self, authenticators, **conf):
+        m = middleware.Middleware([Identifier()], authenticators,
+                                  Authorizer(), profile_path=self.path,
+                                  **conf)
+        self.addCleanup(m.profiler.close)
+        return m
+
+    def test_plugin_timings(self):
+        m = self.middleware([Authenticator(False), Authenticator()],
+                            profile_sample_rate=1.0)
+        self.assertIsNone(m.process(_request(), {}))
+        m.profiler.close()
+        r = profiling.read(self.path)[0]
+        self.assertEqual('accepted', r['outcome'])
+        self.assertEqual('alice', r['login'])
+        self.assertEqual([('identify', 'test_profiling.Identifier', True),
+                          ('authenticate', 'test_profiling.Authenticator',
+                           False),
+                          ('authenticate', 'test_profiling.Authenticator',
+                           True),
+                          ('authorize', 'test_profiling.Authorizer', True)],
+                         [(x['stage'], x['plugin'], x['ok'])
+                          for x in r['plugins']])
+
+    def test_rejected(self):
+        m = self.middleware([Authenticator(False)], profile_sample_rate=1.0,
+                            profile_mode='cprofile')
+        req = _request()
+        self.assertEqual(middleware.AUTHENTICATE_FAILED,
+                         m.process(req, {}))
+        self.assertNotIn(profiling.TRACE_ENV_KEY, req.env)
+        m.profiler.close()
+        r = profiling.read(self.path)[0]
+        self.assertEqual('authenticate_failed', r['outcome'])
+        self.assertEqual(['identify', 'authenticate'],
+                         [x['stage'] for x in r['plugins']])
+        self.assertIn('cprofile', r)
+
+    def test_only_slow_requests(self):
+        m = self.middleware([Authenticator(delay=0.05)],
+                            profile_slow_threshold=0.04)
+        m.process(_request(), {})
+        m.authenticators[0].delay = 0
+        m.process(_request(), {})
+        m.profiler.close()
+        records = profiling.read(self.path)
+        self.assertEqual(1, len(records))
+        self.assertGreaterEqual(records[0]['seconds'], 0.04)
+
+    def test_error_stops_profile(self):
+        m = self.middleware([Authenticator()], profile_sample_rate=1.0,
+                            profile_mode='stack')
+        m.authenticators[0].authenticate = mock.Mock(
+            side_effect=RuntimeError)
+        self.assertRaises(RuntimeError, m.process, _request(), {})
+        self.assertEqual({}, m.profiler._active)
+
+    def test_asgi(self):
+        c = asgi.create_async_component(basicauth.Identifier,
+                                        Authenticator(), Authorizer(),
+                                        profile_path=self.path,
+                                        profile_sample_rate=1.0)
+        self.addCleanup(c.auth_middleware.profiler.close)
+        app = falcon.asgi.App(middleware=[c])
+        app.add_route('/users/{user_id}', _AsyncResource())
+        creds = base64.b64encode(b'Aladdin:open sesame').decode('ascii')
+        result = testing.TestClient(app).simulate_get(
+            '/users/1', headers={'Authorization': 'Basic ' + creds})
+        self.assertEqual(200, result.status_code)
+        c.auth_middleware.profiler.close()
+        r = profiling.read(self.path)[0]
+        self.assertEqual(('accepted', 'Aladdin'), (r['outcome'], r['login']))
+        self.assertEqual(['identify', 'authenticate', 'authorize'],
+                         [x['stage'] for x in r['plugins']])
+
+    def _creds(self):
+        creds = base64.b64encode(b'Aladdin:open sesame').decode('ascii')
+        return {'Authorization': 'Basic ' + creds}
+
+    def test_unrouted(self):
+        c = component.create_component(basicauth.Identifier,
+                                       Authenticator(), Authorizer(),
+                                       profile_path=self.path,
+                                       profile_sample_rate=1.0)
+        self.addCleanup(c.auth_middleware.profiler.close)
+        app = falcon.App(middleware=[c])
+        result = testing.TestClient(app).simulate_get('/missing',
+                                                      headers=self._creds())
+        self.assertEqual(404, result.status_code)
+        c.auth_middleware.profiler.close()
+        r = profiling.read(self.path)[0]
+        self.assertEqual(('unrouted', 'Aladdin'), (r['outcome'], r['login']))
+        self.assertEqual(['identify', 'authenticate'],
+                         [x['stage'] for x in r['plugins']])
+
+    def test_asgi_unrouted(self):
+        c = asgi.create_async_component(basicauth.Identifier,
+                                        Authenticator(), Authorizer(),
+                                        profile_path=self.path,
+                                        profile_sample_rate=1.0)
+        self.addCleanup(c.auth_middleware.profiler.close)
+        app = falcon.asgi.App(middleware=[c])
+        result = testing.TestClient(app).simulate_get('/missing',
+                                                      headers=self._creds())
+        self.assertEqual(404, result.status_code)
+        c.auth_middleware.profiler.close()
+        self.assertEqual(['unrouted'],
+                         [r['outcome'] for r in profiling.read(self.path)])
+
+
+class _AsyncResource(object):
+
+    async def on_get(self, req, resp, **kwargs):
+        resp.media = {}
@@ -0,0 +1,90 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import mock
+import testtools
+
+from talons import exc
+from talons import stats
+from talons.auth import basicauth
+from talons.auth import interfaces
+from talons.auth import public
+from talons.auth import wsgi
+
+from tests import base
+
+
+class TestPublicPaths(base.TestCase):
+
+    def test_exact(self):
+        p = public.PublicPaths(['/healthz', 'GET /status', 'HEAD /status'])
+        self.assertIsNone(p.regex)
+        self.assertTrue(p.match('GET', '/healthz'))
+        self.assertTrue(p.match('POST', '/healthz'))
+        self.assertFalse(p.match('GET', '/healthz/'))
+        self.assertTrue(p.match('GET', '/status'))
+        self.assertTrue(p.match('HEAD', '/status'))
+        self.assertFalse(p.match('POST', '/status'))
+        self.assertFalse(p.match('GET', '/users'))
+
+    def test_wildcards(self):
+        p = public.PublicPaths(['/static/*', 'GET|HEAD /users/*/avatar'])
+        self.assertTrue(p.match('GET', '/static/css/site.css'))
+        self.assertFalse(p.match('GET', '/staticfile'))
+        self.assertTrue(p.match('HEAD', '/users/1/avatar'))
+        self.assertFalse(p.match('PUT', '/users/1/avatar'))
+        self.assertFalse(p.match('GET', '/users/1/2/avatar'))
+        self.assertFalse(p.match('GET', '/users/1/avatar/x'))
+
+    def test_methods(self):
+        p = public.PublicPaths(methods=['options'])
+        self.assertTrue(p.match('OPTIONS', '/anything'))
+        self.assertFalse(p.match('GET', '/anything'))
+
+    def test_create(self):
+        self.assertIsNone(public.create_public_paths())
+        p = public.create_public_paths(public_paths='/healthz, /static/*',
+                                       public_methods='OPTIONS')
+        self.assertTrue(p.match('GET', '/static/x'))
+        self.assertTrue(p.match('OPTIONS', '/x'))
+        with testtools.ExpectedException(exc.BadConfiguration):
+            public.create_public_paths(public_paths=['healthz'])
+
+
+class TestPublicMiddleware(base.TestCase):
+
+    def test_bypass(self):
+        identifier = mock.MagicMock(spec=basicauth.Identifier)
+        app = mock.MagicMock(return_value=[b'ok'])
+        sink = stats.InMemorySink()
+        mw = wsgi.create_wsgi_middleware(app, [identifier],
+                                         [interfaces.Authenticates()],
+                                         public_paths=['/healthz'],
+                                         stats_sink=sink)
+        env = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/healthz'}
+        self.assertEqual([b'ok'], mw(env, mock.MagicMock()))
+        self.assertFalse(identifier.identify.called)
+        self.assertFalse(env['wsgi.identified'])
+        self.assertTrue(env['wsgi.authorized'])
+        self.assertEqual({'public.bypass': 1}, sink.snapshot()[0])
+
+        identifier.identify.return_value = False
+        start_response = mock.MagicMock()
+        env = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/users'}
+        mw(env, start_response)
+        self.assertTrue(identifier.identify.called)
+        self.assertEqual('401 Unauthorized', start_response.call_args[0][0])
@@ -0,0 +1,147 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import falcon
+import mock
+import testtools
+
+from talons import exc
+from talons import stats
+from talons.auth import interfaces
+from talons.auth import middleware
+from talons.auth import ratelimit
+from talons.auth import wsgi
+
+from tests import base
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestGCRALimiter(base.TestCase):
+
+    def test_burst_and_rate(self):
+        clock = Clock()
+        limiter = ratelimit.GCRALimiter(clock=clock)
+        limit = ratelimit.Limit(2, burst=3)
+        self.assertEqual([0, 0, 0],
+                         [limiter.acquire('a', limit) for _x in range(3)])
+        self.assertAlmostEqual(0.5, limiter.acquire('a', limit))
+        # Other keys are not affected
+        self.assertEqual(0, limiter.acquire('b', limit))
+        clock.now += 0.5
+        self.assertEqual(0, limiter.acquire('a', limit))
+        self.assertAlmostEqual(0.5, limiter.acquire('a', limit))
+
+    def test_idle_eviction(self):
+        clock = Clock()
+        limiter = ratelimit.GCRALimiter(shards=1, clock=clock)
+        limit = ratelimit.Limit(10)
+        limiter.acquire('a', limit)
+        limiter.acquire('b', limit)
+        clock.now += 1
+        limiter.acquire('c', limit)
+        self.assertEqual(['c'], list(limiter.shards[0][0]))
+
+    def test_bounded(self):
+        clock = Clock()
+        limiter = ratelimit.GCRALimiter(shards=2, max_entries=4, clock=clock)
+        limit = ratelimit.Limit(1)
+        for x in range(100):
+            limiter.acquire(x, limit)
+        self.assertTrue(len(limiter) <= 4)
+
+
+class TestRateLimiter(base.TestCase):
+
+    def test_role_limits(self):
+        limiter = ratelimit.create_rate_limiter(
+            ratelimit_rate=1, ratelimit_roles='admin=100/200, batch=0,'
+                                              'reader=5')
+        default = limiter.limit_for(interfaces.Identity('a'))
+        self.assertEqual((1.0, 1), (default.rate, default.burst))
+        admin = limiter.limit_for(interfaces.Identity(
+            'a', roles=['reader', 'admin']))
+        self.assertEqual((100.0, 200), (admin.rate, admin.burst))
+        self.assertIsNone(limiter.limit_for(interfaces.Identity(
+            'a', roles=['batch', 'admin'])))
+        self.assertEqual(default, limiter.limit_for(interfaces.Identity(
+            'a', roles=['other'])))
+        self.assertEqual(0, limiter.check(interfaces.Identity(
+            'a', roles=['batch'])))
+
+    def test_create(self):
+        self.assertIsNone(ratelimit.create_rate_limiter())
+        limiter = ratelimit.create_rate_limiter(
+            ratelimit_roles={'admin': '10/20'})
+        self.assertIsNone(limiter.default)
+        for conf in (dict(ratelimit_rate='x'),
+                     dict(ratelimit_rate=-1),
+                     dict(ratelimit_rate=1, ratelimit_burst=0),
+                     dict(ratelimit_roles='admin=fast'),
+                     dict(ratelimit_rate=1, ratelimit_shards=0)):
+            with testtools.ExpectedException(exc.BadConfiguration):
+                ratelimit.create_rate_limiter(**conf)
+
+
+class Identifier(interfaces.Identifies):
+
+    def identify(self, request):
+        request.env[self.IDENTITY_ENV_KEY] = interfaces.Identity('Aladdin')
+        return True
+
+
+class Authenticator(interfaces.Authenticates):
+
+    def authenticate(self, identity):
+        return True
+
+
+class TestRateLimitMiddleware(base.TestCase):
+
+    def test_hook(self):
+        sink = stats.InMemorySink()
+        m = middleware.Middleware([Identifier()], [Authenticator()],
+                                  default_authorize=True, ratelimit_rate=1,
+                                  stats_sink=sink)
+        req = mock.MagicMock()
+        req.env = {}
+        m(req, None, {})
+        req.env = {}
+        with testtools.ExpectedException(falcon.HTTPError):
+            m(req, None, {})
+        self.assertEqual(1, req.env[ratelimit.RETRY_AFTER_ENV_KEY])
+        self.assertEqual(1, sink.snapshot()[0]['ratelimit.rejected'])
+
+    def test_wsgi(self):
+        app = mock.MagicMock(return_value=[b'ok'])
+        mw = wsgi.create_wsgi_middleware(app, Identifier, Authenticator,
+                                         default_authorize=True,
+                                         ratelimit_rate=0.5)
+        start_response = mock.MagicMock()
+        env = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/'}
+        self.assertEqual([b'ok'], mw(dict(env), start_response))
+        mw(dict(env), start_response)
+        status, headers = start_response.call_args[0]
+        self.assertEqual('429 Too Many Requests', status)
+        self.assertIn(('Retry-After', '2'), headers)
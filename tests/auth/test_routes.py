@@ -0,0 +1,73 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import testtools
+
+from talons import exc
+from talons.auth import routes
+
+from tests import base
+
+
+class TestRouteTable(base.TestCase):
+
+    def test_resolve(self):
+        table = routes.RouteTable({'/users/{user_id}': 'users',
+                                   '/admin/*': 'admin',
+                                   '/admin/public/*': None},
+                                  'default')
+        self.assertEqual('users', table.resolve('/users/{user_id}'))
+        self.assertEqual('admin', table.resolve('/admin/users'))
+        self.assertIsNone(table.resolve('/admin/public/docs'))
+        # A prefix also covers its parent path
+        self.assertEqual('admin', table.resolve('/admin'))
+        self.assertIsNone(table.resolve('/admin/public'))
+        self.assertEqual('default', table.resolve('/administrators'))
+        self.assertEqual('default', table.resolve('/users'))
+        self.assertEqual({'/users/{user_id}': 'users',
+                          '/admin/users': 'admin',
+                          '/admin/public/docs': None,
+                          '/admin': 'admin',
+                          '/admin/public': None,
+                          '/administrators': 'default',
+                          '/users': 'default'}, table.table)
+
+    def test_templates_resolved_at_startup(self):
+        table = routes.RouteTable([('/a', 1)], 2, templates=['/a', '/b'])
+        self.assertEqual({'/a': 1, '/b': 2}, table.table)
+
+    def test_bad_pattern(self):
+        with testtools.ExpectedException(exc.BadConfiguration):
+            routes.RouteTable({'admin/*': None}, None)
+
+    def test_build_policies(self):
+        built = []
+
+        def build(**options):
+            built.append(options)
+            return 'chain{0}'.format(len(built))
+
+        r, default = routes.build_policies(
+            {'/a': dict(authorize_with='x'), '/b': None, '/c': 'prebuilt'},
+            dict(identify_with='i'), build, delay_401=True)
+        self.assertEqual({'/a': 'chain1', '/b': None, '/c': 'prebuilt'},
+                         dict(r))
+        self.assertEqual('chain2', default)
+        self.assertEqual({'authorize_with': 'x', 'delay_401': True},
+                         built[0])
+        self.assertEqual({'identify_with': 'i', 'delay_401': True},
+                         built[1])
@@ -0,0 +1,314 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import base64
+import os
+import threading
+import time
+
+import fixtures
+import mock
+from passlib import apache
+import testtools
+
+from talons import exc
+from talons.auth import basicauth
+from talons.auth import external
+from talons.auth import interfaces
+from talons.auth import middleware
+from talons.auth import ratelimit
+from talons.auth import tenant
+
+from tests import base
+
+
+class Authenticator(interfaces.Authenticates):
+
+    def __init__(self, **conf):
+        self.tenant = conf.get('name')
+        self.logins = []
+
+    def authenticate(self, identity):
+        self.logins.append(identity.login)
+        identity.roles.add(self.tenant)
+        return identity.key == 'secret-' + self.tenant
+
+
+def _request(login, password, **headers):
+    creds = base64.b64encode('{0}:{1}'.format(login, password).encode(
+        'utf-8'))
+    env = {'HTTP_AUTHORIZATION': 'Basic ' + creds.decode('ascii')}
+    for name, value in headers.items():
+        env['HTTP_' + name.upper()] = value
+    req = mock.MagicMock()
+    req.env = env
+    req.auth = env['HTTP_AUTHORIZATION']
+    return req
+
+
+class TestIdentifier(base.TestCase):
+
+    def test_header(self):
+        i = tenant.Identifier(tenant_identify_with='basicauth')
+        self.assertIsInstance(i.identifiers[0], basicauth.Identifier)
+        req = _request('alice', 'pw', x_tenant_id='acme')
+        self.assertTrue(i.identify(req))
+        self.assertEqual('acme', req.env['wsgi.identity'].tenant)
+
+    def test_host(self):
+        i = tenant.Identifier(tenant_identify_with=[basicauth.Identifier],
+                              tenant_from='host')
+        req = _request('alice', 'pw', host='Acme.example.com:8080')
+        self.assertTrue(i.identify(req))
+        self.assertEqual('acme', req.env['wsgi.identity'].tenant)
+
+        i = tenant.Identifier(tenant_identify_with=[basicauth.Identifier],
+                              tenant_from='host',
+                              tenant_host_suffix='.example.com')
+        self.assertEqual('acme', i.tenant_of(
+            {'HTTP_HOST': 'acme.example.com'}))
+        self.assertIsNone(i.tenant_of({'HTTP_HOST': 'acme.example.org'}))
+        self.assertIsNone(i.tenant_of({}))
+
+    def test_not_identified(self):
+        i = tenant.Identifier(tenant_identify_with='basicauth')
+        req = mock.MagicMock()
+        req.env = {}
+        req.auth = None
+        self.assertFalse(i.identify(req))
+
+    def test_bad_configuration(self):
+        for conf in (dict(),
+                     dict(tenant_identify_with='basicauth',
+                          tenant_from='cookie'),
+                     dict(tenant_identify_with=object())):
+            with testtools.ExpectedException(exc.BadConfiguration):
+                tenant.Identifier(**conf)
+
+
+class TestAuthenticator(base.TestCase):
+
+    def setUp(self):
+        super(TestAuthenticator, self).setUp()
+        self.created = []
+
+        def factory(name):
+            if name == 'nobody':
+                return None
+            self.created.append(name)
+            return Authenticator(name=name)
+        self.factory = factory
+
+    def test_header_tenant(self):
+        a = tenant.Authenticator(tenant_factory=self.factory)
+        identity = interfaces.Identity('alice', key='secret-acme')
+        self.assertFalse(a.authenticate(identity))
+        self.assertEqual('alice', identity.login)
+        identity.tenant = 'acme'
+        self.assertTrue(a.authenticate(identity))
+        self.assertEqual('acme/alice', identity.login)
+        self.assertEqual(set(['acme']), identity.roles)
+        self.assertEqual(['alice'], a.tenants.get('acme').logins)
+        identity = interfaces.Identity('alice', key='secret-acme')
+        identity.tenant = 'initech'
+        self.assertFalse(a.authenticate(identity))
+        self.assertEqual('initech/alice', identity.login)
+        self.assertEqual(['acme', 'initech'], self.created)
+
+    def test_same_login_in_two_tenants(self):
+        a = tenant.Authenticator(tenant_factory=self.factory)
+        limiter = ratelimit.RateLimiter(ratelimit.parse_limit((1, 1)))
+        calls = []
+
+        def authorize(identity, resource):
+            calls.append(identity.login)
+            return True
+        z = external.Authorizer(external_authz_callable=authorize,
+                                external_authz_cache_ttl=60)
+        resource = mock.Mock(to_string=mock.Mock(return_value='users.get'))
+        for name in ('acme', 'initech'):
+            identity = interfaces.Identity('alice', key='secret-' + name)
+            identity.tenant = name
+            self.assertTrue(a.authenticate(identity))
+            self.assertEqual(name + '/alice', identity.login)
+            # Each tenant's alice has her own rate bucket and decisions
+            self.assertFalse(limiter.check(identity))
+            self.assertTrue(z.authorize(identity, resource))
+        self.assertEqual(['acme/alice', 'initech/alice'], calls)
+
+    def test_login_tenant(self):
+        a = tenant.Authenticator(tenant_factory=self.factory,
+                                 tenant_from='login')
+        identity = interfaces.Identity('acme/alice', key='secret-acme')
+        self.assertTrue(a.authenticate(identity))
+        self.assertEqual('acme/alice', identity.login)
+        self.assertEqual('acme', identity.tenant)
+        self.assertEqual(set(['acme']), identity.roles)
+        self.assertEqual(['alice'], a.tenants.get('acme').logins)
+
+        failed = interfaces.Identity('acme/alice', key='wrong')
+        self.assertFalse(a.authenticate(failed))
+        self.assertEqual(set(), failed.roles)
+        self.assertFalse(a.authenticate(interfaces.Identity('alice')))
+        self.assertFalse(a.authenticate(interfaces.Identity('acme/')))
+
+    def test_invalid_tenant_keys(self):
+        a = tenant.Authenticator(tenant_factory=self.factory,
+                                 tenant_from='login')
+        for login in ('../etc/alice', '.acme/alice', 'a b/alice'):
+            self.assertFalse(a.authenticate(interfaces.Identity(login)))
+        self.assertEqual([], self.created)
+
+    def test_unknown_tenant_remembered(self):
+        a = tenant.Authenticator(tenant_factory=mock.Mock(return_value=None),
+                                 tenant_from='login')
+        for _x in range(3):
+            self.assertFalse(a.authenticate(
+                interfaces.Identity('nobody/alice')))
+        self.assertEqual(1, a.factory.call_count)
+        self.assertIsNone(a.authenticator_for('nobody'))
+
+    def test_unknown_tenants_kept_apart(self):
+        a = tenant.Authenticator(tenant_factory=self.factory,
+                                 tenant_from='login', tenant_cache_size=2,
+                                 tenant_unknown_cache_size=2)
+        a.authenticate(interfaces.Identity('t1/alice'))
+        a.factory = mock.Mock(return_value=None)
+        for n in range(10):
+            a.authenticate(interfaces.Identity('random{0}/alice'.format(n)))
+        self.assertEqual(['t1'], self.created)
+        self.assertIsNotNone(a.tenants.get('t1'))
+        self.assertEqual(2, len(a.unknown))
+        self.assertFalse(a.is_expensive(interfaces.Identity('random9/x')))
+
+    def test_unknown_ttl(self):
+        factory = mock.Mock(return_value=None)
+        a = tenant.Authenticator(tenant_factory=factory,
+                                 tenant_unknown_ttl='30')
+        a.authenticator_for('nobody')
+        a.authenticator_for('nobody')
+        with mock.patch('time.time', return_value=1e12):
+            a.authenticator_for('nobody')
+        self.assertEqual(2, factory.call_count)
+
+    def test_factory_error(self):
+        factory = mock.Mock(side_effect=[IOError('unreachable'), None])
+        a = tenant.Authenticator(tenant_factory=factory)
+        self.assertIsNone(a.authenticator_for('acme'))
+        self.assertIsNone(a.authenticator_for('acme'))
+        self.assertEqual(1, factory.call_count)
+        # Errors are only remembered for a few seconds
+        with mock.patch('time.time',
+                        return_value=time.time() + tenant.ERROR_TTL + 1):
+            self.assertIsNone(a.authenticator_for('acme'))
+        self.assertEqual(2, factory.call_count)
+
+    def test_slow_tenant_does_not_block_others(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def factory(name):
+            if name == 'slow':
+                started.set()
+                release.wait(5)
+            return Authenticator(name=name)
+        a = tenant.Authenticator(tenant_factory=factory)
+        t = threading.Thread(target=a.authenticator_for, args=('slow',))
+        t.start()
+        try:
+            self.assertTrue(started.wait(5))
+            self.assertEqual('fast', a.authenticator_for('fast').tenant)
+            self.assertFalse(release.is_set())
+        finally:
+            release.set()
+            t.join()
+        self.assertEqual({}, a._locks)
+        self.assertEqual('slow', a.tenants.get('slow').tenant)
+
+    def test_lru_eviction(self):
+        a = tenant.Authenticator(tenant_factory=self.factory,
+                                 tenant_from='login', tenant_cache_size=2)
+        for name in ('t1', 't2', 't1', 't3', 't1', 't2'):
+            a.authenticate(interfaces.Identity(name + '/alice'))
+        # t2 was evicted by t3, and created again
+        self.assertEqual(['t1', 't2', 't3', 't2'], self.created)
+        self.assertEqual(2, len(a.tenants))
+
+    def test_ttl(self):
+        a = tenant.Authenticator(tenant_factory=self.factory,
+                                 tenant_from='login', tenant_ttl='60')
+        a.authenticate(interfaces.Identity('t1/alice'))
+        with mock.patch('time.time', return_value=1e12):
+            a.authenticate(interfaces.Identity('t1/alice'))
+        self.assertEqual(['t1', 't1'], self.created)
+
+    def test_is_expensive(self):
+        a = tenant.Authenticator(tenant_factory=self.factory,
+                                 tenant_from='login')
+        identity = interfaces.Identity('t1/alice')
+        self.assertTrue(a.is_expensive(identity))
+        a.authenticate(identity)
+        self.assertFalse(a.is_expensive(identity))
+        self.assertFalse(a.is_expensive(interfaces.Identity('alice')))
+
+    def test_bad_configuration(self):
+        for conf in (dict(),
+                     dict(tenant_factory=self.factory,
+                          tenant_authenticator='htpasswd'),
+                     dict(tenant_factory='talons.nonexistent.factory'),
+                     dict(tenant_authenticator=object),
+                     dict(tenant_factory=self.factory,
+                          tenant_cache_size=0),
+                     dict(tenant_factory=self.factory, tenant_ttl='x'),
+                     dict(tenant_factory=self.factory,
+                          tenant_unknown_cache_size=0),
+                     dict(tenant_factory=self.factory,
+                          tenant_unknown_ttl='0')):
+            with testtools.ExpectedException(exc.BadConfiguration):
+                tenant.Authenticator(**conf)
+
+
+class TestHtpasswdTenants(base.TestCase):
+
+    def setUp(self):
+        super(TestHtpasswdTenants, self).setUp()
+        self.path = self.useFixture(fixtures.TempDir()).path
+        for name in ('acme', 'initech'):
+            htfile = apache.HtpasswdFile(
+                os.path.join(self.path, name + '.htpasswd'), new=True)
+            htfile.set_password('alice', 'pw-' + name)
+            htfile.save()
+
+    def test_middleware(self):
+        m = middleware.create_middleware(
+            'tenant', 'tenant', default_authorize=True,
+            tenant_identify_with='basicauth',
+            tenant_authenticator='htpasswd',
+            htpasswd_path=os.path.join(self.path, '{tenant}.htpasswd'))
+        self.assertIsNone(m.process(
+            _request('alice', 'pw-acme', x_tenant_id='acme'), {}))
+        self.assertEqual(middleware.AUTHENTICATE_FAILED, m.process(
+            _request('alice', 'pw-acme', x_tenant_id='initech'), {}))
+        self.assertEqual(middleware.AUTHENTICATE_FAILED, m.process(
+            _request('alice', 'pw-acme', x_tenant_id='missing'), {}))
+        self.assertEqual(middleware.AUTHENTICATE_FAILED, m.process(
+            _request('alice', 'pw-acme'), {}))
+        tenants = m.authenticators[0].tenants
+        self.assertEqual(['acme', 'initech'],
+                         sorted(k for k, _v, _e in tenants.items()))
+        self.assertTrue(m.authenticators[0].unknown.get('missing'))
+        self.assertIsNone(m.authenticators[0].authenticator_for('missing'))
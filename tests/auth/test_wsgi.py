@@ -0,0 +1,134 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import base64
+import json
+
+import mock
+
+from talons.auth import basicauth
+from talons.auth import interfaces
+from talons.auth import middleware
+from talons.auth import wsgi
+
+from tests import base
+
+
+class PasswordAuthenticator(interfaces.Authenticates):
+
+    def authenticate(self, identity):
+        return identity.key == 'open sesame'
+
+
+class AdminAuthorizer(interfaces.Authorizes):
+
+    def authorize(self, identity, resource):
+        return resource.to_string() != 'admin.get'
+
+
+def _environ(path='/users/1', user=None, password=None):
+    env = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path}
+    if user is not None:
+        creds = '{0}:{1}'.format(user, password).encode('ascii')
+        env['HTTP_AUTHORIZATION'] = ('Basic ' +
+                                     base64.b64encode(creds).decode('ascii'))
+    return env
+
+
+class TestWsgi(base.TestCase):
+
+    def setUp(self):
+        super(TestWsgi, self).setUp()
+        self.app = mock.MagicMock(return_value=[b'ok'])
+        self.start_response = mock.MagicMock()
+        self.mw = wsgi.create_wsgi_middleware(self.app,
+                                              basicauth.Identifier,
+                                              PasswordAuthenticator,
+                                              AdminAuthorizer)
+
+    def test_request(self):
+        req = wsgi.Request({'REQUEST_METHOD': 'PUT',
+                            'HTTP_X_AUTH_USER': 'Aladdin',
+                            'HTTP_AUTHORIZATION': 'Basic abc'})
+        self.assertEqual('PUT', req.method)
+        self.assertEqual('Basic abc', req.auth)
+        self.assertEqual('Aladdin', req.get_header('X-Auth-User'))
+        self.assertIsNone(req.get_header('X-Missing'))
+
+    def test_accepted(self):
+        env = _environ(user='Aladdin', password='open sesame')
+        self.assertEqual([b'ok'], self.mw(env, self.start_response))
+        self.app.assert_called_once_with(env, self.start_response)
+        self.assertTrue(env['wsgi.identified'])
+        self.assertTrue(env['wsgi.authenticated'])
+        self.assertTrue(env['wsgi.authorized'])
+
+    def test_no_identity(self):
+        body = self.mw(_environ(), self.start_response)
+        self.assertFalse(self.app.called)
+        status, headers = self.start_response.call_args[0]
+        self.assertEqual('401 Unauthorized', status)
+        self.assertIn(('Content-Type', 'application/json'), headers)
+        self.assertEqual('No identity information found.',
+                         json.loads(body[0].decode('utf-8'))['description'])
+
+    def test_authenticate_failed(self):
+        env = _environ(user='Aladdin', password='wrong')
+        body = self.mw(env, self.start_response)
+        self.assertFalse(self.app.called)
+        self.assertEqual('401 Unauthorized',
+                         self.start_response.call_args[0][0])
+        self.assertEqual('Authentication failed.',
+                         json.loads(body[0].decode('utf-8'))['description'])
+
+    def test_headers_not_shared(self):
+        self.mw(_environ(), self.start_response)
+        self.start_response.call_args[0][1].append(('X-Extra', 'yes'))
+        self.mw(_environ(), self.start_response)
+        headers = self.start_response.call_args[0][1]
+        self.assertNotIn(('X-Extra', 'yes'), headers)
+
+    def test_forbidden(self):
+        env = _environ(path='/admin', user='Aladdin', password='open sesame')
+        self.mw(env, self.start_response)
+        self.assertFalse(self.app.called)
+        self.assertEqual('403 Forbidden',
+                         self.start_response.call_args[0][0])
+
+    def test_challenge(self):
+        authenticator = PasswordAuthenticator()
+        authenticator.challenge = mock.MagicMock(
+            return_value='Digest realm="lamp"')
+        mw = wsgi.create_wsgi_middleware(self.app, basicauth.Identifier,
+                                         authenticator)
+        mw(_environ(), self.start_response)
+        headers = self.start_response.call_args[0][1]
+        self.assertIn(('WWW-Authenticate', 'Digest realm="lamp"'), headers)
+        self.assertEqual(3, len(headers))
+
+    def test_process_outcomes(self):
+        m = middleware.create_middleware(basicauth.Identifier,
+                                         PasswordAuthenticator,
+                                         AdminAuthorizer)
+        req = wsgi.Request(_environ())
+        self.assertEqual(middleware.NO_IDENTITY, m.process(req, {}))
+        req = wsgi.Request(_environ(user='Aladdin', password='x'))
+        self.assertEqual(middleware.AUTHENTICATE_FAILED, m.process(req, {}))
+        req = wsgi.Request(_environ(path='/admin', user='Aladdin',
+                                    password='open sesame'))
+        self.assertEqual(middleware.FORBIDDEN, m.process(req, {}))
+        req = wsgi.Request(_environ(user='Aladdin', password='open sesame'))
+        self.assertIsNone(m.process(req, {}))
@@ -0,0 +1,150 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+"""
+In-process fake of a memcached server, speaking the subset of the text
+protocol used by `talons.memcache`, for tests.
+"""
+
+import socket
+import threading
+import time
+
+from six.moves import socketserver
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def _reply(self, line):
+        self.wfile.write(line + b'\r\n')
+
+    def handle(self):
+        server = self.server
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            parts = line.split()
+            if not parts:
+                continue
+            command = parts[0].decode('ascii')
+            server.commands.append(command)
+            with server.lock:
+                handler = getattr(self, 'do_' + command, None)
+                if handler is None:
+                    self._reply(b'ERROR')
+                else:
+                    handler(parts[1:])
+            self.wfile.flush()
+
+    def _live(self, key):
+        entry = self.server.data.get(key)
+        if entry is None:
+            return None
+        if entry[1] and entry[1] <= time.time():
+            del self.server.data[key]
+            return None
+        return entry
+
+    def do_get(self, keys):
+        for key in keys:
+            entry = self._live(key)
+            if entry is not None:
+                self._reply(b'VALUE ' + key + b' 0 ' +
+                            str(len(entry[0])).encode('ascii'))
+                self._reply(entry[0])
+        self._reply(b'END')
+
+    def _read_store(self, args):
+        key, _flags, exptime, length = args[:4]
+        data = self.rfile.read(int(length) + 2)[:-2]
+        exptime = int(exptime)
+        return key, (data, time.time() + exptime if exptime else 0)
+
+    def do_set(self, args):
+        key, entry = self._read_store(args)
+        self.server.data[key] = entry
+        self._reply(b'STORED')
+
+    def do_add(self, args):
+        key, entry = self._read_store(args)
+        if self._live(key) is not None:
+            self._reply(b'NOT_STORED')
+            return
+        self.server.data[key] = entry
+        self._reply(b'STORED')
+
+    def do_delete(self, args):
+        if self._live(args[0]) is None:
+            self._reply(b'NOT_FOUND')
+            return
+        del self.server.data[args[0]]
+        self._reply(b'DELETED')
+
+    def do_incr(self, args):
+        entry = self._live(args[0])
+        if entry is None:
+            self._reply(b'NOT_FOUND')
+            return
+        value = str(int(entry[0]) + int(args[1])).encode('ascii')
+        self.server.data[args[0]] = value, entry[1]
+        self._reply(value)
+
+
+class FakeMemcacheServer(socketserver.ThreadingMixIn,
+                         socketserver.TCPServer):
+
+    """
+    Threaded fake memcached server listening on a free port of the loopback
+    interface. `data` maps keys to (value, expires) tuples, and `commands`
+    lists the commands received, in order.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        socketserver.TCPServer.__init__(self, ('127.0.0.1', 0), _Handler)
+        self.data = {}
+        self.commands = []
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever,
+                                       kwargs={'poll_interval': 0.05})
+        self.thread.daemon = True
+
+    @property
+    def address(self):
+        return '{0}:{1}'.format(*self.server_address)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def free_port():
+    """
+    Returns a port of the loopback interface nothing listens on.
+    """
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
@@ -0,0 +1,100 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import fixtures
+import mock
+
+from talons import cache
+from talons import exc
+
+from tests import base
+
+
+class TestLRUCache(base.TestCase):
+
+    def test_get_set(self):
+        c = cache.LRUCache(2)
+        self.assertIsNone(c.get('a'))
+        self.assertEqual('x', c.get('a', 'x'))
+        c.set('a', 1)
+        self.assertEqual(1, c.get('a'))
+        self.assertEqual(1, c.hits)
+        self.assertEqual(2, c.misses)
+        c.delete('a')
+        self.assertIsNone(c.get('a'))
+        self.assertEqual(0, len(c))
+
+    def test_evicts_least_recently_used(self):
+        c = cache.LRUCache(2)
+        c.set('a', 1)
+        c.set('b', 2)
+        c.get('a')
+        c.set('c', 3)
+        self.assertEqual(2, len(c))
+        self.assertEqual(1, c.get('a'))
+        self.assertIsNone(c.get('b'))
+        self.assertEqual(3, c.get('c'))
+        c.clear()
+        self.assertEqual(0, len(c))
+
+    def test_ttl(self):
+        c = cache.LRUCache(2, ttl=10)
+        with mock.patch('time.time', return_value=100.0):
+            c.set('a', 1)
+            c.set('b', 2, ttl=100)
+        with mock.patch('time.time', return_value=150.0):
+            self.assertIsNone(c.get('a'))
+            self.assertEqual(2, c.get('b'))
+            self.assertTrue(c.add('a', 3))
+
+    def test_add_and_get_many(self):
+        c = cache.LRUCache(4)
+        self.assertTrue(c.add('a', 1))
+        self.assertFalse(c.add('a', 2))
+        c.set('b', 2)
+        self.assertEqual({'a': 1, 'b': 2}, c.get_many(['a', 'b', 'c']))
+
+
+class TestCreateCache(base.TestCase):
+
+    def test_memory_is_default(self):
+        c = cache.create_cache('test_create', 10, cache_ttl='5')
+        self.assertIsInstance(c, cache.LRUCache)
+        self.assertEqual((10, 5.0), (c.maxsize, c.ttl))
+
+    def test_factory(self):
+        factory = mock.MagicMock()
+        c = cache.create_cache('test_create', 10, cache_backend=factory)
+        factory.assert_called_once_with('test_create', 10)
+        self.assertIs(factory.return_value, c)
+
+    def test_bad_backend(self):
+        self.assertRaises(exc.BadConfiguration, cache.create_cache,
+                          'test_create', cache_backend='redis')
+        self.assertRaises(exc.BadConfiguration, cache.create_cache,
+                          'test_create', cache_backend='shm')
+
+    def test_shared_backends_require_secret(self):
+        path = self.useFixture(fixtures.TempDir()).join('cache')
+        self.assertRaises(exc.BadConfiguration, cache.create_cache,
+                          'test_create', cache_shm_path=path)
+        self.assertRaises(exc.BadConfiguration, cache.create_cache,
+                          'test_create', cache_backend='memcached')
+
+    def test_key_digest_requires_secret(self):
+        self.assertRaises(ValueError, cache.key_digest, 'a', None)
+        self.assertNotEqual(cache.key_digest('a', 'x'),
+                            cache.key_digest('a', 'y'))
@@ -38,3 +38,9 @@ class TestHelpers(base.TestCase):
     def test_return_function(self):
         fn = helpers.import_function('os.path.join')
         self.assertEqual(callable(fn), True)
+
+    def test_environ_key(self):
+        self.assertEqual('HTTP_X_AUTH_USER',
+                         helpers.environ_key('X-Auth-User'))
+        self.assertEqual('CONTENT_TYPE',
+                         helpers.environ_key('content-type'))
@@ -0,0 +1,165 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import hashlib
+import socket
+import time
+
+import mock
+import testtools
+
+from talons import cache
+from talons import exc
+from talons import memcache
+
+from tests import base
+from tests import fakememcache
+
+
+class TestMemcacheBackend(base.TestCase):
+
+    def setUp(self):
+        super(TestMemcacheBackend, self).setUp()
+        self.server = fakememcache.FakeMemcacheServer().start()
+        self.addCleanup(self.server.stop)
+
+    def cache(self, name='test', **kwargs):
+        kwargs.setdefault('secret', 's3cr3t')
+        c = memcache.MemcacheBackend(self.server.address, name, **kwargs)
+        self.addCleanup(c.pool.close)
+        return c
+
+    def test_get_set_delete(self):
+        c = self.cache()
+        self.assertIsNone(c.get(('alice', 'pw')))
+        c.set(('alice', 'pw'), {'roles': set(['admin'])})
+        self.assertEqual({'roles': ['admin']}, c.get(('alice', 'pw')))
+        self.assertEqual((1, 1), (c.hits, c.misses))
+        for key in self.server.data:
+            self.assertNotIn(b'alice', key)
+        c.delete(('alice', 'pw'))
+        self.assertIsNone(c.get(('alice', 'pw')))
+
+    def test_add(self):
+        c = self.cache()
+        self.assertTrue(c.add('a', 1))
+        self.assertFalse(c.add('a', 2))
+        self.assertEqual(1, c.get('a'))
+
+    def test_ttl(self):
+        c = self.cache(ttl=0.2)
+        c.set('a', 1)
+        c.set('b', 2, ttl=60)
+        self.assertEqual(1, c.get('a'))
+        now = memcache.time.time() + 10
+        with mock.patch('time.time', return_value=now):
+            self.assertIsNone(c.get('a'))
+            self.assertEqual(2, c.get('b'))
+
+    def test_get_many_pipelines_batches(self):
+        c = self.cache()
+        keys = ['k{0}'.format(x) for x in range(250)]
+        for x, key in enumerate(keys[:200]):
+            c.set(key, x)
+        del self.server.commands[:]
+        result = c.get_many(keys)
+        self.assertEqual(dict((k, x) for x, k in enumerate(keys[:200])),
+                         result)
+        self.assertEqual(['get'] * 3, self.server.commands)
+
+    def test_clear_changes_generation(self):
+        c = self.cache()
+        other = self.cache()
+        c.set('a', 1)
+        self.assertEqual(1, other.get('a'))
+        c.clear()
+        self.assertIsNone(c.get('a'))
+        other._generation_read = 0
+        self.assertIsNone(other.get('a'))
+
+    def test_pool_reuses_connections(self):
+        c = self.cache(pool_size=1)
+        c.set('a', 1)
+        conn = c.pool._idle[0]
+        c.get('a')
+        self.assertEqual([conn], c.pool._idle)
+
+    def test_requires_secret(self):
+        with testtools.ExpectedException(exc.BadConfiguration):
+            self.cache(secret=None)
+
+    def test_forged_entry_rejected(self):
+        c = self.cache()
+        key = ('alice', 'wrong password')
+        self.assertIsNone(c.get(key))
+        # Without the secret, another client can only guess unkeyed digests
+        digest = hashlib.sha256(repr(key).encode('utf-8')).hexdigest()
+        forged = '{0}{1}:{2}:{3}'.format(c.prefix, c.name, c._generation,
+                                         digest).encode('ascii')
+        self.server.data[forged] = (cache.dumps(True), 0)
+        self.assertIsNone(c.get(key))
+
+    def test_overwritten_entry_rejected(self):
+        c = self.cache()
+        key = ('alice', 'wrong password')
+        c.set(key, False)
+        c.set(('bob', 'pw'), True)
+        name = c.server_key(key, c._generation).encode('ascii')
+        stored, exptime = self.server.data[name]
+        # Another client replaces the value but cannot compute its MAC
+        self.server.data[name] = (stored[:memcache.MAC_SIZE] +
+                                  cache.dumps(True), exptime)
+        self.assertIsNone(c.get(key))
+        # Nor can it copy the valid entry of another key
+        bob = c.server_key(('bob', 'pw'), c._generation).encode('ascii')
+        self.server.data[name] = self.server.data[bob]
+        self.assertIsNone(c.get(key))
+        self.assertTrue(c.get(('bob', 'pw')))
+
+    def test_server_down_is_a_miss(self):
+        port = fakememcache.free_port()
+        c = memcache.MemcacheBackend('127.0.0.1:{0}'.format(port), 'down',
+                                     secret='s3cr3t')
+        c.set('a', 1)
+        self.assertFalse(c.add('a', 1))
+        self.assertIsNone(c.get('a'))
+        c.delete('a')
+        c.clear()
+        self.assertEqual(1, c.misses)
+
+    def test_server_down_not_retried_at_once(self):
+        port = fakememcache.free_port()
+        c = memcache.MemcacheBackend('127.0.0.1:{0}'.format(port), 'down',
+                                     secret='s3cr3t')
+        with mock.patch.object(c.pool, 'acquire',
+                               side_effect=socket.error) as acquire:
+            c.get('a')
+            c.get('b')
+            self.assertEqual(1, acquire.call_count)
+            now = time.time() + memcache.RETRY_INTERVAL
+            with mock.patch('time.time', return_value=now):
+                c.get('c')
+            self.assertEqual(2, acquire.call_count)
+
+    def test_create_cache(self):
+        c = cache.create_cache('shared', 10, cache_backend='memcached',
+                               cache_memcached_server=self.server.address,
+                               cache_memcached_pool_size='2',
+                               cache_ttl='30', cache_secret='x')
+        self.addCleanup(c.pool.close)
+        self.assertIsInstance(c, memcache.MemcacheBackend)
+        self.assertEqual((30.0, 'x', 2), (c.ttl, c.secret, c.pool.size))
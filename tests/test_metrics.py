@@ -0,0 +1,170 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import os
+
+import fixtures
+import mock
+
+from talons import cache
+from talons import metrics
+from talons import stats
+
+from tests import base
+
+
+class TestMetrics(base.TestCase):
+
+    def test_render_counters(self):
+        out = metrics.render({'identify.success': 3,
+                              'plugin.htpasswd.Authenticator.calls': 2},
+                             {})
+        self.assertIn('# TYPE talons_identify_success_total counter\n'
+                      'talons_identify_success_total 3\n', out)
+        self.assertIn('talons_plugin_calls_total'
+                      '{name="htpasswd.Authenticator"} 2\n', out)
+
+    def test_render_histogram(self):
+        h = stats.Histogram((0.001, 0.01, float('inf')))
+        h.observe(0.0005)
+        h.observe(0.005)
+        h.observe(1)
+        out = metrics.render({}, {'stage.identify': h,
+                                  'htpasswd_reload': stats.Histogram()})
+        self.assertIn('# TYPE talons_stage_seconds histogram\n'
+                      'talons_stage_seconds_bucket'
+                      '{name="identify",le="0.001"} 1\n'
+                      'talons_stage_seconds_bucket'
+                      '{name="identify",le="0.01"} 2\n'
+                      'talons_stage_seconds_bucket'
+                      '{name="identify",le="+Inf"} 3\n'
+                      'talons_stage_seconds_sum{name="identify"} 1.0055\n'
+                      'talons_stage_seconds_count{name="identify"} 3\n', out)
+        self.assertIn('talons_htpasswd_reload_seconds_count 0\n', out)
+
+    def test_render_cache_ratio(self):
+        out = metrics.render({'cache.clientcert.hits': 3,
+                              'cache.clientcert.misses': 1,
+                              'cache.empty.hits': 0}, {})
+        self.assertIn('talons_cache_hits_total{name="clientcert"} 3\n', out)
+        self.assertIn('# TYPE talons_cache_hit_ratio gauge\n'
+                      'talons_cache_hit_ratio{name="clientcert"} 0.75\n', out)
+        self.assertNotIn('hit_ratio{name="empty"}', out)
+
+    def test_label_escaping(self):
+        out = metrics.render({'plugin.a"b.calls': 1}, {})
+        self.assertIn('{name="a\\"b"}', out)
+
+    def test_collect_named_caches(self):
+        c = cache.LRUCache(name='test_metrics')
+        c.set('a', 1)
+        c.get('a')
+        c.get('b')
+        sink = stats.InMemorySink()
+        sink.incr('identify.success')
+        counters, histograms = metrics.collect(sink)
+        self.assertEqual(1, counters['identify.success'])
+        self.assertEqual(1, counters['cache.test_metrics.hits'])
+        self.assertEqual(1, counters['cache.test_metrics.misses'])
+
+    def test_resource(self):
+        sink = stats.InMemorySink()
+        sink.incr('authorize.failure')
+        resource = metrics.MetricsResource(sink)
+        resp = mock.Mock()
+        resource.on_get(mock.sentinel.req, resp)
+        self.assertEqual(metrics.CONTENT_TYPE, resp.content_type)
+        self.assertIn(b'talons_authorize_failure_total 1\n', resp.data)
+
+
+class TestSharedStatsFile(base.TestCase):
+
+    def setUp(self):
+        super(TestSharedStatsFile, self).setUp()
+        tmp = self.useFixture(fixtures.TempDir()).path
+        self.path = os.path.join(tmp, 'talons.stats')
+
+    def test_publish_collect(self):
+        shared = metrics.SharedStatsFile(self.path, slots=4, slot_size=4096)
+        sink = stats.InMemorySink()
+        sink.incr('identify.success', 2)
+        sink.observe('stage.identify', 0.002)
+        self.assertTrue(shared.publish(sink))
+        sink.incr('identify.success')
+        self.assertTrue(shared.publish(sink))
+
+        other = metrics.SharedStatsFile(self.path, slots=4, slot_size=4096)
+        counters, histograms = other.collect()
+        self.assertEqual(3, counters['identify.success'])
+        self.assertEqual(1, histograms['stage.identify'].count)
+
+    def test_aggregates_workers(self):
+        shared = metrics.SharedStatsFile(self.path, slots=4, slot_size=4096)
+        sink = stats.InMemorySink()
+        sink.incr('identify.success')
+        sink.observe('stage.identify', 0.002)
+        shared.publish(sink)
+        # Pretend to be a second, forked worker
+        with mock.patch('os.getpid', return_value=os.getpid() + 100000):
+            with mock.patch('talons.metrics._pid_alive', return_value=True):
+                self.assertTrue(shared.publish(sink))
+        self.assertEqual(1, shared._slot)
+        counters, histograms = shared.collect()
+        self.assertEqual(2, counters['identify.success'])
+        self.assertEqual(2, histograms['stage.identify'].count)
+
+    def test_reclaims_dead_worker_slot(self):
+        shared = metrics.SharedStatsFile(self.path, slots=1, slot_size=4096)
+        sink = stats.InMemorySink()
+        self.assertTrue(shared.publish(sink))
+        with mock.patch('os.getpid', return_value=os.getpid() + 100000):
+            with mock.patch('talons.metrics._pid_alive', return_value=True):
+                self.assertFalse(shared.publish(sink))
+            with mock.patch('talons.metrics._pid_alive', return_value=False):
+                self.assertTrue(shared.publish(sink))
+        self.assertEqual(0, shared._slot)
+
+    def test_torn_read_skipped(self):
+        shared = metrics.SharedStatsFile(self.path, slots=1, slot_size=4096)
+        sink = stats.InMemorySink()
+        sink.incr('identify.success')
+        shared.publish(sink)
+        pid, seq, length = shared._read_header(0)
+        shared.HEADER.pack_into(shared._map, 0, pid, seq + 1, length)
+        self.assertEqual(({}, {}), shared.collect())
+
+    def test_header_written_while_odd(self):
+        shared = metrics.SharedStatsFile(self.path, slots=1, slot_size=4096)
+        sink = stats.InMemorySink()
+        shared.publish(sink)
+        sink.incr('identify.success')
+        real = metrics.SharedStatsFile.HEADER
+        shared.HEADER = mock.Mock(wraps=real, size=real.size)
+        shared.publish(sink)
+        seqs = [args[3] for args, _kw in
+                shared.HEADER.pack_into.call_args_list]
+        self.assertEqual([3], seqs)
+        _pid, seq, length = metrics.SharedStatsFile.HEADER.unpack_from(
+            shared._map, 0)
+        self.assertEqual(4, seq)
+        self.assertEqual({'identify.success': 1}, shared.collect()[0])
+
+    def test_payload_too_large(self):
+        shared = metrics.SharedStatsFile(self.path, slots=1, slot_size=64)
+        sink = stats.InMemorySink()
+        sink.incr('a_rather_long_counter_name.success')
+        self.assertFalse(shared.publish(sink))
@@ -0,0 +1,209 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import fcntl
+import hashlib
+import os
+import struct
+import time
+
+import fixtures
+import mock
+import testtools
+
+from talons import cache
+from talons import exc
+from talons import shmcache
+
+from tests import base
+
+
+class TestSharedMemoryCache(base.TestCase):
+
+    def setUp(self):
+        super(TestSharedMemoryCache, self).setUp()
+        tmp = self.useFixture(fixtures.TempDir()).path
+        self.path = os.path.join(tmp, 'talons.cache')
+        self.addCleanup(shmcache._TABLES.clear)
+
+    def cache(self, name='test', **kwargs):
+        kwargs.setdefault('slots', 64)
+        kwargs.setdefault('secret', 's3cret')
+        return shmcache.SharedMemoryCache(self.path, name, **kwargs)
+
+    def test_get_set(self):
+        c = self.cache()
+        self.assertIsNone(c.get('a'))
+        self.assertEqual('x', c.get('a', 'x'))
+        c.set('a', ['login', ['admin']])
+        self.assertEqual(['login', ['admin']], c.get('a'))
+        c.set(('alice', 'digest'), True)
+        self.assertTrue(c.get(('alice', 'digest')))
+        self.assertEqual((2, 2), (c.hits, c.misses))
+        self.assertEqual(2, len(c))
+        c.delete('a')
+        self.assertIsNone(c.get('a'))
+        self.assertIn(('test', c), cache.named_caches())
+
+    def test_no_plaintext_keys(self):
+        c = self.cache()
+        c.set(('alice', 'open sesame'), True)
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        self.assertNotIn(b'alice', data)
+        self.assertNotIn(b'sesame', data)
+        # Digests depend on the secret
+        self.assertIsNone(self.cache(secret='other').get(
+            ('alice', 'open sesame')))
+
+    def test_requires_secret(self):
+        for secret in (None, ''):
+            with testtools.ExpectedException(exc.BadConfiguration):
+                self.cache(secret=secret)
+
+    def test_forged_entry_rejected(self):
+        c = self.cache()
+        key = ('alice', 'digest of a wrong password')
+        # Without the secret, a writer can only guess unkeyed digests
+        forged = hashlib.sha256(repr(key).encode('utf-8')).digest()[:16]
+        c.table.put(c.tag, forged, 0, cache.dumps(True), time.time())
+        self.assertIsNone(c.get(key))
+
+    def test_sets_stored_as_lists(self):
+        c = self.cache()
+        c.set('a', ('alice', frozenset(['b', 'a'])))
+        self.assertEqual(['alice', ['a', 'b']], c.get('a'))
+        with testtools.ExpectedException(TypeError):
+            c.set('b', object())
+
+    def test_value_too_large(self):
+        c = self.cache(slot_size=64)
+        c.set('a', 'x' * 100)
+        self.assertIsNone(c.get('a'))
+
+    def test_ttl(self):
+        c = self.cache(ttl=10)
+        with mock.patch('time.time', return_value=1000.0):
+            c.set('a', 1)
+            c.set('b', 2, ttl=100)
+        with mock.patch('time.time', return_value=1050.0):
+            self.assertIsNone(c.get('a'))
+            self.assertEqual(2, c.get('b'))
+
+    def test_namespaces(self):
+        a = self.cache('a')
+        b = self.cache('b')
+        a.set('key', 1)
+        b.set('key', 2)
+        self.assertEqual(1, a.get('key'))
+        self.assertEqual(2, b.get('key'))
+        a.clear()
+        self.assertIsNone(a.get('key'))
+        self.assertEqual(2, b.get('key'))
+
+    def test_eviction(self):
+        c = self.cache(slots=8)
+        for x in range(20):
+            c.set(x, x)
+        self.assertEqual(8, len(c))
+        self.assertEqual(19, c.get(19))
+        # Overwriting a key does not duplicate it
+        c.set(19, 'new')
+        self.assertEqual('new', c.get(19))
+        self.assertEqual(8, len(c))
+
+    def test_torn_slot_skipped_and_repaired(self):
+        c = self.cache(slots=8)
+        c.set('a', 1)
+        table = c.table
+        for slot in range(table.slots):
+            offset = table._offset(slot)
+            seq = struct.unpack_from('<Q', table._map, offset)[0]
+            if seq:
+                struct.pack_into('<Q', table._map, offset, seq + 1)
+        self.assertIsNone(c.get('a'))
+        c.set('a', 2)
+        self.assertEqual(2, c.get('a'))
+
+    def test_header_written_while_odd(self):
+        c = self.cache()
+        real = shmcache.SLOT_HEADER
+        header = mock.Mock(wraps=real, size=real.size)
+        with mock.patch.object(shmcache, 'SLOT_HEADER', header):
+            c.set('a', 1)
+            c.delete('a')
+        # Readers must never see an even sequence number with the tag,
+        # digest or length of another write
+        self.assertEqual([1, 3], [args[2] for args, _kw in
+                                  header.pack_into.call_args_list])
+        self.assertIsNone(c.get('a'))
+
+    def test_layout_mismatch(self):
+        self.cache(slots=64)
+        shmcache._TABLES.clear()
+        with testtools.ExpectedException(exc.BadConfiguration):
+            self.cache(slots=128)
+
+    def test_add(self):
+        c = self.cache()
+        self.assertTrue(c.add('a', 1))
+        self.assertFalse(c.add('a', 2))
+        self.assertEqual(1, c.get('a'))
+        self.assertEqual({'a': 1}, c.get_many(['a', 'b']))
+
+    def test_shared_across_fork(self):
+        c = self.cache()
+        pid = os.fork()
+        if pid == 0:  # pragma: NO COVER
+            try:
+                c.set('from child', 'hello')
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        self.assertEqual('hello', c.get('from child'))
+
+    def test_writers_exclude_each_other_after_fork(self):
+        # The table is mapped before the fork, as with gunicorn --preload
+        c = self.cache()
+        locked_r, locked_w = os.pipe()
+        done_r, done_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:  # pragma: NO COVER
+            try:
+                with c.table._locked():
+                    os.write(locked_w, b'x')
+                    os.read(done_r, 1)
+            finally:
+                os._exit(0)
+        try:
+            os.read(locked_r, 1)
+            self.assertRaises(IOError, fcntl.flock, c.table._fd,
+                              fcntl.LOCK_EX | fcntl.LOCK_NB)
+        finally:
+            os.write(done_w, b'x')
+            os.waitpid(pid, 0)
+            for fd in (locked_r, locked_w, done_r, done_w):
+                os.close(fd)
+
+    def test_create_cache(self):
+        c = cache.create_cache('local', 10)
+        self.assertIsInstance(c, cache.LRUCache)
+        c = cache.create_cache('shared', 10, cache_shm_path=self.path,
+                               cache_shm_slots=64, cache_ttl='30',
+                               cache_secret='x')
+        self.assertIsInstance(c, shmcache.SharedMemoryCache)
+        self.assertEqual((30.0, 'x'), (c.ttl, c.secret))
@@ -0,0 +1,61 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013-2014 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import os
+import stat
+
+import fixtures
+
+from talons import snapshot
+
+from tests import base
+
+
+class TestSnapshot(base.TestCase):
+
+    def setUp(self):
+        super(TestSnapshot, self).setUp()
+        tmp = self.useFixture(fixtures.TempDir()).path
+        self.path = os.path.join(tmp, 'snapshot.json')
+
+    def test_round_trip(self):
+        entries = [(b'\x01' * 32, 200.0), (b'\x02' * 32, 50.0)]
+        self.assertEqual(1, snapshot.save(self.path, 's3cr3t', 'src',
+                                          entries, now=100.0))
+        self.assertEqual(0o600, stat.S_IMODE(os.stat(self.path).st_mode))
+        self.assertEqual({b'\x01' * 32: 200.0},
+                         snapshot.load(self.path, 's3cr3t', 'src', now=100.0))
+        self.assertEqual({}, snapshot.load(self.path, 's3cr3t', 'src',
+                                           now=300.0))
+        with open(self.path) as f:
+            self.assertNotIn('s3cr3t', f.read())
+
+    def test_stale(self):
+        snapshot.save(self.path, 's3cr3t', 'src', [(b'\x01', 200.0)], 100.0)
+        self.assertEqual({}, snapshot.load(self.path, 'other', 'src', 100.0))
+        self.assertEqual({}, snapshot.load(self.path, 's3cr3t', 'new', 100.0))
+
+    def test_missing_or_corrupt(self):
+        self.assertEqual({}, snapshot.load(self.path, 's', 'src'))
+        with open(self.path, 'w') as f:
+            f.write('{"version": 1, "secret": ')
+        self.assertEqual({}, snapshot.load(self.path, 's', 'src'))
+        with open(self.path, 'w') as f:
+            f.write('{{"version": 1, "secret": "{0}", "source": "src", '
+                    '"entries": [["zz", 1e12]]}}'.format(
+                        snapshot.secret_fingerprint('s')))
+        self.assertEqual({}, snapshot.load(self.path, 's', 'src'))
@@ -0,0 +1,97 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2013 Jay Pipes
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import socket
+import threading
+
+from talons import stats
+
+from tests import base
+
+
+class TestStats(base.TestCase):
+
+    def test_histogram(self):
+        h = stats.Histogram((0.001, 0.01, float('inf')))
+        h.observe(0.0005)
+        h.observe(0.001)
+        h.observe(0.005)
+        h.observe(30)
+        self.assertEqual([2, 1, 1], h.counts)
+        self.assertEqual(4, h.count)
+        other = stats.Histogram((0.001, 0.01, float('inf')))
+        other.observe(0.002)
+        h.merge(other)
+        self.assertEqual([2, 2, 1], h.counts)
+        self.assertAlmostEqual(30.0085, h.sum)
+
+    def test_in_memory_sink_shards(self):
+        sink = stats.InMemorySink()
+
+        def work():
+            for x in range(100):
+                sink.incr('calls')
+                sink.observe('latency', 0.0002)
+
+        threads = [threading.Thread(target=work) for x in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        work()
+
+        counters, histograms = sink.snapshot()
+        self.assertEqual({'calls': 500}, counters)
+        self.assertEqual(500, histograms['latency'].count)
+        # The shards of the exited threads were folded
+        self.assertEqual(1, len(sink._shards))
+        # Snapshots are copies
+        counters['calls'] = 0
+        histograms['latency'].observe(1)
+        counters, histograms = sink.snapshot()
+        self.assertEqual(500, counters['calls'])
+        self.assertEqual(500, histograms['latency'].count)
+
+    def test_in_memory_sink_short_lived_threads(self):
+        sink = stats.InMemorySink()
+        for x in range(50):
+            t = threading.Thread(target=sink.incr, args=('calls',))
+            t.start()
+            t.join()
+        sink.observe('latency', 0.001)
+        counters, histograms = sink.snapshot()
+        self.assertEqual({'calls': 50}, counters)
+        self.assertEqual(1, histograms['latency'].count)
+        self.assertEqual(1, len(sink._shards))
+
+    def test_statsd_sink(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addCleanup(server.close)
+        server.bind(('127.0.0.1', 0))
+        server.settimeout(2)
+        sink = stats.StatsdSink(port=server.getsockname()[1])
+        sink.incr('identify.success')
+        self.assertEqual(b'talons.identify.success:1|c', server.recv(512))
+        sink.observe('stage.identify', 0.0015)
+        self.assertEqual(b'talons.stage.identify:1.500|ms', server.recv(512))
+
+    def test_statsd_sink_unreachable(self):
+        sink = stats.StatsdSink(host='256.0.0.1')
+        sink.incr('identify.success')
+
+    def test_plugin_name(self):
+        self.assertEqual('stats.InMemorySink',
+                         stats.plugin_name(stats.InMemorySink()))